@@ -9,10 +9,13 @@ que le dice EXACTAMENTE qué hacer en este turno.
 import json
 import re
 import logging
-import time
-import hashlib
 from typing import Optional
 
+try:
+    from expert_knowledge_store import expert_knowledge_store
+except ImportError:
+    from backend.expert_knowledge_store import expert_knowledge_store
+
 logger = logging.getLogger("agent_context")
 
 _EMAIL_ADDRESS_RE = re.compile(r"\b[a-z0-9._%+\-]+@[a-z0-9.\-]+\.[a-z]{2,}\b", re.IGNORECASE)
@@ -80,29 +83,6 @@ def _looks_like_internal_promo_price_followup(user_message: str, conversation_co
         return False
     return any(signal in normalized for signal in _INTERNAL_PROMO_PRICE_SIGNALS)
 
-# ─── Cache de embeddings por turno (evita llamadas redundantes a OpenAI) ──────
-# TTL de 120s: si el mismo semantic_query se repite en menos de 2 min, reutiliza el embedding.
-_EMBEDDING_CACHE: dict[str, tuple[list[float], float]] = {}
-_EMBEDDING_CACHE_TTL = 120  # seconds
-_EMBEDDING_CACHE_MAX = 50   # max entries
-
-def _get_cached_embedding(text: str) -> Optional[list[float]]:
-    """Retorna embedding cacheado si existe y no expiró."""
-    key = hashlib.md5(text.encode()).hexdigest()
-    entry = _EMBEDDING_CACHE.get(key)
-    if entry and (time.time() - entry[1]) < _EMBEDDING_CACHE_TTL:
-        return entry[0]
-    return None
-
-def _set_cached_embedding(text: str, embedding: list[float]):
-    """Guarda embedding en cache con timestamp."""
-    # Evict oldest if cache is full
-    if len(_EMBEDDING_CACHE) >= _EMBEDDING_CACHE_MAX:
-        oldest_key = min(_EMBEDDING_CACHE, key=lambda k: _EMBEDDING_CACHE[k][1])
-        del _EMBEDDING_CACHE[oldest_key]
-    key = hashlib.md5(text.encode()).hexdigest()
-    _EMBEDDING_CACHE[key] = (embedding, time.time())
-
 
 # ─── Alertas críticas de superficie (Python-side, imposibles de ignorar) ─────
 # Estas reglas son DURAS: si Python las detecta, el LLM las recibe como bloqueo.
@@ -464,68 +444,23 @@ def _fetch_expert_directives_for_turn(
 
 def _search_expert_knowledge_semantic(query: str, limit: int = 3) -> list[dict]:
     """
-    Búsqueda semántica de conocimiento experto usando pgvector.
-    Embebe la consulta y busca contra embeddings pre-computados de las notas.
-    Si la tabla no tiene columna embedding, cae al fallback de keywords.
+    Búsqueda semántica de conocimiento experto contra `expert_knowledge_store`.
+    Las notas se embeben con Gemini (backfill / registro), así que la consulta
+    usa el mismo modelo vía el cache compartido de embeddings de consulta.
+    Sin embeddings cargados devuelve [] y cae al fallback de keywords.
     """
     try:
         # Import lazily to avoid circular dependency
         try:
-            from main import get_openai_client, get_db_engine
+            from rag_search import _generate_query_embedding
         except ImportError:
-            from backend.main import get_openai_client, get_db_engine
+            from backend.rag_search import _generate_query_embedding
 
-        # Generate embedding for the query (with cache)
-        query_input = query.strip()[:500]
-        query_embedding = _get_cached_embedding(query_input)
+        query_embedding = _generate_query_embedding(query.strip()[:500])
         if query_embedding is None:
-            client = get_openai_client()
-            resp = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=query_input,
-                dimensions=1536,
-            )
-            query_embedding = resp.data[0].embedding
-            _set_cached_embedding(query_input, query_embedding)
-        embedding_literal = "[" + ",".join(str(v) for v in query_embedding) + "]"
-
-        engine = get_db_engine()
-        raw_conn = engine.raw_connection()
-        try:
-            cur = raw_conn.cursor()
-            # Check if embedding column exists in expert_knowledge
-            cur.execute("""
-                SELECT column_name FROM information_schema.columns 
-                WHERE table_name = 'agent_expert_knowledge' 
-                AND column_name = 'embedding'
-            """)
-            has_embedding = cur.fetchone() is not None
-
-            if not has_embedding:
-                return []  # Fall to keyword fallback
-
-            cur.execute(
-                """
-                SELECT id, contexto_tags, producto_recomendado, producto_desestimado,
-                       nota_comercial, tipo, nombre_experto,
-                       1 - (embedding <=> %s::vector) AS similarity
-                FROM public.agent_expert_knowledge
-                WHERE activo = true
-                  AND embedding IS NOT NULL
-                ORDER BY embedding <=> %s::vector
-                LIMIT %s
-                """,
-                [embedding_literal, embedding_literal, limit * 2],
-            )
-            columns = [desc[0] for desc in cur.description]
-            rows = [dict(zip(columns, row)) for row in cur.fetchall()]
-            
-            # Only return rows with high semantic similarity (>= 0.45)
-            # — lower than RAG threshold because expert notes are short texts
-            strong = [r for r in rows if (r.get("similarity") or 0) >= 0.45]
-            return strong[:limit]
-        finally:
-            raw_conn.close()
+            raise RuntimeError("Sin embedding para la consulta de conocimiento experto")
+        # Umbral 0.45 (< umbral RAG) porque las notas expertas son textos cortos.
+        return expert_knowledge_store.semantic_search(query_embedding, limit=limit)
     except Exception as exc:
         logger.debug("_search_expert_knowledge_semantic error: %s", exc)
         return []
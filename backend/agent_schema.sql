@@ -432,6 +432,18 @@ CREATE INDEX IF NOT EXISTS idx_agent_doc_chunk_embedding
     USING hnsw (embedding vector_cosine_ops)
     WITH (m = 16, ef_construction = 64);
 
+-- Cache de embeddings de consulta compartido entre workers (backend/embedding_cache.py)
+CREATE TABLE IF NOT EXISTS public.query_embedding_cache (
+    cache_key text PRIMARY KEY,
+    model text NOT NULL,
+    dimensions integer NOT NULL,
+    normalized_text text NOT NULL,
+    embedding real[] NOT NULL,
+    hit_count integer NOT NULL DEFAULT 0,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    last_used_at timestamptz NOT NULL DEFAULT now()
+);
+
 CREATE TABLE IF NOT EXISTS public.agent_technical_profile (
     id bigserial PRIMARY KEY,
     canonical_family text NOT NULL,
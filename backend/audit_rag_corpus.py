@@ -16,6 +16,7 @@ from pathlib import Path
 from ingest_technical_sheets import (
     build_corpus_report,
     curate_pdf_entries,
+    get_db_engine,
     get_dropbox_client,
     list_dropbox_pdfs,
 )
@@ -23,7 +24,7 @@ from ingest_technical_sheets import (
 
 def main():
     dbx = get_dropbox_client()
-    pdf_entries = list_dropbox_pdfs(dbx)
+    pdf_entries = list_dropbox_pdfs(dbx, engine=get_db_engine())
     curated_entries, duplicate_groups, skipped_entries = curate_pdf_entries(pdf_entries)
     report = build_corpus_report(curated_entries, duplicate_groups, skipped_entries)
 
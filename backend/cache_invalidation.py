@@ -0,0 +1,207 @@
+"""Invalidación de caches en memoria entre workers vía LISTEN/NOTIFY.
+
+Cada worker uvicorn mantiene sus propios índices en memoria (aprendizajes,
+rotación, perfiles...). Cuando un worker escribe en una tabla espejada,
+publica un `pg_notify` en el canal correspondiente y todos los workers
+(incluido el emisor) reciben el evento en un hilo daemon dedicado.
+
+Diseño:
+
+  * Un solo hilo y una sola conexión LISTEN por proceso, compartidos por
+    todos los canales suscritos.
+  * Los handlers reciben el payload ya decodificado (dict o None) y deben
+    ser idempotentes: Postgres también entrega el evento al emisor.
+  * Reconexión con backoff si la conexión LISTEN se cae. Al reconectar se
+    invoca cada handler con `None` para forzar recarga completa, porque los
+    eventos emitidos durante la desconexión se pierden.
+  * Si no hay base de datos (tests, scripts) `start` no hace nada y las
+    caches dependen de su TTL.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import re
+import select
+import threading
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("ferreinox_agent.cache_invalidation")
+
+_CHANNEL_RE = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+ChangeHandler = Callable[[Optional[dict]], None]
+
+
+def _validate_channel(channel: str) -> str:
+    if not _CHANNEL_RE.match(channel or ""):
+        raise ValueError(f"Canal NOTIFY inválido: {channel!r}")
+    return channel
+
+
+def notify_change(connection, channel: str, payload: Optional[dict] = None) -> None:
+    """Publica un cambio en `channel` dentro de la transacción de `connection` (SQLAlchemy).
+
+    El NOTIFY sólo se entrega si la transacción hace commit, así que los
+    lectores nunca ven un evento de una escritura revertida.
+    """
+    from sqlalchemy import text
+
+    body = json.dumps(payload, ensure_ascii=False, default=str) if payload is not None else ""
+    # pg_notify limita el payload a ~8000 bytes: si no cabe se manda vacío
+    # y los receptores recargan completo.
+    if len(body.encode("utf-8")) > 7500:
+        body = ""
+    connection.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": _validate_channel(channel), "payload": body})
+
+
+# ── Refresh generations ─────────────────────────────────────────────────
+# `public.agent_refresh_generation` guarda un contador por scope (una MV,
+# una tabla derivada...). Quien refresca el dato llama a
+# `fn_bump_refresh_generation(scope)`, que incrementa el contador y emite
+# NOTIFY en REFRESH_GENERATION_CHANNEL con `{"scope", "generation"}`.
+# Las caches guardan la generación con la que cargaron y sólo recargan
+# cuando cambia.
+REFRESH_GENERATION_CHANNEL = "agent_refresh_generation"
+
+
+def fetch_refresh_generation(connection, scope: str) -> Optional[int]:
+    """Generación actual de `scope`; None si la tabla aún no existe o no hay registro.
+
+    Usa SAVEPOINT para no dejar abortada la transacción de búsqueda del llamador.
+    """
+    from sqlalchemy import text
+
+    try:
+        with connection.begin_nested():
+            value = connection.execute(
+                text("SELECT generation FROM public.agent_refresh_generation WHERE scope = :scope"),
+                {"scope": scope},
+            ).scalar()
+    except Exception:
+        return None
+    return int(value) if value is not None else None
+
+
+def bump_refresh_generation(connection, scope: str) -> Optional[int]:
+    """Sube la generación de `scope` dentro de la transacción de `connection`.
+
+    Corre en un SAVEPOINT: si la función aún no existe (postgrest_views.sql
+    sin aplicar) la transacción del llamador sigue viva y devuelve None.
+    """
+    from sqlalchemy import text
+
+    try:
+        with connection.begin_nested():
+            value = connection.execute(
+                text("SELECT public.fn_bump_refresh_generation(:scope)"),
+                {"scope": scope},
+            ).scalar()
+    except Exception as exc:
+        logger.warning("No se pudo subir la generación de %s: %s", scope, exc)
+        return None
+    return int(value) if value is not None else None
+
+
+class ChangeNotifier:
+    """Hilo LISTEN compartido que despacha eventos a handlers por canal."""
+
+    def __init__(self, poll_timeout: float = 5.0, max_backoff: float = 60.0):
+        self._handlers: dict[str, list[ChangeHandler]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._poll_timeout = poll_timeout
+        self._max_backoff = max_backoff
+
+    def subscribe(self, channel: str, handler: ChangeHandler) -> None:
+        _validate_channel(channel)
+        with self._lock:
+            handlers = self._handlers.setdefault(channel, [])
+            if handler not in handlers:
+                handlers.append(handler)
+
+    def channels(self) -> list[str]:
+        with self._lock:
+            return sorted(self._handlers)
+
+    def dispatch(self, channel: str, raw_payload: Optional[str]) -> None:
+        payload: Optional[dict] = None
+        if raw_payload:
+            try:
+                decoded = json.loads(raw_payload)
+                payload = decoded if isinstance(decoded, dict) else None
+            except ValueError:
+                payload = None
+        with self._lock:
+            handlers = list(self._handlers.get(channel, []))
+        for handler in handlers:
+            try:
+                handler(payload)
+            except Exception as exc:
+                logger.warning("Handler de invalidación %s falló: %s", channel, exc)
+
+    def _dispatch_full_reload(self) -> None:
+        for channel in self.channels():
+            self.dispatch(channel, None)
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self, connection_factory: Callable[[], Any]) -> bool:
+        """Arranca el hilo LISTEN. `connection_factory` devuelve una conexión psycopg2 dedicada."""
+        if self.is_running():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(connection_factory,), name="cache-invalidation-listener", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self, connection_factory: Callable[[], Any]) -> None:
+        backoff = 1.0
+        first_connect = True
+        while not self._stop.is_set():
+            connection = None
+            try:
+                connection = connection_factory()
+                connection.autocommit = True
+                cursor = connection.cursor()
+                listening: set[str] = set()
+                if not first_connect:
+                    self._dispatch_full_reload()
+                first_connect = False
+                backoff = 1.0
+                while not self._stop.is_set():
+                    # Canales suscritos después del arranque se agregan en caliente.
+                    for channel in self.channels():
+                        if channel not in listening:
+                            cursor.execute(f"LISTEN {channel}")
+                            listening.add(channel)
+                    ready, _, _ = select.select([connection], [], [], self._poll_timeout)
+                    if not ready:
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notification = connection.notifies.pop(0)
+                        self.dispatch(notification.channel, notification.payload)
+            except Exception as exc:
+                logger.warning("Listener de invalidación desconectado: %s (reintento en %.0fs)", exc, backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self._max_backoff)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+# Singleton compartido por el proceso.
+change_notifier = ChangeNotifier()
+
@@ -0,0 +1,286 @@
+"""Espejo en Postgres de la metadata de una carpeta de Dropbox (cursores incrementales).
+
+`list_dropbox_pdfs` (ingesta) y `list_technical_document_entries` (búsqueda
+de fichas para enviar al cliente) recorrían todo el árbol de fichas con
+`files_list_folder` paginado en cada refresco: miles de archivos, decenas
+de páginas y rate limit de Dropbox cada 10 minutos por worker.
+
+Diseño:
+
+  * Tabla `dropbox_file_mirror`: una fila por archivo vivo (name, rev,
+    content_hash, size, server_modified) por carpeta raíz.
+  * Tabla `dropbox_mirror_cursor`: el cursor de `files_list_folder` de cada
+    raíz y cuándo se sincronizó.
+  * `sync()` sigue el cursor con `files_list_folder/continue` y aplica sólo
+    lo que cambió (rev distinta) y las bajas (DeletedMetadata, también de
+    carpetas completas). Sin cursor, o si Dropbox lo invalida (`reset`), se
+    hace un listado completo que reconcilia el espejo.
+  * `refresh()` sincroniza como mucho cada `max_age_seconds` (compartido por
+    todos los workers vía `synced_at`) y lee del espejo. Si Dropbox falla se
+    sirve el espejo tal cual; si la BD falla, listado directo como antes.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+import dropbox
+from dropbox.exceptions import ApiError
+from sqlalchemy import text
+
+logger = logging.getLogger("ferreinox_agent.dropbox_mirror")
+
+DROPBOX_MIRROR_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.dropbox_file_mirror (
+    root_folder text NOT NULL,
+    path_lower text NOT NULL,
+    path_display text,
+    name text NOT NULL,
+    rev text,
+    content_hash text,
+    size bigint,
+    server_modified timestamp,
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (root_folder, path_lower)
+)
+"""
+
+DROPBOX_CURSOR_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.dropbox_mirror_cursor (
+    root_folder text PRIMARY KEY,
+    cursor text,
+    synced_at timestamptz,
+    full_synced_at timestamptz
+)
+"""
+
+_ENTRY_COLUMNS = ("name", "path_lower", "size", "content_hash", "rev")
+
+
+def _file_row(entry) -> dict:
+    return {
+        "path_lower": entry.path_lower,
+        "path_display": entry.path_display,
+        "name": entry.name,
+        "rev": entry.rev,
+        "content_hash": entry.content_hash,
+        "size": entry.size,
+        "server_modified": entry.server_modified,
+    }
+
+
+def _is_cursor_reset(exc: ApiError) -> bool:
+    error = getattr(exc, "error", None)
+    return bool(error is not None and getattr(error, "is_reset", lambda: False)())
+
+
+class DropboxMirror:
+    def __init__(self, root_folder: str, engine_factory: Optional[Callable[[], Any]] = None,
+                 suffixes: tuple[str, ...] = (".pdf",)):
+        self.root_folder = root_folder
+        self._root_key = root_folder.lower()
+        self._engine_factory = engine_factory
+        self._suffixes = tuple(suffix.lower() for suffix in suffixes)
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._table_ready = False
+        self._counters = {"full_syncs": 0, "incremental_syncs": 0, "changed": 0, "deleted": 0,
+                          "sync_errors": 0, "db_errors": 0}
+
+    def bind_engine(self, engine_factory: Callable[[], Any]) -> None:
+        self._engine_factory = engine_factory
+
+    def _wanted(self, entry) -> bool:
+        return isinstance(entry, dropbox.files.FileMetadata) and entry.name.lower().endswith(self._suffixes)
+
+    def _engine(self):
+        if self._engine_factory is None:
+            raise RuntimeError("dropbox_mirror sin engine de BD")
+        engine = self._engine_factory()
+        if not self._table_ready:
+            with engine.begin() as conn:
+                conn.execute(text(DROPBOX_MIRROR_TABLE_SQL))
+                conn.execute(text(DROPBOX_CURSOR_TABLE_SQL))
+            self._table_ready = True
+        return engine
+
+    # ── Sincronización ──────────────────────────────────────────────────
+    def sync(self, dbx) -> dict:
+        """Aplica al espejo los cambios desde el último cursor; devuelve lo que cambió.
+
+        {"mode": "incremental"|"full", "changed": [entradas nuevas o con rev
+        nueva], "deleted": [path_lower], "pages": páginas leídas}.
+        """
+        engine = self._engine()
+        with engine.connect() as conn:
+            cursor = conn.execute(
+                text("SELECT cursor FROM public.dropbox_mirror_cursor WHERE root_folder = :root"),
+                {"root": self._root_key},
+            ).scalar()
+
+        result = None
+        if cursor:
+            try:
+                result = dbx.files_list_folder_continue(cursor)
+            except ApiError as exc:
+                if not _is_cursor_reset(exc):
+                    raise
+                logger.info("dropbox_mirror: cursor de %s invalidado por Dropbox; listado completo", self.root_folder)
+        full = result is None
+        if full:
+            result = dbx.files_list_folder(self.root_folder, recursive=True)
+
+        files: dict[str, dict] = {}
+        deleted_paths: list[str] = []
+        pages = 1
+        while True:
+            for entry in result.entries:
+                if isinstance(entry, dropbox.files.DeletedMetadata):
+                    files.pop(entry.path_lower, None)
+                    deleted_paths.append(entry.path_lower)
+                elif self._wanted(entry):
+                    files[entry.path_lower] = _file_row(entry)
+            if not result.has_more:
+                break
+            result = dbx.files_list_folder_continue(result.cursor)
+            pages += 1
+
+        changed, deleted = self._apply(engine, files, deleted_paths, result.cursor, full)
+        with self._lock:
+            self._counters["full_syncs" if full else "incremental_syncs"] += 1
+            self._counters["changed"] += len(changed)
+            self._counters["deleted"] += len(deleted)
+        logger.info(
+            "dropbox_mirror %s: sync %s (%s páginas) → %s cambiados, %s eliminados",
+            self.root_folder, "completo" if full else "incremental", pages, len(changed), len(deleted),
+        )
+        return {
+            "mode": "full" if full else "incremental",
+            "changed": [{column: row[column] for column in _ENTRY_COLUMNS} for row in changed],
+            "deleted": deleted,
+            "pages": pages,
+        }
+
+    def _apply(self, engine, files: dict[str, dict], deleted_paths: list[str], cursor: str,
+               full: bool) -> tuple[list[dict], list[str]]:
+        with engine.begin() as conn:
+            known = {
+                row[0]: row[1]
+                for row in conn.execute(
+                    text("SELECT path_lower, rev FROM public.dropbox_file_mirror WHERE root_folder = :root"),
+                    {"root": self._root_key},
+                ).fetchall()
+            }
+            changed = [row for path, row in files.items() if known.get(path) != row["rev"]]
+            if full:
+                gone = [path for path in known if path not in files]
+            else:
+                # Una carpeta borrada llega como un único DeletedMetadata: caen también sus archivos.
+                deleted = set(deleted_paths)
+                prefixes = tuple(f"{path}/" for path in deleted)
+                gone = [path for path in known
+                        if path not in files and (path in deleted or path.startswith(prefixes))]
+            if gone:
+                conn.execute(
+                    text("DELETE FROM public.dropbox_file_mirror WHERE root_folder = :root AND path_lower = ANY(:paths)"),
+                    {"root": self._root_key, "paths": gone},
+                )
+            if changed:
+                conn.execute(
+                    text("""
+                        INSERT INTO public.dropbox_file_mirror
+                            (root_folder, path_lower, path_display, name, rev, content_hash, size, server_modified, updated_at)
+                        VALUES (:root, :path_lower, :path_display, :name, :rev, :content_hash, :size, :server_modified, now())
+                        ON CONFLICT (root_folder, path_lower) DO UPDATE SET
+                            path_display = EXCLUDED.path_display,
+                            name = EXCLUDED.name,
+                            rev = EXCLUDED.rev,
+                            content_hash = EXCLUDED.content_hash,
+                            size = EXCLUDED.size,
+                            server_modified = EXCLUDED.server_modified,
+                            updated_at = now()
+                    """),
+                    [{"root": self._root_key, **row} for row in changed],
+                )
+            conn.execute(
+                text(f"""
+                    INSERT INTO public.dropbox_mirror_cursor (root_folder, cursor, synced_at, full_synced_at)
+                    VALUES (:root, :cursor, now(), {"now()" if full else "NULL"})
+                    ON CONFLICT (root_folder) DO UPDATE SET
+                        cursor = EXCLUDED.cursor,
+                        synced_at = now(){", full_synced_at = now()" if full else ""}
+                """),
+                {"root": self._root_key, "cursor": cursor},
+            )
+        return changed, gone
+
+    # ── Lectura ─────────────────────────────────────────────────────────
+    def entries(self) -> list[dict]:
+        """Archivos vivos del espejo, con las mismas llaves que `list_dropbox_pdfs`."""
+        with self._engine().connect() as conn:
+            rows = conn.execute(
+                text("""
+                    SELECT name, path_lower, size, content_hash, rev
+                    FROM public.dropbox_file_mirror
+                    WHERE root_folder = :root
+                    ORDER BY path_lower
+                """),
+                {"root": self._root_key},
+            ).mappings().fetchall()
+        return [dict(row) for row in rows]
+
+    def seconds_since_sync(self) -> Optional[float]:
+        with self._engine().connect() as conn:
+            age = conn.execute(
+                text("""
+                    SELECT EXTRACT(EPOCH FROM now() - synced_at)
+                    FROM public.dropbox_mirror_cursor WHERE root_folder = :root
+                """),
+                {"root": self._root_key},
+            ).scalar()
+        return None if age is None else float(age)
+
+    def refresh(self, client_factory: Callable[[], Any], max_age_seconds: float = 600.0) -> list[dict]:
+        """Entradas del espejo, sincronizando antes si la última sync tiene más de `max_age_seconds`."""
+        with self._sync_lock:
+            try:
+                age = self.seconds_since_sync()
+            except Exception as exc:
+                self._count("db_errors")
+                logger.warning("dropbox_mirror sin BD (%s); listado directo de %s", exc, self.root_folder)
+                return self.walk(client_factory())
+            if age is None or age >= max_age_seconds:
+                try:
+                    self.sync(client_factory())
+                except Exception as exc:
+                    self._count("sync_errors")
+                    if age is None:
+                        raise
+                    logger.warning("dropbox_mirror: sync de %s falló, se sirve el espejo (%.0fs): %s",
+                                   self.root_folder, age, exc)
+            return self.entries()
+
+    def walk(self, dbx) -> list[dict]:
+        """Listado completo directo contra Dropbox, sin espejo (respaldo si la BD no responde)."""
+        entries = []
+        result = dbx.files_list_folder(self.root_folder, recursive=True)
+        while True:
+            entries.extend(
+                {column: row[column] for column in _ENTRY_COLUMNS}
+                for row in (_file_row(entry) for entry in result.entries if self._wanted(entry))
+            )
+            if not result.has_more:
+                break
+            result = dbx.files_list_folder_continue(result.cursor)
+        return entries
+
+    # ── Métricas ────────────────────────────────────────────────────────
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "root_folder": self.root_folder}
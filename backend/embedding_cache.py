@@ -0,0 +1,508 @@
+"""Cache compartido de embeddings de consulta (memoria LRU + Postgres).
+
+Antes cada búsqueda RAG (`search_technical_chunks`,
+`search_supporting_technical_guides`, `search_multimodal_product_index`)
+embebía la misma consulta por separado, `agent_context` tenía su propio
+dict de 50 entradas y nada sobrevivía a un reinicio. Los clientes repiten
+las mismas preguntas todo el día ("impermeabilizante para techo").
+
+Diseño:
+
+  * Clave = texto normalizado (espacios colapsados, minúsculas) + modelo +
+    dimensiones, así modelos distintos nunca comparten vectores. Se embebe
+    ese mismo texto normalizado: el vector guardado corresponde a la clave
+    sin importar qué variante de mayúsculas llegó primero.
+  * Nivel 1: LRU en memoria con vectores `float32` (≈6 KB por entrada de
+    1536 dimensiones en vez de ≈50 KB como lista de floats).
+  * Nivel 2: tabla `query_embedding_cache` en Postgres, compartida por
+    todos los workers y persistente entre reinicios. Si la BD falla, el
+    nivel 2 se desactiva un rato y el cache sigue sólo en memoria.
+  * `get_or_compute_many`: varias consultas del mismo turno se resuelven
+    texto por texto contra ambos niveles y sólo los fallos se embeben,
+    juntos, en una única llamada batch al proveedor.
+  * Métricas de aciertos por nivel (`stats()`), expuestas en
+    `/admin/cache-stats`.
+  * `hit_count`/`last_used_at` en BD no se actualizan en cada acierto: se
+    acumulan en memoria y se vuelcan en un UPDATE por lote en segundo plano
+    como mucho cada `QUERY_EMBEDDING_HIT_FLUSH_SECONDS`.
+
+`IngestEmbeddingCache` cubre el otro lado: la ingesta (fichas, guías,
+índice multimodal). Reingestar o reindexar tras un ajuste de chunking
+reembebía todos los chunks aunque casi todos los textos fueran idénticos.
+La tabla `embedding_cache` guarda el vector por sha256 del contenido exacto
+enviado al modelo + modelo + dimensiones; sólo el texto nuevo se embebe.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+logger = logging.getLogger("ferreinox_agent.embedding_cache")
+
+QUERY_EMBEDDING_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.query_embedding_cache (
+    cache_key text PRIMARY KEY,
+    model text NOT NULL,
+    dimensions integer NOT NULL,
+    normalized_text text NOT NULL,
+    embedding real[] NOT NULL,
+    hit_count integer NOT NULL DEFAULT 0,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    last_used_at timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+INGEST_EMBEDDING_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.embedding_cache (
+    content_sha256 text NOT NULL,
+    model text NOT NULL,
+    dims integer NOT NULL,
+    vector real[] NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    last_used_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (content_sha256, model, dims)
+)
+"""
+
+_PERSISTENCE_COOLDOWN_SECONDS = 60.0
+_HIT_FLUSH_SECONDS = float(os.getenv("QUERY_EMBEDDING_HIT_FLUSH_SECONDS", "60"))
+_INGEST_LOOKUP_BATCH = 500
+
+
+def normalize_query_text(text_value: Optional[str]) -> str:
+    return " ".join(str(text_value or "").split()).lower()
+
+
+def embedding_cache_key(normalized_text: str, model: str, dimensions: int) -> str:
+    raw = f"{model}\x1f{int(dimensions)}\x1f{normalized_text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class QueryEmbeddingCache:
+    def __init__(self, max_entries: int = 2048, engine_factory: Optional[Callable[[], Any]] = None):
+        self._max_entries = max(1, int(max_entries))
+        self._engine_factory = engine_factory
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._persistence_disabled_until = 0.0
+        self._pending_hits: dict[str, int] = {}
+        self._hits_flushed_at = time.time()
+        self._counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "db_errors": 0, "compute_errors": 0,
+                          "hit_flushes": 0}
+
+    def bind_engine(self, engine_factory: Callable[[], Any]) -> None:
+        self._engine_factory = engine_factory
+
+    # ── API principal ───────────────────────────────────────────────────
+    def get_or_compute(
+        self,
+        text_value: Optional[str],
+        *,
+        model: str,
+        dimensions: int,
+        compute: Callable[[str], Optional[list[float]]],
+    ) -> Optional[list[float]]:
+        """Embedding de `text_value`; `compute(texto)` sólo se llama si no está en ningún nivel."""
+        return self.get_or_compute_many(
+            [text_value],
+            model=model,
+            dimensions=dimensions,
+            compute_many=lambda texts: [compute(texts[0])],
+        )[0]
+
+    def get_or_compute_many(
+        self,
+        text_values: list[Optional[str]],
+        *,
+        model: str,
+        dimensions: int,
+        compute_many: Callable[[list[str]], list[Optional[list[float]]]],
+    ) -> list[Optional[list[float]]]:
+        """Embeddings de varios textos, en el mismo orden de entrada.
+
+        Cada texto se busca por separado en memoria y en BD; sólo los fallos
+        (deduplicados por clave) van a `compute_many` en una única llamada.
+        Si esa llamada falla, los textos afectados devuelven None.
+        """
+        results: list[Optional[list[float]]] = [None] * len(text_values)
+        keyed: list[tuple[int, str, str]] = []
+        for index, text_value in enumerate(text_values):
+            normalized = normalize_query_text(text_value)
+            if normalized:
+                keyed.append((index, embedding_cache_key(normalized, model, dimensions), normalized))
+
+        pending: list[tuple[int, str, str]] = []
+        hits: list[str] = []
+        for item in keyed:
+            cached = self._memory_get(item[1])
+            if cached is not None:
+                self._count("memory_hits")
+                hits.append(item[1])
+                results[item[0]] = cached.tolist()
+            else:
+                pending.append(item)
+
+        stored = self._db_get_many(list(dict.fromkeys(key for _, key, _ in pending))) if pending else {}
+        misses: "OrderedDict[str, str]" = OrderedDict()
+        for index, key, normalized in pending:
+            vector = stored.get(key)
+            if vector is not None:
+                self._count("db_hits")
+                hits.append(key)
+                self._memory_put(key, vector)
+                results[index] = vector.tolist()
+            else:
+                self._count("misses")
+                misses.setdefault(key, normalized)
+        self._record_hits(hits)
+
+        if not misses:
+            return results
+        try:
+            computed = list(compute_many(list(misses.values())))
+        except Exception as exc:
+            self._count("compute_errors")
+            logger.debug("Embedding de consulta falló: %s", exc)
+            return results
+        fresh: dict[str, list[float]] = {}
+        for (key, normalized), embedding in zip(misses.items(), computed):
+            if not embedding:
+                continue
+            vector = np.asarray(embedding, dtype=np.float32)
+            self._memory_put(key, vector)
+            self._db_put(key, normalized, model, dimensions, vector)
+            fresh[key] = list(embedding)
+        for index, key, _ in pending:
+            if results[index] is None and key in fresh:
+                results[index] = list(fresh[key])
+        return results
+
+    # ── Nivel 1: memoria ────────────────────────────────────────────────
+    def _memory_get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+            return vector
+
+    def _memory_put(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    # ── Nivel 2: Postgres ───────────────────────────────────────────────
+    def _engine(self):
+        if self._engine_factory is None or time.time() < self._persistence_disabled_until:
+            return None
+        try:
+            engine = self._engine_factory()
+            if not self._table_ready:
+                from sqlalchemy import text
+
+                with engine.begin() as connection:
+                    connection.execute(text(QUERY_EMBEDDING_CACHE_TABLE_SQL))
+                self._table_ready = True
+            return engine
+        except Exception as exc:
+            self._disable_persistence(exc)
+            return None
+
+    def _disable_persistence(self, exc: Exception) -> None:
+        self._count("db_errors")
+        self._persistence_disabled_until = time.time() + _PERSISTENCE_COOLDOWN_SECONDS
+        logger.warning("query_embedding_cache sin BD por %.0fs: %s", _PERSISTENCE_COOLDOWN_SECONDS, exc)
+
+    def _db_get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        engine = self._engine()
+        if engine is None or not keys:
+            return {}
+        from sqlalchemy import text
+
+        try:
+            with engine.begin() as connection:
+                rows = connection.execute(
+                    text("SELECT cache_key, embedding FROM public.query_embedding_cache WHERE cache_key = ANY(:keys)"),
+                    {"keys": keys},
+                ).fetchall()
+        except Exception as exc:
+            self._disable_persistence(exc)
+            return {}
+        return {row[0]: np.asarray(row[1], dtype=np.float32) for row in rows if row[1]}
+
+    def _record_hits(self, keys: list[str]) -> None:
+        """Acumula aciertos; si toca volcar, lo hace un hilo aparte (nunca el request)."""
+        if self._engine_factory is None:
+            return
+        with self._lock:
+            for key in keys:
+                self._pending_hits[key] = self._pending_hits.get(key, 0) + 1
+            if not self._pending_hits or time.time() - self._hits_flushed_at < _HIT_FLUSH_SECONDS:
+                return
+            batch, self._pending_hits = self._pending_hits, {}
+            self._hits_flushed_at = time.time()
+        threading.Thread(target=self._flush_hits, args=(batch,), name="query-embedding-hits", daemon=True).start()
+
+    def _flush_hits(self, batch: dict[str, int]) -> None:
+        engine = self._engine()
+        if engine is None:
+            return
+        from sqlalchemy import text
+
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        """
+                        UPDATE public.query_embedding_cache AS c
+                        SET hit_count = c.hit_count + h.hits, last_used_at = now()
+                        FROM unnest(CAST(:keys AS text[]), CAST(:hits AS integer[])) AS h(cache_key, hits)
+                        WHERE c.cache_key = h.cache_key
+                        """
+                    ),
+                    {"keys": list(batch), "hits": list(batch.values())},
+                )
+            self._count("hit_flushes")
+        except Exception as exc:
+            self._disable_persistence(exc)
+
+    def _db_put(self, key: str, normalized: str, model: str, dimensions: int, vector: np.ndarray) -> None:
+        engine = self._engine()
+        if engine is None:
+            return
+        from sqlalchemy import text
+
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        """
+                        INSERT INTO public.query_embedding_cache (cache_key, model, dimensions, normalized_text, embedding)
+                        VALUES (:key, :model, :dimensions, :normalized_text, :embedding)
+                        ON CONFLICT (cache_key) DO NOTHING
+                        """
+                    ),
+                    {
+                        "key": key,
+                        "model": model,
+                        "dimensions": int(dimensions),
+                        "normalized_text": normalized[:2000],
+                        "embedding": vector.tolist(),
+                    },
+                )
+        except Exception as exc:
+            self._disable_persistence(exc)
+
+    # ── Métricas / estado ───────────────────────────────────────────────
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            nbytes = sum(vector.nbytes for vector in self._entries.values())
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["db_hits"]
+        return {
+            **counters,
+            "lookups": lookups,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": entries,
+            "memory_kb": round(nbytes / 1024, 1),
+            "persistence_enabled": self._engine_factory is not None and time.time() >= self._persistence_disabled_until,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+def content_sha256(content: str | bytes) -> str:
+    raw = content if isinstance(content, bytes) else str(content).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class IngestEmbeddingCache:
+    """Embeddings de ingesta direccionados por contenido (tabla `embedding_cache`).
+
+    Sin memoria intermedia: una corrida de ingesta lee cada texto una vez, y
+    los duplicados dentro de una misma llamada se embeben una sola vez. Si la
+    BD falla, la corrida sigue embebiendo todo (el cache se desactiva un rato).
+    """
+
+    def __init__(self, engine_factory: Optional[Callable[[], Any]] = None, enabled: bool = True):
+        self._engine_factory = engine_factory
+        self._enabled = enabled
+        self._lock = threading.Lock()
+        self._table_ready = False
+        self._persistence_disabled_until = 0.0
+        self._counters = {"hits": 0, "misses": 0, "deduplicated": 0, "stored": 0, "db_errors": 0}
+
+    def bind_engine(self, engine_factory: Callable[[], Any]) -> None:
+        self._engine_factory = engine_factory
+
+    def get_or_embed(
+        self,
+        items: list[Any],
+        *,
+        model: str,
+        dimensions: int,
+        content: Callable[[Any], str | bytes],
+        compute_many: Callable[[list[Any]], list[list[float]]],
+    ) -> list[list[float]]:
+        """Un vector por item, en orden; `compute_many` sólo recibe los items cuyo contenido no está cacheado.
+
+        `content(item)` debe ser exactamente lo que determina el embedding
+        (texto ya formateado para el modelo, hashes de adjuntos...).
+        """
+        keys = [content_sha256(content(item)) for item in items]
+        stored = self._db_get_many(list(dict.fromkeys(keys)), model, dimensions) if items else {}
+        misses: "OrderedDict[str, Any]" = OrderedDict()
+        hits = duplicates = 0
+        for key, item in zip(keys, items):
+            if key in stored:
+                hits += 1
+            elif key in misses:
+                duplicates += 1
+            else:
+                misses[key] = item
+        with self._lock:
+            self._counters["hits"] += hits
+            self._counters["deduplicated"] += duplicates
+            self._counters["misses"] += len(misses)
+
+        if misses:
+            computed = list(compute_many(list(misses.values())))
+            if len(computed) != len(misses):
+                raise ValueError(f"{len(computed)} embeddings para {len(misses)} textos")
+            fresh = dict(zip(misses.keys(), computed))
+            self._db_put_many(fresh, model, dimensions)
+            stored.update(fresh)
+        return [list(stored[key]) for key in keys]
+
+    # ── Postgres ────────────────────────────────────────────────────────
+    def _engine(self):
+        if not self._enabled or self._engine_factory is None or time.time() < self._persistence_disabled_until:
+            return None
+        try:
+            engine = self._engine_factory()
+            if not self._table_ready:
+                from sqlalchemy import text
+
+                with engine.begin() as connection:
+                    connection.execute(text(INGEST_EMBEDDING_CACHE_TABLE_SQL))
+                self._table_ready = True
+            return engine
+        except Exception as exc:
+            self._disable_persistence(exc)
+            return None
+
+    def _disable_persistence(self, exc: Exception) -> None:
+        with self._lock:
+            self._counters["db_errors"] += 1
+        self._persistence_disabled_until = time.time() + _PERSISTENCE_COOLDOWN_SECONDS
+        logger.warning("embedding_cache de ingesta sin BD por %.0fs: %s", _PERSISTENCE_COOLDOWN_SECONDS, exc)
+
+    def _db_get_many(self, keys: list[str], model: str, dimensions: int) -> dict[str, list[float]]:
+        engine = self._engine()
+        if engine is None or not keys:
+            return {}
+        from sqlalchemy import text
+
+        found: dict[str, list[float]] = {}
+        try:
+            with engine.begin() as connection:
+                for start in range(0, len(keys), _INGEST_LOOKUP_BATCH):
+                    rows = connection.execute(
+                        text(
+                            """
+                            UPDATE public.embedding_cache
+                            SET last_used_at = now()
+                            WHERE model = :model AND dims = :dims AND content_sha256 = ANY(:keys)
+                            RETURNING content_sha256, vector
+                            """
+                        ),
+                        {"model": model, "dims": int(dimensions), "keys": keys[start:start + _INGEST_LOOKUP_BATCH]},
+                    ).fetchall()
+                    found.update({row[0]: list(row[1]) for row in rows if row[1] and len(row[1]) == int(dimensions)})
+        except Exception as exc:
+            self._disable_persistence(exc)
+            return {}
+        return found
+
+    def _db_put_many(self, vectors: dict[str, list[float]], model: str, dimensions: int) -> None:
+        engine = self._engine()
+        if engine is None or not vectors:
+            return
+        from sqlalchemy import text
+
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        """
+                        INSERT INTO public.embedding_cache (content_sha256, model, dims, vector)
+                        VALUES (:key, :model, :dims, :vector)
+                        ON CONFLICT (content_sha256, model, dims) DO NOTHING
+                        """
+                    ),
+                    [
+                        {"key": key, "model": model, "dims": int(dimensions), "vector": [float(v) for v in vector]}
+                        for key, vector in vectors.items()
+                    ],
+                )
+        except Exception as exc:
+            self._disable_persistence(exc)
+            return
+        with self._lock:
+            self._counters["stored"] += len(vectors)
+
+    # ── Métricas ────────────────────────────────────────────────────────
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["hits"] + counters["misses"] + counters["deduplicated"]
+        return {
+            **counters,
+            "enabled": self._enabled,
+            "lookups": lookups,
+            "hit_rate": round((counters["hits"] + counters["deduplicated"]) / lookups, 4) if lookups else 0.0,
+        }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def log_run_summary(self, label: str) -> None:
+        stats = self.stats()
+        logger.info(
+            "Cache de embeddings (%s): %s/%s reutilizados (%.1f%%) | %s embebidos | %s guardados | %s errores BD",
+            label, stats["hits"] + stats["deduplicated"], stats["lookups"], stats["hit_rate"] * 100,
+            stats["misses"], stats["stored"], stats["db_errors"],
+        )
+
+
+# Singleton compartido por el proceso; main.py enlaza el engine de BD.
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "2048") or "2048"),
+)
+
+# Singleton de los scripts de ingesta; cada corrida enlaza su engine.
+ingest_embedding_cache = IngestEmbeddingCache(
+    enabled=(os.getenv("INGEST_EMBEDDING_CACHE", "on") or "on").strip().lower() not in ("0", "false", "off"),
+)
@@ -0,0 +1,286 @@
+"""Conocimiento experto (`agent_expert_knowledge`) indexado en memoria.
+
+La tabla es pequeña (decenas/cientos de notas) y cambia poco, pero se
+consultaba en cada turno: `agent_context` preguntaba a `information_schema`
+por la columna embedding y lanzaba un pgvector, y `fetch_expert_knowledge`
+re-normalizaba todas las filas para buscar términos.
+
+Ahora cada worker mantiene un snapshot inmutable:
+
+  * Matriz float32 normalizada con los embeddings de las notas activas:
+    la búsqueda semántica es un único producto matriz-vector.
+  * Índice invertido por token y por campo (contexto, nota, recomendado,
+    desestimado). Un término casa con una fila si es subcadena de alguno
+    de sus tokens (mismo criterio que el `term in texto` histórico); la
+    resolución término → tokens se memoiza por snapshot.
+  * Filas duplicadas (mismo tipo y textos) se descartan al cargar.
+  * Recarga cuando sube la generación `agent_expert_knowledge` (trigger de
+    la migración + NOTIFY) o, si la generación no existe, por TTL.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+import numpy as np
+
+logger = logging.getLogger("ferreinox_agent.expert_knowledge_store")
+
+EXPERT_KNOWLEDGE_SCOPE = "agent_expert_knowledge"
+EXPERT_SEMANTIC_MIN_SIMILARITY = 0.45
+
+_TOKEN_RE = re.compile(r"[a-z0-9áéíóúñ]+")
+_FIELDS = ("contexto_tags", "nota_comercial", "producto_recomendado", "producto_desestimado")
+_LOAD_RETRY_SECONDS = 30.0
+
+# loader() -> filas activas (más recientes primero) con "embedding" opcional
+ExpertLoader = Callable[[], list[dict]]
+GenerationReader = Callable[[], Optional[int]]
+
+
+def _as_vector(value: Any) -> Optional[np.ndarray]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        stripped = value.strip().strip("[]")
+        if not stripped:
+            return None
+        return np.array(stripped.split(","), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+class ExpertSnapshot:
+    """Filas + matriz de embeddings + índice invertido; no se modifica tras construirse."""
+
+    def __init__(self, rows: list[dict], generation: Optional[int], normalize: Callable[[str], str]):
+        self.generation = generation
+        self.loaded_at = time.time()
+        self.rows: list[dict] = []
+        self.fields: list[dict[str, str]] = []
+        self.postings: dict[str, tuple[set[int], ...]] = {}
+        self._term_cache: dict[str, tuple[frozenset[int], ...]] = {}
+        self._term_lock = threading.Lock()
+
+        vectors: list[Optional[np.ndarray]] = []
+        seen_keys: set[tuple] = set()
+        for raw_row in rows:
+            row = {key: value for key, value in raw_row.items() if key != "embedding"}
+            texts = {field: normalize(row.get(field) or "") for field in _FIELDS}
+            dedupe_key = (row.get("tipo") or "", *(texts[field] for field in _FIELDS))
+            if dedupe_key in seen_keys:
+                continue
+            seen_keys.add(dedupe_key)
+            index = len(self.rows)
+            self.rows.append(row)
+            self.fields.append(texts)
+            vectors.append(_as_vector(raw_row.get("embedding")))
+            for slot, field in enumerate(_FIELDS):
+                for token in _TOKEN_RE.findall(texts[field]):
+                    self.postings.setdefault(token, (set(), set(), set(), set()))[slot].add(index)
+
+        dimensions = next((vector.shape[0] for vector in vectors if vector is not None), 0)
+        self.matrix = np.zeros((len(self.rows), dimensions), dtype=np.float32)
+        self.has_embedding = np.zeros(len(self.rows), dtype=bool)
+        for index, vector in enumerate(vectors):
+            if vector is None or vector.shape[0] != dimensions:
+                continue
+            norm = float(np.linalg.norm(vector))
+            if norm > 0:
+                self.matrix[index] = vector / norm
+                self.has_embedding[index] = True
+
+    def term_rows(self, term: str) -> tuple[frozenset[int], ...]:
+        """Filas donde `term` aparece, por campo (contexto, nota, recomendado, desestimado)."""
+        with self._term_lock:
+            cached = self._term_cache.get(term)
+        if cached is not None:
+            return cached
+        per_field: list[set[int]] = [set(), set(), set(), set()]
+        for token, postings in self.postings.items():
+            if term in token:
+                for slot in range(4):
+                    per_field[slot] |= postings[slot]
+        result = tuple(frozenset(rows) for rows in per_field)
+        with self._term_lock:
+            self._term_cache[term] = result
+        return result
+
+
+class ExpertKnowledgeStore:
+    def __init__(self, loader: Optional[ExpertLoader] = None, generation_reader: Optional[GenerationReader] = None,
+                 ttl_seconds: float = 300.0, normalize: Optional[Callable[[str], str]] = None):
+        self._loader = loader
+        self._generation_reader = generation_reader
+        self._ttl_seconds = float(ttl_seconds)
+        self._normalize = normalize or (lambda value: " ".join(str(value or "").lower().split()))
+        self._snapshot: Optional[ExpertSnapshot] = None
+        self._checked_at = 0.0
+        self._stale = True
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._counters = {"loads": 0, "load_errors": 0, "semantic_searches": 0, "keyword_searches": 0}
+
+    def bind(self, loader: ExpertLoader, generation_reader: Optional[GenerationReader] = None, *,
+             normalize: Optional[Callable[[str], str]] = None, ttl_seconds: Optional[float] = None) -> None:
+        self._loader = loader
+        self._generation_reader = generation_reader
+        if normalize is not None:
+            self._normalize = normalize
+        if ttl_seconds is not None:
+            self._ttl_seconds = float(ttl_seconds)
+
+    # ── Carga ───────────────────────────────────────────────────────────
+    def snapshot(self) -> Optional[ExpertSnapshot]:
+        current = self._snapshot
+        if current is not None and not self._stale and time.time() - self._checked_at < self._ttl_seconds:
+            return current
+        self._refresh()
+        return self._snapshot
+
+    def _refresh(self) -> None:
+        if not self._refresh_lock.acquire(blocking=self._snapshot is None):
+            return  # otro hilo ya recarga; se responde con el snapshot vigente
+        try:
+            current = self._snapshot
+            if current is not None and not self._stale and time.time() - self._checked_at < self._ttl_seconds:
+                return
+            generation = self._read_generation()
+            if current is not None and not self._stale and generation is not None and generation == current.generation:
+                self._checked_at = time.time()
+                return
+            if self._loader is None:
+                return
+            invalidations = self._invalidations
+            try:
+                rows = self._loader() or []
+            except Exception as exc:
+                self._counters["load_errors"] += 1
+                # Sin BD: se sigue con el snapshot anterior y se reintenta en un rato.
+                self._checked_at = time.time() - self._ttl_seconds + _LOAD_RETRY_SECONDS
+                logger.debug("expert_knowledge_store: carga falló: %s", exc)
+                return
+            snapshot = ExpertSnapshot(rows, generation, self._normalize)
+            with self._lock:
+                self._snapshot = snapshot
+                # Una invalidación que llegó durante la carga obliga a recargar otra vez.
+                self._stale = invalidations != self._invalidations
+                self._checked_at = time.time()
+                self._counters["loads"] += 1
+        finally:
+            self._refresh_lock.release()
+
+    def _read_generation(self) -> Optional[int]:
+        if self._generation_reader is None:
+            return None
+        try:
+            return self._generation_reader()
+        except Exception:
+            return None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._stale = True
+
+    def on_generation(self, payload: Optional[dict]) -> None:
+        """Handler de REFRESH_GENERATION_CHANNEL."""
+        scope = (payload or {}).get("scope")
+        if scope not in (None, EXPERT_KNOWLEDGE_SCOPE):
+            return
+        current = self._snapshot
+        if current is None or (payload or {}).get("generation") != current.generation:
+            self.invalidate()
+
+    # ── Consultas ───────────────────────────────────────────────────────
+    def rows(self) -> list[dict]:
+        snapshot = self.snapshot()
+        return list(snapshot.rows) if snapshot else []
+
+    def semantic_search(self, query_embedding: Optional[Iterable[float]], limit: int = 3,
+                        min_similarity: float = EXPERT_SEMANTIC_MIN_SIMILARITY) -> list[dict]:
+        snapshot = self.snapshot()
+        if snapshot is None or query_embedding is None or limit <= 0 or not snapshot.has_embedding.any():
+            return []
+        query = np.asarray(list(query_embedding), dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm == 0.0 or query.shape[0] != snapshot.matrix.shape[1]:
+            return []
+        self._counters["semantic_searches"] += 1
+        similarities = snapshot.matrix @ (query / norm)
+        similarities[~snapshot.has_embedding] = -1.0
+        order = np.argsort(-similarities, kind="stable")[:limit]
+        return [
+            {**snapshot.rows[index], "similarity": float(similarities[index])}
+            for index in order
+            if similarities[index] >= min_similarity
+        ]
+
+    def keyword_search(self, terms: list[str], anchor_terms: list[str], limit: int = 8) -> list[dict]:
+        """Ranking por términos con los pesos históricos de `fetch_expert_knowledge`."""
+        snapshot = self.snapshot()
+        if snapshot is None or not terms or limit <= 0:
+            return []
+        self._counters["keyword_searches"] += 1
+        term_rows = {term: snapshot.term_rows(term) for term in dict.fromkeys(terms + anchor_terms)}
+        candidates: set[int] = set()
+        for term in terms:
+            for rows in term_rows[term]:
+                candidates |= rows
+
+        scored = []
+        for index in sorted(candidates):
+            row = snapshot.rows[index]
+            score = 0.0
+            context_hits = 0
+            matched = 0
+            rejected_hit = False
+            for term in terms:
+                in_context, in_note, in_recommended, in_rejected = (index in rows for rows in term_rows[term])
+                if not (in_context or in_note or in_recommended or in_rejected):
+                    continue
+                matched += 1
+                score += 1.0
+                if in_context:
+                    score += 2.0
+                    context_hits += 1
+                elif in_note:
+                    score += 1.0
+                elif in_recommended or in_rejected:
+                    score += 0.4
+                if len(term) >= 7:
+                    score += 0.35
+                rejected_hit = rejected_hit or in_rejected
+
+            anchor_context_hits = sum(1 for term in anchor_terms if index in term_rows[term][0])
+            if anchor_context_hits:
+                score += 2.5 * anchor_context_hits
+            elif anchor_terms:
+                score -= 1.5
+            if row.get("tipo") == "alerta_superficie" and context_hits:
+                score += 1.5
+            if row.get("tipo") == "evitar" and rejected_hit:
+                score += 0.75
+            if score >= 2.0:
+                scored.append((score, matched, index))
+        scored.sort(key=lambda item: (-item[0], -item[1], -(snapshot.rows[item[2]].get("_ts") or 0)))
+        return [{**snapshot.rows[index], "_expert_score": round(score, 2)} for score, _, index in scored[:limit]]
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            **self._counters,
+            "rows": len(snapshot.rows) if snapshot else 0,
+            "with_embedding": int(snapshot.has_embedding.sum()) if snapshot else 0,
+            "tokens": len(snapshot.postings) if snapshot else 0,
+            "generation": snapshot.generation if snapshot else None,
+            "stale": self._stale,
+        }
+
+
+# Singleton compartido por el proceso; main.py enlaza loader y generación.
+expert_knowledge_store = ExpertKnowledgeStore()
@@ -1,10 +1,30 @@
+"""Cliente de embeddings Gemini.
+
+Las consultas del agente pasan por `query_embedding_client`:
+
+  * Token bucket (`GEMINI_EMBEDDING_MIN_INTERVAL_SECONDS` de ritmo
+    sostenido, `GEMINI_EMBEDDING_BURST` de ráfaga). La espera se reserva
+    bajo lock pero se duerme fuera de él: nadie hace cola detrás de un
+    sleep ajeno.
+  * Singleflight: textos idénticos pedidos a la vez por turnos distintos
+    comparten una sola llamada.
+  * Micro-batching: lo que llega dentro de `GEMINI_EMBEDDING_BATCH_WINDOW_MS`
+    (o mientras hay una llamada en vuelo) sale junto en un solo request.
+  * Reintentos cortos para consultas (`GEMINI_QUERY_EMBEDDING_MAX_RETRIES`);
+    la ingesta conserva el backoff largo de `_embed_content_with_retry`.
+
+`stats()` expone espera en cola, tamaño de lote y espera del bucket.
+"""
+
 from __future__ import annotations
 
 import os
 import time
-from threading import Lock
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 
 from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 
@@ -13,9 +33,11 @@ EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "gemini-embedding-2")
 EMBEDDING_DIMENSIONS = int(os.getenv("GEMINI_EMBEDDING_DIMENSIONS", "1536"))
 EMBEDDING_MIN_INTERVAL_SECONDS = float(os.getenv("GEMINI_EMBEDDING_MIN_INTERVAL_SECONDS", "0.6"))
 EMBEDDING_MAX_RETRIES = int(os.getenv("GEMINI_EMBEDDING_MAX_RETRIES", "6"))
-
-_EMBED_CALL_LOCK = Lock()
-_LAST_EMBED_CALL_AT = 0.0
+# batchEmbedContents acepta hasta 100 contenidos por request.
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("GEMINI_EMBEDDING_BATCH_MAX_ITEMS", "100"))
+EMBEDDING_BURST = float(os.getenv("GEMINI_EMBEDDING_BURST", "4"))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("GEMINI_EMBEDDING_BATCH_WINDOW_MS", "5"))
+QUERY_EMBEDDING_MAX_RETRIES = int(os.getenv("GEMINI_QUERY_EMBEDDING_MAX_RETRIES", "2"))
 
 
 def _read_streamlit_secret_value(*keys: str) -> str | None:
@@ -59,16 +81,53 @@ def _extract_embedding_values(result) -> list[float]:
     return list(values)
 
 
-def _sleep_for_rate_limit_floor():
-    global _LAST_EMBED_CALL_AT
-    if EMBEDDING_MIN_INTERVAL_SECONDS <= 0:
-        return
-    with _EMBED_CALL_LOCK:
-        now = time.monotonic()
-        wait_time = EMBEDDING_MIN_INTERVAL_SECONDS - (now - _LAST_EMBED_CALL_AT)
+def _extract_embedding_values_list(result) -> list[list[float]]:
+    embeddings = getattr(result, "embeddings", None) or []
+    values_list: list[list[float]] = []
+    for embedding in embeddings:
+        values = getattr(embedding, "values", None)
+        if values is None and isinstance(embedding, dict):
+            values = embedding.get("values")
+        if values is None:
+            raise ValueError("No se encontraron valores del embedding Gemini")
+        values_list.append(list(values))
+    return values_list
+
+
+class TokenBucket:
+    """`rate` tokens por segundo con ráfaga de hasta `burst`; rate <= 0 = sin límite."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self._rate = float(rate)
+        self._burst = max(1.0, float(burst))
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._lock = Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self) -> float:
+        """Toma un token; si hay deuda duerme lo necesario (fuera del lock). Devuelve la espera."""
+        if self._rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            self._tokens -= 1.0
+            wait_time = -self._tokens / self._rate if self._tokens < 0 else 0.0
+            if wait_time > 0:
+                self.waits += 1
+                self.wait_seconds += wait_time
         if wait_time > 0:
             time.sleep(wait_time)
-        _LAST_EMBED_CALL_AT = time.monotonic()
+        return wait_time
+
+
+_RATE_LIMITER = TokenBucket(
+    1.0 / EMBEDDING_MIN_INTERVAL_SECONDS if EMBEDDING_MIN_INTERVAL_SECONDS > 0 else 0.0,
+    burst=EMBEDDING_BURST,
+)
 
 
 def _is_retryable_gemini_error(exc: Exception) -> bool:
@@ -95,7 +154,22 @@ def _is_retryable_gemini_error(exc: Exception) -> bool:
     reraise=True,
 )
 def _embed_content_with_retry(*, model: str, contents, config):
-    _sleep_for_rate_limit_floor()
+    return _embed_content(model=model, contents=contents, config=config)
+
+
+@retry(
+    retry=retry_if_exception(_is_retryable_gemini_error),
+    wait=wait_exponential(multiplier=0.25, min=0.25, max=2),
+    stop=stop_after_attempt(max(1, QUERY_EMBEDDING_MAX_RETRIES)),
+    reraise=True,
+)
+def _embed_query_content_with_retry(*, model: str, contents, config):
+    # Consultas: el cliente espera la respuesta; mejor fallar rápido que 30 s de backoff.
+    return _embed_content(model=model, contents=contents, config=config)
+
+
+def _embed_content(*, model: str, contents, config):
+    _RATE_LIMITER.acquire()
     client, _ = get_gemini_client()
     return client.models.embed_content(
         model=model,
@@ -126,14 +200,163 @@ def prepare_retrieval_document(text: str, title: str | None = None) -> str:
     return f"title: {clean_title} | text: {clean_text}"
 
 
-def generate_query_embedding(query_text: str) -> list[float]:
+def _embed_query_batch(query_texts: list[str]) -> list[list[float]]:
+    """Un request batchEmbedContents para `query_texts` (ya acotado a EMBEDDING_BATCH_MAX_ITEMS)."""
     _, types = get_gemini_client()
-    result = _embed_content_with_retry(
+    result = _embed_query_content_with_retry(
         model=EMBEDDING_MODEL,
-        contents=prepare_retrieval_query(query_text),
+        contents=[prepare_retrieval_query(query_text) for query_text in query_texts],
         config=types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIMENSIONS),
     )
-    return _extract_embedding_values(result)
+    values = _extract_embedding_values_list(result)
+    if len(values) != len(query_texts):
+        raise ValueError(f"Gemini devolvió {len(values)} embeddings para {len(query_texts)} consultas")
+    return values
+
+
+class QueryEmbeddingBatcher:
+    """Singleflight + micro-batching de embeddings de consulta entre turnos concurrentes.
+
+    El primer llamador sin lote en curso queda como líder: espera la
+    ventana, saca hasta `max_items` textos de la cola y llama a
+    `compute_many`. Deja de ser líder en cuanto sus propios textos están
+    resueltos; si queda cola, otro llamador que espera toma el relevo, así
+    ningún turno se queda vaciando la cola ajena bajo carga sostenida. Un
+    texto ya en cola o en vuelo no se vuelve a pedir. Si un lote de varios
+    textos falla se reintenta texto por texto: cada llamador recibe su
+    propio resultado o error.
+    """
+
+    def __init__(self, compute_many: Callable[[list[str]], list[list[float]]], *,
+                 window_seconds: float = 0.005, max_items: int = 100, metrics_window: int = 512):
+        self._compute_many = compute_many
+        self._window_seconds = max(0.0, window_seconds)
+        self._max_items = max(1, int(max_items))
+        self._lock = Lock()
+        self._changed = Condition(self._lock)
+        self._queue: deque[tuple[str, Future, float]] = deque()
+        self._inflight: dict[str, Future] = {}
+        self._flushing = False
+        self._queue_waits_ms: deque[float] = deque(maxlen=metrics_window)
+        self._batch_sizes: deque[int] = deque(maxlen=metrics_window)
+        self._counters = {"requests": 0, "singleflight_hits": 0, "batches": 0, "batch_errors": 0,
+                          "single_retries": 0, "leader_handoffs": 0}
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        futures: list[Future] = []
+        with self._lock:
+            now = time.monotonic()
+            for text_value in texts:
+                self._counters["requests"] += 1
+                future = self._inflight.get(text_value)
+                if future is None:
+                    future = Future()
+                    self._inflight[text_value] = future
+                    self._queue.append((text_value, future, now))
+                else:
+                    self._counters["singleflight_hits"] += 1
+                futures.append(future)
+        first_turn = True
+        while True:
+            with self._lock:
+                self._changed.wait_for(
+                    lambda: all(future.done() for future in futures) or (self._queue and not self._flushing)
+                )
+                if all(future.done() for future in futures):
+                    break
+                self._flushing = True
+                if not first_turn:
+                    self._counters["leader_handoffs"] += 1
+            first_turn = False
+            self._drain(futures)
+        return [list(future.result()) for future in futures]
+
+    def _drain(self, own: list[Future]) -> None:
+        if self._window_seconds:
+            time.sleep(self._window_seconds)
+        while True:
+            with self._lock:
+                if not self._queue or all(future.done() for future in own):
+                    self._flushing = False
+                    self._changed.notify_all()
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self._max_items, len(self._queue)))]
+                started = time.monotonic()
+                self._batch_sizes.append(len(batch))
+                self._queue_waits_ms.extend((started - enqueued) * 1000 for _, _, enqueued in batch)
+                self._counters["batches"] += 1
+            outcomes = self._compute_batch([text_value for text_value, _, _ in batch])
+            with self._lock:
+                for (text_value, future, _), (value, error) in zip(batch, outcomes):
+                    self._inflight.pop(text_value, None)
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(value)
+                self._changed.notify_all()
+
+    def _compute_batch(self, texts: list[str]) -> list[tuple[Optional[list[float]], Optional[Exception]]]:
+        """(vector, error) por texto; un lote fallido de varios textos se reintenta uno a uno."""
+        try:
+            return [(value, None) for value in self._compute_many(texts)]
+        except Exception as exc:
+            with self._lock:
+                self._counters["batch_errors"] += 1
+            if len(texts) == 1:
+                return [(None, exc)]
+        outcomes = []
+        for text_value in texts:
+            with self._lock:
+                self._counters["single_retries"] += 1
+            try:
+                outcomes.append((self._compute_many([text_value])[0], None))
+            except Exception as exc:
+                outcomes.append((None, exc))
+        return outcomes
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            waits = sorted(self._queue_waits_ms)
+            sizes = list(self._batch_sizes)
+            queued = len(self._queue)
+
+        def _p(values: list[float], fraction: float) -> float:
+            return round(values[min(len(values) - 1, int(fraction * len(values)))], 2) if values else 0.0
+
+        return {
+            **counters,
+            "queued": queued,
+            "queue_wait_ms_p50": _p(waits, 0.5),
+            "queue_wait_ms_p95": _p(waits, 0.95),
+            "batch_size_avg": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+            "batch_size_max": max(sizes) if sizes else 0,
+            "rate_limit_waits": _RATE_LIMITER.waits,
+            "rate_limit_wait_seconds": round(_RATE_LIMITER.wait_seconds, 3),
+        }
+
+
+# Compartido por todos los turnos del proceso.
+query_embedding_client = QueryEmbeddingBatcher(
+    lambda texts: _embed_query_batch(texts),
+    window_seconds=EMBEDDING_BATCH_WINDOW_MS / 1000.0,
+    max_items=EMBEDDING_BATCH_MAX_ITEMS,
+)
+
+
+def generate_query_embedding(query_text: str) -> list[float]:
+    return query_embedding_client.embed([query_text])[0]
+
+
+def generate_query_embeddings(query_texts: list[str]) -> list[list[float]]:
+    """Embebe varias consultas en el mismo orden de `query_texts`.
+
+    Van juntas (y con las de otros turnos concurrentes) en requests
+    batchEmbedContents de hasta EMBEDDING_BATCH_MAX_ITEMS.
+    """
+    if not query_texts:
+        return []
+    return query_embedding_client.embed(list(query_texts))
 
 
 def generate_document_embedding(document_text: str, *, title: str | None = None) -> list[float]:
@@ -139,6 +139,14 @@ def import_precios(conn, filepath):
         VALUES %s
     """, tuples, page_size=2000)
 
+    # Invalida el price_book de los workers del backend (NOTIFY al hacer commit).
+    cur.execute("SAVEPOINT bump_precios")
+    try:
+        cur.execute("SELECT public.fn_bump_refresh_generation('agent_precios')")
+        cur.execute("RELEASE SAVEPOINT bump_precios")
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT bump_precios")
+
     conn.commit()
     print(f"[PRECIOS] Done. {len(tuples)} rows imported.", flush=True)
     return len(tuples)
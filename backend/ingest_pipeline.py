@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""Pipeline por etapas para la ingesta de fichas técnicas.
+
+`run_ingestion` procesaba cada PDF de punta a punta en serie: descarga,
+extracción (a veces OCR por visión), perfil LLM, embeddings e inserción.
+Cada documento esperaba a la red, a la CPU y al rate limit de Gemini por
+turnos, y una reindexación completa tomaba horas.
+
+Etapas (colas acotadas entre ellas, así la memoria no crece con el corpus):
+
+  1. download  – pool de hilos (I/O Dropbox).
+  2. extract   – PyMuPDF en un pool de procesos (CPU pura; la función debe
+                 ser picklable, a nivel de módulo).
+  3. prepare   – pool de hilos: OCR por visión, metadata, perfil LLM,
+                 embedding multimodal y chunking. Es I/O contra OpenAI/Gemini
+                 y usa clientes que no viajan a otro proceso.
+  4. embed     – hilos que embeben los chunks en lotes; el rate limit real lo
+                 pone el `TokenBucket` compartido de `gemini_embeddings`.
+  5. write     – un único escritor a la BD, un documento por transacción.
+
+Un error en cualquier etapa descarta sólo ese documento (queda en
+`PipelineReport.failed`) y el resto sigue. La concurrencia de cada etapa se
+configura con `PipelineConfig` / variables INGEST_*.
+
+`on_event(evento, entry, detalle)` recibe "start", el nombre de cada etapa
+completada (con el documento preparado en "prepare"), "skipped", "failed"
+y "resumed"; `resume(entry)` puede devolver un documento ya preparado en un
+intento anterior y entonces se salta directo a embed. Así se engancha el
+diario de ingesta (`ingestion_journal`).
+
+Benchmark sobre PDFs locales con embedder simulado:
+
+    python backend/ingest_pipeline.py --benchmark ./pdfs --embed-latency-ms 40 --embed-rate 20
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger("ferreinox_agent.ingest_pipeline")
+
+PIPELINE_STAGES = ("download", "extract", "prepare", "embed", "write")
+
+_DONE = object()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except ValueError:
+        return default
+
+
+def pipeline_mode() -> str:
+    """INGEST_PIPELINE=serial conserva el recorrido documento a documento."""
+    return "serial" if (os.getenv("INGEST_PIPELINE") or "staged").strip().lower() == "serial" else "staged"
+
+
+@dataclass
+class PipelineConfig:
+    download_workers: int = 4
+    extract_processes: int = 2      # 0 = extracción en los hilos del pipeline (sin procesos)
+    prepare_workers: int = 4
+    embed_workers: int = 4
+    embed_batch_size: int = 16
+    queue_size: int = 8
+    progress_seconds: float = 15.0
+
+    @classmethod
+    def from_env(cls, **overrides) -> "PipelineConfig":
+        config = cls(
+            download_workers=_env_int("INGEST_DOWNLOAD_WORKERS", 4),
+            extract_processes=_env_int("INGEST_EXTRACT_PROCESSES", max(1, min(4, (os.cpu_count() or 2) - 1))),
+            prepare_workers=_env_int("INGEST_PREPARE_WORKERS", 4),
+            embed_workers=_env_int("INGEST_EMBED_WORKERS", 4),
+            embed_batch_size=_env_int("INGEST_EMBED_BATCH", 16),
+            queue_size=_env_int("INGEST_QUEUE_SIZE", 8),
+            progress_seconds=float(os.getenv("INGEST_PROGRESS_SECONDS", "15") or 15),
+        )
+        for key, value in overrides.items():
+            if value is not None:
+                setattr(config, key, value)
+        return config
+
+
+@dataclass
+class PipelineReport:
+    documents: int
+    written: int
+    skipped: int
+    chunks: int
+    elapsed_seconds: float
+    failed: list[dict] = field(default_factory=list)
+    stages: dict[str, dict] = field(default_factory=dict)
+    resumed: int = 0
+
+    @property
+    def docs_per_second(self) -> float:
+        return round(self.written / self.elapsed_seconds, 3) if self.elapsed_seconds > 0 else 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return round(self.chunks / self.elapsed_seconds, 3) if self.elapsed_seconds > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "docs_per_second": self.docs_per_second, "chunks_per_second": self.chunks_per_second}
+
+
+@dataclass
+class _Item:
+    entry: dict
+    pdf_bytes: Optional[bytes] = None
+    pages: Any = None
+    prepared: Optional[dict] = None
+    embeddings: list = field(default_factory=list)
+    resumed: bool = False
+
+
+class _StageStats:
+    def __init__(self):
+        self.done = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return {"done": self.done, "failed": self.failed, "busy_seconds": round(self.busy_seconds, 3)}
+
+
+class StagedIngestPipeline:
+    """Ejecuta download → extract → prepare → embed → write con colas acotadas.
+
+    Funciones de etapa (inyectadas, así el benchmark y los tests usan stubs):
+
+      * download(entry) -> bytes
+      * extract(pdf_bytes) -> páginas (corre en otro proceso si extract_processes > 0)
+      * prepare(entry, pdf_bytes, pages) -> dict con "chunks" (lista de textos), o None para omitir
+      * embed(texts) -> un vector por texto
+      * write(prepared, embeddings) -> chunks escritos
+    """
+
+    def __init__(self, *, download: Callable, extract: Callable, prepare: Callable, embed: Callable,
+                 write: Callable, config: Optional[PipelineConfig] = None,
+                 progress: Optional[Callable[[dict], None]] = None,
+                 resume: Optional[Callable[[dict], Optional[dict]]] = None,
+                 on_event: Optional[Callable[[str, dict, Any], None]] = None):
+        self._download = download
+        self._extract = extract
+        self._prepare = prepare
+        self._embed = embed
+        self._write = write
+        self.config = config or PipelineConfig()
+        self._progress = progress or _log_progress
+        self._resume = resume
+        self._on_event = on_event
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._stats = {name: _StageStats() for name in PIPELINE_STAGES}
+        self._failed: list[dict] = []
+        self._skipped = 0
+        self._resumed = 0
+        self._chunks = 0
+        self._total = 0
+        self._started = time.perf_counter()
+        self._queues: dict[str, queue.Queue] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    # ── Etapas ──────────────────────────────────────────────────────────
+    def _do_download(self, item: _Item) -> bool:
+        self._emit("start", item.entry)
+        if self._resume is not None:
+            prepared = self._resume(item.entry)
+            if prepared is not None:
+                item.prepared = prepared
+                item.resumed = True
+                with self._lock:
+                    self._resumed += 1
+                self._emit("resumed", item.entry)
+                return True
+        item.pdf_bytes = self._download(item.entry)
+        return True
+
+    def _do_extract(self, item: _Item) -> bool:
+        if item.resumed:
+            return True
+        executor = self._executor
+        if executor is not None:
+            try:
+                item.pages = executor.submit(self._extract, item.pdf_bytes).result()
+                return True
+            except BrokenProcessPool:
+                logger.warning("Pool de extracción roto; se sigue extrayendo en hilos")
+                self._executor = None
+        item.pages = self._extract(item.pdf_bytes)
+        return True
+
+    def _do_prepare(self, item: _Item) -> bool:
+        if item.resumed:
+            return True
+        item.prepared = self._prepare(item.entry, item.pdf_bytes, item.pages)
+        item.pdf_bytes = None
+        item.pages = None
+        return item.prepared is not None
+
+    def _do_embed(self, item: _Item) -> bool:
+        texts = list(item.prepared.get("chunks") or [])
+        batch_size = max(1, self.config.embed_batch_size)
+        embeddings: list = []
+        for start in range(0, len(texts), batch_size):
+            embeddings.extend(self._embed(texts[start:start + batch_size]))
+        if len(embeddings) != len(texts):
+            raise ValueError(f"{len(embeddings)} embeddings para {len(texts)} chunks")
+        item.embeddings = embeddings
+        return True
+
+    def _do_write(self, item: _Item) -> bool:
+        written = self._write(item.prepared, item.embeddings) or 0
+        with self._lock:
+            self._chunks += written
+        item.prepared = None
+        item.embeddings = []
+        return True
+
+    # ── Motor ───────────────────────────────────────────────────────────
+    def _stage_plan(self) -> list[tuple[str, Callable[[_Item], bool], int]]:
+        config = self.config
+        extract_workers = config.extract_processes if config.extract_processes > 0 else config.download_workers
+        return [
+            ("download", self._do_download, max(1, config.download_workers)),
+            ("extract", self._do_extract, max(1, extract_workers)),
+            ("prepare", self._do_prepare, max(1, config.prepare_workers)),
+            ("embed", self._do_embed, max(1, config.embed_workers)),
+            ("write", self._do_write, 1),
+        ]
+
+    def _process(self, name: str, fn: Callable[[_Item], bool], item: _Item) -> bool:
+        """Corre una etapa sobre un documento; True si el documento sigue a la siguiente etapa."""
+        stats = self._stats[name]
+        started = time.perf_counter()
+        try:
+            keep = fn(item)
+        except Exception as exc:
+            with self._lock:
+                stats.failed += 1
+                stats.busy_seconds += time.perf_counter() - started
+                self._failed.append({
+                    "name": item.entry.get("name"),
+                    "path_lower": item.entry.get("path_lower"),
+                    "stage": name,
+                    "error": str(exc),
+                })
+            logger.error("  ✗ Error en %s (%s): %s", item.entry.get("name"), name, exc)
+            self._emit("failed", item.entry, {"stage": name, "error": str(exc)})
+            return False
+        with self._lock:
+            stats.done += 1
+            stats.busy_seconds += time.perf_counter() - started
+            if not keep:
+                self._skipped += 1
+        if not keep:
+            self._emit("skipped", item.entry)
+        elif not (item.resumed and name in ("download", "extract", "prepare")):
+            self._emit(name, item.entry, item.prepared if name == "prepare" else None)
+        return keep
+
+    def _emit(self, event: str, entry: dict, detail: Any = None) -> None:
+        if self._on_event is None:
+            return
+        try:
+            self._on_event(event, entry, detail)
+        except Exception as exc:
+            # El diario es auxiliar: si su BD falla la ingesta sigue.
+            logger.warning("on_event %s falló para %s: %s", event, entry.get("name"), exc)
+
+    def _worker(self, name: str, fn: Callable[[_Item], bool], inbox: queue.Queue,
+                outbox: Optional[queue.Queue]) -> None:
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                return
+            if self._process(name, fn, item) and outbox is not None:
+                outbox.put(item)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = time.perf_counter() - self._started
+            written = self._stats["write"].done
+            return {
+                "documents": self._total,
+                "written": written,
+                "skipped": self._skipped,
+                "resumed": self._resumed,
+                "failed": len(self._failed),
+                "chunks": self._chunks,
+                "elapsed_seconds": round(elapsed, 3),
+                "docs_per_second": round(written / elapsed, 3) if elapsed > 0 else 0.0,
+                "chunks_per_second": round(self._chunks / elapsed, 3) if elapsed > 0 else 0.0,
+                "stages": {name: stats.as_dict() for name, stats in self._stats.items()},
+                "queues": {name: q.qsize() for name, q in self._queues.items()},
+            }
+
+    def _report(self) -> PipelineReport:
+        snapshot = self.snapshot()
+        return PipelineReport(
+            documents=snapshot["documents"],
+            written=snapshot["written"],
+            skipped=snapshot["skipped"],
+            chunks=snapshot["chunks"],
+            elapsed_seconds=snapshot["elapsed_seconds"],
+            failed=list(self._failed),
+            stages=snapshot["stages"],
+            resumed=snapshot["resumed"],
+        )
+
+    def run(self, entries: Iterable[dict]) -> PipelineReport:
+        entries = list(entries)
+        self._reset()
+        self._total = len(entries)
+        plan = self._stage_plan()
+        self._queues = {name: queue.Queue(maxsize=max(1, self.config.queue_size)) for name, _, _ in plan}
+        if self.config.extract_processes > 0 and entries:
+            # spawn: los hilos del pipeline ya corren cuando el pool crea procesos; fork con hilos vivos no es seguro.
+            start_method = os.getenv("INGEST_MP_START_METHOD") or "spawn"
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.config.extract_processes, mp_context=multiprocessing.get_context(start_method),
+            )
+
+        stage_threads: list[list[threading.Thread]] = []
+        for index, (name, fn, workers) in enumerate(plan):
+            outbox = self._queues[plan[index + 1][0]] if index + 1 < len(plan) else None
+            threads = [
+                threading.Thread(target=self._worker, args=(name, fn, self._queues[name], outbox),
+                                 name=f"ingest-{name}-{n}", daemon=True)
+                for n in range(workers)
+            ]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+
+        stop_progress = threading.Event()
+        monitor = threading.Thread(target=self._monitor, args=(stop_progress,), name="ingest-progress", daemon=True)
+        monitor.start()
+        try:
+            first_queue = self._queues[plan[0][0]]
+            for entry in entries:
+                first_queue.put(_Item(entry=entry))
+            # Cierre en cascada: cuando una etapa termina, cada hilo de la siguiente recibe su centinela.
+            for _ in range(plan[0][2]):
+                first_queue.put(_DONE)
+            for index, threads in enumerate(stage_threads):
+                for thread in threads:
+                    thread.join()
+                if index + 1 < len(plan):
+                    next_name, _, next_workers = plan[index + 1]
+                    for _ in range(next_workers):
+                        self._queues[next_name].put(_DONE)
+        finally:
+            stop_progress.set()
+            monitor.join()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        report = self._report()
+        self._progress({**self.snapshot(), "final": True})
+        return report
+
+    def run_serial(self, entries: Iterable[dict]) -> PipelineReport:
+        """Las mismas etapas, un documento a la vez y sin procesos: la línea base del benchmark."""
+        entries = list(entries)
+        self._reset()
+        self._total = len(entries)
+        plan = self._stage_plan()
+        for entry in entries:
+            item = _Item(entry=entry)
+            for name, fn, _ in plan:
+                if not self._process(name, fn, item):
+                    break
+        return self._report()
+
+    def _monitor(self, stop: threading.Event) -> None:
+        interval = self.config.progress_seconds
+        if interval <= 0:
+            return
+        while not stop.wait(interval):
+            self._progress(self.snapshot())
+
+
+def _log_progress(snapshot: dict) -> None:
+    stages = snapshot["stages"]
+    logger.info(
+        "[pipeline] %s/%s escritos | descargados %s | extraídos %s | preparados %s | embebidos %s | "
+        "omitidos %s | errores %s | %s chunks | %.2f docs/s | %.1f chunks/s",
+        snapshot["written"], snapshot["documents"], stages["download"]["done"], stages["extract"]["done"],
+        stages["prepare"]["done"], stages["embed"]["done"], snapshot["skipped"], snapshot["failed"],
+        snapshot["chunks"], snapshot["docs_per_second"], snapshot["chunks_per_second"],
+    )
+
+
+# ---------------------------------------------------------------------------
+# Benchmark sobre un corpus local
+# ---------------------------------------------------------------------------
+class StubEmbedder:
+    """Embedder determinístico con latencia y rate limit simulados (sin red)."""
+
+    def __init__(self, latency_seconds: float = 0.04, rate: float = 0.0, dimensions: int = 8):
+        try:
+            from gemini_embeddings import TokenBucket
+        except ImportError:
+            from backend.gemini_embeddings import TokenBucket
+
+        self._latency = latency_seconds
+        self._bucket = TokenBucket(rate, burst=1.0)
+        self._dimensions = dimensions
+        self.calls = 0
+
+    def __call__(self, texts: list[str]) -> list[list[float]]:
+        vectors = []
+        for text_value in texts:
+            self._bucket.acquire()
+            if self._latency > 0:
+                time.sleep(self._latency)
+            digest = hashlib.sha256(text_value.encode("utf-8")).digest()
+            vectors.append([byte / 255.0 for byte in digest[:self._dimensions]])
+            self.calls += 1
+        return vectors
+
+
+def benchmark_ingest_pipeline(pdf_dir: str, *, config: Optional[PipelineConfig] = None,
+                              embed_latency_seconds: float = 0.04, embed_rate: float = 0.0,
+                              limit: Optional[int] = None) -> dict:
+    """Serie vs pipeline sobre los PDFs de `pdf_dir`: extracción y chunking reales, embedder simulado, sin BD."""
+    try:
+        import ingest_technical_sheets as sheets
+    except ImportError:
+        from backend import ingest_technical_sheets as sheets
+
+    paths = sorted(Path(pdf_dir).rglob("*.pdf"))[:limit] if limit else sorted(Path(pdf_dir).rglob("*.pdf"))
+    entries = [{"name": path.name, "path_lower": str(path).lower(), "local_path": str(path)} for path in paths]
+
+    def build(pipeline_config: PipelineConfig) -> StagedIngestPipeline:
+        return StagedIngestPipeline(
+            download=lambda entry: Path(entry["local_path"]).read_bytes(),
+            extract=sheets.extract_text_from_pdf_pages,
+            prepare=lambda entry, pdf_bytes, pages: sheets.prepare_ingest_document(
+                None, entry, pdf_bytes, pages, multimodal=False,
+            ),
+            embed=StubEmbedder(embed_latency_seconds, embed_rate),
+            write=lambda prepared, embeddings: len(sheets.build_chunk_rows(prepared, embeddings)),
+            config=pipeline_config,
+            progress=lambda snapshot: None,
+        )
+
+    staged_config = config or PipelineConfig.from_env()
+    serial = build(staged_config).run_serial(entries)
+    staged = build(staged_config).run(entries)
+    return {
+        "pdf_dir": str(pdf_dir),
+        "documents": len(entries),
+        "config": asdict(staged_config),
+        "embed_latency_seconds": embed_latency_seconds,
+        "embed_rate": embed_rate,
+        "serial": serial.as_dict(),
+        "staged": staged.as_dict(),
+        "speedup": round(serial.elapsed_seconds / staged.elapsed_seconds, 2) if staged.elapsed_seconds > 0 else None,
+    }
+
+
+def write_benchmark_report(result: dict) -> Path:
+    report_dir = Path(__file__).resolve().parent.parent / "artifacts" / "rag"
+    report_dir.mkdir(parents=True, exist_ok=True)
+    report_path = report_dir / "ingest_pipeline_benchmark.json"
+    report_path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    for mode in ("serial", "staged"):
+        logger.info(
+            "  %-6s %s docs en %.2fs | %.2f docs/s | %.1f chunks/s | errores %s",
+            mode, result[mode]["written"], result[mode]["elapsed_seconds"], result[mode]["docs_per_second"],
+            result[mode]["chunks_per_second"], len(result[mode]["failed"]),
+        )
+    logger.info("Speedup del pipeline: x%s. Reporte escrito en: %s", result["speedup"], report_path)
+    return report_path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de ingesta sobre PDFs locales")
+    parser.add_argument("--benchmark", required=True, metavar="DIR", help="Carpeta con PDFs (recursivo)")
+    parser.add_argument("--limit", type=int, help="Máximo de PDFs")
+    parser.add_argument("--embed-latency-ms", type=float, default=40.0, help="Latencia simulada por chunk")
+    parser.add_argument("--embed-rate", type=float, default=0.0, help="Chunks/s del rate limit simulado (0 = sin límite)")
+    parser.add_argument("--download-workers", type=int)
+    parser.add_argument("--extract-processes", type=int)
+    parser.add_argument("--prepare-workers", type=int)
+    parser.add_argument("--embed-workers", type=int)
+    parser.add_argument("--embed-batch", type=int)
+    args = parser.parse_args()
+    result = benchmark_ingest_pipeline(
+        args.benchmark,
+        config=PipelineConfig.from_env(
+            download_workers=args.download_workers,
+            extract_processes=args.extract_processes,
+            prepare_workers=args.prepare_workers,
+            embed_workers=args.embed_workers,
+            embed_batch_size=args.embed_batch,
+        ),
+        embed_latency_seconds=args.embed_latency_ms / 1000.0,
+        embed_rate=args.embed_rate,
+        limit=args.limit,
+    )
+    write_benchmark_report(result)
@@ -26,14 +26,16 @@ sys.path.insert(0, os.path.dirname(__file__))
 from ingest_technical_sheets import (
     EMBEDDING_DIMENSIONS,
     EMBEDDING_MODEL,
+    embed_documents_cached,
     get_database_url,
     insert_chunks,
+    publish_chunk_generation,
 )
 
 try:
-    from gemini_embeddings import generate_document_embeddings
+    from embedding_cache import ingest_embedding_cache
 except ImportError:
-    from backend.gemini_embeddings import generate_document_embeddings
+    from backend.embedding_cache import ingest_embedding_cache
 
 from sqlalchemy import create_engine, text
 
@@ -296,14 +298,14 @@ def prepare_chunks(guides: list[dict]) -> list[dict]:
 
 
 def generate_embeddings_batch(texts: list[str], titles: list[str] | None = None) -> list[list[float]]:
-    """Genera embeddings documento por documento con Gemini para evitar agregación multi-input."""
+    """Genera embeddings documento por documento con Gemini (sin agregación multi-input); reutiliza los ya cacheados."""
     documents = []
     for index, text_value in enumerate(texts):
         documents.append({
             "title": titles[index] if titles and index < len(titles) else None,
             "text": text_value,
         })
-    return generate_document_embeddings(documents, sleep_seconds=0.05)
+    return embed_documents_cached(documents, sleep_seconds=0.05)
 
 
 def delete_existing_guide_chunks(engine):
@@ -342,6 +344,7 @@ def main():
     if not database_url:
         raise RuntimeError("DATABASE_URL no configurado")
     engine = create_engine(database_url)
+    ingest_embedding_cache.bind_engine(lambda: engine)
 
     guides = load_all_guides(workspace_root)
     chunks = prepare_chunks(guides)
@@ -377,10 +380,12 @@ def main():
     for chunk, embedding in zip(to_ingest, embeddings):
         chunk["embedding"] = embedding
     logger.info(f"Embeddings generados: {len(embeddings)}")
+    ingest_embedding_cache.log_run_summary("guías de solución")
 
     logger.info("Insertando chunks en BD...")
     insert_chunks(engine, to_ingest)
     logger.info(f"✅ {len(to_ingest)} guías de solución ingeridas exitosamente")
+    publish_chunk_generation(engine)
 
     with engine.connect() as conn:
         count = conn.execute(text(
@@ -8,6 +8,13 @@ Uso:
     python backend/ingest_technical_sheets.py --dry-run      # Solo lista PDFs sin procesar
     python backend/ingest_technical_sheets.py --profiles-only # Rebuild solo de perfiles estructurados
     python backend/ingest_technical_sheets.py --rebuild-profiles-from-db # Rebuild de perfiles desde chunks ya guardados
+    python backend/ingest_technical_sheets.py --vector-tier-index halfvec  # Índice cuantizado (halfvec|bit)
+    python backend/ingest_technical_sheets.py --vector-tier-report       # Recall/latencia por nivel vectorial y bajo filtros
+    python backend/ingest_technical_sheets.py --partial-indexes          # Índices HNSW parciales (guías / fichas por segmento)
+    python backend/ingest_technical_sheets.py --fulltext-index           # tsvector + GIN para la búsqueda híbrida
+    python backend/ingest_technical_sheets.py --full --embed-workers 6   # Concurrencia por etapa del pipeline
+    python backend/ingest_technical_sheets.py --release-quarantine       # Reintentar PDFs en cuarentena
+    INGEST_PIPELINE=serial python backend/ingest_technical_sheets.py     # Recorrido documento a documento
 
 Variables de entorno requeridas:
     DATABASE_URL / POSTGRES_DB_URI
@@ -24,6 +31,7 @@ import json
 import logging
 import os
 import re
+import struct
 import sys
 import time
 import unicodedata
@@ -38,12 +46,18 @@ from openai import OpenAI
 from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
 from sqlalchemy import create_engine, text
 
+try:
+    from pgvector import Vector as PgVector
+except ImportError:
+    PgVector = None
+
 try:
     from gemini_embeddings import (
         EMBEDDING_DIMENSIONS,
         EMBEDDING_MODEL,
         generate_document_embeddings,
         generate_multimodal_product_embedding,
+        prepare_retrieval_document,
     )
 except ImportError:
     from backend.gemini_embeddings import (
@@ -51,8 +65,63 @@ except ImportError:
         EMBEDDING_MODEL,
         generate_document_embeddings,
         generate_multimodal_product_embedding,
+        prepare_retrieval_document,
+    )
+
+try:
+    from embedding_cache import content_sha256, ingest_embedding_cache
+except ImportError:
+    from backend.embedding_cache import content_sha256, ingest_embedding_cache
+
+try:
+    from rag_search import (
+        CHUNK_TSVECTOR_COLUMN,
+        CHUNK_TSVECTOR_CONFIG,
+        GUIDE_TYPE_SQL,
+        PARTIAL_INDEX_SEGMENTS,
+        PORTFOLIO_SEGMENT_SQL,
+        TECHNICAL_SHEET_TYPES_SQL,
+        hnsw_session_sql,
+        quantized_candidate_limit,
+        vector_distance_sql,
+    )
+except ImportError:
+    from backend.rag_search import (
+        CHUNK_TSVECTOR_COLUMN,
+        CHUNK_TSVECTOR_CONFIG,
+        GUIDE_TYPE_SQL,
+        PARTIAL_INDEX_SEGMENTS,
+        PORTFOLIO_SEGMENT_SQL,
+        TECHNICAL_SHEET_TYPES_SQL,
+        hnsw_session_sql,
+        quantized_candidate_limit,
+        vector_distance_sql,
     )
 
+try:
+    from ingest_pipeline import PipelineConfig, PipelineReport, StagedIngestPipeline, pipeline_mode
+except ImportError:
+    from backend.ingest_pipeline import PipelineConfig, PipelineReport, StagedIngestPipeline, pipeline_mode
+
+try:
+    from ingestion_journal import IngestionJournal
+except ImportError:
+    from backend.ingestion_journal import IngestionJournal
+
+try:
+    from dropbox_mirror import DropboxMirror
+except ImportError:
+    from backend.dropbox_mirror import DropboxMirror
+
+try:
+    from cache_invalidation import bump_refresh_generation
+    from local_vector_index import CHUNK_INDEX_SCOPE, export_chunk_index, local_index_mode
+    from technical_profile_store import PROFILE_SCOPE
+except ImportError:
+    from backend.cache_invalidation import bump_refresh_generation
+    from backend.local_vector_index import CHUNK_INDEX_SCOPE, export_chunk_index, local_index_mode
+    from backend.technical_profile_store import PROFILE_SCOPE
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
@@ -506,6 +575,331 @@ def ensure_profile_table(engine):
     logger.info("Tabla agent_technical_profile verificada/creada.")
 
 
+# ---------------------------------------------------------------------------
+# Nivel vectorial cuantizado (halfvec / bit) para agent_technical_doc_chunk
+# ---------------------------------------------------------------------------
+# Índices de expresión opcionales; el vector completo sigue en `embedding`
+# para el rerank exacto (ver rag_search._chunk_table_source). Requieren
+# pgvector >= 0.7 y se activan en el agente con RAG_VECTOR_TIER.
+QUANTIZED_CHUNK_INDEXES = {
+    "halfvec": (
+        "idx_technical_chunks_halfvec",
+        f"USING hnsw ((embedding::halfvec({EMBEDDING_DIMENSIONS})) halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)",
+    ),
+    "bit": (
+        "idx_technical_chunks_bit",
+        f"USING hnsw ((binary_quantize(embedding)::bit({EMBEDDING_DIMENSIONS})) bit_hamming_ops) WITH (m = 16, ef_construction = 64)",
+    ),
+}
+PGVECTOR_QUANTIZATION_MIN_VERSION = (0, 7, 0)
+
+
+def _pgvector_version(conn) -> tuple[int, ...]:
+    raw = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar() or "0"
+    return tuple(int(part) for part in re.findall(r"\d+", raw)[:3])
+
+
+def _index_state(conn, index_name: str) -> str:
+    """'missing', 'valid' o 'invalid' (un CREATE INDEX CONCURRENTLY interrumpido deja el índice inválido)."""
+    valid = conn.execute(
+        text("""
+            SELECT i.indisvalid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public' AND c.relname = :name
+        """),
+        {"name": index_name},
+    ).scalar()
+    if valid is None:
+        return "missing"
+    return "valid" if valid else "invalid"
+
+
+def ensure_quantized_chunk_index(engine, tier: str, reindex: bool = False) -> bool:
+    """Crea (o reconstruye) el índice cuantizado del nivel sin bloquear escrituras.
+
+    CONCURRENTLY no corre dentro de una transacción: se usa AUTOCOMMIT.
+    `reindex=True` reconstruye el índice tras una re-ingesta completa.
+    """
+    if tier not in QUANTIZED_CHUNK_INDEXES:
+        raise ValueError(f"Nivel vectorial sin índice cuantizado: {tier}")
+    index_name, using_sql = QUANTIZED_CHUNK_INDEXES[tier]
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        version = _pgvector_version(conn)
+        if version < PGVECTOR_QUANTIZATION_MIN_VERSION:
+            logger.warning("pgvector %s no soporta halfvec/bit; se mantiene el nivel exacto.", ".".join(map(str, version)))
+            return False
+        _create_chunk_index_concurrently(conn, index_name, using_sql, reindex=reindex)
+        conn.execute(text("ANALYZE public.agent_technical_doc_chunk"))
+    return True
+
+
+def _create_chunk_index_concurrently(conn, index_name: str, index_sql: str, reindex: bool = False):
+    """CREATE INDEX CONCURRENTLY idempotente; repara builds interrumpidos (índice inválido)."""
+    state = _index_state(conn, index_name)
+    if state == "invalid":
+        logger.info("Índice %s inválido (build interrumpido); se elimina y recrea.", index_name)
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS public.{index_name}"))
+        state = "missing"
+    started = time.perf_counter()
+    if state == "missing":
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON public.agent_technical_doc_chunk {index_sql}"))
+        logger.info("Índice %s creado en %.1fs.", index_name, time.perf_counter() - started)
+    elif reindex:
+        conn.execute(text(f"REINDEX INDEX CONCURRENTLY public.{index_name}"))
+        logger.info("Índice %s reconstruido en %.1fs.", index_name, time.perf_counter() - started)
+
+
+def partial_chunk_index_predicates() -> dict[str, str]:
+    """Índices HNSW parciales: guías y fichas técnicas por segmento de portafolio.
+
+    Los predicados usan las mismas expresiones que rag_search para que el
+    planner pueda probar que el WHERE de la búsqueda los implica.
+    """
+    predicates = {"idx_technical_chunks_guias": GUIDE_TYPE_SQL}
+    for segment in PARTIAL_INDEX_SEGMENTS:
+        predicates[f"idx_technical_chunks_fichas_{segment}"] = (
+            f"{TECHNICAL_SHEET_TYPES_SQL} AND {PORTFOLIO_SEGMENT_SQL} = '{segment}'"
+        )
+    return predicates
+
+
+def _partial_chunk_indexes_present(engine) -> bool:
+    with engine.connect() as conn:
+        return any(_index_state(conn, name) != "missing" for name in partial_chunk_index_predicates())
+
+
+def ensure_partial_chunk_indexes(engine, reindex: bool = False) -> list[str]:
+    index_names = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for index_name, predicate in partial_chunk_index_predicates().items():
+            _create_chunk_index_concurrently(
+                conn,
+                index_name,
+                f"USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64) WHERE {predicate}",
+                reindex=reindex,
+            )
+            index_names.append(index_name)
+        conn.execute(text("ANALYZE public.agent_technical_doc_chunk"))
+    return index_names
+
+
+FULLTEXT_CHUNK_INDEX = "idx_technical_chunks_tsv"
+
+
+def ensure_chunk_fulltext_index(engine, reindex: bool = False) -> bool:
+    """Columna tsvector generada + índice GIN para la búsqueda híbrida.
+
+    Mismo contenido que migrations/2026_10_19_chunk_fulltext.sql. El ADD
+    COLUMN reescribe la tabla una vez; el índice se crea CONCURRENTLY.
+    """
+    config_schema, config_name = CHUNK_TSVECTOR_CONFIG.split(".", 1)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS unaccent"))
+        exists = conn.execute(
+            text("""
+                SELECT 1 FROM pg_ts_config c JOIN pg_namespace n ON n.oid = c.cfgnamespace
+                WHERE n.nspname = :schema AND c.cfgname = :name
+            """),
+            {"schema": config_schema, "name": config_name},
+        ).scalar()
+        if not exists:
+            conn.execute(text(f"CREATE TEXT SEARCH CONFIGURATION {CHUNK_TSVECTOR_CONFIG} (COPY = pg_catalog.spanish)"))
+            conn.execute(text(
+                f"ALTER TEXT SEARCH CONFIGURATION {CHUNK_TSVECTOR_CONFIG} "
+                "ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem"
+            ))
+        started = time.perf_counter()
+        conn.execute(text(f"""
+            ALTER TABLE public.agent_technical_doc_chunk
+                ADD COLUMN IF NOT EXISTS {CHUNK_TSVECTOR_COLUMN} tsvector GENERATED ALWAYS AS (
+                    setweight(to_tsvector('{CHUNK_TSVECTOR_CONFIG}'::regconfig, COALESCE(familia_producto, '')), 'A')
+                    || setweight(to_tsvector('{CHUNK_TSVECTOR_CONFIG}'::regconfig, COALESCE(chunk_text, '')), 'B')
+                ) STORED
+        """))
+        logger.info("Columna %s verificada en %.1fs.", CHUNK_TSVECTOR_COLUMN, time.perf_counter() - started)
+        _create_chunk_index_concurrently(conn, FULLTEXT_CHUNK_INDEX, f"USING gin ({CHUNK_TSVECTOR_COLUMN})", reindex=reindex)
+        conn.execute(text("ANALYZE public.agent_technical_doc_chunk"))
+    return True
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def build_vector_tier_report(engine, sample_size: int = 30, top_k: int = 6) -> dict:
+    """Recall@k y latencia de cada nivel contra búsqueda exacta por fuerza bruta.
+
+    Las consultas son embeddings de chunks reales (excluyendo su propia
+    fila). "exact" es el índice HNSW actual sobre vector(1536); los niveles
+    cuantizados sólo se miden si su índice existe y es válido.
+    """
+    query_vector = "CAST(:q AS vector)"
+    with engine.connect() as conn:
+        samples = conn.execute(
+            text("SELECT id, embedding::text FROM public.agent_technical_doc_chunk ORDER BY random() LIMIT :n"),
+            {"n": sample_size},
+        ).fetchall()
+        tiers = ["exact"] + [tier for tier, (name, _) in QUANTIZED_CHUNK_INDEXES.items() if _index_state(conn, name) == "valid"]
+        index_sizes = {
+            tier: conn.execute(
+                text("SELECT pg_relation_size(to_regclass(:name))"),
+                {"name": f"public.{QUANTIZED_CHUNK_INDEXES[tier][0]}" if tier != "exact" else "public.idx_technical_chunks"},
+            ).scalar()
+            for tier in tiers
+        }
+        conn.rollback()
+        candidates = quantized_candidate_limit(top_k)
+        recalls: dict[str, list[float]] = {tier: [] for tier in tiers}
+        latencies: dict[str, list[float]] = {tier: [] for tier in tiers}
+        for sample_id, embedding_text in samples:
+            params = {"q": embedding_text, "self_id": sample_id, "k": top_k, "candidates": candidates}
+            # Verdad de referencia: escaneo secuencial exacto (SET LOCAL muere con el rollback).
+            conn.execute(text("SET LOCAL enable_indexscan = off"))
+            truth = {row[0] for row in conn.execute(
+                text(f"""
+                    SELECT id FROM public.agent_technical_doc_chunk
+                    WHERE id <> :self_id
+                    ORDER BY embedding <=> {query_vector}
+                    LIMIT :k
+                """),
+                params,
+            )}
+            conn.rollback()
+            for tier in tiers:
+                if tier == "exact":
+                    sql = f"""
+                        SELECT id FROM public.agent_technical_doc_chunk
+                        WHERE id <> :self_id
+                        ORDER BY {vector_distance_sql(tier, query_vector)}
+                        LIMIT :k
+                    """
+                else:
+                    sql = f"""
+                        SELECT id FROM (
+                            SELECT id, embedding FROM public.agent_technical_doc_chunk
+                            WHERE id <> :self_id
+                            ORDER BY {vector_distance_sql(tier, query_vector)}
+                            LIMIT :candidates
+                        ) AS candidates
+                        ORDER BY embedding <=> {query_vector}
+                        LIMIT :k
+                    """
+                started = time.perf_counter()
+                found = {row[0] for row in conn.execute(text(sql), params)}
+                latencies[tier].append((time.perf_counter() - started) * 1000)
+                recalls[tier].append(len(found & truth) / len(truth) if truth else 1.0)
+            conn.rollback()
+        filtered = _build_filtered_recall(conn, samples, top_k)
+
+    return {
+        "generated_at": datetime.now(UTC).isoformat(),
+        "samples": len(samples),
+        "top_k": top_k,
+        "rerank_candidates": candidates,
+        "tiers": {
+            tier: {
+                "recall_at_k": round(sum(recalls[tier]) / len(recalls[tier]), 4) if recalls[tier] else None,
+                "latency_ms_p50": round(_percentile(latencies[tier], 0.5), 2),
+                "latency_ms_p95": round(_percentile(latencies[tier], 0.95), 2),
+                "index_size_mb": round((index_sizes.get(tier) or 0) / (1024 * 1024), 1),
+            }
+            for tier in tiers
+        },
+        "filtered": filtered,
+    }
+
+
+def _build_filtered_recall(conn, samples, top_k: int) -> dict:
+    """Recall@k bajo filtros (fichas/guías/segmento) con los SET LOCAL que usa el agente.
+
+    `avg_rows` < top_k delata el problema de post-filtrado del ANN.
+    """
+    query_vector = "CAST(:q AS vector)"
+    session_sql = hnsw_session_sql(top_k, True, _pgvector_version(conn))
+    scenarios = {"fichas": TECHNICAL_SHEET_TYPES_SQL, "guias": GUIDE_TYPE_SQL}
+    for segment in PARTIAL_INDEX_SEGMENTS:
+        scenarios[f"fichas_{segment}"] = f"{TECHNICAL_SHEET_TYPES_SQL} AND {PORTFOLIO_SEGMENT_SQL} = '{segment}'"
+    conn.rollback()
+
+    report: dict[str, dict] = {}
+    for scenario, predicate in scenarios.items():
+        sql = f"""
+            SELECT id FROM public.agent_technical_doc_chunk
+            WHERE {predicate} AND id <> :self_id
+            ORDER BY embedding <=> {query_vector}
+            LIMIT :k
+        """
+        recalls: list[float] = []
+        rows_returned: list[int] = []
+        for sample_id, embedding_text in samples:
+            params = {"q": embedding_text, "self_id": sample_id, "k": top_k}
+            conn.execute(text("SET LOCAL enable_indexscan = off"))
+            truth = {row[0] for row in conn.execute(text(sql), params)}
+            conn.rollback()
+            if not truth:
+                continue
+            for statement in filter(None, (part.strip() for part in session_sql.split(";"))):
+                conn.execute(text(statement))
+            found = {row[0] for row in conn.execute(text(sql), params)}
+            conn.rollback()
+            recalls.append(len(found & truth) / len(truth))
+            rows_returned.append(len(found))
+        report[scenario] = {
+            "queries": len(recalls),
+            "recall_at_k": round(sum(recalls) / len(recalls), 4) if recalls else None,
+            "avg_rows": round(sum(rows_returned) / len(rows_returned), 2) if rows_returned else None,
+        }
+    return report
+
+
+def write_vector_tier_report(report: dict):
+    report_dir = Path(__file__).resolve().parent.parent / "artifacts" / "rag"
+    report_dir.mkdir(parents=True, exist_ok=True)
+    report_path = report_dir / "rag_vector_tier_report.json"
+    report_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    for tier, metrics in report["tiers"].items():
+        logger.info(
+            "  %-8s recall@%s=%s p50=%sms p95=%sms índice=%sMB",
+            tier, report["top_k"], metrics["recall_at_k"], metrics["latency_ms_p50"],
+            metrics["latency_ms_p95"], metrics["index_size_mb"],
+        )
+    for scenario, metrics in (report.get("filtered") or {}).items():
+        logger.info(
+            "  filtro %-32s recall@%s=%s filas=%s",
+            scenario, report["top_k"], metrics["recall_at_k"], metrics["avg_rows"],
+        )
+    logger.info("Reporte de niveles vectoriales escrito en: %s", report_path)
+
+
+def publish_chunk_generation(engine) -> None:
+    """Sube la generación de los chunks y, si el índice local está activo, lo re-exporta.
+
+    La generación invalida en los workers todo lo derivado de los chunks
+    (índice vectorial local incluido, vía NOTIFY).
+    """
+    with engine.begin() as conn:
+        generation = bump_refresh_generation(conn, CHUNK_INDEX_SCOPE)
+    logger.info("Generación %s de los chunks técnicos: %s", CHUNK_INDEX_SCOPE, generation)
+    if local_index_mode() == "off":
+        return
+    try:
+        export_chunk_index(engine)
+    except Exception as exc:
+        logger.warning("No se pudo exportar el índice vectorial local: %s", exc)
+
+
+def publish_profile_generation(engine) -> None:
+    """Sube la generación de los perfiles técnicos: cada worker recarga technical_profile_store."""
+    with engine.begin() as conn:
+        generation = bump_refresh_generation(conn, PROFILE_SCOPE)
+    logger.info("Generación %s de los perfiles técnicos: %s", PROFILE_SCOPE, generation)
+
+
 def normalize_text(value: str) -> str:
     text = unicodedata.normalize("NFKD", value or "")
     text = "".join(ch for ch in text if not unicodedata.combining(ch))
@@ -832,6 +1226,7 @@ def _search_dropbox_pdf_by_name(dbx, filename: str) -> dict | None:
                 "path_lower": path_lower,
                 "size": meta.size,
                 "content_hash": meta.content_hash,
+                "rev": meta.rev,
             }
     return best
 
@@ -865,7 +1260,21 @@ def _discover_dropbox_pdfs_via_manifest(dbx) -> list[dict]:
     return entries
 
 
-def list_dropbox_pdfs(dbx) -> list[dict]:
+def list_dropbox_pdfs(dbx, engine=None) -> list[dict]:
+    """PDFs de TECHNICAL_DOC_FOLDER; con `engine` se leen del espejo `dropbox_file_mirror` tras una sync incremental."""
+    if engine is not None:
+        mirror = DropboxMirror(TECHNICAL_DOC_FOLDER, engine_factory=lambda: engine)
+        try:
+            changes = mirror.sync(dbx)
+            logger.info(
+                "  Espejo Dropbox (%s): %s nuevos/modificados, %s eliminados desde la última corrida",
+                changes["mode"],
+                len(changes["changed"]),
+                len(changes["deleted"]),
+            )
+            return mirror.entries()
+        except Exception as exc:
+            logger.warning("Espejo Dropbox no disponible (%s); listado directo", exc)
     entries = []
     try:
         result = dbx.files_list_folder(TECHNICAL_DOC_FOLDER, recursive=True)
@@ -877,6 +1286,7 @@ def list_dropbox_pdfs(dbx) -> list[dict]:
                         "path_lower": entry.path_lower,
                         "size": entry.size,
                         "content_hash": entry.content_hash,
+                        "rev": entry.rev,
                     })
             if not result.has_more:
                 break
@@ -1008,12 +1418,13 @@ def extract_text_from_page_image_with_vision(openai_client: OpenAI, page, filena
     return (response.choices[0].message.content or "").strip()
 
 
-def extract_text_from_pdf_robust(openai_client: OpenAI, pdf_bytes: bytes, filename: str) -> tuple[str, dict]:
-    page_payloads = extract_text_from_pdf_pages(pdf_bytes)
+def apply_vision_ocr(openai_client: OpenAI | None, pdf_bytes: bytes, page_payloads: list[dict],
+                     filename: str) -> tuple[str, dict]:
+    """Completa con OCR/visión las páginas pobres de `extract_text_from_pdf_pages`; sin cliente no hay OCR."""
     if not page_payloads:
         return "", {"page_count": 0, "ocr_pages": 0, "ocr_page_numbers": []}
 
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf") if openai_client is not None else None
     ocr_pages = []
     combined_pages = []
     try:
@@ -1021,7 +1432,7 @@ def extract_text_from_pdf_robust(openai_client: OpenAI, pdf_bytes: bytes, filena
             page_number = page_payload["page_number"]
             extracted_text = page_payload.get("text") or ""
             final_text = extracted_text
-            if should_run_vision_ocr(extracted_text) and len(ocr_pages) < OCR_MAX_PAGES:
+            if doc is not None and should_run_vision_ocr(extracted_text) and len(ocr_pages) < OCR_MAX_PAGES:
                 try:
                     vision_text = extract_text_from_page_image_with_vision(
                         openai_client,
@@ -1037,7 +1448,8 @@ def extract_text_from_pdf_robust(openai_client: OpenAI, pdf_bytes: bytes, filena
             if final_text.strip():
                 combined_pages.append(final_text.strip())
     finally:
-        doc.close()
+        if doc is not None:
+            doc.close()
 
     return "\n\n".join(combined_pages).strip(), {
         "page_count": len(page_payloads),
@@ -1046,6 +1458,10 @@ def extract_text_from_pdf_robust(openai_client: OpenAI, pdf_bytes: bytes, filena
     }
 
 
+def extract_text_from_pdf_robust(openai_client: OpenAI, pdf_bytes: bytes, filename: str) -> tuple[str, dict]:
+    return apply_vision_ocr(openai_client, pdf_bytes, extract_text_from_pdf_pages(pdf_bytes), filename)
+
+
 def clean_extracted_text(raw_text: str) -> str:
     text = re.sub(r"\n{3,}", "\n\n", raw_text)
     text = re.sub(r"[ \t]+", " ", text)
@@ -2170,7 +2586,7 @@ def build_technical_profile(openai_client: OpenAI, filename: str, path_lower: st
         portfolio_segment,
         portfolio_subsegment,
     )
-    llm_profile = extract_llm_profile(openai_client, heuristic_profile, excerpts)
+    llm_profile = extract_llm_profile(openai_client, heuristic_profile, excerpts) if openai_client is not None else None
     merged_profile = merge_profile_values(heuristic_profile, llm_profile or {})
     merged_profile.setdefault("extraction", {})
     merged_profile["extraction"]["strategy"] = "hybrid" if llm_profile else "heuristic"
@@ -2316,9 +2732,36 @@ def infer_family(filename: str) -> str | None:
 # ---------------------------------------------------------------------------
 # Embeddings
 # ---------------------------------------------------------------------------
-def generate_embeddings(client: OpenAI, texts: list[str]) -> list[list[float]]:
+def embed_documents_cached(documents: list[dict], sleep_seconds: float = 0.05) -> list[list[float]]:
+    """Embeddings de documentos {"title", "text"}; sólo se llama a Gemini para contenido no visto antes."""
+    return ingest_embedding_cache.get_or_embed(
+        documents,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS,
+        content=lambda document: prepare_retrieval_document(document.get("text") or "", title=document.get("title")),
+        compute_many=lambda missing: generate_document_embeddings(missing, sleep_seconds=sleep_seconds),
+    )
+
+
+def generate_embeddings(client: OpenAI, texts: list[str], sleep_seconds: float = 0.05) -> list[list[float]]:
     documents = [{"title": None, "text": text} for text in texts]
-    return generate_document_embeddings(documents, sleep_seconds=0.05)
+    return embed_documents_cached(documents, sleep_seconds=sleep_seconds)
+
+
+def generate_multimodal_embedding_cached(*, title: str, summary_text: str, pdf_bytes: bytes | None,
+                                         image_bytes: bytes | None) -> list[float]:
+    request = {"title": title, "summary_text": summary_text, "pdf_bytes": pdf_bytes, "image_bytes": image_bytes}
+    return ingest_embedding_cache.get_or_embed(
+        [request],
+        model=f"{EMBEDDING_MODEL}:multimodal",
+        dimensions=EMBEDDING_DIMENSIONS,
+        content=lambda item: "\x1f".join([
+            prepare_retrieval_document(item["summary_text"], title=item["title"]),
+            content_sha256(item["pdf_bytes"] or b""),
+            content_sha256(item["image_bytes"] or b""),
+        ]),
+        compute_many=lambda missing: [generate_multimodal_product_embedding(**item) for item in missing],
+    )[0]
 
 
 # ---------------------------------------------------------------------------
@@ -2360,41 +2803,111 @@ def delete_technical_profile(engine, path_lower: str):
         conn.execute(text("DELETE FROM public.agent_technical_profile WHERE source_doc_path_lower = :p"), {"p": path_lower})
 
 
-def insert_chunks(engine, chunks_data: list[dict]):
-    """Insert chunks using raw psycopg2 to avoid SQLAlchemy text() issues with ::vector cast."""
+CHUNK_COPY_STAGE_TABLE = "agent_chunk_copy_stage"
+CHUNK_COPY_COLUMNS = (
+    "doc_filename", "doc_path_lower", "chunk_index", "chunk_text", "marca",
+    "familia_producto", "tipo_documento", "metadata", "embedding", "token_count",
+)
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+_PGCOPY_NULL = struct.pack(">i", -1)
+
+
+def _copy_field(payload: bytes | None) -> bytes:
+    if payload is None:
+        return _PGCOPY_NULL
+    return struct.pack(">i", len(payload)) + payload
+
+
+def _copy_text(value) -> bytes | None:
+    return None if value is None else str(value).encode("utf-8")
+
+
+def _copy_int4(value) -> bytes | None:
+    return None if value is None else struct.pack(">i", int(value))
+
+
+def _copy_vector(embedding) -> bytes:
+    """Formato binario de `vector` (vector_recv): dim uint16, unused uint16, float4 big-endian."""
+    if PgVector is not None:
+        return PgVector(embedding if hasattr(embedding, "ndim") else list(embedding)).to_binary()
+    values = [float(v) for v in embedding]
+    return struct.pack(f">HH{len(values)}f", len(values), 0, *values)
+
+
+def encode_chunk_copy_rows(chunks_data: list[dict]) -> bytes:
+    """Stream `COPY ... FROM STDIN (FORMAT binary)` con las columnas de CHUNK_COPY_COLUMNS."""
+    parts = [_PGCOPY_HEADER]
+    field_count = struct.pack(">h", len(CHUNK_COPY_COLUMNS))
+    for chunk in chunks_data:
+        metadata_json = json.dumps(chunk.get("metadata") or {}, ensure_ascii=False)
+        parts.append(field_count)
+        parts.append(_copy_field(_copy_text(chunk["doc_filename"])))
+        parts.append(_copy_field(_copy_text(chunk["doc_path_lower"])))
+        parts.append(_copy_field(_copy_int4(chunk["chunk_index"])))
+        parts.append(_copy_field(_copy_text(chunk["chunk_text"])))
+        parts.append(_copy_field(_copy_text(chunk.get("marca"))))
+        parts.append(_copy_field(_copy_text(chunk.get("familia_producto"))))
+        parts.append(_copy_field(_copy_text(chunk["tipo_documento"])))
+        # jsonb_recv: byte de versión (1) + texto JSON.
+        parts.append(_copy_field(b"\x01" + metadata_json.encode("utf-8")))
+        parts.append(_copy_field(_copy_vector(chunk["embedding"])))
+        parts.append(_copy_field(_copy_int4(chunk.get("token_count"))))
+    parts.append(_PGCOPY_TRAILER)
+    return b"".join(parts)
+
+
+def insert_chunks(engine, chunks_data: list[dict], replace: bool = False):
+    """COPY binario a una tabla temporal y un solo INSERT ... SELECT en la misma transacción.
+
+    Con `replace=True` los chunks previos de cada documento se borran en esa
+    transacción: los lectores ven el documento viejo completo o el nuevo
+    completo, nunca uno a medio indexar.
+    """
+    # Un (doc, chunk_index) repetido haría fallar el ON CONFLICT; gana el último, como con el upsert fila a fila.
+    unique_chunks = list({(chunk["doc_path_lower"], chunk["chunk_index"]): chunk for chunk in chunks_data}.values())
+    if not unique_chunks:
+        return
+    columns = ", ".join(CHUNK_COPY_COLUMNS)
     raw_conn = engine.raw_connection()
     try:
         cur = raw_conn.cursor()
-        for chunk in chunks_data:
-            embedding_str = "[" + ",".join(str(v) for v in chunk["embedding"]) + "]"
-            metadata_json = json.dumps(chunk.get("metadata") or {}, ensure_ascii=False)
-            cur.execute("""
-                INSERT INTO public.agent_technical_doc_chunk
-                    (doc_filename, doc_path_lower, chunk_index, chunk_text,
-                     marca, familia_producto, tipo_documento, metadata,
-                     embedding, token_count)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s::jsonb, %s::vector, %s)
-                ON CONFLICT (doc_path_lower, chunk_index) DO UPDATE SET
-                    chunk_text = EXCLUDED.chunk_text,
-                    marca = EXCLUDED.marca,
-                    familia_producto = EXCLUDED.familia_producto,
-                    tipo_documento = EXCLUDED.tipo_documento,
-                    metadata = EXCLUDED.metadata,
-                    embedding = EXCLUDED.embedding,
-                    token_count = EXCLUDED.token_count,
-                    ingested_at = now()
-            """, (
-                chunk["doc_filename"],
-                chunk["doc_path_lower"],
-                chunk["chunk_index"],
-                chunk["chunk_text"],
-                chunk["marca"],
-                chunk["familia_producto"],
-                chunk["tipo_documento"],
-                metadata_json,
-                embedding_str,
-                chunk.get("token_count"),
-            ))
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {CHUNK_COPY_STAGE_TABLE} (
+                doc_filename text,
+                doc_path_lower text,
+                chunk_index integer,
+                chunk_text text,
+                marca text,
+                familia_producto text,
+                tipo_documento text,
+                metadata jsonb,
+                embedding vector,
+                token_count integer
+            ) ON COMMIT DELETE ROWS
+        """)
+        cur.copy_expert(
+            f"COPY {CHUNK_COPY_STAGE_TABLE} ({columns}) FROM STDIN WITH (FORMAT binary)",
+            io.BytesIO(encode_chunk_copy_rows(unique_chunks)),
+        )
+        if replace:
+            cur.execute(f"""
+                DELETE FROM public.agent_technical_doc_chunk
+                WHERE doc_path_lower IN (SELECT DISTINCT doc_path_lower FROM {CHUNK_COPY_STAGE_TABLE})
+            """)
+        cur.execute(f"""
+            INSERT INTO public.agent_technical_doc_chunk ({columns})
+            SELECT {columns} FROM {CHUNK_COPY_STAGE_TABLE}
+            ON CONFLICT (doc_path_lower, chunk_index) DO UPDATE SET
+                chunk_text = EXCLUDED.chunk_text,
+                marca = EXCLUDED.marca,
+                familia_producto = EXCLUDED.familia_producto,
+                tipo_documento = EXCLUDED.tipo_documento,
+                metadata = EXCLUDED.metadata,
+                embedding = EXCLUDED.embedding,
+                token_count = EXCLUDED.token_count,
+                ingested_at = now()
+        """)
         raw_conn.commit()
     except Exception:
         raw_conn.rollback()
@@ -2597,18 +3110,22 @@ def rebuild_profiles_from_db_chunks(openai_client, engine, dry_run: bool = False
             logger.error("  ✗ Error reconstruyendo %s: %s", row.get("doc_filename"), exc)
             errors += 1
     logger.info("Reconstrucción desde DB completada: %s actualizados, %s errores", updated, errors)
+    publish_profile_generation(engine)
 
 
 # ---------------------------------------------------------------------------
 # Main ingestion pipeline
 # ---------------------------------------------------------------------------
-def ingest_pdf(dbx, openai_client, engine, pdf_entry: dict, profiles_only: bool = False) -> int:
+def prepare_ingest_document(openai_client, pdf_entry: dict, pdf_bytes: bytes, page_payloads: list[dict],
+                            profiles_only: bool = False, multimodal: bool = True) -> dict | None:
+    """OCR, metadata, perfil, embedding multimodal y chunks de un PDF ya extraído; None si no hay nada que indexar.
+
+    No escribe en la BD: `write_ingested_document` persiste el resultado una
+    vez que los chunks tienen embedding.
+    """
     filename = pdf_entry["name"]
     path_lower = pdf_entry["path_lower"]
-    logger.info(f"  Descargando: {filename} ...")
-
-    pdf_bytes = download_pdf_bytes(dbx, path_lower)
-    raw_text, extraction_meta = extract_text_from_pdf_robust(openai_client, pdf_bytes, filename)
+    raw_text, extraction_meta = apply_vision_ocr(openai_client, pdf_bytes, page_payloads, filename)
     if extraction_meta.get("ocr_pages"):
         logger.info(
             "  OCR/visión activado en %s páginas de %s: %s",
@@ -2618,7 +3135,7 @@ def ingest_pdf(dbx, openai_client, engine, pdf_entry: dict, profiles_only: bool
         )
     if not raw_text or len(raw_text.strip()) < PDF_MIN_TEXT_CHARS:
         logger.warning(f"  ⚠ PDF sin texto extraíble: {filename} (puede ser imagen/escaneo)")
-        return 0
+        return None
 
     clean_text = clean_extracted_text(raw_text)
 
@@ -2651,19 +3168,26 @@ def ingest_pdf(dbx, openai_client, engine, pdf_entry: dict, profiles_only: bool
         portfolio_segment,
         portfolio_subsegment,
     )
-    upsert_technical_profile(engine, {
-        "canonical_family": familia,
-        "source_doc_filename": filename,
-        "source_doc_path_lower": path_lower,
-        "marca": marca,
-        "tipo_documento": tipo_doc,
-        "profile_json": technical_profile,
-        "completeness_score": technical_profile.get("extraction", {}).get("field_coverage_score") or 0,
-        "extraction_method": technical_profile.get("extraction", {}).get("strategy") or "hybrid",
-        "extraction_status": "ready",
-        "content_hash": pdf_entry.get("content_hash"),
-        "text_fingerprint": text_fingerprint,
-    })
+    prepared = {
+        "entry": pdf_entry,
+        "profile_record": {
+            "canonical_family": familia,
+            "source_doc_filename": filename,
+            "source_doc_path_lower": path_lower,
+            "marca": marca,
+            "tipo_documento": tipo_doc,
+            "profile_json": technical_profile,
+            "completeness_score": technical_profile.get("extraction", {}).get("field_coverage_score") or 0,
+            "extraction_method": technical_profile.get("extraction", {}).get("strategy") or "hybrid",
+            "extraction_status": "ready",
+            "content_hash": pdf_entry.get("content_hash"),
+            "text_fingerprint": text_fingerprint,
+        },
+        "multimodal_record": None,
+        "chunks": [],
+        "chunk_columns": {"marca": marca, "familia_producto": familia, "tipo_documento": tipo_doc},
+        "chunk_metadata": {},
+    }
 
     multimodal_summary = " ".join(filter(None, [
         technical_profile.get("product_identity", {}).get("display_name"),
@@ -2671,15 +3195,15 @@ def ingest_pdf(dbx, openai_client, engine, pdf_entry: dict, profiles_only: bool
         " | ".join(technical_profile.get("commercial_context", {}).get("recommended_uses") or []),
         " | ".join(technical_profile.get("application", {}).get("surface_preparation") or []),
     ])).strip()
-    if multimodal_summary:
+    if multimodal and multimodal_summary:
         preview_image_bytes = render_pdf_preview_image(pdf_bytes)
-        multimodal_embedding = generate_multimodal_product_embedding(
+        multimodal_embedding = generate_multimodal_embedding_cached(
             title=technical_profile.get("product_identity", {}).get("display_name") or familia or filename,
             summary_text=multimodal_summary,
             pdf_bytes=pdf_bytes,
             image_bytes=preview_image_bytes,
         )
-        upsert_product_multimodal_index(engine, {
+        prepared["multimodal_record"] = {
             "canonical_family": familia,
             "source_doc_filename": filename,
             "source_doc_path_lower": path_lower,
@@ -2694,16 +3218,12 @@ def ingest_pdf(dbx, openai_client, engine, pdf_entry: dict, profiles_only: bool
                 "has_preview_image": bool(preview_image_bytes),
             },
             "embedding": multimodal_embedding,
-        })
+        }
 
     if profiles_only:
-        logger.info(f"  ✅ {filename}: perfil técnico actualizado (modo profiles-only)")
-        return 0
+        return prepared
 
     chunks = chunk_text_with_context(clean_text, filename, marca)
-    if not chunks:
-        return 0
-
     normalized_name = normalize_text(filename)
     has_primary_hint = any(tok in normalized_name for tok in [normalize_text(tok) for tok in PRIMARY_DOC_HINTS])
     if tipo_doc == "ficha_tecnica" and len(chunks) > MAX_PRIMARY_CHUNKS and not has_primary_hint:
@@ -2712,58 +3232,145 @@ def ingest_pdf(dbx, openai_client, engine, pdf_entry: dict, profiles_only: bool
             filename,
             len(chunks),
         )
-        return 0
+        chunks = []
+    prepared["chunks"] = chunks
+    prepared["chunk_metadata"] = {
+        "content_hash": pdf_entry.get("content_hash"),
+        "size": pdf_entry.get("size"),
+        "doc_kind": pdf_entry.get("doc_kind") or tipo_doc,
+        "canonical_family": familia,
+        "normalized_name": pdf_entry.get("normalized_name") or normalize_document_name(filename),
+        "duplicate_count": pdf_entry.get("duplicate_count", 0),
+        "duplicate_members": pdf_entry.get("duplicate_members") or [filename],
+        "text_fingerprint": text_fingerprint,
+        "document_scope": "primary" if tipo_doc == "ficha_tecnica" else "guide",
+        "quality_tier": "primary" if tipo_doc == "ficha_tecnica" else "supporting",
+        "portfolio_segment": portfolio_segment,
+        "portfolio_subsegment": portfolio_subsegment,
+        "ocr_pages": extraction_meta.get("ocr_pages", 0),
+        "ocr_page_numbers": extraction_meta.get("ocr_page_numbers") or [],
+        "page_count": extraction_meta.get("page_count", 0),
+    }
+    return prepared
 
-    logger.info(f"  {len(chunks)} chunks generados, generando embeddings...")
-    embeddings = generate_embeddings(openai_client, chunks)
 
-    chunks_data = []
-    for idx, (chunk_text_val, embedding) in enumerate(zip(chunks, embeddings)):
-        chunks_data.append({
-            "doc_filename": filename,
-            "doc_path_lower": path_lower,
+def build_chunk_rows(prepared: dict, embeddings: list[list[float]]) -> list[dict]:
+    entry = prepared["entry"]
+    return [
+        {
+            "doc_filename": entry["name"],
+            "doc_path_lower": entry["path_lower"],
             "chunk_index": idx,
             "chunk_text": chunk_text_val,
-            "marca": marca,
-            "familia_producto": familia,
-            "tipo_documento": tipo_doc,
-            "metadata": {
-                "content_hash": pdf_entry.get("content_hash"),
-                "size": pdf_entry.get("size"),
-                "doc_kind": pdf_entry.get("doc_kind") or tipo_doc,
-                "canonical_family": familia,
-                "normalized_name": pdf_entry.get("normalized_name") or normalize_document_name(filename),
-                "duplicate_count": pdf_entry.get("duplicate_count", 0),
-                "duplicate_members": pdf_entry.get("duplicate_members") or [filename],
-                "text_fingerprint": text_fingerprint,
-                "document_scope": "primary" if tipo_doc == "ficha_tecnica" else "guide",
-                "quality_tier": "primary" if tipo_doc == "ficha_tecnica" else "supporting",
-                "portfolio_segment": portfolio_segment,
-                "portfolio_subsegment": portfolio_subsegment,
-                "ocr_pages": extraction_meta.get("ocr_pages", 0),
-                "ocr_page_numbers": extraction_meta.get("ocr_page_numbers") or [],
-                "page_count": extraction_meta.get("page_count", 0),
-            },
+            **prepared["chunk_columns"],
+            "metadata": dict(prepared["chunk_metadata"]),
             "embedding": embedding,
             "token_count": len(chunk_text_val) // 4,
-        })
+        }
+        for idx, (chunk_text_val, embedding) in enumerate(zip(prepared["chunks"], embeddings))
+    ]
+
 
-    delete_doc_chunks(engine, path_lower)
-    insert_chunks(engine, chunks_data)
-    logger.info(f"  ✅ {filename}: {len(chunks_data)} chunks insertados")
+def write_ingested_document(engine, prepared: dict, embeddings: list[list[float]],
+                            profiles_only: bool = False, on_written=None) -> int:
+    """Persiste chunks, perfil e índice multimodal de un documento preparado; devuelve los chunks insertados.
+
+    `on_written()` se llama cuando los chunks ya están en la BD y antes del perfil (etapa `written` del diario).
+    """
+    filename = prepared["entry"]["name"]
+    chunks_data = [] if profiles_only else build_chunk_rows(prepared, embeddings)
+    if chunks_data:
+        insert_chunks(engine, chunks_data, replace=True)
+        logger.info(f"  ✅ {filename}: {len(chunks_data)} chunks insertados")
+    if on_written is not None:
+        on_written()
+    upsert_technical_profile(engine, prepared["profile_record"])
+    if prepared.get("multimodal_record"):
+        upsert_product_multimodal_index(engine, prepared["multimodal_record"])
+    if profiles_only:
+        logger.info(f"  ✅ {filename}: perfil técnico actualizado (modo profiles-only)")
     return len(chunks_data)
 
 
+def ingest_pdf(dbx, openai_client, engine, pdf_entry: dict, profiles_only: bool = False) -> int:
+    filename = pdf_entry["name"]
+    logger.info(f"  Descargando: {filename} ...")
+
+    pdf_bytes = download_pdf_bytes(dbx, pdf_entry["path_lower"])
+    prepared = prepare_ingest_document(
+        openai_client, pdf_entry, pdf_bytes, extract_text_from_pdf_pages(pdf_bytes), profiles_only=profiles_only,
+    )
+    if prepared is None:
+        return 0
+    embeddings = []
+    if prepared["chunks"]:
+        logger.info(f"  {len(prepared['chunks'])} chunks generados, generando embeddings...")
+        embeddings = generate_embeddings(openai_client, prepared["chunks"])
+    return write_ingested_document(engine, prepared, embeddings, profiles_only=profiles_only)
+
+
+def run_staged_ingestion(dbx, openai_client, engine, pending: list[dict], profiles_only: bool = False,
+                         config: PipelineConfig | None = None, journal: IngestionJournal | None = None,
+                         retry_passes: int | None = None) -> PipelineReport:
+    """Ingesta `pending` con el pipeline por etapas (descarga → extracción → preparación → embeddings → escritura).
+
+    Con `journal` cada documento deja su etapa en `ingestion_journal` y los
+    que ya tenían documento preparado de un intento anterior saltan directo
+    a embeddings. Los fallidos se reintentan hasta `retry_passes` veces en la
+    misma corrida (INGEST_RETRY_PASSES), siempre dentro de los intentos que
+    permite el diario; el resto queda para la próxima corrida o en cuarentena.
+    """
+    def write(prepared, embeddings):
+        on_written = (lambda: journal.mark(prepared["entry"], "written")) if journal is not None else None
+        return write_ingested_document(engine, prepared, embeddings, profiles_only=profiles_only, on_written=on_written)
+
+    pipeline = StagedIngestPipeline(
+        download=lambda entry: download_pdf_bytes(dbx, entry["path_lower"]),
+        extract=extract_text_from_pdf_pages,
+        prepare=lambda entry, pdf_bytes, pages: prepare_ingest_document(
+            openai_client, entry, pdf_bytes, pages, profiles_only=profiles_only,
+        ),
+        embed=lambda texts: generate_embeddings(openai_client, texts, sleep_seconds=0),
+        write=write,
+        config=config or PipelineConfig.from_env(),
+        resume=journal.resume_artifact if journal is not None else None,
+        on_event=journal.on_pipeline_event if journal is not None else None,
+    )
+    if retry_passes is None:
+        retry_passes = int(os.getenv("INGEST_RETRY_PASSES", "1") or 1)
+    report = pipeline.run(pending)
+    total_chunks, total_written, total_resumed = report.chunks, report.written, report.resumed
+    by_path = {entry["path_lower"]: entry for entry in pending}
+    for retry_pass in range(1, max(0, retry_passes) + 1):
+        retry = [by_path[failure["path_lower"]] for failure in report.failed if failure["path_lower"] in by_path]
+        if journal is not None:
+            retry = [entry for entry in retry if journal.attempts(entry) < journal.max_attempts]
+        if not retry:
+            break
+        logger.info("Reintento %s/%s: %s documentos fallidos", retry_pass, retry_passes, len(retry))
+        report = pipeline.run(retry)
+        total_chunks += report.chunks
+        total_written += report.written
+        total_resumed += report.resumed
+    report.chunks, report.written, report.resumed = total_chunks, total_written, total_resumed
+    return report
+
+
 def run_ingestion(full_mode: bool = False, dry_run: bool = False, profiles_only: bool = False,
-                  rebuild_profiles_from_db: bool = False):
+                  rebuild_profiles_from_db: bool = False, pipeline_config: PipelineConfig | None = None):
     logger.info("=" * 60)
     logger.info("INGESTIÓN DE FICHAS TÉCNICAS → pgvector")
     logger.info("=" * 60)
 
     engine = get_db_engine()
+    ingest_embedding_cache.bind_engine(lambda: engine)
+    ingest_embedding_cache.reset_stats()
     ensure_chunk_table(engine)
     ensure_profile_table(engine)
     ensure_product_multimodal_table(engine)
+    vector_tier = (os.getenv("RAG_VECTOR_TIER") or "exact").strip().lower()
+    if vector_tier in QUANTIZED_CHUNK_INDEXES and not dry_run:
+        ensure_quantized_chunk_index(engine, vector_tier)
     openai_client = get_openai_client()
 
     if rebuild_profiles_from_db:
@@ -2773,7 +3380,7 @@ def run_ingestion(full_mode: bool = False, dry_run: bool = False, profiles_only:
     dbx = get_dropbox_client()
 
     logger.info(f"Listando PDFs en Dropbox: {TECHNICAL_DOC_FOLDER}")
-    pdf_entries = list_dropbox_pdfs(dbx)
+    pdf_entries = list_dropbox_pdfs(dbx, engine=None if dry_run else engine)
     logger.info(f"  Encontrados: {len(pdf_entries)} PDFs")
 
     curated_entries, duplicate_groups, skipped_entries = curate_pdf_entries(pdf_entries)
@@ -2786,7 +3393,21 @@ def run_ingestion(full_mode: bool = False, dry_run: bool = False, profiles_only:
         len(skipped_entries),
     )
 
-    if full_mode:
+    journal = IngestionJournal(engine)
+    journal.ensure_tables()
+    run = journal.start_run("profiles" if profiles_only else "full" if full_mode else "incremental", persist=not dry_run)
+
+    if full_mode and run["resumed"]:
+        logger.info(
+            "Modo COMPLETO: reanudando la corrida #%s iniciada %s (el índice no se vuelve a borrar)",
+            run["run_id"],
+            run["started_at"],
+        )
+        already_ingested = get_ingested_paths(engine)
+        existing_index = get_ingested_doc_index(engine)
+        existing_profile_index = get_ingested_profile_index(engine)
+        logger.info(f"  Ya ingestados: {len(already_ingested)} documentos")
+    elif full_mode:
         logger.info("Modo COMPLETO: borrando índice técnico Dropbox anterior...")
         with engine.begin() as conn:
             if not profiles_only:
@@ -2830,6 +3451,14 @@ def run_ingestion(full_mode: bool = False, dry_run: bool = False, profiles_only:
             or profiles_only
         ):
             pending.append(entry)
+    pending, held_back = journal.plan(pending, run, persist=not dry_run)
+    if held_back["done_this_run"]:
+        logger.info("  Ya completos en esta corrida (reanudada): %s", len(held_back["done_this_run"]))
+    if held_back["quarantined"]:
+        logger.warning(
+            "  En cuarentena (se omiten hasta que cambien o se liberen con --release-quarantine): %s",
+            ", ".join(entry["name"] for entry in held_back["quarantined"]),
+        )
     logger.info(f"  Pendientes de reingesta: {len(pending)} fichas técnicas canónicas")
 
     if dry_run:
@@ -2845,18 +3474,41 @@ def run_ingestion(full_mode: bool = False, dry_run: bool = False, profiles_only:
 
     total_chunks = 0
     errors = 0
-    for i, entry in enumerate(pending, 1):
-        try:
-            logger.info(f"[{i}/{len(pending)}] Procesando: {entry['name']}")
-            n = ingest_pdf(dbx, openai_client, engine, entry, profiles_only=profiles_only)
-            total_chunks += n
-        except Exception as exc:
-            logger.error(f"  ✗ Error en {entry['name']}: {exc}")
-            errors += 1
-            continue
+    if pipeline_mode() == "staged":
+        pipeline_report = run_staged_ingestion(dbx, openai_client, engine, pending, profiles_only=profiles_only,
+                                               config=pipeline_config, journal=journal)
+        total_chunks = pipeline_report.chunks
+        errors = len(pipeline_report.failed)
+    else:
+        for i, entry in enumerate(pending, 1):
+            try:
+                logger.info(f"[{i}/{len(pending)}] Procesando: {entry['name']}")
+                journal.begin(entry)
+                n = ingest_pdf(dbx, openai_client, engine, entry, profiles_only=profiles_only)
+                journal.mark(entry, "profiled")
+                total_chunks += n
+            except Exception as exc:
+                logger.error(f"  ✗ Error en {entry['name']}: {exc}")
+                journal.fail(entry, "serial", str(exc))
+                errors += 1
+                continue
+
+    if full_mode and not profiles_only and vector_tier in QUANTIZED_CHUNK_INDEXES:
+        # La re-ingesta completa reemplaza casi todas las filas: el grafo HNSW
+        # cuantizado queda degradado hasta reconstruirlo.
+        ensure_quantized_chunk_index(engine, vector_tier, reindex=True)
+    if full_mode and not profiles_only and _partial_chunk_indexes_present(engine):
+        ensure_partial_chunk_indexes(engine, reindex=True)
+    publish_profile_generation(engine)
+    if not profiles_only:
+        publish_chunk_generation(engine)
+    journal.finish_run(run)
 
     logger.info("=" * 60)
     logger.info(f"RESULTADO: {len(pending) - errors}/{len(pending)} PDFs procesados, {total_chunks} chunks totales, {errors} errores")
+    ingest_embedding_cache.log_run_summary("fichas técnicas")
+    for row in journal.quarantined():
+        logger.warning("  ☣ Cuarentena: %s (%s intentos) — %s", row["doc_filename"], row["attempts"], row["last_error"])
     logger.info("=" * 60)
 
 
@@ -2866,10 +3518,52 @@ if __name__ == "__main__":
     parser.add_argument("--dry-run", action="store_true", help="Solo lista PDFs pendientes sin procesar")
     parser.add_argument("--profiles-only", action="store_true", help="Reconstruye solo los perfiles técnicos estructurados")
     parser.add_argument("--rebuild-profiles-from-db", action="store_true", help="Reconstruye perfiles desde agent_technical_doc_chunk")
+    parser.add_argument("--vector-tier-index", choices=sorted(QUANTIZED_CHUNK_INDEXES),
+                        help="Crea (o repara) el índice cuantizado halfvec/bit de agent_technical_doc_chunk")
+    parser.add_argument("--vector-tier-reindex", action="store_true",
+                        help="Con --vector-tier-index: reconstruye el índice aunque ya exista")
+    parser.add_argument("--vector-tier-report", action="store_true",
+                        help="Mide recall@k y latencia de cada nivel vectorial contra búsqueda exacta")
+    parser.add_argument("--report-samples", type=int, default=30, help="Consultas de muestra para --vector-tier-report")
+    parser.add_argument("--partial-indexes", action="store_true",
+                        help="Crea los índices HNSW parciales (guías y fichas por segmento de portafolio)")
+    parser.add_argument("--fulltext-index", action="store_true",
+                        help="Crea la columna tsvector y el índice GIN de la búsqueda híbrida")
+    parser.add_argument("--download-workers", type=int, help="Hilos de descarga (INGEST_DOWNLOAD_WORKERS)")
+    parser.add_argument("--extract-processes", type=int,
+                        help="Procesos de extracción PyMuPDF; 0 = en hilos (INGEST_EXTRACT_PROCESSES)")
+    parser.add_argument("--prepare-workers", type=int, help="Hilos de OCR/perfil/chunking (INGEST_PREPARE_WORKERS)")
+    parser.add_argument("--embed-workers", type=int, help="Hilos de embeddings (INGEST_EMBED_WORKERS)")
+    parser.add_argument("--embed-batch", type=int, help="Chunks por lote de embeddings (INGEST_EMBED_BATCH)")
+    parser.add_argument("--release-quarantine", action="store_true",
+                        help="Libera los PDFs en cuarentena del diario de ingesta para reintentarlos")
     args = parser.parse_args()
+    if args.release_quarantine:
+        released_journal = IngestionJournal(get_db_engine())
+        released_journal.ensure_tables()
+        logger.info("PDFs liberados de cuarentena: %s", released_journal.release())
+        sys.exit(0)
+    if args.vector_tier_index or args.vector_tier_report or args.partial_indexes or args.fulltext_index:
+        tier_engine = get_db_engine()
+        if args.fulltext_index:
+            ensure_chunk_fulltext_index(tier_engine)
+        if args.partial_indexes:
+            ensure_partial_chunk_indexes(tier_engine)
+        if args.vector_tier_index:
+            ensure_quantized_chunk_index(tier_engine, args.vector_tier_index, reindex=args.vector_tier_reindex)
+        if args.vector_tier_report:
+            write_vector_tier_report(build_vector_tier_report(tier_engine, sample_size=args.report_samples))
+        sys.exit(0)
     run_ingestion(
         full_mode=args.full,
         dry_run=args.dry_run,
         profiles_only=args.profiles_only,
         rebuild_profiles_from_db=args.rebuild_profiles_from_db,
+        pipeline_config=PipelineConfig.from_env(
+            download_workers=args.download_workers,
+            extract_processes=args.extract_processes,
+            prepare_workers=args.prepare_workers,
+            embed_workers=args.embed_workers,
+            embed_batch_size=args.embed_batch,
+        ),
     )
@@ -0,0 +1,306 @@
+"""Diario por documento de la ingesta de fichas técnicas (reanudable).
+
+Si `run_ingestion` moría a mitad de camino (rate limit agotado, OOM con un
+PDF enorme, un deploy), la siguiente corrida empezaba de cero y una
+reingesta completa dejaba el índice a medias durante horas.
+
+`ingestion_journal` guarda, por `doc_path_lower`, la revisión procesada
+(content_hash + rev de Dropbox) y la última etapa completada:
+
+    started → downloaded → extracted → embedded → written → profiled
+
+  * extracted guarda el documento preparado (texto con OCR, perfil LLM,
+    chunks, registro multimodal) en `artifact`: al reanudar no se repiten
+    descarga, OCR ni perfil. Los embeddings ya hechos los sirve
+    `embedding_cache` y la escritura es idempotente (swap por documento).
+  * Una corrida completa (`--full`) queda registrada en
+    `ingestion_journal_run`; si no terminó, la siguiente la reanuda: no
+    vuelve a borrar el índice y salta los documentos ya completos desde
+    que empezó.
+  * Reintentos acotados: `attempts` sube al *empezar* un documento y se
+    reinicia al completarlo, así también cuentan los procesos que mueren
+    (OOM) sin registrar el error. Con `max_attempts` intentos fallidos de
+    la misma revisión el documento queda en cuarentena y las corridas
+    siguientes lo saltan hasta que cambie en Dropbox o se libere.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Optional
+
+from sqlalchemy import text
+
+logger = logging.getLogger("ferreinox_agent.ingestion_journal")
+
+JOURNAL_STAGES = ("started", "downloaded", "extracted", "embedded", "written", "profiled")
+COMPLETE_STAGES = ("profiled", "skipped")
+RESUMABLE_STAGES = ("extracted", "embedded", "written")
+
+# Evento de StagedIngestPipeline → etapa del diario ("written" lo marca el escritor entre chunks y perfil).
+PIPELINE_EVENT_STAGES = {
+    "download": "downloaded",
+    "prepare": "extracted",
+    "embed": "embedded",
+    "write": "profiled",
+    "skipped": "skipped",
+}
+
+INGESTION_JOURNAL_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.ingestion_journal (
+    doc_path_lower text PRIMARY KEY,
+    doc_filename text,
+    content_hash text,
+    dropbox_rev text,
+    stage text NOT NULL DEFAULT 'started',
+    attempts integer NOT NULL DEFAULT 0,
+    quarantined boolean NOT NULL DEFAULT false,
+    last_error text,
+    artifact jsonb,
+    started_at timestamptz,
+    completed_at timestamptz,
+    updated_at timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+INGESTION_RUN_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.ingestion_journal_run (
+    run_id bigserial PRIMARY KEY,
+    mode text NOT NULL,
+    started_at timestamptz NOT NULL DEFAULT now(),
+    finished_at timestamptz
+)
+"""
+
+
+def _same_revision(row: dict, entry: dict) -> bool:
+    """Misma revisión si coinciden content_hash y rev (cuando ambos lados los tienen)."""
+    for row_key, entry_key in (("content_hash", "content_hash"), ("dropbox_rev", "rev")):
+        if row.get(row_key) and entry.get(entry_key) and row[row_key] != entry[entry_key]:
+            return False
+    return True
+
+
+class IngestionJournal:
+    def __init__(self, engine, max_attempts: Optional[int] = None):
+        self._engine = engine
+        self.max_attempts = max(1, int(max_attempts or os.getenv("INGEST_MAX_ATTEMPTS", "3") or 3))
+        self._rows: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def ensure_tables(self) -> None:
+        with self._engine.begin() as conn:
+            conn.execute(text(INGESTION_JOURNAL_TABLE_SQL))
+            conn.execute(text(INGESTION_RUN_TABLE_SQL))
+
+    # ── Corridas ────────────────────────────────────────────────────────
+    def start_run(self, mode: str, persist: bool = True) -> dict:
+        """Abre una corrida; una corrida `full` sin terminar se reanuda en lugar de abrir otra."""
+        with self._engine.begin() as conn:
+            if mode == "full":
+                row = conn.execute(text("""
+                    SELECT run_id, started_at FROM public.ingestion_journal_run
+                    WHERE mode = 'full' AND finished_at IS NULL
+                    ORDER BY run_id DESC LIMIT 1
+                """)).fetchone()
+                if row is not None:
+                    return {"run_id": row[0], "started_at": row[1], "mode": mode, "resumed": True}
+            if not persist:
+                return {"run_id": None, "started_at": None, "mode": mode, "resumed": False}
+            row = conn.execute(
+                text("INSERT INTO public.ingestion_journal_run (mode) VALUES (:mode) RETURNING run_id, started_at"),
+                {"mode": mode},
+            ).fetchone()
+        return {"run_id": row[0], "started_at": row[1], "mode": mode, "resumed": False}
+
+    def finish_run(self, run: dict) -> None:
+        if run.get("run_id") is None:
+            return
+        with self._engine.begin() as conn:
+            conn.execute(
+                text("UPDATE public.ingestion_journal_run SET finished_at = now() WHERE run_id = :run_id"),
+                {"run_id": run["run_id"]},
+            )
+
+    # ── Planificación ───────────────────────────────────────────────────
+    def load(self) -> dict[str, dict]:
+        with self._engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT doc_path_lower, doc_filename, content_hash, dropbox_rev, stage, attempts,
+                       quarantined, last_error, artifact, completed_at
+                FROM public.ingestion_journal
+            """)).mappings().fetchall()
+        with self._lock:
+            self._rows = {row["doc_path_lower"]: dict(row) for row in rows}
+            return dict(self._rows)
+
+    def plan(self, entries: list[dict], run: dict, persist: bool = True) -> tuple[list[dict], dict[str, list[dict]]]:
+        """Separa los pendientes: (a procesar, {"quarantined": [...], "done_this_run": [...]})."""
+        rows = self.load()
+        todo: list[dict] = []
+        held: dict[str, list[dict]] = {"quarantined": [], "done_this_run": []}
+        newly_quarantined = []
+        for entry in entries:
+            row = rows.get(entry["path_lower"])
+            if row is None or not _same_revision(row, entry):
+                todo.append(entry)
+                continue
+            if row["quarantined"]:
+                held["quarantined"].append(entry)
+                continue
+            if row["stage"] not in COMPLETE_STAGES and row["attempts"] >= self.max_attempts:
+                # El proceso murió `attempts` veces con este documento en curso (OOM, kill).
+                newly_quarantined.append(entry)
+                held["quarantined"].append(entry)
+                continue
+            if (run.get("resumed") and row["stage"] in COMPLETE_STAGES and row.get("completed_at")
+                    and run.get("started_at") and row["completed_at"] >= run["started_at"]):
+                held["done_this_run"].append(entry)
+                continue
+            todo.append(entry)
+        for entry in newly_quarantined if persist else []:
+            self._update(entry["path_lower"], quarantined=True,
+                         last_error=f"interrumpido {self.max_attempts} veces sin completar")
+        return todo, held
+
+    # ── Eventos por documento ───────────────────────────────────────────
+    def begin(self, entry: dict) -> None:
+        """Cuenta un intento; una revisión nueva reinicia etapa, intentos y artefacto."""
+        path_lower = entry["path_lower"]
+        with self._lock:
+            row = self._rows.get(path_lower)
+        fresh = row is None or not _same_revision(row, entry)
+        params = {
+            "path": path_lower,
+            "filename": entry.get("name"),
+            "content_hash": entry.get("content_hash"),
+            "rev": entry.get("rev"),
+        }
+        with self._engine.begin() as conn:
+            if fresh:
+                conn.execute(text("""
+                    INSERT INTO public.ingestion_journal
+                        (doc_path_lower, doc_filename, content_hash, dropbox_rev, stage, attempts,
+                         quarantined, last_error, artifact, started_at, completed_at, updated_at)
+                    VALUES (:path, :filename, :content_hash, :rev, 'started', 1, false, NULL, NULL, now(), NULL, now())
+                    ON CONFLICT (doc_path_lower) DO UPDATE SET
+                        doc_filename = EXCLUDED.doc_filename,
+                        content_hash = EXCLUDED.content_hash,
+                        dropbox_rev = EXCLUDED.dropbox_rev,
+                        stage = 'started',
+                        attempts = 1,
+                        quarantined = false,
+                        last_error = NULL,
+                        artifact = NULL,
+                        started_at = now(),
+                        completed_at = NULL,
+                        updated_at = now()
+                """), params)
+            else:
+                conn.execute(text("""
+                    UPDATE public.ingestion_journal
+                    SET attempts = CASE WHEN stage IN ('profiled', 'skipped') THEN 1 ELSE attempts + 1 END,
+                        stage = CASE WHEN stage IN ('profiled', 'skipped') THEN 'started' ELSE stage END,
+                        started_at = now(), updated_at = now()
+                    WHERE doc_path_lower = :path
+                """), params)
+        with self._lock:
+            if fresh:
+                self._rows[path_lower] = {
+                    "doc_path_lower": path_lower, "content_hash": entry.get("content_hash"),
+                    "dropbox_rev": entry.get("rev"), "stage": "started", "attempts": 1,
+                    "quarantined": False, "artifact": None,
+                }
+            elif row.get("stage") in COMPLETE_STAGES:
+                row.update(stage="started", attempts=1)
+            else:
+                row["attempts"] = int(row.get("attempts") or 0) + 1
+
+    def resume_artifact(self, entry: dict) -> Optional[dict]:
+        """Documento preparado de un intento anterior de la misma revisión, si llegó a `extracted`."""
+        with self._lock:
+            row = self._rows.get(entry["path_lower"])
+        if not row or row.get("stage") not in RESUMABLE_STAGES or not _same_revision(row, entry):
+            return None
+        artifact = row.get("artifact")
+        if isinstance(artifact, str):
+            artifact = json.loads(artifact)
+        return artifact or None
+
+    def mark(self, entry: dict, stage: str, artifact: Optional[dict] = None) -> None:
+        if stage in COMPLETE_STAGES:
+            self._update(entry["path_lower"], stage=stage, attempts=0, last_error=None, artifact=None,
+                         completed_at=True)
+        elif artifact is not None:
+            self._update(entry["path_lower"], stage=stage, artifact=artifact)
+        else:
+            self._update(entry["path_lower"], stage=stage)
+
+    def fail(self, entry: dict, stage: str, error: str) -> bool:
+        """Registra el error; devuelve True si el documento quedó en cuarentena."""
+        with self._lock:
+            row = self._rows.get(entry["path_lower"]) or {}
+        quarantined = int(row.get("attempts") or 0) >= self.max_attempts
+        self._update(entry["path_lower"], last_error=f"{stage}: {error}"[:2000], quarantined=quarantined)
+        if quarantined:
+            logger.warning("  ☣ %s en cuarentena tras %s intentos: %s", entry.get("name"), row.get("attempts"), error)
+        return quarantined
+
+    def attempts(self, entry: dict) -> int:
+        with self._lock:
+            return int((self._rows.get(entry["path_lower"]) or {}).get("attempts") or 0)
+
+    def _update(self, path_lower: str, **values: Any) -> None:
+        assignments = ["updated_at = now()"]
+        params: dict[str, Any] = {"path": path_lower}
+        for column, value in values.items():
+            if column == "completed_at":
+                assignments.append("completed_at = now()")
+            elif column == "artifact" and value is not None:
+                assignments.append("artifact = CAST(:artifact AS jsonb)")
+                params["artifact"] = json.dumps(value, ensure_ascii=False, default=str)
+            else:
+                assignments.append(f"{column} = :{column}")
+                params[column] = value
+        with self._engine.begin() as conn:
+            conn.execute(
+                text(f"UPDATE public.ingestion_journal SET {', '.join(assignments)} WHERE doc_path_lower = :path"),
+                params,
+            )
+        with self._lock:
+            row = self._rows.setdefault(path_lower, {"doc_path_lower": path_lower})
+            for column, value in values.items():
+                if column != "completed_at":
+                    row[column] = value
+
+    # ── Cuarentena ──────────────────────────────────────────────────────
+    def quarantined(self) -> list[dict]:
+        with self._engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT doc_path_lower, doc_filename, attempts, last_error, updated_at
+                FROM public.ingestion_journal WHERE quarantined
+                ORDER BY updated_at DESC
+            """)).mappings().fetchall()
+        return [dict(row) for row in rows]
+
+    def release(self, paths: Optional[list[str]] = None) -> int:
+        """Saca documentos de cuarentena (todos si `paths` es None) para que la próxima corrida los reintente."""
+        sql = "UPDATE public.ingestion_journal SET quarantined = false, attempts = 0, updated_at = now() WHERE quarantined"
+        params: dict[str, Any] = {}
+        if paths:
+            sql += " AND doc_path_lower = ANY(:paths)"
+            params["paths"] = list(paths)
+        with self._engine.begin() as conn:
+            return conn.execute(text(sql), params).rowcount or 0
+
+    # ── Enganche con StagedIngestPipeline ───────────────────────────────
+    def on_pipeline_event(self, event: str, entry: dict, detail: Any = None) -> None:
+        if event == "start":
+            self.begin(entry)
+        elif event == "failed":
+            self.fail(entry, detail["stage"], detail["error"])
+        elif event in PIPELINE_EVENT_STAGES:
+            self.mark(entry, PIPELINE_EVENT_STAGES[event], artifact=detail if event == "prepare" else None)
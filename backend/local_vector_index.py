@@ -0,0 +1,414 @@
+"""Índice ANN local (NumPy memory-mapped) de los chunks técnicos.
+
+Cada pregunta técnica hace búsquedas pgvector; si Postgres está lento todo
+el RAG cae. Este módulo mantiene una copia de los embeddings de
+`agent_technical_doc_chunk` en disco:
+
+  * `export_chunk_index()` (al final de cada ingesta, o con
+    ``python backend/local_vector_index.py --rebuild``) escribe una matriz
+    float32 normalizada (`.npy`), las columnas de filtro por fila y un
+    `manifest.json` con la generación `agent_technical_chunks` de
+    `agent_refresh_generation` leída en el mismo snapshot.
+  * Cada worker abre la matriz con ``np.load(mmap_mode="r")``: las páginas
+    las comparte el page cache del SO, no se copian por proceso.
+  * La búsqueda es exacta (producto punto sobre vectores normalizados =
+    coseno) con los mismos filtros que las ramas SQL de `rag_search`. La
+    BD sólo hidrata el texto de los ids ganadores.
+  * Sólo se usa si la generación del archivo coincide con la de la BD
+    (NOTIFY en REFRESH_GENERATION_CHANNEL o consulta periódica); un índice
+    viejo nunca responde.
+
+Modo por RAG_LOCAL_INDEX: ``off`` (defecto), ``fallback`` (sólo cuando la
+consulta pgvector falla o excede RAG_PGVECTOR_STATEMENT_TIMEOUT_MS) o
+``primary`` (siempre que esté vigente).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger("ferreinox_agent.local_vector_index")
+
+CHUNK_INDEX_SCOPE = "agent_technical_chunks"
+LOCAL_INDEX_MODES = ("off", "fallback", "primary")
+MANIFEST_NAME = "manifest.json"
+DB_GENERATION_MAX_AGE_SECONDS = 60.0
+
+# Columnas de filtro por fila (mismas expresiones que las ramas SQL de rag_search).
+_ROW_COLUMNS = (
+    "tipo_documento",
+    "marca",               # LOWER(marca)
+    "portfolio_segment",   # COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general')
+    "document_scope",      # metadata ->> 'document_scope' (vacío = sin valor)
+    "quality_tier",        # metadata ->> 'quality_tier'
+    "canonical_family",    # LOWER(COALESCE(metadata ->> 'canonical_family', familia_producto))
+    "chemical_family",     # LOWER(COALESCE(metadata ->> 'chemical_family', ''))
+)
+_TECHNICAL_SHEET_TYPES = ("ficha_tecnica", "ficha_tecnica_experto")
+
+
+def local_index_mode() -> str:
+    mode = (os.getenv("RAG_LOCAL_INDEX", "off") or "off").strip().lower()
+    return mode if mode in LOCAL_INDEX_MODES else "off"
+
+
+def default_index_dir() -> Path:
+    configured = os.getenv("RAG_LOCAL_INDEX_DIR")
+    if configured:
+        return Path(configured)
+    return Path(__file__).resolve().parent.parent / "artifacts" / "rag" / "vector_index"
+
+
+def _like_to_regex(pattern: str) -> re.Pattern:
+    """Patrón SQL LIKE (% y _) → regex anclada."""
+    parts = []
+    for char in pattern:
+        if char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("^" + "".join(parts) + "$", re.DOTALL)
+
+
+class _Snapshot:
+    __slots__ = ("generation", "matrix", "ids", "columns", "manifest_mtime")
+
+    def __init__(self, generation: Optional[int], matrix: np.ndarray, ids: np.ndarray,
+                 columns: dict[str, np.ndarray], manifest_mtime: float):
+        self.generation = generation
+        self.matrix = matrix
+        self.ids = ids
+        self.columns = columns
+        self.manifest_mtime = manifest_mtime
+
+
+class LocalVectorIndex:
+    def __init__(self, directory: Optional[Path] = None, check_interval: float = 30.0):
+        self._directory = Path(directory) if directory else None
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        self._last_check = 0.0
+        self._db_generation: Optional[int] = None
+        self._db_generation_at = 0.0
+        self._counters = {"searches": 0, "stale_skips": 0, "load_errors": 0}
+
+    @property
+    def directory(self) -> Path:
+        return self._directory or default_index_dir()
+
+    # ── Generación de la BD ─────────────────────────────────────────────
+    def note_db_generation(self, generation: Optional[int]) -> None:
+        with self._lock:
+            self._db_generation = int(generation) if generation is not None else None
+            self._db_generation_at = time.monotonic()
+
+    def needs_db_generation(self) -> bool:
+        return time.monotonic() - self._db_generation_at > DB_GENERATION_MAX_AGE_SECONDS
+
+    @property
+    def generation(self) -> Optional[int]:
+        snapshot = self._current_snapshot()
+        return snapshot.generation if snapshot else None
+
+    # ── Carga (mmap, sólo lectura) ──────────────────────────────────────
+    def _current_snapshot(self) -> Optional[_Snapshot]:
+        now = time.monotonic()
+        if now - self._last_check >= self._check_interval or (self._snapshot is None and now - self._last_check >= 1.0):
+            self._last_check = now
+            self._maybe_reload()
+        return self._snapshot
+
+    def _maybe_reload(self) -> None:
+        manifest_path = self.directory / MANIFEST_NAME
+        try:
+            mtime = manifest_path.stat().st_mtime
+        except OSError:
+            return
+        current = self._snapshot
+        if current is not None and current.manifest_mtime == mtime:
+            return
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            matrix = np.load(self.directory / manifest["matrix_file"], mmap_mode="r")
+            rows = json.loads((self.directory / manifest["rows_file"]).read_text(encoding="utf-8"))
+            ids = np.asarray(rows["id"], dtype=np.int64)
+            columns = {name: np.asarray(rows[name], dtype=object) for name in _ROW_COLUMNS}
+            if matrix.shape[0] != ids.shape[0]:
+                raise ValueError(f"matriz {matrix.shape[0]} filas vs {ids.shape[0]} ids")
+        except Exception as exc:
+            self._counters["load_errors"] += 1
+            logger.warning("No se pudo cargar el índice vectorial local: %s", exc)
+            return
+        with self._lock:
+            self._snapshot = _Snapshot(manifest.get("generation"), matrix, ids, columns, mtime)
+        logger.info("Índice vectorial local cargado: %s chunks, generación %s", ids.shape[0], manifest.get("generation"))
+
+    def is_current(self) -> bool:
+        """True si el archivo existe y su generación coincide con la última conocida de la BD."""
+        snapshot = self._current_snapshot()
+        if snapshot is None or snapshot.generation is None or self._db_generation is None:
+            return False
+        if snapshot.generation != self._db_generation:
+            self._counters["stale_skips"] += 1
+            return False
+        return True
+
+    # ── Búsqueda ────────────────────────────────────────────────────────
+    def search(
+        self,
+        query_embedding: list[float],
+        *,
+        source: str,
+        top_k: int,
+        marca_filter: str | None = None,
+        segment_filters: list[str] | None = None,
+        metadata_prefilters: dict | None = None,
+        distance_threshold: float = 0.0,
+    ) -> list[tuple[int, float]]:
+        """Top-k ``(id, similitud coseno)`` para `source` "chunks" o "guides"."""
+        snapshot = self._current_snapshot()
+        if snapshot is None or top_k <= 0:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm == 0.0 or query.shape[0] != snapshot.matrix.shape[1]:
+            return []
+        mask = self._filter_mask(snapshot, source, marca_filter, segment_filters, metadata_prefilters)
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+        similarities = np.asarray(snapshot.matrix[candidates] @ (query / norm), dtype=np.float32)
+        if distance_threshold > 0:
+            keep = similarities >= distance_threshold
+            candidates, similarities = candidates[keep], similarities[keep]
+        if candidates.size == 0:
+            return []
+        k = min(top_k, candidates.size)
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top], kind="stable")]
+        self._counters["searches"] += 1
+        return [(int(snapshot.ids[candidates[i]]), float(similarities[i])) for i in top]
+
+    @staticmethod
+    def _filter_mask(snapshot: _Snapshot, source: str, marca_filter: str | None,
+                     segment_filters: list[str] | None, metadata_prefilters: dict | None) -> np.ndarray:
+        columns = snapshot.columns
+        if source == "guides":
+            mask = columns["tipo_documento"] == "guia_solucion"
+            mask &= np.isin(columns["document_scope"], ["", "guide"])
+        else:
+            mask = np.isin(columns["tipo_documento"], _TECHNICAL_SHEET_TYPES)
+            mask &= np.isin(columns["document_scope"], ["", "primary"])
+            mask &= columns["quality_tier"] != "rejected"
+        if marca_filter:
+            mask &= columns["marca"] == marca_filter.lower()
+        if segment_filters:
+            mask &= np.isin(columns["portfolio_segment"], list(segment_filters))
+        if source == "chunks" and metadata_prefilters:
+            patterns = [_like_to_regex(p.lower()) for p in (metadata_prefilters.get("canonical_family_patterns") or [])]
+            terms = {t.lower() for t in (metadata_prefilters.get("chemical_family_terms") or []) if t}
+            if patterns or terms:
+                family_mask = np.zeros(mask.shape, dtype=bool)
+                if patterns:
+                    family_mask |= np.fromiter(
+                        (bool(value) and any(p.match(value) for p in patterns) for value in columns["canonical_family"]),
+                        dtype=bool,
+                        count=mask.shape[0],
+                    )
+                if terms:
+                    family_mask |= np.isin(columns["chemical_family"], list(terms))
+                mask &= family_mask
+        return mask
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            **self._counters,
+            "mode": local_index_mode(),
+            "loaded": snapshot is not None,
+            "chunks": int(snapshot.ids.shape[0]) if snapshot else 0,
+            "generation": snapshot.generation if snapshot else None,
+            "db_generation": self._db_generation,
+        }
+
+
+# ── Exportación (ingesta / comando de rebuild) ──────────────────────────
+
+def _parse_vector_text(value: str) -> np.ndarray:
+    return np.array(value.strip("[]").split(","), dtype=np.float32)
+
+
+def export_chunk_index(engine, directory: Optional[Path] = None, batch_size: int = 2000) -> dict:
+    """Escribe matriz + filas + manifest de la generación actual de los chunks.
+
+    Generación y filas se leen en una transacción REPEATABLE READ: el
+    archivo nunca mezcla una generación con filas de otra. El manifest se
+    reemplaza al final (os.replace atómico) y después se borran los
+    archivos de generaciones anteriores.
+    """
+    target = Path(directory) if directory else default_index_dir()
+    target.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+
+    raw_conn = engine.raw_connection()
+    try:
+        raw_conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        cur = raw_conn.cursor()
+        try:
+            cur.execute("SELECT generation FROM public.agent_refresh_generation WHERE scope = %s", [CHUNK_INDEX_SCOPE])
+            row = cur.fetchone()
+            generation = int(row[0]) if row else None
+        except Exception:
+            raw_conn.rollback()
+            raw_conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+            generation = None
+        cur.close()
+        rows_cursor = raw_conn.cursor(name="local_vector_index_export")
+        rows_cursor.itersize = batch_size
+        rows_cursor.execute(
+            """
+            SELECT id,
+                   tipo_documento,
+                   LOWER(COALESCE(marca, '')),
+                   COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general'),
+                   COALESCE(metadata ->> 'document_scope', ''),
+                   COALESCE(metadata ->> 'quality_tier', ''),
+                   LOWER(COALESCE(metadata ->> 'canonical_family', familia_producto, '')),
+                   LOWER(COALESCE(metadata ->> 'chemical_family', '')),
+                   embedding::text
+            FROM public.agent_technical_doc_chunk
+            ORDER BY id
+            """
+        )
+        rows: dict[str, list[Any]] = {"id": [], **{name: [] for name in _ROW_COLUMNS}}
+        vectors: list[np.ndarray] = []
+        for record in rows_cursor:
+            rows["id"].append(int(record[0]))
+            for name, value in zip(_ROW_COLUMNS, record[1:8]):
+                rows[name].append(value or "")
+            vectors.append(_parse_vector_text(record[8]))
+        rows_cursor.close()
+        raw_conn.rollback()
+    finally:
+        raw_conn.close()
+
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    if matrix.size:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = (matrix / norms).astype(np.float32)
+
+    stamp = f"g{generation if generation is not None else 'none'}-{int(time.time())}"
+    matrix_file = f"chunks-{stamp}.npy"
+    rows_file = f"chunks-{stamp}.rows.json"
+    np.save(target / matrix_file, matrix)
+    (target / rows_file).write_text(json.dumps(rows, ensure_ascii=False), encoding="utf-8")
+    manifest = {
+        "generation": generation,
+        "chunks": len(rows["id"]),
+        "dimensions": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "matrix_file": matrix_file,
+        "rows_file": rows_file,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        "build_seconds": round(time.perf_counter() - started, 2),
+    }
+    tmp_manifest = target / f"{MANIFEST_NAME}.tmp"
+    tmp_manifest.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp_manifest, target / MANIFEST_NAME)
+    for stale in target.glob("chunks-*"):
+        if stale.name not in (matrix_file, rows_file):
+            try:
+                stale.unlink()  # los workers con el mmap abierto conservan su copia hasta recargar
+            except OSError:
+                pass
+    logger.info("Índice vectorial local exportado: %s chunks, generación %s, %.1fs",
+                manifest["chunks"], generation, manifest["build_seconds"])
+    return manifest
+
+
+def benchmark_local_index(engine, index: LocalVectorIndex, samples: int = 30, top_k: int = 6) -> dict:
+    """Latencia local vs pgvector (HNSW) sobre embeddings reales y solapamiento de resultados."""
+    with engine.connect() as conn:
+        from sqlalchemy import text
+
+        sample_rows = conn.execute(
+            text("SELECT id, embedding::text FROM public.agent_technical_doc_chunk ORDER BY random() LIMIT :n"),
+            {"n": samples},
+        ).fetchall()
+        local_ms: list[float] = []
+        pg_ms: list[float] = []
+        overlap: list[float] = []
+        for _, embedding_text in sample_rows:
+            vector = _parse_vector_text(embedding_text)
+            started = time.perf_counter()
+            local_ids = {hit[0] for hit in index.search(vector.tolist(), source="chunks", top_k=top_k)}
+            local_ms.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            pg_ids = {row[0] for row in conn.execute(
+                text(
+                    """
+                    SELECT id FROM public.agent_technical_doc_chunk
+                    WHERE tipo_documento IN ('ficha_tecnica', 'ficha_tecnica_experto')
+                      AND COALESCE(metadata ->> 'document_scope', 'primary') = 'primary'
+                      AND COALESCE(metadata ->> 'quality_tier', 'primary') <> 'rejected'
+                    ORDER BY embedding <=> CAST(:q AS vector)
+                    LIMIT :k
+                    """
+                ),
+                {"q": embedding_text, "k": top_k},
+            )}
+            pg_ms.append((time.perf_counter() - started) * 1000)
+            if local_ids:
+                overlap.append(len(local_ids & pg_ids) / len(local_ids))
+
+    def _p(values: list[float], fraction: float) -> float:
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))], 2) if ordered else 0.0
+
+    return {
+        "samples": len(sample_rows),
+        "top_k": top_k,
+        "local_ms_p50": _p(local_ms, 0.5),
+        "local_ms_p95": _p(local_ms, 0.95),
+        "pgvector_ms_p50": _p(pg_ms, 0.5),
+        "pgvector_ms_p95": _p(pg_ms, 0.95),
+        "overlap_at_k": round(sum(overlap) / len(overlap), 4) if overlap else None,
+        "index": index.stats(),
+    }
+
+
+# Singleton por proceso; main.py le informa la generación vía NOTIFY.
+local_vector_index = LocalVectorIndex()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Índice vectorial local (mmap) de agent_technical_doc_chunk")
+    parser.add_argument("--rebuild", action="store_true", help="Exporta de nuevo el índice desde Postgres")
+    parser.add_argument("--benchmark", type=int, default=0, metavar="N", help="Compara latencia local vs pgvector con N consultas")
+    parser.add_argument("--dir", default=None, help="Directorio del índice (defecto RAG_LOCAL_INDEX_DIR o artifacts/rag/vector_index)")
+    args = parser.parse_args()
+    try:
+        from ingest_technical_sheets import get_db_engine
+    except ImportError:
+        from backend.ingest_technical_sheets import get_db_engine
+    cli_engine = get_db_engine()
+    if args.rebuild:
+        export_chunk_index(cli_engine, Path(args.dir) if args.dir else None)
+    if args.benchmark:
+        cli_index = LocalVectorIndex(Path(args.dir) if args.dir else None)
+        print(json.dumps(benchmark_local_index(cli_engine, cli_index, samples=args.benchmark), indent=2))
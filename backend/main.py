@@ -15,6 +15,7 @@ import hashlib
 import secrets
 import asyncio
 import threading
+from contextlib import asynccontextmanager
 from difflib import SequenceMatcher
 from datetime import date, timedelta, datetime
 from html import escape
@@ -36,23 +37,34 @@ try:
     from gemini_embeddings import (
         generate_document_embedding,
         generate_query_embedding as generate_gemini_query_embedding,
+        query_embedding_client,
     )
 except ImportError:
     from backend.gemini_embeddings import (
         generate_document_embedding,
         generate_query_embedding as generate_gemini_query_embedding,
+        query_embedding_client,
     )
 
 
 logger = logging.getLogger("ferreinox_agent")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(name)s] %(levelname)s: %(message)s")
 
-app = FastAPI(title="CRM Ferreinox Backend", version="2026.3.1")
+
+@asynccontextmanager
+async def _app_lifespan(_app: FastAPI):
+    # Precalentar índices en memoria sin bloquear el arranque del worker.
+    change_notifier.start(_open_cache_listener_connection)
+    schedule_rotation_refresh()
+    schedule_product_code_index_refresh(force=True)
+    schedule_product_learning_index_refresh(force=True)
+    yield
+
+
+app = FastAPI(title="CRM Ferreinox Backend", version="2026.3.1", lifespan=_app_lifespan)
 
 INVENTORY_ACTIVE_LOOKBACK_YEARS = int(os.getenv("INVENTORY_ACTIVE_LOOKBACK_YEARS", "2"))
 _EXPERT_CACHE_TTL = float(os.getenv("EXPERT_CACHE_TTL_SECONDS", "300"))
-_expert_knowledge_cache: list[dict] = []
-_expert_knowledge_cache_ts = 0.0
 
 # ── Agent V3 (production engine) ──────────────────────────────────────────────
 try:
@@ -154,10 +166,12 @@ try:
         PORTFOLIO_SEGMENT_ALIASES,
         PORTFOLIO_SEGMENT_QUERY_HINTS,
         _generate_query_embedding,
+        prefetch_query_embeddings,
         _normalize_portfolio_segment,
         _infer_portfolio_segments_for_query,
         _dedupe_preserve_order,
         _infer_technical_metadata_prefilters,
+        search_rag_indexes,
         search_technical_chunks,
         search_supporting_technical_guides,
         search_multimodal_product_index,
@@ -169,10 +183,12 @@ except ImportError:
         PORTFOLIO_SEGMENT_ALIASES,
         PORTFOLIO_SEGMENT_QUERY_HINTS,
         _generate_query_embedding,
+        prefetch_query_embeddings,
         _normalize_portfolio_segment,
         _infer_portfolio_segments_for_query,
         _dedupe_preserve_order,
         _infer_technical_metadata_prefilters,
+        search_rag_indexes,
         search_technical_chunks,
         search_supporting_technical_guides,
         search_multimodal_product_index,
@@ -211,6 +227,78 @@ except ImportError:
         _handle_tool_consultar_referencia_international,
     )
 
+try:
+    from product_code_index import normalize_code, product_code_index
+except ImportError:
+    from backend.product_code_index import normalize_code, product_code_index
+
+try:
+    from product_learning_index import product_learning_index
+except ImportError:
+    from backend.product_learning_index import product_learning_index
+
+try:
+    from cache_invalidation import (
+        REFRESH_GENERATION_CHANNEL,
+        bump_refresh_generation,
+        change_notifier,
+        fetch_refresh_generation,
+        notify_change,
+    )
+except ImportError:
+    from backend.cache_invalidation import (
+        REFRESH_GENERATION_CHANNEL,
+        bump_refresh_generation,
+        change_notifier,
+        fetch_refresh_generation,
+        notify_change,
+    )
+
+try:
+    from rotation_store import ROTATION_SCOPE, RotationSnapshot, rotation_store
+except ImportError:
+    from backend.rotation_store import ROTATION_SCOPE, RotationSnapshot, rotation_store
+
+try:
+    from price_book import DEFAULT_PRICE_LIST, PRICE_SCOPE, price_book
+except ImportError:
+    from backend.price_book import DEFAULT_PRICE_LIST, PRICE_SCOPE, price_book
+
+try:
+    from embedding_cache import query_embedding_cache
+except ImportError:
+    from backend.embedding_cache import query_embedding_cache
+
+try:
+    from local_vector_index import CHUNK_INDEX_SCOPE, local_vector_index
+except ImportError:
+    from backend.local_vector_index import CHUNK_INDEX_SCOPE, local_vector_index
+
+try:
+    from expert_knowledge_store import EXPERT_KNOWLEDGE_SCOPE, expert_knowledge_store
+except ImportError:
+    from backend.expert_knowledge_store import EXPERT_KNOWLEDGE_SCOPE, expert_knowledge_store
+
+try:
+    from technical_profile_store import technical_profile_store
+except ImportError:
+    from backend.technical_profile_store import technical_profile_store
+
+try:
+    from rag_context import rag_context_stats
+except ImportError:
+    from backend.rag_context import rag_context_stats
+
+try:
+    from rag_result_cache import rag_result_cache
+except ImportError:
+    from backend.rag_result_cache import rag_result_cache
+
+try:
+    from dropbox_mirror import DropboxMirror
+except ImportError:
+    from backend.dropbox_mirror import DropboxMirror
+
 # ── Color formulas data (from LIBRO DE FORMULAS) ──
 _COLOR_FORMULAS: list[dict] = []
 _COLOR_FORMULAS_FILE = Path(__file__).resolve().parent.parent / "data" / "color_formulas.json"
@@ -388,6 +476,7 @@ TECHNICAL_DOC_STOPWORDS = {
     "el",
 }
 TECHNICAL_DOC_CACHE = {"loaded_at": 0.0, "entries": []}
+technical_doc_mirror = DropboxMirror(TECHNICAL_DOC_FOLDER)
 
 
 TECHNICAL_ADVISORY_KEYWORDS = [
@@ -3211,6 +3300,18 @@ def get_db_engine():
     return _db_engine_singleton
 
 
+query_embedding_cache.bind_engine(get_db_engine)
+rag_result_cache.bind_engine(get_db_engine)
+technical_doc_mirror.bind_engine(get_db_engine)
+
+
+def _open_cache_listener_connection():
+    """Conexión psycopg2 dedicada (fuera del pool) para el hilo LISTEN de invalidación."""
+    raw_connection = get_db_engine().raw_connection()
+    raw_connection.detach()
+    return raw_connection.driver_connection
+
+
 def safe_json_dumps(value):
     return json.dumps(value, ensure_ascii=False, default=str)
 
@@ -5413,6 +5514,8 @@ def _execute_sql_file_in_background(sql_path: Path, database_url: str):
             cur.execute(sql_text)
             cur.close()
         logger.info("Applied SQL file %s", sql_path)
+        # postgrest_views.sql recrea mv_productos: el índice de códigos queda viejo.
+        refresh_product_code_index()
     except Exception as exc:
         logger.exception("Failed to apply SQL file %s: %s", sql_path, exc)
 
@@ -6594,18 +6697,10 @@ def list_technical_document_entries(force_refresh: bool = False):
     if not force_refresh and TECHNICAL_DOC_CACHE.get("entries") and cache_age < TECHNICAL_DOC_CACHE_TTL_SECONDS:
         return TECHNICAL_DOC_CACHE["entries"]
 
-    dbx = get_dropbox_ventas_client()
-    entries = []
-    result = dbx.files_list_folder(TECHNICAL_DOC_FOLDER, recursive=True)
-    while True:
-        entries.extend(
-            entry for entry in result.entries
-            if isinstance(entry, dropbox.files.FileMetadata) and entry.name.lower().endswith(".pdf")
-        )
-        if not result.has_more:
-            break
-        result = dbx.files_list_folder_continue(result.cursor)
-
+    entries = technical_doc_mirror.refresh(
+        get_dropbox_ventas_client,
+        max_age_seconds=0 if force_refresh else TECHNICAL_DOC_CACHE_TTL_SECONDS,
+    )
     TECHNICAL_DOC_CACHE["loaded_at"] = time.time()
     TECHNICAL_DOC_CACHE["entries"] = entries
     return entries
@@ -6679,8 +6774,8 @@ def search_technical_documents(document_request: dict):
 
     ranked_documents = []
     for entry in list_technical_document_entries():
-        path_value = normalize_text_value(entry.path_lower or entry.name)
-        name_value = normalize_text_value(entry.name)
+        path_value = normalize_text_value(entry["path_lower"] or entry["name"])
+        name_value = normalize_text_value(entry["name"])
         exact_hits = sum(1 for term in terms if term in path_value)
         if exact_hits == 0 and not any(sequence_similarity(term, name_value) >= 0.74 for term in terms):
             continue
@@ -6694,8 +6789,8 @@ def search_technical_documents(document_request: dict):
 
         ranked_documents.append(
             {
-                "name": entry.name,
-                "path_lower": entry.path_lower,
+                "name": entry["name"],
+                "path_lower": entry["path_lower"],
                 "exact_hits": exact_hits,
                 "safety_score": safety_score,
                 "technical_score": technical_score,
@@ -6925,8 +7020,8 @@ def smart_score_product(
     candidate_brand = str(candidate.get("marca") or candidate.get("marca_producto") or "")
 
     # ── +0.4: Rotation score (historical sales velocity) ──
-    if rotation_cache and candidate_code in rotation_cache:
-        score += 0.4 * rotation_cache[candidate_code]
+    if rotation_cache:
+        score += 0.4 * (rotation_cache.get(candidate_code) or 0.0)
 
     # ── +0.3: Text similarity (phonetic + trigram-style character overlap) ──
     normalized_query = normalize_text_value(query_text)
@@ -6989,27 +7084,121 @@ def smart_score_product(
     return round(score, 4)
 
 
-# ── Global rotation cache with TTL ────────────────────────────────────────────
-_rotation_cache_data: dict = {}
-_rotation_cache_ts: float = 0.0
-_ROTATION_CACHE_TTL = 300  # 5 minutes
+# ── Global rotation store (sorted codes + float32 scores) ─────────────────────
+# Se recarga sólo cuando cambia la refresh generation de mv_product_rotation.
+# Si la tabla de generaciones aún no existe, cae a recarga por TTL en segundo plano.
+ROTATION_GENERATION_CHECK_SECONDS = int(os.getenv("ROTATION_GENERATION_CHECK_SECONDS", "60"))
+_ROTATION_CACHE_TTL = 300  # 5 minutes, sólo sin refresh generation
 
 
-def fetch_rotation_cache(connection) -> dict:
-    """Load the rotation scores with 5-minute in-memory cache."""
-    global _rotation_cache_data, _rotation_cache_ts
-    now = time.time()
-    if _rotation_cache_data and (now - _rotation_cache_ts) < _ROTATION_CACHE_TTL:
-        return _rotation_cache_data
-    try:
-        rows = connection.execute(
-            text("SELECT producto_codigo, rotation_score FROM mv_product_rotation")
-        ).mappings().all()
-        _rotation_cache_data = {str(row["producto_codigo"]): float(row["rotation_score"]) for row in rows}
-        _rotation_cache_ts = now
-        return _rotation_cache_data
-    except Exception:
-        return {}
+def _load_rotation_snapshot(connection, generation: Optional[int]) -> RotationSnapshot:
+    rows = connection.execute(
+        text("SELECT producto_codigo, rotation_score FROM mv_product_rotation")
+    ).all()
+    return RotationSnapshot.from_rows(rows, generation=generation)
+
+
+def _refresh_rotation_store_once(force: bool) -> None:
+    engine = get_db_engine()
+    with engine.connect() as connection:
+        generation = fetch_refresh_generation(connection, ROTATION_SCOPE)
+        snapshot = rotation_store.snapshot()
+        unchanged = generation is not None and generation == snapshot.generation
+        fresh_without_generation = generation is None and (time.time() - snapshot.loaded_at) < _ROTATION_CACHE_TTL
+        if not force and rotation_store.is_loaded() and (unchanged or fresh_without_generation):
+            rotation_store.mark_checked()
+            return
+        rotation_store.publish(_load_rotation_snapshot(connection, generation))
+
+
+def refresh_rotation_store(force: bool = False):
+    """Recarga el snapshot; un pedido que llega mientras corre (p. ej. un NOTIFY) la repite al terminar."""
+    if not rotation_store.try_begin_refresh():
+        return
+    while True:
+        try:
+            _refresh_rotation_store_once(force)
+        except Exception as exc:
+            logger.warning("No se pudo refrescar rotation_store: %s", exc)
+        if not rotation_store.end_refresh():
+            return
+        force = False
+
+
+def schedule_rotation_refresh() -> None:
+    rotation_store.mark_checked()
+    run_background_io("rotation-store", refresh_rotation_store)
+
+
+def _on_refresh_generation_change(payload: Optional[dict]):
+    scope = (payload or {}).get("scope")
+    if scope in (None, ROTATION_SCOPE) and (payload or {}).get("generation") != rotation_store.generation:
+        schedule_rotation_refresh()
+
+
+change_notifier.subscribe(REFRESH_GENERATION_CHANNEL, _on_refresh_generation_change)
+
+
+def fetch_rotation_cache(connection) -> RotationSnapshot:
+    """Snapshot compartido de rotation scores (Mapping de sólo lectura, sin copias).
+
+    Nunca carga la MV en el request: en frío o con el chequeo de generación
+    vencido agenda la recarga en segundo plano y sirve el snapshot vigente
+    (vacío sólo hasta que termina el precalentamiento del arranque).
+    """
+    if rotation_store.check_due(ROTATION_GENERATION_CHECK_SECONDS):
+        schedule_rotation_refresh()
+    return rotation_store.snapshot()
+
+
+# La rotación ya no se une en SQL: se traen todas las filas empatadas en
+# match_score con la fila `limit` (la frontera) y se desempata con el
+# rotation_store en memoria. Con match_score discreto un empate puede ser
+# mucho mayor que `limit`; una ventana fija (p. ej. 3×limit por stock)
+# cortaría productos de alta rotación y poco stock antes del desempate.
+# ROTATION_RERANK_MAX_ROWS sólo acota consultas patológicas.
+_ROTATION_RERANK_MAX_ROWS = int(os.getenv("ROTATION_RERANK_MAX_ROWS", "2000"))
+
+
+def _rotation_rerank_sql(candidates_sql: str, limit: int, ctes: str = "") -> str:
+    """Envuelve `candidates_sql` (con columnas match_score y stock_total) para traer la frontera completa."""
+    return f"""
+        WITH {ctes}candidates AS ({candidates_sql}),
+        boundary AS (
+            SELECT match_score FROM candidates
+            ORDER BY match_score DESC
+            LIMIT 1 OFFSET {max(0, int(limit) - 1)}
+        )
+        SELECT candidates.* FROM candidates
+        WHERE NOT EXISTS (SELECT 1 FROM boundary)
+           OR candidates.match_score >= (SELECT match_score FROM boundary)
+        ORDER BY candidates.match_score DESC, candidates.stock_total DESC NULLS LAST
+        LIMIT {_ROTATION_RERANK_MAX_ROWS}
+    """
+
+
+def _fetch_rotation_ranked_rows(connection, candidates_sql: str, params: dict, code_field: str, limit: int,
+                                ctes: str = "") -> list[dict]:
+    rows = connection.execute(text(_rotation_rerank_sql(candidates_sql, limit, ctes)), params).mappings().all()
+    return _rank_rows_by_rotation([dict(r) for r in rows], connection, code_field, limit)
+
+
+def _rank_rows_by_rotation(rows: list[dict], connection, code_field: str, limit: int) -> list[dict]:
+    if not rows:
+        return rows
+    rotation = fetch_rotation_cache(connection)
+    scores = rotation.scores_for(normalize_code(row.get(code_field)) for row in rows)
+    for row, rotation_score in zip(rows, scores):
+        row["rotation_score"] = round(float(rotation_score), 4)
+    rows.sort(
+        key=lambda row: (
+            parse_numeric_value(row.get("match_score")) or 0,
+            row["rotation_score"],
+            parse_numeric_value(row.get("stock_total")) or 0,
+        ),
+        reverse=True,
+    )
+    return rows[: int(limit)]
 
 
 # ── Fuzzy Multi-Column Search (Trigram + Phonetic) ────────────────────────────
@@ -7116,37 +7305,35 @@ def fetch_smart_product_rows(
             allow_stale_with_stock=allow_stale_with_stock,
         )
 
-    rows = connection.execute(
-        text(
-            f"""
-            WITH recent_sales AS (
-                SELECT
-                    am.referencia_normalizada,
-                    MAX(public.fn_parse_date(rv.fecha_venta)) AS last_sale_date
-                FROM public.raw_ventas_detalle rv
-                JOIN public.articulos_maestro am ON am.codigo_articulo = rv.codigo_articulo
-                WHERE LOWER(COALESCE(rv.tipo_documento, '')) LIKE '%factura%'
-                GROUP BY am.referencia_normalizada
-            )
+    return _fetch_rotation_ranked_rows(
+        connection,
+        f"""
             SELECT p.producto_codigo, p.referencia, p.descripcion, p.marca, p.departamentos, p.stock_total, p.costo_promedio_und, p.stock_por_tienda,
                    p.linea_clasificacion, p.marca_clasificacion, p.familia_clasificacion, p.aplicacion_clasificacion, p.cat_producto, p.descripcion_ebs, p.tipo_articulo,
                    p.nombre_comercial_abracol, p.familia_abracol, p.descripcion_larga_abracol, p.portafolio_abracol,
                    rs.last_sale_date AS ultima_venta,
-                   ({match_score_sql}) AS match_score,
-                   COALESCE(rot.rotation_score, 0) AS rotation_score
+                   ({match_score_sql}) AS match_score
             FROM mv_productos p
-            LEFT JOIN mv_product_rotation rot ON rot.producto_codigo = p.producto_codigo
             LEFT JOIN recent_sales rs
               ON rs.referencia_normalizada = public.fn_keep_alnum(COALESCE(p.referencia, p.producto_codigo))
             WHERE ({where_clause})
               AND rs.last_sale_date >= CURRENT_DATE - INTERVAL '{INVENTORY_ACTIVE_LOOKBACK_YEARS} years'
-            ORDER BY ({match_score_sql}) DESC, COALESCE(rot.rotation_score, 0) DESC, stock_total DESC NULLS LAST
-            LIMIT {int(limit)}
-            """
-        ),
+        """,
         params,
-    ).mappings().all()
-    return [dict(r) for r in rows]
+        "producto_codigo",
+        limit,
+        ctes="""
+            recent_sales AS (
+                SELECT
+                    am.referencia_normalizada,
+                    MAX(public.fn_parse_date(rv.fecha_venta)) AS last_sale_date
+                FROM public.raw_ventas_detalle rv
+                JOIN public.articulos_maestro am ON am.codigo_articulo = rv.codigo_articulo
+                WHERE LOWER(COALESCE(rv.tipo_documento, '')) LIKE '%factura%'
+                GROUP BY am.referencia_normalizada
+            ),
+        """,
+    )
 
 
 def _fetch_smart_from_store(connection, where_clause, params, match_score_sql, store_filters, limit, allow_stale_with_stock: bool = False):
@@ -7169,23 +7356,13 @@ def _fetch_smart_from_store(connection, where_clause, params, match_score_sql, s
         else f"inventory.ultima_venta >= CURRENT_DATE - INTERVAL '{INVENTORY_ACTIVE_LOOKBACK_YEARS} years'"
     )
 
-    rows = connection.execute(
-        text(
-            f"""
-            WITH recent_sales AS (
-                SELECT
-                    am.referencia_normalizada,
-                    MAX(public.fn_parse_date(rv.fecha_venta)) AS last_sale_date
-                FROM public.raw_ventas_detalle rv
-                JOIN public.articulos_maestro am ON am.codigo_articulo = rv.codigo_articulo
-                WHERE LOWER(COALESCE(rv.tipo_documento, '')) LIKE '%factura%'
-                GROUP BY am.referencia_normalizada
-            )
+    return _fetch_rotation_ranked_rows(
+        connection,
+        f"""
             SELECT referencia, descripcion, marca, departamentos, stock_total, costo_promedio_und, stock_por_tienda,
                    linea_clasificacion, marca_clasificacion, familia_clasificacion, aplicacion_clasificacion, cat_producto, descripcion_ebs, tipo_articulo,
                    ultima_venta,
-                   ({match_score_sql}) AS match_score,
-                   COALESCE(rot.rotation_score, 0) AS rotation_score
+                   ({match_score_sql}) AS match_score
             FROM (
                 SELECT
                     referencia,
@@ -7208,22 +7385,17 @@ def _fetch_smart_from_store(connection, where_clause, params, match_score_sql, s
                     MAX(cat_producto) AS cat_producto,
                     MAX(descripcion_ebs) AS descripcion_ebs,
                     MAX(tipo_articulo) AS tipo_articulo,
-                    MAX(rs.last_sale_date) AS ultima_venta
-                FROM public.vw_inventario_agente_activo inv
-                LEFT JOIN recent_sales rs
-                  ON rs.referencia_normalizada = inv.referencia_normalizada
+                    MAX(inv.ultima_venta) AS ultima_venta
+                FROM public.inventario_agente_activo inv
                 WHERE {inner_where}
                 GROUP BY referencia, descripcion, marca
             ) inventory
-            LEFT JOIN mv_product_rotation rot ON rot.producto_codigo = inventory.referencia
             WHERE {activity_clause}
-            ORDER BY ({match_score_sql}) DESC, COALESCE(rot.rotation_score, 0) DESC, stock_total DESC NULLS LAST
-            LIMIT {int(limit)}
-            """
-        ),
+        """,
         params,
-    ).mappings().all()
-    return [dict(r) for r in rows]
+        "referencia",
+        limit,
+    )
 
 
 def translate_product_to_commercial(description: Optional[str], presentation: Optional[str] = None, brand: Optional[str] = None):
@@ -8014,12 +8186,14 @@ def ensure_expert_knowledge_table():
 
 
 _expert_embedding_column_ensured = False
+# None = aún no se consultó information_schema en este proceso.
+_expert_embedding_column_present: Optional[bool] = None
 
 
 def _ensure_expert_knowledge_embedding_column():
     """Add vector embedding column to agent_expert_knowledge if missing.
     This enables semantic search for expert directives in agent_context.py."""
-    global _expert_embedding_column_ensured
+    global _expert_embedding_column_ensured, _expert_embedding_column_present
     if _expert_embedding_column_ensured:
         return
     try:
@@ -8042,6 +8216,7 @@ def _ensure_expert_knowledge_embedding_column():
                 ))
                 logger.info("Added embedding column + HNSW index to agent_expert_knowledge")
         _expert_embedding_column_ensured = True
+        _expert_embedding_column_present = True
         # Backfill embeddings for existing rows
         _backfill_expert_knowledge_embeddings()
     except Exception as exc:
@@ -8225,38 +8400,57 @@ def seed_expert_knowledge_polyurethane_1550():
 
 
 # [moved-to-rag_helpers.py @ Phase C3 HITO 1] originally lines 8180..8286
-def _get_expert_knowledge_cache() -> list[dict]:
-    global _expert_knowledge_cache, _expert_knowledge_cache_ts
-    import time as _time
-    now = _time.time()
-    if _expert_knowledge_cache and (now - _expert_knowledge_cache_ts) < _EXPERT_CACHE_TTL:
-        return _expert_knowledge_cache
-    try:
-        engine = get_db_engine()
-        with engine.connect() as connection:
-            rows = connection.execute(
+def _load_expert_knowledge_rows() -> list[dict]:
+    """Notas activas (más recientes primero) con su embedding si la columna existe."""
+    global _expert_embedding_column_present
+    engine = get_db_engine()
+    with engine.connect() as connection:
+        if _expert_embedding_column_present is None:
+            _expert_embedding_column_present = connection.execute(
                 text(
-                    """SELECT id, contexto_tags, producto_recomendado, producto_desestimado,
-                              nota_comercial, tipo, nombre_experto, created_at
-                       FROM public.agent_expert_knowledge
-                       WHERE activo = true
-                       ORDER BY created_at DESC"""
+                    """SELECT 1 FROM information_schema.columns
+                       WHERE table_schema = 'public' AND table_name = 'agent_expert_knowledge'
+                         AND column_name = 'embedding'"""
                 )
-            ).mappings().all()
-            _expert_knowledge_cache = [
-                {**dict(r), "_ts": r["created_at"].timestamp() if r.get("created_at") else 0}
-                for r in rows
-            ]
-            _expert_knowledge_cache_ts = now
-    except Exception as exc:
-        logger.debug("_get_expert_knowledge_cache refresh error: %s", exc)
-    return _expert_knowledge_cache
+            ).fetchone() is not None
+        embedding_sql = "embedding::text" if _expert_embedding_column_present else "NULL::text"
+        rows = connection.execute(
+            text(
+                f"""SELECT id, contexto_tags, producto_recomendado, producto_desestimado,
+                          nota_comercial, tipo, nombre_experto, created_at,
+                          {embedding_sql} AS embedding
+                   FROM public.agent_expert_knowledge
+                   WHERE activo = true
+                   ORDER BY created_at DESC"""
+            )
+        ).mappings().all()
+    return [
+        {**dict(r), "_ts": r["created_at"].timestamp() if r.get("created_at") else 0}
+        for r in rows
+    ]
+
+
+def _read_expert_knowledge_generation() -> Optional[int]:
+    with get_db_engine().connect() as connection:
+        return fetch_refresh_generation(connection, EXPERT_KNOWLEDGE_SCOPE)
+
+
+expert_knowledge_store.bind(
+    _load_expert_knowledge_rows,
+    _read_expert_knowledge_generation,
+    normalize=normalize_text_value,
+    ttl_seconds=_EXPERT_CACHE_TTL,
+)
+change_notifier.subscribe(REFRESH_GENERATION_CHANNEL, expert_knowledge_store.on_generation)
+
+
+def _get_expert_knowledge_cache() -> list[dict]:
+    return expert_knowledge_store.rows()
 
 
 def invalidate_expert_knowledge_cache():
     """Call after inserting new expert knowledge to force refresh on next read."""
-    global _expert_knowledge_cache_ts
-    _expert_knowledge_cache_ts = 0.0
+    expert_knowledge_store.invalidate()
 
 
 # ── Color formula lookup (from LIBRO DE FORMULAS data) ──
@@ -8309,30 +8503,58 @@ def lookup_international_product(producto: str, base: str = "", ral: str = "") -
     return results[:20]
 
 
+def _load_product_prices(referencias: list[str], price_list: str = DEFAULT_PRICE_LIST) -> dict[str, dict]:
+    """Loader en bloque de `price_book`: una fila por referencia con precio > 0."""
+    engine = get_db_engine()
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("""
+                SELECT DISTINCT ON (referencia)
+                       referencia, descripcion, marca, cat_producto, aplicacion,
+                       pvp_sap, pvp_franquicia,
+                       COALESCE(NULLIF(pvp_sap, 0), NULLIF(pvp_franquicia, 0)) AS precio_mejor
+                FROM public.agent_precios
+                WHERE referencia = ANY(:refs) AND (pvp_sap > 0 OR pvp_franquicia > 0)
+                ORDER BY referencia, id
+            """),
+            {"refs": list(referencias)},
+        ).mappings().all()
+    return {str(row["referencia"]).strip(): dict(row) for row in rows}
+
+
+price_book.bind_loader(_load_product_prices)
+
+
+def _on_price_refresh_generation(payload: Optional[dict]):
+    if (payload or {}).get("scope") in (None, PRICE_SCOPE):
+        price_book.invalidate()
+
+
+change_notifier.subscribe(REFRESH_GENERATION_CHANNEL, _on_price_refresh_generation)
+
+
+def _on_chunk_index_generation(payload: Optional[dict]):
+    # Una ingesta nueva deja obsoleto el índice vectorial local hasta que se re-exporte.
+    if (payload or {}).get("scope") == CHUNK_INDEX_SCOPE:
+        local_vector_index.note_db_generation((payload or {}).get("generation"))
+
+
+change_notifier.subscribe(REFRESH_GENERATION_CHANNEL, _on_chunk_index_generation)
+change_notifier.subscribe(REFRESH_GENERATION_CHANNEL, technical_profile_store.on_generation)
+change_notifier.subscribe(REFRESH_GENERATION_CHANNEL, rag_result_cache.on_generation)
+
+
+def fetch_product_prices(referencias: list[str], price_list: str = DEFAULT_PRICE_LIST) -> dict[str, Optional[dict]]:
+    """Precios de varias referencias vía `price_book` (una consulta para las que no están en cache)."""
+    return price_book.get_many(referencias, price_list=price_list)
+
+
 def fetch_product_price(referencia: str) -> Optional[dict]:
     """Look up price for a product by its referencia code from agent_precios.
     Uses pvp_sap for Pintuco/MPY brands, pvp_franquicia for complementary brands (Goya, Yale, Abracol, etc.)."""
     if not referencia:
         return None
-    try:
-        engine = get_db_engine()
-        with engine.connect() as conn:
-            row = conn.execute(
-                text("""
-                    SELECT referencia, descripcion, marca, cat_producto, aplicacion,
-                           pvp_sap, pvp_franquicia,
-                           COALESCE(NULLIF(pvp_sap, 0), NULLIF(pvp_franquicia, 0)) AS precio_mejor
-                    FROM public.agent_precios
-                    WHERE referencia = :ref AND (pvp_sap > 0 OR pvp_franquicia > 0)
-                    LIMIT 1
-                """),
-                {"ref": str(referencia).strip()},
-            ).mappings().first()
-            if row:
-                return dict(row)
-    except Exception as exc:
-        logger.debug("fetch_product_price error: %s", exc)
-    return None
+    return price_book.get(referencia)
 
 
 def fetch_client_by_nif_or_codigo(criterio: str) -> Optional[dict]:
@@ -8375,30 +8597,85 @@ def fetch_client_by_nif_or_codigo(criterio: str) -> Optional[dict]:
     return None
 
 
+# ── Companion graph cache ─────────────────────────────────────────────────────
+# agent_product_companion cambia sólo cuando un asesor guarda una relación, así
+# que las aristas se cachean por referencia (incluidas las que no tienen
+# acompañantes) hasta que llega un NOTIFY de cambio o se refresca mv_productos.
+PRODUCT_COMPANION_CHANNEL = "agent_product_companion_changed"
+COMPANION_CACHE_TTL_SECONDS = int(os.getenv("COMPANION_CACHE_TTL_SECONDS", "900"))
+_companion_graph: dict[str, list[dict]] = {}
+_companion_graph_ts = 0.0
+_companion_graph_lock = threading.Lock()
+
+
+def invalidate_product_companion_cache(payload: Optional[dict] = None):
+    global _companion_graph_ts
+    with _companion_graph_lock:
+        _companion_graph.clear()
+        _companion_graph_ts = time.time()
+
+
+def _on_companion_refresh_generation(payload: Optional[dict]):
+    # stock_total / descripcion_inventario vienen de mv_productos.
+    if (payload or {}).get("scope") in (None, "mv_productos"):
+        invalidate_product_companion_cache()
+
+
+change_notifier.subscribe(PRODUCT_COMPANION_CHANNEL, invalidate_product_companion_cache)
+change_notifier.subscribe(REFRESH_GENERATION_CHANNEL, _on_companion_refresh_generation)
+
+
+def fetch_product_companions_bulk(referencias: list[str]) -> dict[str, list[dict]]:
+    """Acompañantes activos de varias referencias con una sola consulta `= ANY(:refs)`."""
+    global _companion_graph_ts
+    requested = list(dict.fromkeys(str(ref) for ref in (referencias or []) if ref))
+    if not requested:
+        return {}
+    with _companion_graph_lock:
+        if time.time() - _companion_graph_ts > COMPANION_CACHE_TTL_SECONDS:
+            _companion_graph.clear()
+            _companion_graph_ts = time.time()
+        graph_ts = _companion_graph_ts
+        result = {ref: _companion_graph[ref] for ref in requested if ref in _companion_graph}
+    missing = [ref for ref in requested if ref not in result]
+    if missing:
+        try:
+            engine = get_db_engine()
+            with engine.connect() as connection:
+                rows = connection.execute(
+                    text(
+                        """
+                        SELECT c.producto_referencia,
+                               c.companion_referencia, c.companion_descripcion, c.tipo_relacion,
+                               c.proporcion, c.notas, c.confidence,
+                               p.stock_total, p.descripcion AS descripcion_inventario
+                        FROM public.agent_product_companion c
+                        LEFT JOIN mv_productos p ON p.referencia = c.companion_referencia
+                        WHERE c.producto_referencia = ANY(:refs) AND c.activo = true
+                        ORDER BY c.producto_referencia, c.tipo_relacion, c.confidence DESC
+                        """
+                    ),
+                    {"refs": missing},
+                ).mappings().all()
+        except Exception:
+            return {ref: [] for ref in requested}
+        fetched: dict[str, list[dict]] = {ref: [] for ref in missing}
+        for row in rows:
+            companion = dict(row)
+            fetched.setdefault(str(companion.pop("producto_referencia")), []).append(companion)
+        with _companion_graph_lock:
+            # Si hubo invalidación mientras consultábamos, no se cachea el resultado viejo.
+            if graph_ts == _companion_graph_ts:
+                _companion_graph.update(fetched)
+        result.update(fetched)
+    return {ref: [dict(companion) for companion in result[ref]] for ref in requested}
+
+
 def fetch_product_companions(referencia: str) -> list[dict]:
     """Fetch all active companion/complementary products for a given reference."""
     if not referencia:
         return []
-    try:
-        engine = get_db_engine()
-        with engine.connect() as connection:
-            rows = connection.execute(
-                text(
-                    """
-                    SELECT c.companion_referencia, c.companion_descripcion, c.tipo_relacion,
-                           c.proporcion, c.notas, c.confidence,
-                           p.stock_total, p.descripcion AS descripcion_inventario
-                    FROM public.agent_product_companion c
-                    LEFT JOIN mv_productos p ON p.referencia = c.companion_referencia
-                    WHERE c.producto_referencia = :ref AND c.activo = true
-                    ORDER BY c.tipo_relacion, c.confidence DESC
-                    """
-                ),
-                {"ref": str(referencia)},
-            ).mappings().all()
-            return [dict(r) for r in rows]
-    except Exception:
-        return []
+    return fetch_product_companions_bulk([referencia]).get(str(referencia), [])
 
 
 # ---------------------------------------------------------------------------
@@ -8445,75 +8722,165 @@ def learn_product_resolution(conversation_id: Optional[int], product_request: Op
     if not phrases:
         return
 
+    learning_rows = []
+    for phrase in phrases[:6]:
+        for row in reliable_rows:
+            reference_value = row.get("referencia") or row.get("codigo_articulo")
+            if not reference_value:
+                continue
+            canonical_presentation = None
+            description_value = normalize_text_value(row.get("descripcion") or row.get("nombre_articulo"))
+            for size_token, unit_name in PRESENTATION_SIZE_MAP.items():
+                if size_token in description_value:
+                    canonical_presentation = unit_name
+                    break
+            learning_rows.append(
+                {
+                    "normalized_phrase": phrase,
+                    "raw_phrase": phrase,
+                    "canonical_reference": str(reference_value),
+                    "canonical_description": row.get("descripcion") or row.get("nombre_articulo"),
+                    "canonical_brand": row.get("marca") or row.get("marca_producto"),
+                    "canonical_presentation": canonical_presentation,
+                    "source_conversation_id": conversation_id,
+                    "source_message": product_request.get("original_query"),
+                    "confidence": 0.95 if product_request.get("product_codes") else 0.82,
+                }
+            )
+
+    if not learning_rows:
+        return
+    # El índice en memoria se actualiza ya; la escritura en BD sale del camino de la respuesta.
+    for learning_row in learning_rows:
+        product_learning_index.merge(learning_row)
+    run_background_io("product-learning", persist_product_learning_rows, learning_rows, _PRODUCT_LEARNING_UPSERT_SQL)
+
+
+_PRODUCT_LEARNING_RETURNING_SQL = """
+    RETURNING normalized_phrase, canonical_reference, canonical_description, canonical_brand,
+              canonical_presentation, source_conversation_id, confidence, usage_count
+"""
+
+_PRODUCT_LEARNING_UPSERT_SQL = """
+    INSERT INTO public.agent_product_learning (
+        normalized_phrase,
+        raw_phrase,
+        canonical_reference,
+        canonical_description,
+        canonical_brand,
+        canonical_presentation,
+        source_conversation_id,
+        source_message,
+        confidence,
+        usage_count,
+        created_at,
+        updated_at
+    )
+    VALUES (
+        :normalized_phrase,
+        :raw_phrase,
+        :canonical_reference,
+        :canonical_description,
+        :canonical_brand,
+        :canonical_presentation,
+        :source_conversation_id,
+        :source_message,
+        :confidence,
+        1,
+        now(),
+        now()
+    )
+    ON CONFLICT (normalized_phrase, canonical_reference)
+    DO UPDATE SET
+        canonical_description = COALESCE(EXCLUDED.canonical_description, public.agent_product_learning.canonical_description),
+        canonical_brand = COALESCE(EXCLUDED.canonical_brand, public.agent_product_learning.canonical_brand),
+        canonical_presentation = COALESCE(EXCLUDED.canonical_presentation, public.agent_product_learning.canonical_presentation),
+        source_conversation_id = COALESCE(EXCLUDED.source_conversation_id, public.agent_product_learning.source_conversation_id),
+        source_message = COALESCE(EXCLUDED.source_message, public.agent_product_learning.source_message),
+        confidence = GREATEST(public.agent_product_learning.confidence, EXCLUDED.confidence),
+        usage_count = public.agent_product_learning.usage_count + 1,
+        updated_at = now()
+""" + _PRODUCT_LEARNING_RETURNING_SQL
+
+# Aprendizaje explícito del asesor (tool guardar_aprendizaje_producto): la descripción confirmada manda.
+_PRODUCT_LEARNING_CONFIRMED_UPSERT_SQL = """
+    INSERT INTO public.agent_product_learning (
+        normalized_phrase, raw_phrase, canonical_reference,
+        canonical_description, canonical_brand, canonical_presentation, source_conversation_id,
+        source_message, confidence, usage_count,
+        created_at, updated_at
+    ) VALUES (
+        :normalized_phrase, :raw_phrase, :canonical_reference,
+        :canonical_description, :canonical_brand, :canonical_presentation, :source_conversation_id,
+        :source_message, :confidence, 1, now(), now()
+    )
+    ON CONFLICT (normalized_phrase, canonical_reference)
+    DO UPDATE SET
+        canonical_description = EXCLUDED.canonical_description,
+        canonical_brand = COALESCE(EXCLUDED.canonical_brand, public.agent_product_learning.canonical_brand),
+        canonical_presentation = COALESCE(EXCLUDED.canonical_presentation, public.agent_product_learning.canonical_presentation),
+        source_conversation_id = COALESCE(EXCLUDED.source_conversation_id,
+            public.agent_product_learning.source_conversation_id),
+        confidence = GREATEST(public.agent_product_learning.confidence, EXCLUDED.confidence),
+        usage_count = public.agent_product_learning.usage_count + 1,
+        updated_at = now()
+""" + _PRODUCT_LEARNING_RETURNING_SQL
+
+PRODUCT_LEARNING_CHANNEL = "agent_product_learning_changed"
+PRODUCT_LEARNING_INDEX_TTL_SECONDS = int(os.getenv("PRODUCT_LEARNING_INDEX_TTL_SECONDS", "900"))
+_product_learning_refresh_lock = threading.Lock()
+
+
+def persist_product_learning_rows(learning_rows: list[dict], upsert_sql: str):
+    """Escribe aprendizajes, refresca el índice local con la fila final y avisa a los demás workers."""
     ensure_product_learning_table()
     engine = get_db_engine()
     with engine.begin() as connection:
-        for phrase in phrases[:6]:
-            for row in reliable_rows:
-                reference_value = row.get("referencia") or row.get("codigo_articulo")
-                if not reference_value:
-                    continue
-                canonical_presentation = None
-                description_value = normalize_text_value(row.get("descripcion") or row.get("nombre_articulo"))
-                for size_token, unit_name in PRESENTATION_SIZE_MAP.items():
-                    if size_token in description_value:
-                        canonical_presentation = unit_name
-                        break
-                connection.execute(
-                    text(
-                        """
-                        INSERT INTO public.agent_product_learning (
-                            normalized_phrase,
-                            raw_phrase,
-                            canonical_reference,
-                            canonical_description,
-                            canonical_brand,
-                            canonical_presentation,
-                            source_conversation_id,
-                            source_message,
-                            confidence,
-                            usage_count,
-                            created_at,
-                            updated_at
-                        )
-                        VALUES (
-                            :normalized_phrase,
-                            :raw_phrase,
-                            :canonical_reference,
-                            :canonical_description,
-                            :canonical_brand,
-                            :canonical_presentation,
-                            :source_conversation_id,
-                            :source_message,
-                            :confidence,
-                            1,
-                            now(),
-                            now()
-                        )
-                        ON CONFLICT (normalized_phrase, canonical_reference)
-                        DO UPDATE SET
-                            canonical_description = COALESCE(EXCLUDED.canonical_description, public.agent_product_learning.canonical_description),
-                            canonical_brand = COALESCE(EXCLUDED.canonical_brand, public.agent_product_learning.canonical_brand),
-                            canonical_presentation = COALESCE(EXCLUDED.canonical_presentation, public.agent_product_learning.canonical_presentation),
-                            source_conversation_id = COALESCE(EXCLUDED.source_conversation_id, public.agent_product_learning.source_conversation_id),
-                            source_message = COALESCE(EXCLUDED.source_message, public.agent_product_learning.source_message),
-                            confidence = GREATEST(public.agent_product_learning.confidence, EXCLUDED.confidence),
-                            usage_count = public.agent_product_learning.usage_count + 1,
-                            updated_at = now()
-                        """
-                    ),
-                    {
-                        "normalized_phrase": phrase,
-                        "raw_phrase": phrase,
-                        "canonical_reference": str(reference_value),
-                        "canonical_description": row.get("descripcion") or row.get("nombre_articulo"),
-                        "canonical_brand": row.get("marca") or row.get("marca_producto"),
-                        "canonical_presentation": canonical_presentation,
-                        "source_conversation_id": conversation_id,
-                        "source_message": product_request.get("original_query"),
-                        "confidence": 0.95 if product_request.get("product_codes") else 0.82,
-                    },
+        for learning_row in learning_rows:
+            stored_row = connection.execute(text(upsert_sql), learning_row).mappings().first()
+            if stored_row:
+                stored_row = dict(stored_row)
+                product_learning_index.upsert(stored_row)
+                notify_change(connection, PRODUCT_LEARNING_CHANNEL, stored_row)
+
+
+def refresh_product_learning_index():
+    if not _product_learning_refresh_lock.acquire(blocking=False):
+        return product_learning_index.size()
+    try:
+        ensure_product_learning_table()
+        engine = get_db_engine()
+        with engine.connect() as connection:
+            rows = connection.execute(
+                text(
+                    """
+                    SELECT normalized_phrase, canonical_reference, canonical_description, canonical_brand,
+                           canonical_presentation, source_conversation_id, confidence, usage_count
+                    FROM public.agent_product_learning
+                    """
                 )
+            ).mappings().all()
+        return product_learning_index.build(rows)
+    except Exception as exc:
+        logger.warning("No se pudo cargar el índice de aprendizajes: %s", exc)
+        return product_learning_index.size()
+    finally:
+        _product_learning_refresh_lock.release()
+
+
+def schedule_product_learning_index_refresh(force: bool = False):
+    if force or not product_learning_index.is_loaded() or product_learning_index.age_seconds() > PRODUCT_LEARNING_INDEX_TTL_SECONDS:
+        run_background_io("product-learning-index", refresh_product_learning_index)
+
+
+def _on_product_learning_change(payload: Optional[dict]):
+    # Con fila completa se aplica en sitio; sin payload (reconexión, borrado masivo) se recarga todo.
+    if payload and product_learning_index.upsert(payload):
+        return
+    schedule_product_learning_index_refresh(force=True)
+
+
+change_notifier.subscribe(PRODUCT_LEARNING_CHANNEL, _on_product_learning_change)
 
 
 def fetch_learned_product_references(product_request: Optional[dict]):
@@ -8531,26 +8898,36 @@ def fetch_learned_product_references(product_request: Optional[dict]):
     if not phrases:
         return []
 
-    ensure_product_learning_table()
-    engine = get_db_engine()
     learned_rows = []
-    with engine.connect() as connection:
-        for index, phrase in enumerate(phrases[:4]):
-            row_set = connection.execute(
-                text(
-                    """
-                    SELECT canonical_reference, canonical_description, canonical_brand, canonical_presentation,
-                           MAX(confidence) AS confidence, SUM(usage_count) AS total_hits
-                    FROM public.agent_product_learning
-                    WHERE normalized_phrase = :normalized_phrase
-                    GROUP BY canonical_reference, canonical_description, canonical_brand, canonical_presentation
-                    ORDER BY MAX(confidence) DESC, SUM(usage_count) DESC
-                    LIMIT 5
-                    """
-                ),
-                {"normalized_phrase": phrase},
-            ).mappings().all()
-            learned_rows.extend(row for row in row_set if is_learned_reference_relevant(product_request, row))
+    schedule_product_learning_index_refresh()
+    if product_learning_index.is_loaded():
+        for phrase in phrases[:4]:
+            learned_rows.extend(row for row in product_learning_index.lookup(phrase) if is_learned_reference_relevant(product_request, row))
+        if not learned_rows:
+            # Coincidencia parcial por trie de tokens ("koraza blanca" dentro de la frase pedida).
+            for phrase in phrases[:4]:
+                learned_rows.extend(row for row in product_learning_index.lookup_partial(phrase) if is_learned_reference_relevant(product_request, row))
+    else:
+        # Arranque en frío mientras el índice carga: consulta directa como antes.
+        ensure_product_learning_table()
+        engine = get_db_engine()
+        with engine.connect() as connection:
+            for index, phrase in enumerate(phrases[:4]):
+                row_set = connection.execute(
+                    text(
+                        """
+                        SELECT canonical_reference, canonical_description, canonical_brand, canonical_presentation,
+                               MAX(confidence) AS confidence, SUM(usage_count) AS total_hits
+                        FROM public.agent_product_learning
+                        WHERE normalized_phrase = :normalized_phrase
+                        GROUP BY canonical_reference, canonical_description, canonical_brand, canonical_presentation
+                        ORDER BY MAX(confidence) DESC, SUM(usage_count) DESC
+                        LIMIT 5
+                        """
+                    ),
+                    {"normalized_phrase": phrase},
+                ).mappings().all()
+                learned_rows.extend(row for row in row_set if is_learned_reference_relevant(product_request, row))
 
     ordered_references = []
     seen_references = set()
@@ -14572,6 +14949,22 @@ def _resolve_pdf_line_pricing(reference: str) -> dict:
     return empty
 
 
+def _prefetch_pdf_line_prices(detail: dict) -> None:
+    """Carga en bloque los precios de las líneas del PDF; `_resolve_pdf_line_pricing` los lee de cache."""
+    references = []
+    for item in (detail or {}).get("items") or []:
+        if item.get("status") != "matched":
+            continue
+        matched_product = item.get("matched_product") or {}
+        references.append(
+            matched_product.get("referencia")
+            or matched_product.get("codigo_articulo")
+            or item.get("referencia")
+            or item.get("codigo_articulo")
+        )
+    fetch_product_prices([ref for ref in references if ref])
+
+
 def generate_commercial_pdf(
     conversation_id: int,
     request_type: str,
@@ -14583,6 +14976,7 @@ def generate_commercial_pdf(
         from pdf_generator import generate_commercial_pdf_v2
     except ImportError:
         from backend.pdf_generator import generate_commercial_pdf_v2
+    _prefetch_pdf_line_prices(detail)
     return generate_commercial_pdf_v2(
         conversation_id,
         request_type,
@@ -15435,15 +15829,6 @@ def fetch_products_from_store_inventory(connection, where_clause: str, params: d
     return connection.execute(
         text(
             f"""
-            WITH recent_sales AS (
-                SELECT
-                    am.referencia_normalizada,
-                    MAX(public.fn_parse_date(rv.fecha_venta)) AS last_sale_date
-                FROM public.raw_ventas_detalle rv
-                JOIN public.articulos_maestro am ON am.codigo_articulo = rv.codigo_articulo
-                WHERE LOWER(COALESCE(rv.tipo_documento, '')) LIKE '%factura%'
-                GROUP BY am.referencia_normalizada
-            )
             SELECT referencia, descripcion, marca, departamentos, stock_total, costo_promedio_und, stock_por_tienda,
                    linea_clasificacion, marca_clasificacion, familia_clasificacion, aplicacion_clasificacion, cat_producto, descripcion_ebs, tipo_articulo,
                    ultima_venta,
@@ -15475,10 +15860,8 @@ def fetch_products_from_store_inventory(connection, where_clause: str, params: d
                     MAX(cat_producto) AS cat_producto,
                     MAX(descripcion_ebs) AS descripcion_ebs,
                     MAX(tipo_articulo) AS tipo_articulo,
-                    MAX(rs.last_sale_date) AS ultima_venta
-                FROM public.vw_inventario_agente_activo inv
-                LEFT JOIN recent_sales rs
-                  ON rs.referencia_normalizada = inv.referencia_normalizada
+                    MAX(inv.ultima_venta) AS ultima_venta
+                FROM public.inventario_agente_activo inv
                 WHERE {where_clause}
                 GROUP BY referencia, descripcion, marca
             ) inventory
@@ -15583,6 +15966,73 @@ def fetch_code_product_rows(connection, product_codes: list[str], store_filters:
     return fetch_products_from_catalog(connection, where_clause, params, match_score_sql, limit=15)
 
 
+PRODUCT_CODE_INDEX_TTL_SECONDS = int(os.getenv("PRODUCT_CODE_INDEX_TTL_SECONDS", "1800"))
+
+
+def refresh_product_code_index():
+    """Recarga el índice SymSpell de códigos desde mv_productos.
+
+    Se invoca al arrancar, tras las importaciones/refresh de catálogo y en
+    segundo plano cuando el índice supera PRODUCT_CODE_INDEX_TTL_SECONDS
+    (cubre los syncs que corren desde el panel Streamlit en otro proceso).
+    """
+    if not product_code_index.try_begin_refresh():
+        return product_code_index.size()
+    try:
+        engine = get_db_engine()
+        with engine.connect() as connection:
+            rows = connection.execute(
+                text("SELECT producto_codigo, referencia FROM mv_productos")
+            ).all()
+        codes = []
+        for producto_codigo, referencia in rows:
+            codes.append(producto_codigo)
+            codes.append(referencia)
+        return product_code_index.build(codes)
+    except Exception as exc:
+        logger.warning("No se pudo cargar el índice de códigos de producto: %s", exc)
+        return product_code_index.size()
+    finally:
+        product_code_index.end_refresh()
+
+
+def schedule_product_code_index_refresh(force: bool = False):
+    if force or not product_code_index.is_loaded() or product_code_index.age_seconds() > PRODUCT_CODE_INDEX_TTL_SECONDS:
+        run_background_io("product-code-index", refresh_product_code_index)
+
+
+def fetch_near_code_product_rows(connection, near_codes: list[tuple[str, int]], store_filters: list[str], allow_stale_with_stock: bool = False):
+    """Hidrata en UNA consulta los códigos candidatos que devolvió el índice SymSpell."""
+    if not near_codes:
+        return []
+    params = {
+        "near_codes": [code for code, _ in near_codes],
+        "near_codes_d1": [code for code, distance in near_codes if distance <= 1] or [""],
+    }
+    if store_filters:
+        store_filters_sql = []
+        for store_index, store_code in enumerate(store_filters):
+            params[f"store_{store_index}"] = store_code
+            store_filters_sql.append(f"inv.cod_almacen = :store_{store_index}")
+        return fetch_products_from_store_inventory(
+            connection,
+            f"inv.referencia_normalizada = ANY(:near_codes) AND ({' OR '.join(store_filters_sql)})",
+            params,
+            "CASE WHEN referencia_normalizada = ANY(:near_codes_d1) THEN 100 ELSE 90 END",
+            limit=15,
+            allow_stale_with_stock=allow_stale_with_stock,
+        )
+    # El índice normaliza referencia y producto_codigo con `normalize_code`: se compara con la misma normalización.
+    return fetch_products_from_catalog(
+        connection,
+        "(public.fn_keep_alnum(p.producto_codigo) = ANY(:near_codes) OR public.fn_keep_alnum(p.referencia) = ANY(:near_codes))",
+        params,
+        "CASE WHEN public.fn_keep_alnum(p.producto_codigo) = ANY(:near_codes_d1) "
+        "OR public.fn_keep_alnum(p.referencia) = ANY(:near_codes_d1) THEN 100 ELSE 90 END",
+        limit=15,
+    )
+
+
 def fetch_term_product_rows(connection, query_terms: list[str], store_filters: list[str], allow_stale_with_stock: bool = False):
     if not query_terms:
         return []
@@ -16107,6 +16557,76 @@ def _merge_product_rows(primary: list[dict], secondary: list[dict]) -> list[dict
     return merged
 
 
+def fetch_historical_sales_rows(connection, query_terms: list[str], limit: int = 10) -> list:
+    """Último recurso de `lookup_product_context`: referencias vendidas alguna vez.
+
+    Lee `historical_product_names` (una fila por referencia, índice trigram
+    sobre `search_blob`, reconstruida en cada sync). Si la tabla aún no
+    existe cae al escaneo de `vw_ventas_netas`.
+    """
+    sales_filters = []
+    sales_scores = []
+    sales_params = {}
+    for index, term in enumerate(query_terms):
+        sales_params[f"pattern_{index}"] = f"%{term}%"
+        sales_filters.append(f"search_blob ILIKE :pattern_{index}")
+        sales_scores.append(f"CASE WHEN search_blob ILIKE :pattern_{index} THEN 1 ELSE 0 END")
+    if not sales_filters:
+        return []
+
+    try:
+        with connection.begin_nested():
+            return connection.execute(
+                text(
+                    f"""
+                    SELECT codigo_articulo, nombre_articulo, marca_producto, categoria_producto,
+                           unidades_vendidas, valor_vendido, ultima_venta, total_ventas,
+                           ({' + '.join(sales_scores)}) AS match_score
+                    FROM public.historical_product_names
+                    WHERE {' OR '.join(sales_filters)}
+                    ORDER BY match_score DESC, valor_vendido DESC NULLS LAST
+                    LIMIT {int(limit)}
+                    """
+                ),
+                sales_params,
+            ).mappings().all()
+    except Exception as exc:
+        logger.debug("historical_product_names no disponible, usando vw_ventas_netas: %s", exc)
+
+    return connection.execute(
+        text(
+            f"""
+                SELECT codigo_articulo, nombre_articulo, marca_producto, categoria_producto,
+                       SUM(unidades_vendidas_netas) AS unidades_vendidas,
+                       SUM(valor_venta_neto) AS valor_vendido,
+                       MAX(match_score) AS match_score
+                FROM (
+                    SELECT
+                        codigo_articulo,
+                        nombre_articulo,
+                        marca_producto,
+                        categoria_producto,
+                        unidades_vendidas_netas,
+                        valor_venta_neto,
+                        ({' + '.join(sales_scores)}) AS match_score,
+                        translate(lower(
+                            COALESCE(nombre_articulo, '') || ' ' ||
+                            COALESCE(codigo_articulo, '') || ' ' ||
+                            COALESCE(marca_producto, '') || ' ' ||
+                            COALESCE(categoria_producto, '')
+                        ), 'áéíóúàèìòùâêîôûäëïöüñ', 'aeiouaeiouaeiouaeioun') AS search_blob
+                    FROM public.vw_ventas_netas
+                ) sales
+                WHERE {' OR '.join(sales_filters)}
+                GROUP BY 1, 2, 3, 4
+                ORDER BY match_score DESC, valor_vendido DESC NULLS LAST
+                LIMIT {int(limit)}
+            """
+        ),
+        sales_params,
+    ).mappings().all()
+
+
 def lookup_product_context(text_value: Optional[str], product_request: Optional[dict] = None):
     product_request = prepare_product_request_for_search(text_value, product_request)
     search_query_text = _build_inventory_lookup_text(product_request, text_value)
@@ -16134,22 +16654,33 @@ def lookup_product_context(text_value: Optional[str], product_request: Optional[
                     ranked_code_rows = rank_product_match_rows([dict(row) for row in code_rows], product_request, normalized_query, rotation_cache, text_value)
                     ranked_code_rows = filter_rows_by_requested_presentation(ranked_code_rows, product_request)
                     return ranked_code_rows[:10]
-                # Fuzzy near-code fallback: if no results, try digit-deletion and digit-transposition variants
-                # (e.g. user types "17174" when correct code is "117474" or vice-versa)
-                fuzzy_codes: list[str] = []
-                for code in product_codes[:2]:
-                    if re.fullmatch(r"\d{5,10}", code):
-                        for pos in range(len(code)):
-                            fuzzy_codes.append(code[:pos] + code[pos + 1:])
-                        for pos in range(len(code) - 1):
-                            fuzzy_codes.append(code[:pos] + code[pos + 1] + code[pos] + code[pos + 2:])
-                fuzzy_codes = list(dict.fromkeys(c for c in fuzzy_codes if len(c) >= 4))[:20]
-                if fuzzy_codes:
-                    fuzzy_rows = fetch_code_product_rows(connection, fuzzy_codes[:3], store_filters, allow_stale_with_stock=allow_stale_with_stock)
-                    if fuzzy_rows:
-                        ranked_fuzzy = rank_product_match_rows([dict(row) for row in fuzzy_rows], product_request, normalized_query, rotation_cache, text_value)
-                        ranked_fuzzy = filter_rows_by_requested_presentation(ranked_fuzzy, product_request)
-                        return ranked_fuzzy[:10]
+                # Fuzzy near-code fallback: códigos del catálogo a distancia 1–2
+                # (e.g. user types "17174" when correct code is "117474" or vice-versa).
+                # El índice SymSpell en memoria da el conjunto exacto de candidatos y
+                # la BD se consulta una sola vez con todos ellos.
+                schedule_product_code_index_refresh()
+                fuzzy_rows = []
+                if product_code_index.is_loaded():
+                    near_codes = product_code_index.lookup_many(product_codes[:2])
+                    near_codes = [(code, distance) for code, distance in near_codes if distance > 0]
+                    if near_codes:
+                        fuzzy_rows = fetch_near_code_product_rows(connection, near_codes, store_filters, allow_stale_with_stock=allow_stale_with_stock)
+                else:
+                    # Índice aún cargando (arranque en frío): variantes de dígitos como antes.
+                    fuzzy_codes: list[str] = []
+                    for code in product_codes[:2]:
+                        if re.fullmatch(r"\d{5,10}", code):
+                            for pos in range(len(code)):
+                                fuzzy_codes.append(code[:pos] + code[pos + 1:])
+                            for pos in range(len(code) - 1):
+                                fuzzy_codes.append(code[:pos] + code[pos + 1] + code[pos] + code[pos + 2:])
+                    fuzzy_codes = list(dict.fromkeys(c for c in fuzzy_codes if len(c) >= 4))[:20]
+                    if fuzzy_codes:
+                        fuzzy_rows = fetch_code_product_rows(connection, fuzzy_codes[:3], store_filters, allow_stale_with_stock=allow_stale_with_stock)
+                if fuzzy_rows:
+                    ranked_fuzzy = rank_product_match_rows([dict(row) for row in fuzzy_rows], product_request, normalized_query, rotation_cache, text_value)
+                    ranked_fuzzy = filter_rows_by_requested_presentation(ranked_fuzzy, product_request)
+                    return ranked_fuzzy[:10]
 
             if learned_references:
                 learned_rows = fetch_reference_product_rows(connection, learned_references, store_filters, 90, allow_stale_with_stock=allow_stale_with_stock)
@@ -16214,47 +16745,7 @@ def lookup_product_context(text_value: Optional[str], product_request: Optional[
                     merged = apply_requested_product_filters(merged, product_request)
                     return merged[:10]
 
-            sales_filters = []
-            sales_scores = []
-            sales_params = {}
-            for index, term in enumerate(query_terms):
-                sales_params[f"pattern_{index}"] = f"%{term}%"
-                sales_filters.append(f"search_blob ILIKE :pattern_{index}")
-                sales_scores.append(f"CASE WHEN search_blob ILIKE :pattern_{index} THEN 1 ELSE 0 END")
-
-            sales_rows = connection.execute(
-                text(
-                    f"""
-                    SELECT codigo_articulo, nombre_articulo, marca_producto, categoria_producto,
-                           SUM(unidades_vendidas_netas) AS unidades_vendidas,
-                           SUM(valor_venta_neto) AS valor_vendido,
-                           MAX(match_score) AS match_score
-                    FROM (
-                        SELECT
-                            codigo_articulo,
-                            nombre_articulo,
-                            marca_producto,
-                            categoria_producto,
-                            unidades_vendidas_netas,
-                            valor_venta_neto,
-                            ({' + '.join(sales_scores)}) AS match_score,
-                            translate(lower(
-                                COALESCE(nombre_articulo, '') || ' ' ||
-                                COALESCE(codigo_articulo, '') || ' ' ||
-                                COALESCE(marca_producto, '') || ' ' ||
-                                COALESCE(categoria_producto, '')
-                            ), 'áéíóúàèìòùâêîôûäëïöüñ', 'aeiouaeiouaeiouaeioun') AS search_blob
-                        FROM public.vw_ventas_netas
-                    ) sales
-                    WHERE {' OR '.join(sales_filters)}
-                    GROUP BY 1, 2, 3, 4
-                    ORDER BY match_score DESC, valor_vendido DESC NULLS LAST
-                    LIMIT 10
-                    """
-                ),
-                sales_params,
-            ).mappings().all()
-
+            sales_rows = fetch_historical_sales_rows(connection, query_terms)
             return [dict(row) for row in sales_rows]
     except Exception:
         return []
@@ -16548,6 +17039,8 @@ def _handle_tool_consultar_inventario(args, conversation_context):
             ensure_ascii=False,
         )
     results = []
+    if not inventory_only_mode:
+        fetch_product_prices([row.get("codigo_articulo") or row.get("referencia") or row.get("codigo") for row in rows[:10]])
     for row in rows[:10]:
         item = {
             "codigo": row.get("codigo_articulo") or row.get("referencia") or row.get("codigo"),
@@ -16802,14 +17295,6 @@ def _handle_tool_consultar_inventario_lote(args, conversation_context):
         return json.dumps({"encontrados": 0, "mensaje": "No se enviaron productos válidos."}, ensure_ascii=False)
 
     all_results = []
-    # Pre-warm rotation cache once for the entire batch
-    try:
-        engine = get_db_engine()
-        with engine.connect() as connection:
-            fetch_rotation_cache(connection)  # Warms global cache
-    except Exception:
-        pass
-
     for producto_text in productos[:15]:  # Cap at 15 items max
         producto_text = str(producto_text).strip()
         if not producto_text:
@@ -16862,6 +17347,7 @@ def _handle_tool_consultar_inventario_lote(args, conversation_context):
                 continue
 
             items = []
+            fetch_product_prices([row.get("codigo_articulo") or row.get("referencia") or row.get("codigo") for row in rows[:5]])
             for row in rows[:5]:  # Top 5 per product (less than single to save tokens)
                 item = {
                     "codigo": row.get("codigo_articulo") or row.get("referencia") or row.get("codigo"),
@@ -19073,59 +19559,39 @@ def _handle_tool_guardar_aprendizaje_producto(args, conversation_context):
         pass  # Si no puede verificar, continúa con precaución
 
     try:
-        ensure_product_learning_table()
-        engine = get_db_engine()
-        with engine.begin() as connection:
-            # --- Limitar cantidad de aprendizajes por conversación (anti-spam) ---
-            learning_count = connection.execute(
-                text(
-                    "SELECT COUNT(*) FROM public.agent_product_learning WHERE source_conversation_id = :conv_id"
-                ),
-                {"conv_id": conversation_id},
-            ).scalar() or 0
-            if learning_count >= 10:
-                return json.dumps(
-                    {"guardado": False, "mensaje": "No se guardó: esta conversación ya tiene 10 aprendizajes guardados (límite de seguridad)."},
-                    ensure_ascii=False,
-                )
-
-            connection.execute(
-                text(
-                    """
-                    INSERT INTO public.agent_product_learning (
-                        normalized_phrase, raw_phrase, canonical_reference,
-                        canonical_description, canonical_brand, canonical_presentation, source_conversation_id,
-                        source_message, confidence, usage_count,
-                        created_at, updated_at
-                    ) VALUES (
-                        :normalized_phrase, :raw_phrase, :canonical_reference,
-                        :canonical_description, :canonical_brand, :canonical_presentation, :source_conversation_id,
-                        :source_message, :confidence, 1, now(), now()
-                    )
-                    ON CONFLICT (normalized_phrase, canonical_reference)
-                    DO UPDATE SET
-                        canonical_description = EXCLUDED.canonical_description,
-                        canonical_brand = COALESCE(EXCLUDED.canonical_brand, public.agent_product_learning.canonical_brand),
-                        canonical_presentation = COALESCE(EXCLUDED.canonical_presentation, public.agent_product_learning.canonical_presentation),
-                        source_conversation_id = COALESCE(EXCLUDED.source_conversation_id,
-                            public.agent_product_learning.source_conversation_id),
-                        confidence = GREATEST(public.agent_product_learning.confidence, EXCLUDED.confidence),
-                        usage_count = public.agent_product_learning.usage_count + 1,
-                        updated_at = now()
-                    """
-                ),
-                {
-                    "normalized_phrase": normalized_code,
-                    "raw_phrase": codigo_cliente,
-                    "canonical_reference": str(canonical_reference),
-                    "canonical_description": canonical_description,
-                    "canonical_brand": canonical_brand,
-                    "canonical_presentation": canonical_presentation,
-                    "source_conversation_id": conversation_id,
-                    "source_message": f"{codigo_cliente} = {canonical_reference} | {canonical_description}",
-                    "confidence": 0.95,
-                },
+        # --- Limitar cantidad de aprendizajes por conversación (anti-spam) ---
+        if product_learning_index.is_loaded():
+            learning_count = product_learning_index.count_for_conversation(conversation_id)
+        else:
+            ensure_product_learning_table()
+            engine = get_db_engine()
+            with engine.connect() as connection:
+                learning_count = connection.execute(
+                    text(
+                        "SELECT COUNT(*) FROM public.agent_product_learning WHERE source_conversation_id = :conv_id"
+                    ),
+                    {"conv_id": conversation_id},
+                ).scalar() or 0
+        if learning_count >= 10:
+            return json.dumps(
+                {"guardado": False, "mensaje": "No se guardó: esta conversación ya tiene 10 aprendizajes guardados (límite de seguridad)."},
+                ensure_ascii=False,
             )
+
+        learning_row = {
+            "normalized_phrase": normalized_code,
+            "raw_phrase": codigo_cliente,
+            "canonical_reference": str(canonical_reference),
+            "canonical_description": canonical_description,
+            "canonical_brand": canonical_brand,
+            "canonical_presentation": canonical_presentation,
+            "source_conversation_id": conversation_id,
+            "source_message": f"{codigo_cliente} = {canonical_reference} | {canonical_description}",
+            "confidence": 0.95,
+        }
+        # Escritura síncrona: sólo se confirma al modelo lo que quedó en la BD. persist_product_learning_rows
+        # actualiza el índice local con la fila guardada y avisa a los demás workers.
+        persist_product_learning_rows([learning_row], _PRODUCT_LEARNING_CONFIRMED_UPSERT_SQL)
         logger.info(
             "Aprendizaje guardado: '%s' → '%s | %s' (conv=%s)",
             codigo_cliente, canonical_reference, canonical_description, conversation_id,
@@ -19203,6 +19669,8 @@ def _handle_tool_guardar_producto_complementario(args, conversation_context):
                     "conversation_id": conversation_id,
                 },
             )
+            notify_change(connection, PRODUCT_COMPANION_CHANNEL, {"producto_referencia": producto_ref})
+        invalidate_product_companion_cache()
         return json.dumps(
             {"guardado": True, "mensaje": f"Relación guardada: {producto_ref} → {tipo}: {companion_ref} ({companion_desc or 'sin descripción'})."},
             ensure_ascii=False,
@@ -19793,6 +20261,25 @@ def health_check():
         return {"backend": "ok", "postgrest": "error", "postgrest_url": postgrest_url, "detail": str(exc), "agent_profile": get_agent_profile_name()}
 
 
+@app.get("/admin/cache-stats")
+def admin_cache_stats(admin_key: str = Header(None, alias="x-admin-key")):
+    """Métricas de las caches en memoria de este worker."""
+    expected = os.getenv("ADMIN_API_KEY", "ferreinox_admin_2024")
+    if admin_key != expected:
+        raise HTTPException(status_code=403, detail="Admin key inválida")
+    return {
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "embedding_client": query_embedding_client.stats(),
+        "price_book": price_book.stats(),
+        "local_vector_index": local_vector_index.stats(),
+        "expert_knowledge": expert_knowledge_store.stats(),
+        "technical_profiles": technical_profile_store.stats(),
+        "rag_context": rag_context_stats(),
+        "rag_result_cache": rag_result_cache.stats(),
+        "technical_doc_mirror": technical_doc_mirror.stats(),
+    }
+
+
 @app.get("/admin/rag-buscar")
 def admin_rag_buscar(
     q: str = "",
@@ -19841,6 +20328,7 @@ def admin_rag_buscar(
                             portfolio_prods.append(bt)
             if portfolio_prods:
                 extra: list[dict] = []
+                prefetch_query_embeddings([f"{pp}: {query}" for pp in portfolio_prods[:3]])
                 for pp in portfolio_prods[:3]:
                     extra.extend(
                         search_technical_chunks(
@@ -20437,10 +20925,13 @@ async def admin_importar_articulos_maestro(
             try:
                 conn.execute(text("REFRESH MATERIALIZED VIEW mv_productos"))
                 conn.execute(text("REFRESH MATERIALIZED VIEW mv_product_rotation"))
+                bump_refresh_generation(conn, "mv_productos")
+                bump_refresh_generation(conn, ROTATION_SCOPE)
             except Exception:
                 pass  # May not exist yet on first setup
 
         engine.dispose()
+        schedule_product_code_index_refresh(force=True)
         return {
             "exito": True,
             "articulos_importados": total_imported,
@@ -20560,6 +21051,7 @@ async def admin_importar_catalogo_abracol(
             # Refresh search matview to include new Abracol data
             try:
                 conn.execute(text("REFRESH MATERIALIZED VIEW mv_productos"))
+                bump_refresh_generation(conn, "mv_productos")
             except Exception:
                 pass
 
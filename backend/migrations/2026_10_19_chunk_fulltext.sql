@@ -0,0 +1,39 @@
+-- Texto completo sobre agent_technical_doc_chunk (fichas y guías) para la
+-- búsqueda híbrida de rag_search (ANN + ts_rank_cd fusionados por RRF).
+--
+-- chunk_tsv: tsvector generado con la configuración public.rag_es_unaccent
+-- (spanish + unaccent): familia de producto con peso A, texto del chunk con
+-- peso B. Mantener nombres alineados con rag_search.CHUNK_TSVECTOR_COLUMN /
+-- CHUNK_TSVECTOR_CONFIG.
+--
+-- Equivalente a: python backend/ingest_technical_sheets.py --fulltext-index
+-- El ADD COLUMN ... STORED reescribe la tabla (bloqueo exclusivo mientras
+-- dura); el índice GIN se crea con CONCURRENTLY, fuera de una transacción.
+-- Los workers detectan la columna al arrancar: reiniciarlos tras aplicar.
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_ts_config c JOIN pg_namespace n ON n.oid = c.cfgnamespace
+        WHERE n.nspname = 'public' AND c.cfgname = 'rag_es_unaccent'
+    ) THEN
+        CREATE TEXT SEARCH CONFIGURATION public.rag_es_unaccent (COPY = pg_catalog.spanish);
+        ALTER TEXT SEARCH CONFIGURATION public.rag_es_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+    END IF;
+END
+$$;
+
+ALTER TABLE public.agent_technical_doc_chunk
+    ADD COLUMN IF NOT EXISTS chunk_tsv tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('public.rag_es_unaccent'::regconfig, COALESCE(familia_producto, '')), 'A')
+        || setweight(to_tsvector('public.rag_es_unaccent'::regconfig, COALESCE(chunk_text, '')), 'B')
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_technical_chunks_tsv
+    ON public.agent_technical_doc_chunk
+    USING gin (chunk_tsv);
+
+ANALYZE public.agent_technical_doc_chunk;
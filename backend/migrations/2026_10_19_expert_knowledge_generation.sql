@@ -0,0 +1,26 @@
+-- Generación de refresco para agent_expert_knowledge.
+-- Cualquier escritura (registro desde el agente, seeds, backfill de
+-- embeddings o un UPDATE manual tras una auditoría) sube la generación
+-- 'agent_expert_knowledge' y fn_bump_refresh_generation emite el NOTIFY:
+-- cada worker recarga expert_knowledge_store (matriz de embeddings +
+-- índice invertido) en vez de esperar el TTL.
+--
+-- Requiere public.fn_bump_refresh_generation (postgrest_views.sql).
+
+CREATE OR REPLACE FUNCTION public.fn_agent_expert_knowledge_changed()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM public.fn_bump_refresh_generation('agent_expert_knowledge');
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_agent_expert_knowledge_generation ON public.agent_expert_knowledge;
+CREATE TRIGGER trg_agent_expert_knowledge_generation
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.agent_expert_knowledge
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION public.fn_agent_expert_knowledge_changed();
+
+SELECT public.fn_bump_refresh_generation('agent_expert_knowledge');
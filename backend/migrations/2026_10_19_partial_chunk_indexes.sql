@@ -0,0 +1,39 @@
+-- Índices HNSW parciales para búsquedas filtradas en agent_technical_doc_chunk.
+-- El planner los usa cuando el WHERE de rag_search implica el predicado:
+-- guías (tipo_documento = 'guia_solucion') y fichas técnicas de un único
+-- segmento de portafolio. Mantener los predicados idénticos a
+-- rag_search.TECHNICAL_SHEET_TYPES_SQL / GUIDE_TYPE_SQL / PORTFOLIO_SEGMENT_SQL.
+--
+-- Equivalente a: python backend/ingest_technical_sheets.py --partial-indexes
+-- Ejecutar fuera de una transacción (CONCURRENTLY).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_technical_chunks_guias
+    ON public.agent_technical_doc_chunk
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE tipo_documento = 'guia_solucion';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_technical_chunks_fichas_auxiliares_aplicacion
+    ON public.agent_technical_doc_chunk
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE tipo_documento IN ('ficha_tecnica', 'ficha_tecnica_experto')
+      AND COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general') = 'auxiliares_aplicacion';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_technical_chunks_fichas_herrajes_seguridad
+    ON public.agent_technical_doc_chunk
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE tipo_documento IN ('ficha_tecnica', 'ficha_tecnica_experto')
+      AND COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general') = 'herrajes_seguridad';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_technical_chunks_fichas_herramientas_accesorios
+    ON public.agent_technical_doc_chunk
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE tipo_documento IN ('ficha_tecnica', 'ficha_tecnica_experto')
+      AND COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general') = 'herramientas_accesorios';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_technical_chunks_fichas_recubrimientos_pinturas
+    ON public.agent_technical_doc_chunk
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE tipo_documento IN ('ficha_tecnica', 'ficha_tecnica_experto')
+      AND COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general') = 'recubrimientos_pinturas';
+
+ANALYZE public.agent_technical_doc_chunk;
@@ -0,0 +1,22 @@
+-- Nivel vectorial cuantizado opcional para agent_technical_doc_chunk.
+-- Requiere pgvector >= 0.7. Crear SOLO el índice del nivel que se vaya a
+-- activar con RAG_VECTOR_TIER (halfvec | bit). El índice HNSW exacto
+-- (idx_technical_chunks) sigue sirviendo a RAG_VECTOR_TIER=exact; el rerank
+-- no lo usa (lee `embedding` de las filas candidatas).
+--
+-- Equivalente a: python backend/ingest_technical_sheets.py --vector-tier-index halfvec
+-- Ejecutar fuera de una transacción (CONCURRENTLY).
+
+-- halfvec: mitad de memoria, recall casi idéntico.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_technical_chunks_halfvec
+    ON public.agent_technical_doc_chunk
+    USING hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+-- bit: cuantización binaria (hamming), ~32x más pequeño; depende del rerank exacto.
+-- CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_technical_chunks_bit
+--     ON public.agent_technical_doc_chunk
+--     USING hnsw ((binary_quantize(embedding)::bit(1536)) bit_hamming_ops)
+--     WITH (m = 16, ef_construction = 64);
+
+ANALYZE public.agent_technical_doc_chunk;
@@ -483,6 +483,7 @@ def match_sistema_completo(
     recomendacion: dict,
     lookup_fn,
     price_fn=None,
+    prices_fn=None,
 ) -> dict:
     """
     Resuelve TODOS los productos de una recomendación estructurada.
@@ -490,7 +491,11 @@ def match_sistema_completo(
     Args:
         recomendacion: Output de llm_estructurado.extraer_recomendacion_estructurada()
         lookup_fn: Función de búsqueda en inventario
-        price_fn: Función de obtención de precios
+        price_fn: Función de obtención de precios (un código por llamada)
+        prices_fn: Resolución en bloque: recibe la lista de códigos y retorna
+                   {codigo: precio | None}. Si se pasa, los precios de todo el
+                   pedido se piden en una sola llamada después del matching
+                   y `price_fn` no se usa.
 
     Returns:
         {
@@ -502,41 +507,43 @@ def match_sistema_completo(
             "resumen": {"total": N, "exitosos": M, "fallidos": K},
         }
     """
-    productos_resueltos = []
-    productos_fallidos = []
-    herramientas_resueltas = []
-    herramientas_fallidas = []
+    per_item_price_fn = None if prices_fn else price_fn
 
     # ── Match productos del sistema ──
-    for item in recomendacion.get("sistema", []):
-        resultado = match_producto_contra_inventario(
+    resultados_sistema = [
+        match_producto_contra_inventario(
             producto_nombre=item.get("producto", ""),
             presentacion=item.get("presentacion", ""),
             cantidad=int(item.get("cantidad", 1)),
             funcion=item.get("funcion", ""),
             lookup_fn=lookup_fn,
-            price_fn=price_fn,
+            price_fn=per_item_price_fn,
             color=item.get("color", ""),
         )
-        if resultado.exito:
-            productos_resueltos.append(resultado.to_dict())
-        else:
-            productos_fallidos.append(resultado.to_dict())
+        for item in recomendacion.get("sistema", [])
+    ]
 
     # ── Match herramientas ──
-    for item in recomendacion.get("herramientas", []):
-        resultado = match_producto_contra_inventario(
+    resultados_herramientas = [
+        match_producto_contra_inventario(
             producto_nombre=item.get("producto", ""),
             presentacion="unidad",
             cantidad=int(item.get("cantidad", 1)),
             funcion="herramienta",
             lookup_fn=lookup_fn,
-            price_fn=price_fn,
+            price_fn=per_item_price_fn,
         )
-        if resultado.exito:
-            herramientas_resueltas.append(resultado.to_dict())
-        else:
-            herramientas_fallidas.append(resultado.to_dict())
+        for item in recomendacion.get("herramientas", [])
+    ]
+
+    # ── Precios del pedido completo en una sola llamada ──
+    if prices_fn:
+        _aplicar_precios_en_bloque(resultados_sistema + resultados_herramientas, prices_fn)
+
+    productos_resueltos = [r.to_dict() for r in resultados_sistema if r.exito]
+    productos_fallidos = [r.to_dict() for r in resultados_sistema if not r.exito]
+    herramientas_resueltas = [r.to_dict() for r in resultados_herramientas if r.exito]
+    herramientas_fallidas = [r.to_dict() for r in resultados_herramientas if not r.exito]
 
     total = len(productos_resueltos) + len(productos_fallidos)
     exitosos = len(productos_resueltos)
@@ -582,6 +589,24 @@ def match_sistema_completo(
     return resultado_global
 
 
+def _aplicar_precios_en_bloque(resultados: list[ResultadoMatch], prices_fn) -> None:
+    """Pide los precios de todos los códigos resueltos de una vez (misma prioridad que el Paso 5)."""
+    codigos = list(dict.fromkeys(str(r.codigo) for r in resultados if r.exito and r.codigo))
+    if not codigos:
+        return
+    try:
+        precios = prices_fn(codigos) or {}
+    except Exception as e:
+        logger.warning("MATCH: Error obteniendo precios en bloque para %d códigos: %s", len(codigos), e)
+        return
+    for resultado in resultados:
+        price_info = precios.get(str(resultado.codigo)) if resultado.exito else None
+        if price_info and isinstance(price_info, dict):
+            precio = float(price_info.get("precio_mejor", 0) or 0)
+            if precio:
+                resultado.precio_unitario = precio
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # FUNCIONES INTERNAS DE SCORING
 # ══════════════════════════════════════════════════════════════════════════════
@@ -110,6 +110,7 @@ def ejecutar_pipeline_cotizacion(
     lookup_fn: Callable,
     price_fn: Optional[Callable] = None,
     nombre_cliente: str = "",
+    prices_fn: Optional[Callable] = None,
     perfil_tecnico: Optional[dict] = None,
     guias_tecnicas: Optional[list] = None,
 ) -> dict:
@@ -129,6 +130,8 @@ def ejecutar_pipeline_cotizacion(
         conversation_id: ID de conversación para traza
         lookup_fn: Función que busca en inventario (recibe str, retorna list[dict])
         price_fn: Función que obtiene precio por código
+        prices_fn: Resolución de precios en bloque (lista de códigos → {codigo: precio});
+                   tiene prioridad sobre price_fn
         nombre_cliente: Nombre del cliente
         perfil_tecnico: Perfil técnico principal del RAG
         guias_tecnicas: Guías técnicas relacionadas
@@ -215,6 +218,7 @@ def ejecutar_pipeline_cotizacion(
         recomendacion=recomendacion,
         lookup_fn=lookup_fn,
         price_fn=price_fn,
+        prices_fn=prices_fn,
     )
 
     duracion_match = int((time.time() - t0) * 1000)
@@ -363,7 +367,7 @@ def pipeline_cotizacion_desde_agente(
     Wrapper para integrar con el flujo existente de agent_v3.py.
     
     Usa las funciones de lookup y price del main.py existente
-    como lookup_fn y price_fn.
+    como lookup_fn y prices_fn.
     
     Args:
         main_module: Referencia al módulo main.py (para acceder a funciones de inventario)
@@ -412,14 +416,14 @@ def pipeline_cotizacion_desde_agente(
             logger.error("lookup_fn error: %s", e)
             return []
 
-    def price_fn(codigo: str) -> Optional[dict]:
-        """Wrapper para obtener precio."""
+    def prices_fn(codigos: list[str]) -> dict:
+        """Precios de todo el pedido en una sola consulta (PriceBook de main.py)."""
         try:
-            if hasattr(main_module, "fetch_product_price"):
-                return main_module.fetch_product_price(codigo)
+            if hasattr(main_module, "fetch_product_prices"):
+                return main_module.fetch_product_prices(codigos)
         except Exception as e:
-            logger.error("price_fn error: %s", e)
-        return None
+            logger.error("prices_fn error: %s", e)
+        return {}
 
     # ── Ejecutar pipeline ──
     return ejecutar_pipeline_cotizacion(
@@ -430,7 +434,7 @@ def pipeline_cotizacion_desde_agente(
         user_message=user_message,
         conversation_id=conversation_id,
         lookup_fn=lookup_fn,
-        price_fn=price_fn,
+        prices_fn=prices_fn,
         nombre_cliente=nombre_cliente,
         perfil_tecnico=respuesta_rag.get("perfil_tecnico_principal"),
         guias_tecnicas=respuesta_rag.get("guias_tecnicas_relacionadas"),
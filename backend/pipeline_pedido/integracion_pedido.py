@@ -732,6 +732,7 @@ def _ejecutar_pipeline(
 
         lookup_fn = lookup_fn or _resolve("lookup_product_context")
         price_fn = price_fn or _resolve("fetch_product_price")
+        prices_fn = _resolve("fetch_product_prices")
         send_email_fn = _resolve("send_sendgrid_email")
         upload_dropbox_fn = _resolve("upload_bytes_to_dropbox")
 
@@ -745,6 +746,7 @@ def _ejecutar_pipeline(
             except Exception as exc:
                 logger.error("_ejecutar_pipeline: NO se pudo importar main: %s", exc)
     else:
+        prices_fn = getattr(main_module, "fetch_product_prices", None)
         send_email_fn = getattr(main_module, "send_sendgrid_email", None)
         upload_dropbox_fn = getattr(main_module, "upload_bytes_to_dropbox", None)
 
@@ -767,6 +769,7 @@ def _ejecutar_pipeline(
             descuentos=descuentos,
             lookup_fn=lookup_fn,
             price_fn=price_fn,
+            prices_fn=prices_fn,
             send_email_fn=send_email_fn,
             upload_dropbox_fn=upload_dropbox_fn,
             conversation_id=context.get("conversation_id", ""),
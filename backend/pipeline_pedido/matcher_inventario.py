@@ -743,6 +743,7 @@ def match_pedido_completo(
     tienda_codigo: str = "",
     tienda_nombre: str = "",
     descuentos: list[dict] | None = None,
+    prices_fn: Optional[Callable[[list[str]], dict]] = None,
 ) -> ResultadoMatchPedido:
     """
     Resuelve un pedido completo contra inventario.
@@ -766,6 +767,9 @@ def match_pedido_completo(
         tienda_codigo: Código de la tienda de despacho
         tienda_nombre: Nombre de la tienda
         descuentos: Notas de descuento [{marca, porcentaje}]
+        prices_fn: Opcional, precios en bloque: prices_fn(codigos) -> {codigo: dict}.
+            Los precios de las líneas resueltas se piden al final en una sola
+            llamada; sin prices_fn se usa price_fn por código.
 
     Retorna: ResultadoMatchPedido
     """
@@ -832,12 +836,29 @@ def match_pedido_completo(
             price_cache[ref] = normalized_price
         return dict(normalized_price)
 
+    def _prefetch_prices(codigos: list[str]) -> None:
+        refs = list(dict.fromkeys(str(c or "").strip() for c in codigos if str(c or "").strip()))
+        with price_lock:
+            refs = [ref for ref in refs if ref not in price_cache]
+        if not refs or prices_fn is None:
+            return
+        try:
+            bulk = prices_fn(refs) or {}
+        except Exception as exc:
+            logger.error("prices_fn EXCEPCION para %d refs: %s", len(refs), exc)
+            return
+        with price_lock:
+            for ref in refs:
+                price_cache[ref] = dict(bulk.get(ref) or {})
+
     def _resolver_linea(linea_raw: dict) -> dict:
         linea_result = {
             "resueltos": [],
             "pendientes": [],
             "fallidos": [],
             "nombres_resueltos": [],
+            # (LineaResuelta, precio de respaldo): el precio se completa en bloque al final.
+            "precios_pendientes": [],
         }
 
         linea = preprocesar_linea(linea_raw)
@@ -887,13 +908,9 @@ def match_pedido_completo(
                     or best.get("descripcion")
                     or "Pulidora 120025"
                 )
-                precio = 0
-                if codigo:
-                    precio_data = _cached_price(codigo)
-                    precio = float(precio_data.get("precio_mejor", 0) or 0)
                 stock = float(best.get("stock_total", 0) or 0)
 
-                linea_result["resueltos"].append(LineaResuelta(
+                resuelto = LineaResuelta(
                     producto_solicitado=producto,
                     cantidad=cantidad,
                     unidad=unidad or "galon",
@@ -901,13 +918,15 @@ def match_pedido_completo(
                     descripcion_real=descripcion,
                     marca=best.get("marca", ""),
                     presentacion_real=best.get("presentacion_canonica", "") or unidad or "galon",
-                    precio_unitario=precio,
                     stock_disponible=stock,
                     disponible=stock > 0,
                     score_match=1.0,
                     tipo_match="pulidora_default",
                     original_text=texto_original,
-                ))
+                )
+                linea_result["resueltos"].append(resuelto)
+                if codigo:
+                    linea_result["precios_pendientes"].append((resuelto, 0.0))
                 linea_result["nombres_resueltos"].append(descripcion)
             return linea_result
 
@@ -1115,12 +1134,7 @@ def match_pedido_completo(
             or ""
         )
 
-        precio = 0
-        if codigo:
-            precio_data = _cached_price(codigo)
-            precio = float(precio_data.get("precio_mejor", 0) or 0)
-        if not precio:
-            precio = float(best.get("precio_venta", 0) or best.get("pvp_sap", 0) or 0)
+        precio_respaldo = float(best.get("precio_venta", 0) or best.get("pvp_sap", 0) or 0)
 
         stock = float(best.get("stock_total", 0) or 0)
         score = float(best.get("match_score", 0) or best.get("specific_score", 0) or 0.5)
@@ -1146,7 +1160,7 @@ def match_pedido_completo(
             descripcion_real=descripcion,
             marca=marca_real,
             presentacion_real=pres_real,
-            precio_unitario=precio,
+            precio_unitario=precio_respaldo,
             stock_disponible=stock,
             disponible=stock > 0,
             score_match=score,
@@ -1158,6 +1172,8 @@ def match_pedido_completo(
             cat_producto=cat_prod,
         )
         linea_result["resueltos"].append(resuelto)
+        if codigo:
+            linea_result["precios_pendientes"].append((resuelto, precio_respaldo))
         linea_result["nombres_resueltos"].append(descripcion)
         return linea_result
 
@@ -1174,6 +1190,13 @@ def match_pedido_completo(
         resultado.productos_fallidos.extend(batch["fallidos"])
         nombres_resueltos.extend(batch["nombres_resueltos"])
 
+    # ── Paso 2b: Precios de todas las líneas resueltas en un solo lote ──
+    precios_pendientes = [item for batch in resolved_batches for item in batch["precios_pendientes"]]
+    _prefetch_prices([resuelto.codigo_encontrado for resuelto, _ in precios_pendientes])
+    for resuelto, precio_respaldo in precios_pendientes:
+        precio_data = _cached_price(resuelto.codigo_encontrado)
+        resuelto.precio_unitario = float(precio_data.get("precio_mejor", 0) or 0) or precio_respaldo
+
     # ── Paso 3: Detectar bicomponentes faltantes ──
     _inyectar_bicomponentes(resultado, nombres_resueltos, _cached_lookup, _cached_price)
 
@@ -186,6 +186,7 @@ def ejecutar_pipeline_pedido(
     conversation_id: str = "",
     pedido_id: int | str = 0,
     dropbox_folder: str = "/data/pedidos",
+    prices_fn: Callable | None = None,
 ) -> dict:
     """
     Ejecuta el pipeline completo de pedido directo.
@@ -203,6 +204,7 @@ def ejecutar_pipeline_pedido(
         conversation_id: ID de conversación WhatsApp
         pedido_id: ID del pedido
         dropbox_folder: Carpeta Dropbox destino
+        prices_fn: Función de precios en bloque (codigos -> {codigo: dict}), opcional
 
     Retorna: dict con:
         exito: bool
@@ -261,6 +263,7 @@ def ejecutar_pipeline_pedido(
         tienda_codigo=tienda_codigo,
         tienda_nombre=tienda_nombre,
         descuentos=descuentos,
+        prices_fn=prices_fn,
     )
 
     # ── 3. Validar ──
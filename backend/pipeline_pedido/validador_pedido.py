@@ -12,7 +12,6 @@ Gates:
 """
 from __future__ import annotations
 
-import json
 import logging
 import os
 import re
@@ -23,7 +22,12 @@ from typing import Optional
 
 from .matcher_inventario import ResultadoMatchPedido
 
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
+
+try:
+    from technical_profile_store import technical_profile_store
+except ImportError:
+    from backend.technical_profile_store import technical_profile_store
 
 logger = logging.getLogger("pipeline_pedido.validador")
 
@@ -84,57 +88,42 @@ def _get_database_url() -> str | None:
 
 
 @lru_cache(maxsize=1)
-def _load_structured_product_profiles() -> list[dict]:
+def _standalone_engine():
     database_url = _get_database_url()
     if not database_url:
-        return []
-    try:
-        engine = create_engine(database_url)
-        with engine.connect() as conn:
-            rows = conn.execute(text("""
-                SELECT canonical_family, profile_json
-                FROM public.agent_technical_profile
-                WHERE extraction_status = 'ready'
-            """)).mappings().all()
-        profiles = []
-        for row in rows:
-            profile_json = row.get("profile_json")
-            if isinstance(profile_json, str):
-                try:
-                    profile_json = json.loads(profile_json)
-                except Exception:
-                    profile_json = {}
-            profiles.append({
-                "canonical_family": row.get("canonical_family") or "",
-                "profile_json": profile_json or {},
-            })
-        return profiles
-    except Exception:
-        return []
+        raise RuntimeError("Sin DATABASE_URL para perfiles técnicos")
+    return create_engine(database_url)
+
+
+def _profile_store():
+    # Dentro del backend rag_search ya enlazó el engine compartido; en scripts
+    # sueltos del pipeline se usa un engine propio desde DATABASE_URL.
+    if not technical_profile_store.is_bound():
+        technical_profile_store.bind_engine(_standalone_engine)
+    return technical_profile_store
+
+
+def _load_structured_product_profiles() -> list[dict]:
+    return [
+        {
+            "canonical_family": profile.get("canonical_family") or "",
+            "profile_json": profile.get("profile_json") or {},
+        }
+        for profile in _profile_store().all_profiles()
+    ]
 
 
 def _resolve_structured_product_metadata(product_text: str) -> dict:
-    normalized_product = (product_text or "").lower()
-    if not normalized_product:
+    match = _profile_store().match_product_text(product_text)
+    if not match:
         return {}
-
-    for entry in _load_structured_product_profiles():
-        profile_json = entry.get("profile_json") or {}
-        identity = profile_json.get("product_identity") or {}
-        aliases = identity.get("aliases") or []
-        candidates = [
-            entry.get("canonical_family") or "",
-            identity.get("display_name") or "",
-            *aliases,
-        ]
-        if any(candidate and candidate.lower() in normalized_product for candidate in candidates):
-            return {
-                "chemical_family": profile_json.get("chemical_family"),
-                "requires_component_b": bool(profile_json.get("requires_component_b")),
-                "component_b_name": profile_json.get("component_b_name"),
-                "incompatible_previous_families": profile_json.get("incompatible_previous_families") or [],
-            }
-    return {}
+    profile_json = match.get("profile_json") or {}
+    return {
+        "chemical_family": profile_json.get("chemical_family"),
+        "requires_component_b": bool(profile_json.get("requires_component_b")),
+        "component_b_name": profile_json.get("component_b_name"),
+        "incompatible_previous_families": profile_json.get("incompatible_previous_families") or [],
+    }
 
 
 def resolver_tienda(texto: str) -> tuple[str, str]:
@@ -124,6 +124,35 @@ EXCEPTION
 END;
 $$;
 
+-- Generaciones de refresco: cada scope (MV o tabla derivada) lleva un contador
+-- que las caches en memoria del backend comparan para recargar sólo si cambió.
+CREATE TABLE IF NOT EXISTS public.agent_refresh_generation (
+    scope text PRIMARY KEY,
+    generation bigint NOT NULL DEFAULT 0,
+    refreshed_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION public.fn_bump_refresh_generation(p_scope text)
+RETURNS bigint
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_generation bigint;
+BEGIN
+    INSERT INTO public.agent_refresh_generation (scope, generation, refreshed_at)
+    VALUES (p_scope, 1, now())
+    ON CONFLICT (scope) DO UPDATE
+        SET generation = public.agent_refresh_generation.generation + 1,
+            refreshed_at = now()
+    RETURNING generation INTO new_generation;
+    PERFORM pg_notify(
+        'agent_refresh_generation',
+        json_build_object('scope', p_scope, 'generation', new_generation)::text
+    );
+    RETURN new_generation;
+END;
+$$;
+
 CREATE OR REPLACE FUNCTION public.fn_map_zona_from_serie(serie_value text)
 RETURNS text
 LANGUAGE sql
@@ -904,14 +933,69 @@ WHERE NULLIF(TRIM(nombre_articulo), '') IS NOT NULL
 GROUP BY public.fn_normalize_text(nombre_articulo)
 HAVING MAX(fecha_venta::date) >= CURRENT_DATE - INTERVAL '1 year';
 
--- Vista filtrada: mismas columnas que vw_inventario_agente, solo refs activas
-CREATE OR REPLACE VIEW public.vw_inventario_agente_activo AS
-SELECT inv.*
+-- Inventario activo materializado: mismas columnas que vw_inventario_agente
+-- (ya normalizadas) + ultima_venta por referencia, solo refs activas.
+-- Se reconstruye en cada sync; las búsquedas por tienda leen filas ya
+-- filtradas sin recalcular fn_normalize_text ni agregar raw_ventas_detalle.
+DROP TABLE IF EXISTS public.inventario_agente_activo CASCADE;
+CREATE TABLE public.inventario_agente_activo AS
+WITH recent_sales AS (
+    SELECT
+        am.referencia_normalizada,
+        MAX(public.fn_parse_date(rv.fecha_venta)) AS last_sale_date
+    FROM public.raw_ventas_detalle rv
+    JOIN public.articulos_maestro am ON am.codigo_articulo = rv.codigo_articulo
+    WHERE LOWER(COALESCE(rv.tipo_documento, '')) LIKE '%factura%'
+    GROUP BY am.referencia_normalizada
+)
+SELECT inv.*, rs.last_sale_date AS ultima_venta
 FROM public.vw_inventario_agente inv
-WHERE EXISTS (
-    SELECT 1
-    FROM public.inventario_refs_activas act
-    WHERE act.descripcion_normalizada = inv.descripcion_normalizada
-);
+JOIN public.inventario_refs_activas act
+  ON act.descripcion_normalizada = inv.descripcion_normalizada
+LEFT JOIN recent_sales rs
+  ON rs.referencia_normalizada = inv.referencia_normalizada;
+
+CREATE INDEX IF NOT EXISTS idx_inv_activo_almacen ON public.inventario_agente_activo (cod_almacen);
+CREATE INDEX IF NOT EXISTS idx_inv_activo_referencia ON public.inventario_agente_activo (referencia_normalizada);
+CREATE INDEX IF NOT EXISTS idx_inv_activo_search_blob_trgm ON public.inventario_agente_activo USING GIN (search_blob gin_trgm_ops);
+ANALYZE public.inventario_agente_activo;
+
+-- Compatibilidad: consumidores externos que aún lean la vista.
+CREATE OR REPLACE VIEW public.vw_inventario_agente_activo AS
+SELECT * FROM public.inventario_agente_activo;
+
+-- ═══════════════════════════════════════════════════════════════
+-- NOMBRES HISTÓRICOS: una fila por referencia vendida alguna vez
+-- Último recurso de lookup_product_context cuando el producto no está en
+-- inventario; reemplaza el escaneo de vw_ventas_netas por término.
+-- ═══════════════════════════════════════════════════════════════
+DROP TABLE IF EXISTS public.historical_product_names;
+CREATE TABLE public.historical_product_names AS
+SELECT
+    codigo_articulo,
+    MAX(nombre_articulo) AS nombre_articulo,
+    MAX(marca_producto) AS marca_producto,
+    MAX(categoria_producto) AS categoria_producto,
+    translate(lower(
+        COALESCE(MAX(nombre_articulo), '') || ' ' ||
+        codigo_articulo || ' ' ||
+        COALESCE(MAX(marca_producto), '') || ' ' ||
+        COALESCE(MAX(categoria_producto), '')
+    ), 'áéíóúàèìòùâêîôûäëïöüñ', 'aeiouaeiouaeiouaeioun') AS search_blob,
+    SUM(unidades_vendidas_netas) AS unidades_vendidas,
+    SUM(valor_venta_neto) AS valor_vendido,
+    MAX(fecha_venta) AS ultima_venta,
+    COUNT(*) AS total_ventas
+FROM public.vw_ventas_netas
+WHERE codigo_articulo IS NOT NULL
+GROUP BY codigo_articulo;
+
+ALTER TABLE public.historical_product_names ADD PRIMARY KEY (codigo_articulo);
+CREATE INDEX IF NOT EXISTS idx_historical_product_names_blob_trgm ON public.historical_product_names USING GIN (search_blob gin_trgm_ops);
+ANALYZE public.historical_product_names;
+
+-- Las MVs de búsqueda se recrearon arriba: avisar a las caches del backend.
+SELECT public.fn_bump_refresh_generation('mv_productos');
+SELECT public.fn_bump_refresh_generation('mv_product_rotation');
 
 COMMIT;
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""Libro de precios en memoria sobre `agent_precios`.
+
+Antes cada precio se consultaba por separado (`fetch_product_price`): una
+búsqueda de inventario con 10 filas, un pedido de 15 líneas o un PDF de
+cotización lanzaban una consulta por referencia.
+
+Ahora:
+
+  * `get_many(refs)` resuelve todas las referencias que no están en cache
+    con un solo loader en bloque (`WHERE referencia = ANY(:refs)`).
+  * Cache con TTL por `(lista_precio, referencia)`; también se cachean las
+    referencias sin precio para no volver a consultarlas en cada turno.
+  * La clave incluye la lista de precios del cliente para que listas
+    distintas nunca compartan entradas; hoy `agent_precios` sólo tiene la
+    lista general (`DEFAULT_PRICE_LIST`).
+  * Tamaño acotado (LRU) y thread-safe; el loader corre fuera del lock.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger("ferreinox_agent.price_book")
+
+DEFAULT_PRICE_LIST = "general"
+PRICE_SCOPE = "agent_precios"
+
+# loader(referencias, lista_precio) -> {referencia: fila de precio}
+PriceLoader = Callable[[list[str], str], dict]
+
+
+def normalize_reference(reference: Optional[object]) -> str:
+    return str(reference or "").strip()
+
+
+class PriceBook:
+    def __init__(self, loader: Optional[PriceLoader] = None, ttl_seconds: float = 300.0, max_entries: int = 20000):
+        self._loader = loader
+        self._ttl_seconds = float(ttl_seconds)
+        self._max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[tuple[str, str], tuple[float, Optional[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def bind_loader(self, loader: PriceLoader) -> None:
+        self._loader = loader
+
+    # ── Consulta ────────────────────────────────────────────────────────
+    def get_many(self, references: Iterable[Optional[object]], price_list: str = DEFAULT_PRICE_LIST) -> dict[str, Optional[dict]]:
+        """Precio por referencia (None si no tiene); una sola carga para todos los faltantes."""
+        requested = list(dict.fromkeys(ref for ref in (normalize_reference(item) for item in references or []) if ref))
+        if not requested:
+            return {}
+        result: dict[str, Optional[dict]] = {}
+        missing: list[str] = []
+        now = time.time()
+        with self._lock:
+            for ref in requested:
+                cached = self._entries.get((price_list, ref))
+                if cached is not None and now - cached[0] < self._ttl_seconds:
+                    self._entries.move_to_end((price_list, ref))
+                    result[ref] = dict(cached[1]) if cached[1] is not None else None
+                else:
+                    missing.append(ref)
+            self._hits += len(requested) - len(missing)
+            self._misses += len(missing)
+
+        if missing:
+            loaded = self._load(missing, price_list)
+            if loaded is not None:
+                self._store(price_list, missing, loaded)
+                for ref in missing:
+                    row = loaded.get(ref)
+                    result[ref] = dict(row) if row is not None else None
+            else:
+                # Error de BD: no cachear, responder sin precio.
+                for ref in missing:
+                    result[ref] = None
+        return {ref: result.get(ref) for ref in requested}
+
+    def get(self, reference: Optional[object], price_list: str = DEFAULT_PRICE_LIST) -> Optional[dict]:
+        ref = normalize_reference(reference)
+        if not ref:
+            return None
+        return self.get_many([ref], price_list=price_list).get(ref)
+
+    def _load(self, references: list[str], price_list: str) -> Optional[dict]:
+        if self._loader is None:
+            return None
+        try:
+            rows = self._loader(references, price_list) or {}
+        except Exception as exc:
+            logger.warning("PriceBook: carga de %d referencias falló: %s", len(references), exc)
+            return None
+        return {normalize_reference(ref): row for ref, row in rows.items()}
+
+    def _store(self, price_list: str, references: list[str], loaded: dict) -> None:
+        now = time.time()
+        with self._lock:
+            for ref in references:
+                row = loaded.get(ref)
+                key = (price_list, ref)
+                self._entries[key] = (now, dict(row) if row is not None else None)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    # ── Estado ──────────────────────────────────────────────────────────
+    def invalidate(self, references: Optional[Iterable[object]] = None) -> None:
+        """Sin argumentos vacía todo; con referencias las descarta en todas las listas."""
+        with self._lock:
+            if references is None:
+                self._entries.clear()
+                return
+            targets = {normalize_reference(ref) for ref in references}
+            for key in [key for key in self._entries if key[1] in targets]:
+                del self._entries[key]
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+# Singleton compartido por el proceso; main.py enlaza el loader de BD.
+price_book = PriceBook()
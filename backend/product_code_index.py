@@ -0,0 +1,204 @@
+"""Índice en memoria para códigos de producto casi correctos (SymSpell).
+
+Cuando el cliente escribe un código con un dígito de más, de menos o con
+dos dígitos invertidos ("17174" en vez de "117474"), `lookup_product_context`
+necesita encontrar los códigos reales del catálogo a distancia 1–2 sin
+lanzar una consulta por cada variante.
+
+Diseño:
+
+  * Diccionario de *deletes* estilo SymSpell sobre todos los
+    `producto_codigo` / `referencia` de `mv_productos` (normalizados a
+    mayúsculas alfanuméricas, igual que `fn_keep_alnum`).
+  * Para acotar memoria, los deletes se generan sobre un prefijo de
+    `prefix_length` caracteres (misma técnica que SymSpell).
+  * Los candidatos se verifican con distancia Damerau-Levenshtein (OSA),
+    así las transposiciones cuentan como 1 edición.
+  * Thread-safe: el índice se construye fuera del lock y se reemplaza
+    atómicamente; las lecturas nunca ven un índice a medio construir.
+  * Sin dependencias externas.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+import time
+import unicodedata
+from typing import Iterable, Optional
+
+logger = logging.getLogger("ferreinox_agent.product_code_index")
+
+_NON_ALNUM_RE = re.compile(r"[^A-Z0-9]")
+
+
+def normalize_code(value: Optional[str]) -> str:
+    """Normaliza un código igual que `public.fn_keep_alnum` en Postgres."""
+    if not value:
+        return ""
+    text_value = unicodedata.normalize("NFD", str(value).strip().upper())
+    text_value = "".join(ch for ch in text_value if unicodedata.category(ch) != "Mn")
+    return _NON_ALNUM_RE.sub("", text_value)
+
+
+def _deletes(word: str, max_distance: int) -> set[str]:
+    """Todas las cadenas obtenibles borrando hasta `max_distance` caracteres."""
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for item in frontier:
+            if len(item) <= 1:
+                continue
+            for pos in range(len(item)):
+                candidate = item[:pos] + item[pos + 1:]
+                if candidate not in results:
+                    next_frontier.add(candidate)
+        results.update(next_frontier)
+        frontier = next_frontier
+    return results
+
+
+def damerau_levenshtein(left: str, right: str, max_distance: int) -> int:
+    """Distancia OSA con corte temprano; devuelve `max_distance + 1` si se excede."""
+    if left == right:
+        return 0
+    if abs(len(left) - len(right)) > max_distance:
+        return max_distance + 1
+    previous_previous: list[int] = []
+    previous = list(range(len(right) + 1))
+    for i in range(1, len(left) + 1):
+        current = [i] + [0] * len(right)
+        row_min = current[0]
+        for j in range(1, len(right) + 1):
+            cost = 0 if left[i - 1] == right[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and left[i - 1] == right[j - 2] and left[i - 2] == right[j - 1]:
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class ProductCodeIndex:
+    """Diccionario de deletes SymSpell sobre los códigos del catálogo."""
+
+    def __init__(self, max_distance: int = 2, prefix_length: int = 7, min_code_length: int = 4):
+        self._max_distance = max(1, int(max_distance))
+        self._prefix_length = max(self._max_distance + 1, int(prefix_length))
+        self._min_code_length = max(1, int(min_code_length))
+        self._codes: tuple[str, ...] = ()
+        self._code_set: frozenset[str] = frozenset()
+        self._deletes_map: dict[str, object] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    # ── Construcción ────────────────────────────────────────────────────
+    def build(self, codes: Iterable[Optional[str]]) -> int:
+        """Reconstruye el índice con `codes` y lo publica atómicamente."""
+        normalized = sorted({c for c in (normalize_code(code) for code in codes) if len(c) >= self._min_code_length})
+        deletes_map: dict[str, object] = {}
+        for code_id, code in enumerate(normalized):
+            for key in _deletes(code[: self._prefix_length], self._max_distance):
+                bucket = deletes_map.get(key)
+                # La mayoría de keys apuntan a un solo código: guardar el int
+                # directo y promover a lista sólo cuando hay colisión.
+                if bucket is None:
+                    deletes_map[key] = code_id
+                elif isinstance(bucket, list):
+                    bucket.append(code_id)
+                else:
+                    deletes_map[key] = [bucket, code_id]
+        with self._lock:
+            self._codes = tuple(normalized)
+            self._code_set = frozenset(normalized)
+            self._deletes_map = deletes_map
+            self._loaded_at = time.time()
+        logger.info("ProductCodeIndex: %d códigos, %d deletes", len(normalized), len(deletes_map))
+        return len(normalized)
+
+    # ── Consulta ────────────────────────────────────────────────────────
+    def lookup(self, code: Optional[str], max_distance: Optional[int] = None) -> list[tuple[str, int]]:
+        """Códigos del catálogo a distancia <= `max_distance`, ordenados por (distancia, código)."""
+        query = normalize_code(code)
+        if len(query) < self._min_code_length:
+            return []
+        limit = self._max_distance if max_distance is None else max(0, min(int(max_distance), self._max_distance))
+        with self._lock:
+            codes = self._codes
+            code_set = self._code_set
+            deletes_map = self._deletes_map
+        if not codes:
+            return []
+
+        matches: dict[str, int] = {}
+        if query in code_set:
+            matches[query] = 0
+        if limit > 0:
+            candidate_ids: set[int] = set()
+            for key in _deletes(query[: self._prefix_length], limit):
+                bucket = deletes_map.get(key)
+                if bucket is None:
+                    continue
+                if isinstance(bucket, list):
+                    candidate_ids.update(bucket)
+                else:
+                    candidate_ids.add(bucket)
+            for code_id in candidate_ids:
+                candidate = codes[code_id]
+                if candidate in matches:
+                    continue
+                distance = damerau_levenshtein(query, candidate, limit)
+                if distance <= limit:
+                    matches[candidate] = distance
+        return sorted(matches.items(), key=lambda item: (item[1], item[0]))
+
+    def lookup_many(self, codes: Iterable[Optional[str]], max_distance: Optional[int] = None, limit: int = 25) -> list[tuple[str, int]]:
+        """Une `lookup` para varios códigos conservando la menor distancia por candidato."""
+        best: dict[str, int] = {}
+        for code in codes:
+            for candidate, distance in self.lookup(code, max_distance=max_distance):
+                if candidate not in best or distance < best[candidate]:
+                    best[candidate] = distance
+        return sorted(best.items(), key=lambda item: (item[1], item[0]))[: max(0, int(limit))]
+
+    # ── Estado / refresco ───────────────────────────────────────────────
+    def is_loaded(self) -> bool:
+        with self._lock:
+            return bool(self._codes)
+
+    def age_seconds(self) -> float:
+        with self._lock:
+            return time.time() - self._loaded_at if self._loaded_at else float("inf")
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._codes)
+
+    def try_begin_refresh(self) -> bool:
+        """Marca un refresco en curso; False si otro hilo ya lo está haciendo."""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            return True
+
+    def end_refresh(self) -> None:
+        with self._lock:
+            self._refreshing = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._codes = ()
+            self._code_set = frozenset()
+            self._deletes_map = {}
+            self._loaded_at = 0.0
+
+
+# Singleton compartido por el proceso (un worker uvicorn = un índice).
+product_code_index = ProductCodeIndex()
@@ -0,0 +1,230 @@
+"""Espejo en memoria de `agent_product_learning`.
+
+`fetch_learned_product_references` corre antes de cualquier búsqueda de
+catálogo, así que cada consulta a la tabla de aprendizajes se paga en
+todos los turnos de producto. La tabla es pequeña y casi sólo crece, por lo
+que se mantiene completa en memoria:
+
+  * Hash map `normalized_phrase -> {canonical_reference: entrada}` para el
+    match exacto (mismo resultado que el `WHERE normalized_phrase = ...`).
+  * Trie de tokens para matches parciales: una frase aprendida de varios
+    tokens coincide si cada uno de sus tokens es prefijo de algún token de
+    la consulta ("koraza blanca" dentro de "koraza blanca galon").
+  * `upsert` aplica en sitio la fila autoritativa que devuelve el
+    `INSERT ... RETURNING`; es idempotente, así que el eco del NOTIFY en el
+    mismo worker no duplica contadores.
+  * Thread-safe: escrituras puntuales bajo lock; recarga completa construye
+    estructuras nuevas y las publica de una vez.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger("ferreinox_agent.product_learning_index")
+
+LEARNING_FIELDS = (
+    "normalized_phrase",
+    "canonical_reference",
+    "canonical_description",
+    "canonical_brand",
+    "canonical_presentation",
+    "source_conversation_id",
+    "confidence",
+    "usage_count",
+)
+
+_MIN_PARTIAL_TOKEN_LENGTH = 3
+
+
+def _coerce_entry(row: Any) -> Optional[dict]:
+    data = dict(row or {})
+    phrase = str(data.get("normalized_phrase") or "").strip()
+    reference = str(data.get("canonical_reference") or "").strip()
+    if not phrase or not reference:
+        return None
+    entry = {field: data.get(field) for field in LEARNING_FIELDS}
+    entry["normalized_phrase"] = phrase
+    entry["canonical_reference"] = reference
+    entry["confidence"] = float(entry.get("confidence") or 0.0)
+    entry["usage_count"] = int(entry.get("usage_count") or 0)
+    return entry
+
+
+class _TokenTrie:
+    """Trie de caracteres sobre tokens; cada nodo terminal guarda el token completo."""
+
+    _END = "\0"
+
+    def __init__(self):
+        self._root: dict = {}
+
+    def add(self, token: str) -> None:
+        node = self._root
+        for char in token:
+            node = node.setdefault(char, {})
+        node[self._END] = token
+
+    def prefixes_of(self, word: str) -> list[str]:
+        """Tokens almacenados que son prefijo de `word` (incluido `word`)."""
+        found = []
+        node = self._root
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                break
+            token = node.get(self._END)
+            if token is not None:
+                found.append(token)
+        return found
+
+
+class ProductLearningIndex:
+    def __init__(self):
+        self._by_phrase: dict[str, dict[str, dict]] = {}
+        self._phrases_by_token: dict[str, set[str]] = {}
+        self._trie = _TokenTrie()
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    # ── Construcción ────────────────────────────────────────────────────
+    def build(self, rows: Iterable[Any]) -> int:
+        by_phrase: dict[str, dict[str, dict]] = {}
+        phrases_by_token: dict[str, set[str]] = {}
+        trie = _TokenTrie()
+        total = 0
+        for row in rows:
+            entry = _coerce_entry(row)
+            if entry is None:
+                continue
+            phrase = entry["normalized_phrase"]
+            if phrase not in by_phrase:
+                self._index_phrase_tokens(phrase, phrases_by_token, trie)
+            by_phrase.setdefault(phrase, {})[entry["canonical_reference"]] = entry
+            total += 1
+        with self._lock:
+            self._by_phrase = by_phrase
+            self._phrases_by_token = phrases_by_token
+            self._trie = trie
+            self._loaded_at = time.time()
+        logger.info("ProductLearningIndex: %d aprendizajes, %d frases", total, len(by_phrase))
+        return total
+
+    @staticmethod
+    def _index_phrase_tokens(phrase: str, phrases_by_token: dict[str, set[str]], trie: _TokenTrie) -> None:
+        for token in phrase.split():
+            if len(token) < _MIN_PARTIAL_TOKEN_LENGTH:
+                continue
+            if token not in phrases_by_token:
+                trie.add(token)
+            phrases_by_token.setdefault(token, set()).add(phrase)
+
+    def upsert(self, row: Any) -> bool:
+        """Reemplaza (o crea) la entrada `(normalized_phrase, canonical_reference)`."""
+        entry = _coerce_entry(row)
+        if entry is None:
+            return False
+        with self._lock:
+            phrase = entry["normalized_phrase"]
+            if phrase not in self._by_phrase:
+                self._index_phrase_tokens(phrase, self._phrases_by_token, self._trie)
+            self._by_phrase.setdefault(phrase, {})[entry["canonical_reference"]] = entry
+        return True
+
+    def merge(self, row: Any, overwrite_description: bool = False) -> bool:
+        """Aplica localmente la semántica del `ON CONFLICT DO UPDATE` antes de que la BD confirme."""
+        entry = _coerce_entry(row)
+        if entry is None:
+            return False
+        with self._lock:
+            current = (self._by_phrase.get(entry["normalized_phrase"]) or {}).get(entry["canonical_reference"])
+        if current is not None:
+            merged = dict(current)
+            for field in ("canonical_description", "canonical_brand", "canonical_presentation", "source_conversation_id"):
+                overwrite = overwrite_description and field == "canonical_description"
+                if entry.get(field) is not None and (overwrite or merged.get(field) is None):
+                    merged[field] = entry[field]
+            merged["confidence"] = max(current["confidence"], entry["confidence"])
+            merged["usage_count"] = current["usage_count"] + 1
+            entry = merged
+        else:
+            entry["usage_count"] = max(1, entry["usage_count"])
+        return self.upsert(entry)
+
+    # ── Consulta ────────────────────────────────────────────────────────
+    def lookup(self, phrase: Optional[str], limit: int = 5) -> list[dict]:
+        """Equivalente en memoria al SELECT exacto por `normalized_phrase`."""
+        with self._lock:
+            entries = list((self._by_phrase.get(phrase or "") or {}).values())
+        entries.sort(key=lambda item: (item["confidence"], item["usage_count"]), reverse=True)
+        return [self._as_result(entry) for entry in entries[:limit]]
+
+    def lookup_partial(self, phrase: Optional[str], limit: int = 5) -> list[dict]:
+        """Frases aprendidas (>= 2 tokens) cuyos tokens son todos prefijo de tokens de `phrase`."""
+        query_tokens = [token for token in (phrase or "").split() if len(token) >= _MIN_PARTIAL_TOKEN_LENGTH]
+        if not query_tokens:
+            return []
+        with self._lock:
+            matched_tokens: set[str] = set()
+            for token in query_tokens:
+                matched_tokens.update(self._trie.prefixes_of(token))
+            candidate_phrases: set[str] = set()
+            for token in matched_tokens:
+                candidate_phrases.update(self._phrases_by_token.get(token, ()))
+            entries = []
+            for candidate in candidate_phrases:
+                if candidate == phrase:
+                    continue
+                candidate_tokens = [token for token in candidate.split() if len(token) >= _MIN_PARTIAL_TOKEN_LENGTH]
+                if len(candidate_tokens) < 2 or not all(token in matched_tokens for token in candidate_tokens):
+                    continue
+                entries.extend(self._by_phrase.get(candidate, {}).values())
+        entries.sort(key=lambda item: (len(item["normalized_phrase"]), item["confidence"], item["usage_count"]), reverse=True)
+        return [self._as_result(entry) for entry in entries[:limit]]
+
+    def count_for_conversation(self, conversation_id: Optional[int]) -> int:
+        if conversation_id is None:
+            return 0
+        with self._lock:
+            return sum(
+                1
+                for entries in self._by_phrase.values()
+                for entry in entries.values()
+                if entry.get("source_conversation_id") == conversation_id
+            )
+
+    @staticmethod
+    def _as_result(entry: dict) -> dict:
+        return {
+            "canonical_reference": entry["canonical_reference"],
+            "canonical_description": entry.get("canonical_description"),
+            "canonical_brand": entry.get("canonical_brand"),
+            "canonical_presentation": entry.get("canonical_presentation"),
+            "confidence": entry["confidence"],
+            "total_hits": entry["usage_count"],
+        }
+
+    # ── Estado ──────────────────────────────────────────────────────────
+    def is_loaded(self) -> bool:
+        with self._lock:
+            return self._loaded_at > 0
+
+    def age_seconds(self) -> float:
+        with self._lock:
+            return time.time() - self._loaded_at if self._loaded_at else float("inf")
+
+    def invalidate(self) -> None:
+        """Marca el índice como no cargado; la próxima consulta cae a BD y recarga."""
+        with self._lock:
+            self._loaded_at = 0.0
+
+    def size(self) -> int:
+        with self._lock:
+            return sum(len(entries) for entries in self._by_phrase.values())
+
+
+# Singleton compartido por el proceso.
+product_learning_index = ProductLearningIndex()
@@ -0,0 +1,328 @@
+"""Empaquetado del contexto RAG que va al LLM, con presupuesto de tokens.
+
+`build_rag_context` concatenaba los chunks tal cual: trozos solapados del
+mismo PDF, secciones casi idénticas de fichas duplicadas y guías que
+repiten la ficha inflaban el prompt de cada turno técnico.
+
+`pack_rag_context`:
+
+  1. Mismos filtros que antes: similitud < 0.25, FDS/HDS y una sola
+     entrada por (familia canónica, sección).
+  2. Descarta pasajes casi duplicados: Jaccard / contención sobre shingles
+     de 5 palabras (RAG_CONTEXT_DEDUP_THRESHOLD). Con decenas de pasajes
+     por turno la comparación exacta de conjuntos basta; no hace falta
+     MinHash.
+  3. Une chunks consecutivos (chunk_index ±1) del mismo documento en un
+     solo pasaje: un encabezado `[Fuente]`, sin repetir `[PRODUCTO]` ni el
+     texto solapado entre ambos.
+  4. Si el llamador pasa `token_budget` (opt-in; p. ej.
+     `default_token_budget()` = RAG_CONTEXT_TOKEN_BUDGET), empaca por
+     relevancia hasta ese presupuesto. Sin él no se descarta nada por
+     tamaño. Tokens con tiktoken si está instalado; si no, una estimación
+     local por palabras.
+
+Cada empaquetado reporta por separado lo ahorrado por deduplicación/unión
+(`tokens_saved`) y lo recortado por presupuesto (`tokens_truncated`);
+`rag_context_stats()` acumula ambos para `/admin/cache-stats`.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+try:
+    import tiktoken
+
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # dependencia opcional (o sin red para bajar el BPE)
+    _ENCODING = None
+
+_PASSAGE_SEPARATOR = "\n\n---\n\n"
+_SHINGLE_SIZE = 5
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SECTION_RE = re.compile(r"\[SECCIÓN:\s*([^\]]+)\]")
+_PRODUCT_HEADER_RE = re.compile(r"^\[PRODUCTO:[^\n]*\n?")
+_MIN_OVERLAP_WORDS = 8
+
+_stats_lock = threading.Lock()
+_stats = {"packs": 0, "raw_tokens": 0, "deduplicated_tokens": 0, "packed_tokens": 0, "duplicates_dropped": 0,
+          "chunks_merged": 0, "over_budget_dropped": 0}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except ValueError:
+        return default
+
+
+def default_token_budget() -> int:
+    return _env_int("RAG_CONTEXT_TOKEN_BUDGET", 1600)
+
+
+def guide_token_budget() -> int:
+    return _env_int("RAG_GUIDE_CONTEXT_TOKEN_BUDGET", 800)
+
+
+def _dedup_threshold() -> float:
+    try:
+        return float(os.getenv("RAG_CONTEXT_DEDUP_THRESHOLD", "0.8") or 0.8)
+    except ValueError:
+        return 0.8
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    # Estimación: ~4 caracteres por token en palabras, 1 por signo.
+    return sum(math.ceil(len(piece) / 4) if piece[0].isalnum() else 1 for piece in _PIECE_RE.findall(text))
+
+
+def shingles(text: str, size: int = _SHINGLE_SIZE) -> frozenset[int]:
+    words = _WORD_RE.findall((text or "").lower())
+    if len(words) < size:
+        return frozenset([hash(" ".join(words))]) if words else frozenset()
+    return frozenset(hash(" ".join(words[i:i + size])) for i in range(len(words) - size + 1))
+
+
+def is_near_duplicate(candidate: frozenset[int], existing: frozenset[int], threshold: float) -> bool:
+    """Jaccard alto o un pasaje casi contenido en el otro (chunk solapado dentro de uno mayor)."""
+    if not candidate or not existing:
+        return False
+    overlap = len(candidate & existing)
+    if not overlap:
+        return False
+    jaccard = overlap / len(candidate | existing)
+    containment = overlap / min(len(candidate), len(existing))
+    return jaccard >= threshold or containment >= threshold
+
+
+def _strip_overlap(previous: str, following: str) -> str:
+    """Quita de `following` el prefijo que repite el final de `previous` (solape de la ingesta).
+
+    Conserva la línea `[SECCIÓN: ...]` inicial de `following` salvo que sea
+    la misma sección de `previous`.
+    """
+    header = ""
+    body = following
+    header_match = re.match(r"\[SECCIÓN:[^\]]*\]\s*", following)
+    if header_match:
+        header, body = header_match.group(0), following[header_match.end():]
+        previous_section = _SECTION_RE.search(previous)
+        if previous_section and previous_section.group(0) == header.strip():
+            header = ""
+    previous_words = previous.split()
+    body_words = list(re.finditer(r"\S+", body))
+    limit = min(len(previous_words), len(body_words), 120)
+    for size in range(limit, _MIN_OVERLAP_WORDS - 1, -1):
+        if previous_words[-size:] == [match.group(0) for match in body_words[:size]]:
+            body = body[body_words[size - 1].end():].lstrip()
+            break
+    return f"{header}{body}".strip()
+
+
+@dataclass
+class _Passage:
+    filename: str
+    similarity: float
+    chunk_indexes: list[int]
+    texts: list[str]
+    shingle_set: frozenset[int] = frozenset()
+
+    def render(self) -> str:
+        body = self.texts[0]
+        for previous_index, text_value in enumerate(self.texts[1:]):
+            following = _PRODUCT_HEADER_RE.sub("", text_value, count=1).strip()
+            body = f"{body}\n\n{_strip_overlap(self.texts[previous_index], following)}"
+        return f"[Fuente: {self.filename}]\n{body}"
+
+
+@dataclass
+class RagContextPack:
+    text: str
+    tokens: int = 0
+    raw_tokens: int = 0
+    deduplicated_tokens: int = 0
+    passages: int = 0
+    duplicates_dropped: int = 0
+    chunks_merged: int = 0
+    over_budget_dropped: int = 0
+    shingle_sets: list[frozenset[int]] = field(default_factory=list, repr=False)
+
+    @property
+    def tokens_saved(self) -> int:
+        """Tokens ahorrados por deduplicación y unión de chunks (sin contar el presupuesto)."""
+        return max(0, self.raw_tokens - self.deduplicated_tokens)
+
+    @property
+    def tokens_truncated(self) -> int:
+        """Tokens de contexto útil que quedaron fuera por el presupuesto."""
+        return max(0, self.deduplicated_tokens - self.tokens)
+
+    def report(self) -> dict:
+        return {
+            "tokens": self.tokens,
+            "raw_tokens": self.raw_tokens,
+            "tokens_saved": self.tokens_saved,
+            "tokens_truncated": self.tokens_truncated,
+            "passages": self.passages,
+            "duplicates_dropped": self.duplicates_dropped,
+            "chunks_merged": self.chunks_merged,
+            "over_budget_dropped": self.over_budget_dropped,
+        }
+
+
+def _eligible_chunks(chunks: list[dict], max_chunks: int) -> list[dict]:
+    """Filtros históricos de build_rag_context (similitud, FDS/HDS, familia|sección)."""
+    selected = []
+    seen_signatures = set()
+    for chunk in chunks[:max_chunks + 4]:  # read more to compensate for FDS skips
+        if len(selected) >= max_chunks:
+            break
+        if chunk.get("similarity", 0) < 0.25:
+            continue
+        filename = chunk.get("doc_filename", "desconocido")
+        fn_upper = (filename or "").upper()
+        if fn_upper.startswith("FDS") or fn_upper.startswith("HDS"):
+            continue
+        text_content = (chunk.get("chunk_text") or "").strip()
+        if not text_content:
+            continue
+        metadata = chunk.get("metadata") or {}
+        canonical_family = metadata.get("canonical_family") or chunk.get("familia_producto") or filename
+        section_match = _SECTION_RE.search(text_content)
+        section_name = section_match.group(1).strip().lower() if section_match else "general"
+        signature = f"{canonical_family}|{section_name}"
+        if signature in seen_signatures:
+            continue
+        seen_signatures.add(signature)
+        selected.append({**chunk, "doc_filename": filename, "chunk_text": text_content})
+    return selected
+
+
+def _truncate_to_budget(text: str, budget: int) -> str:
+    """Corta en el último fin de oración que cabe en `budget` tokens."""
+    sentences = re.split(r"(?<=[.!?])\s+|\n+", text)
+    kept: list[str] = []
+    for sentence in sentences:
+        candidate = "\n".join(kept + [sentence])
+        if count_tokens(candidate) > budget:
+            break
+        kept.append(sentence)
+    return "\n".join(kept).strip()
+
+
+def pack_rag_context(chunks: list[dict], *, max_chunks: int = 4, token_budget: Optional[int] = None,
+                     exclude: Optional[list[frozenset[int]]] = None) -> RagContextPack:
+    """Contexto RAG deduplicado y, si se pasa `token_budget`, acotado a esos tokens.
+
+    `exclude`: shingles de pasajes ya enviados en el mismo turno (p. ej. las
+    fichas cuando se empacan las guías) para no repetirlos.
+    """
+    if not chunks:
+        return RagContextPack(text="")
+    budget = None if token_budget is None else max(0, int(token_budget))
+    threshold = _dedup_threshold()
+    selected = _eligible_chunks(chunks, max_chunks)
+    pack = RagContextPack(text="")
+    pack.raw_tokens = sum(count_tokens(f"[Fuente: {c['doc_filename']}]\n{c['chunk_text']}") for c in selected)
+    pack.raw_tokens += count_tokens(_PASSAGE_SEPARATOR) * max(0, len(selected) - 1)
+
+    # 1. Casi duplicados (contra lo ya aceptado y lo excluido por el llamador).
+    accepted: list[dict] = []
+    known = list(exclude or [])
+    for chunk in selected:
+        shingle_set = shingles(chunk["chunk_text"])
+        if any(is_near_duplicate(shingle_set, other, threshold) for other in known):
+            pack.duplicates_dropped += 1
+            continue
+        known.append(shingle_set)
+        accepted.append({**chunk, "_shingles": shingle_set})
+
+    # 2. Chunks consecutivos del mismo documento → un pasaje.
+    passages: list[_Passage] = []
+    by_doc: dict[str, list[_Passage]] = {}
+    for chunk in accepted:
+        chunk_index = chunk.get("chunk_index")
+        target = None
+        if isinstance(chunk_index, int):
+            for passage in by_doc.get(chunk["doc_filename"], []):
+                if chunk_index in (passage.chunk_indexes[0] - 1, passage.chunk_indexes[-1] + 1):
+                    target = passage
+                    break
+        if target is None:
+            passage = _Passage(
+                filename=chunk["doc_filename"],
+                similarity=float(chunk.get("similarity") or 0),
+                chunk_indexes=[chunk_index] if isinstance(chunk_index, int) else [],
+                texts=[chunk["chunk_text"]],
+                shingle_set=chunk["_shingles"],
+            )
+            passages.append(passage)
+            by_doc.setdefault(chunk["doc_filename"], []).append(passage)
+            continue
+        pack.chunks_merged += 1
+        if chunk_index < target.chunk_indexes[0]:
+            target.chunk_indexes.insert(0, chunk_index)
+            target.texts.insert(0, chunk["chunk_text"])
+        else:
+            target.chunk_indexes.append(chunk_index)
+            target.texts.append(chunk["chunk_text"])
+        target.similarity = max(target.similarity, float(chunk.get("similarity") or 0))
+        target.shingle_set = target.shingle_set | chunk["_shingles"]
+
+    # 3. Por relevancia hasta el presupuesto (si lo hay).
+    separator_tokens = count_tokens(_PASSAGE_SEPARATOR)
+    rendered: list[str] = []
+    unbounded: list[str] = []
+    used = 0
+    for passage in sorted(passages, key=lambda item: item.similarity, reverse=True):
+        text_value = passage.render()
+        unbounded.append(text_value)
+        cost = count_tokens(text_value) + (separator_tokens if rendered else 0)
+        if budget is not None and used + cost > budget:
+            if not rendered:
+                # El pasaje más relevante nunca se pierde entero: se recorta.
+                text_value = _truncate_to_budget(text_value, budget)
+                cost = count_tokens(text_value)
+                if not text_value:
+                    pack.over_budget_dropped += 1
+                    continue
+            else:
+                pack.over_budget_dropped += 1
+                continue
+        rendered.append(text_value)
+        pack.shingle_sets.append(passage.shingle_set)
+        used += cost
+
+    pack.text = _PASSAGE_SEPARATOR.join(rendered)
+    pack.tokens = count_tokens(pack.text)
+    unbounded_text = _PASSAGE_SEPARATOR.join(unbounded)
+    pack.deduplicated_tokens = pack.tokens if unbounded_text == pack.text else count_tokens(unbounded_text)
+    pack.passages = len(rendered)
+    with _stats_lock:
+        _stats["packs"] += 1
+        _stats["raw_tokens"] += pack.raw_tokens
+        _stats["deduplicated_tokens"] += pack.deduplicated_tokens
+        _stats["packed_tokens"] += pack.tokens
+        _stats["duplicates_dropped"] += pack.duplicates_dropped
+        _stats["chunks_merged"] += pack.chunks_merged
+        _stats["over_budget_dropped"] += pack.over_budget_dropped
+    return pack
+
+
+def rag_context_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = max(0, stats["raw_tokens"] - stats["deduplicated_tokens"])
+    stats["tokens_truncated"] = max(0, stats["deduplicated_tokens"] - stats["packed_tokens"])
+    stats["tokenizer"] = "tiktoken" if _ENCODING is not None else "estimado"
+    return stats
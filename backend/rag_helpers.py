@@ -8,13 +8,12 @@ antes vivían en `backend.main` y eran consumidos vía un acceso perezoso desde
   - El acceso perezoso a ``backend.main`` queda **contenido** en este módulo,
     como única capa de borde, hasta que se complete la migración de los
     helpers primitivos (``normalize_text_value``, ``parse_numeric_value``,
-    ``lookup_product_context``, ``fetch_product_companions``,
+    ``lookup_product_context``, ``fetch_product_companions_bulk``,
     ``get_exact_product_description``, ``build_product_audit_label``,
     ``infer_product_presentation_from_row``,
     ``prepare_product_request_for_search``,
     ``_derive_portfolio_candidates_from_question``,
     ``_expand_terms_with_portfolio_knowledge``,
-    ``_get_expert_knowledge_cache``,
     ``PORTFOLIO_CATEGORY_MAP``) en una iteración futura.
 
 Funciones movidas (Move & Wire — sin cambios de comportamiento):
@@ -41,8 +40,11 @@ Stubs explícitos (TODO: RECONSTRUIR LOGICA DE NEGOCIO):
 from __future__ import annotations
 
 import logging
+import os
 import re
-from typing import Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Any, Iterator, Optional
 
 logger = logging.getLogger("ferreinox_agent")
 
@@ -57,6 +59,11 @@ try:
 except ImportError:
     from backend.technical_product_canonicalization import canonicalize_technical_product_term
 
+try:
+    from expert_knowledge_store import expert_knowledge_store
+except ImportError:
+    from backend.expert_knowledge_store import expert_knowledge_store
+
 
 def _m():
     """Acceso perezoso a ``backend.main`` para helpers aún no migrados.
@@ -500,8 +507,8 @@ def _build_structured_technical_guide(
 def fetch_expert_knowledge(query: str, limit: int = 8) -> list[dict[str, Any]]:
     """Fetch commercial expert knowledge matching the query context.
 
-    Uses an in-memory cache (refreshed every 120s) to avoid DB round-trips
-    on every tool call. With ~50 rows this is negligible memory.
+    El scoring corre sobre `expert_knowledge_store`: filas normalizadas e
+    índice invertido construidos una vez por carga, no en cada llamada.
     """
     if not query:
         return []
@@ -526,74 +533,11 @@ def fetch_expert_knowledge(query: str, limit: int = 8) -> list[dict[str, Any]]:
         if not terms:
             return []
 
-        all_rows = main._get_expert_knowledge_cache()
-
-        scored = []
-        seen_keys = set()
         anchor_terms = [
             t for t in terms
             if len(t) >= 6 or t in {"eternit", "fibrocemento", "asbesto", "sellomax", "koraza", "intervinil"}
         ]
-        for row in all_rows:
-            context_text = main.normalize_text_value(row.get("contexto_tags") or "")
-            note_text = main.normalize_text_value(row.get("nota_comercial") or "")
-            recommended_text = main.normalize_text_value(row.get("producto_recomendado") or "")
-            rejected_text = main.normalize_text_value(row.get("producto_desestimado") or "")
-            searchable = (
-                context_text
-                + " " + note_text
-                + " " + recommended_text
-                + " " + rejected_text
-            )
-            matched_terms = [t for t in terms if t in searchable]
-            if not matched_terms:
-                continue
-
-            score = 0.0
-            context_hits = 0
-            for term in matched_terms:
-                score += 1.0
-                if term in context_text:
-                    score += 2.0
-                    context_hits += 1
-                elif term in note_text:
-                    score += 1.0
-                elif term in recommended_text or term in rejected_text:
-                    score += 0.4
-                if len(term) >= 7:
-                    score += 0.35
-
-            anchor_context_hits = sum(1 for term in anchor_terms if term in context_text)
-            if anchor_context_hits:
-                score += 2.5 * anchor_context_hits
-            elif anchor_terms:
-                score -= 1.5
-
-            if row.get("tipo") == "alerta_superficie" and context_hits:
-                score += 1.5
-            if row.get("tipo") == "evitar" and any(term in rejected_text for term in matched_terms):
-                score += 0.75
-
-            dedupe_key = (
-                row.get("tipo") or "",
-                context_text,
-                note_text,
-                recommended_text,
-                rejected_text,
-            )
-            if dedupe_key in seen_keys:
-                continue
-            seen_keys.add(dedupe_key)
-
-            if score >= 2.0:
-                scored.append((score, len(matched_terms), row))
-        scored.sort(key=lambda item: (-item[0], -item[1], -(item[2].get("_ts") or 0)))
-        results = []
-        for score_val, _match_count, row in scored[:limit]:
-            row_copy = dict(row)
-            row_copy["_expert_score"] = round(score_val, 2)
-            results.append(row_copy)
-        return results
+        return expert_knowledge_store.keyword_search(terms, anchor_terms, limit=limit)
     except Exception as exc:
         logger.debug("fetch_expert_knowledge error: %s", exc)
         return []
@@ -980,60 +924,49 @@ def _filter_inventory_candidates_by_policy(
 # Inventory candidate lookup (movido desde main.py)
 # ─────────────────────────────────────────────────────────────────────────────
 
-def lookup_inventory_candidates_from_terms(
-    terms: list[str],
-    conversation_context: Optional[dict],
-    *,
-    allow_portfolio_expansion: bool = True,
-) -> list[dict]:
-    main = _m()
-    seen_codes: set[str] = set()
-    resolved: list[dict] = []
-    local_context = dict(conversation_context or {})
+RAG_INVENTORY_LOOKUP_WORKERS = int(os.getenv("RAG_INVENTORY_LOOKUP_WORKERS", "4"))
 
-    # First pass: search with original terms
-    for term in terms:
-        if not term:
-            continue
-        rows = main.lookup_product_context(term, main.prepare_product_request_for_search(term))
-        for row in rows[:2]:
-            code = row.get("codigo_articulo") or row.get("referencia") or row.get("codigo")
-            if not code or code in seen_codes:
-                continue
-            seen_codes.add(code)
-            resolved.append(
-                {
-                    "codigo": code,
-                    "descripcion": main.get_exact_product_description(row),
-                    "etiqueta_auditable": main.build_product_audit_label(row),
-                    "marca": row.get("marca") or row.get("marca_producto"),
-                    "presentacion": main.infer_product_presentation_from_row(row),
-                    "stock_total": main.parse_numeric_value(row.get("stock_total")),
-                    "precio": row.get("precio_venta"),
-                    "productos_complementarios": [
-                        {
-                            "referencia": c.get("companion_referencia"),
-                            "descripcion": c.get("companion_descripcion") or c.get("descripcion_inventario"),
-                            "tipo": c.get("tipo_relacion"),
-                            "proporcion": c.get("proporcion"),
-                        }
-                        for c in main.fetch_product_companions(code)
-                    ],
-                }
-            )
-            local_context["last_product_query"] = term
-        if len(resolved) >= 4:
-            break
 
-    # Second pass: if first pass found nothing, expand terms using portfolio knowledge.
-    if not resolved and allow_portfolio_expansion:
-        expanded_terms = main._expand_terms_with_portfolio_knowledge(terms)
-        original_normalized = {main.normalize_text_value(t) for t in terms if t}
-        new_terms = [t for t in expanded_terms if t not in original_normalized]
-        for term in new_terms:
-            if not term:
-                continue
-            rows = main.lookup_product_context(term, main.prepare_product_request_for_search(term))
+def _lookup_terms_concurrently(main: Any, terms: list[str]) -> Iterator[tuple[str, list[dict]]]:
+    """Corre ``lookup_product_context`` para cada término en paralelo y entrega en orden.
+
+    Es un generador: si el consumidor deja de iterar (ya tiene suficientes
+    productos) y lo cierra, los términos que aún no arrancaron se cancelan.
+    Un término que falla se registra y entrega sin filas.
+    """
+    valid_terms = [term for term in terms if term]
+    if not valid_terms:
+        return
+
+    def _lookup(term: str) -> list[dict]:
+        try:
+            return main.lookup_product_context(term, main.prepare_product_request_for_search(term))
+        except Exception as exc:
+            logger.warning("lookup_product_context falló para '%s': %s", term, exc, exc_info=True)
+            return []
+
+    if len(valid_terms) == 1 or RAG_INVENTORY_LOOKUP_WORKERS <= 1:
+        for term in valid_terms:
+            yield term, _lookup(term)
+        return
+    executor = ThreadPoolExecutor(max_workers=min(RAG_INVENTORY_LOOKUP_WORKERS, len(valid_terms)))
+    try:
+        futures = [executor.submit(_lookup, term) for term in valid_terms]
+        for term, future in zip(valid_terms, futures):
+            yield term, future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _collect_inventory_rows(
+    main: Any,
+    term_rows: Iterator[tuple[str, list[dict]]],
+    seen_codes: set[str],
+    resolved: list[dict],
+) -> None:
+    """Agrega hasta 4 productos en el orden de los términos; al completarlos cierra ``term_rows``."""
+    with closing(term_rows):
+        for _term, rows in term_rows:
             for row in rows[:2]:
                 code = row.get("codigo_articulo") or row.get("referencia") or row.get("codigo")
                 if not code or code in seen_codes:
@@ -1048,22 +981,47 @@ def lookup_inventory_candidates_from_terms(
                         "presentacion": main.infer_product_presentation_from_row(row),
                         "stock_total": main.parse_numeric_value(row.get("stock_total")),
                         "precio": row.get("precio_venta"),
-                        "productos_complementarios": [
-                            {
-                                "referencia": c.get("companion_referencia"),
-                                "descripcion": c.get("companion_descripcion") or c.get("descripcion_inventario"),
-                                "tipo": c.get("tipo_relacion"),
-                                "proporcion": c.get("proporcion"),
-                            }
-                            for c in main.fetch_product_companions(code)
-                        ],
+                        "productos_complementarios": [],
                     }
                 )
-                local_context["last_product_query"] = term
             if len(resolved) >= 4:
                 break
 
-    return resolved[:4]
+
+def lookup_inventory_candidates_from_terms(
+    terms: list[str],
+    conversation_context: Optional[dict],
+    *,
+    allow_portfolio_expansion: bool = True,
+) -> list[dict]:
+    main = _m()
+    seen_codes: set[str] = set()
+    resolved: list[dict] = []
+
+    # First pass: search with original terms (búsquedas concurrentes, fusión en orden)
+    _collect_inventory_rows(main, _lookup_terms_concurrently(main, terms), seen_codes, resolved)
+
+    # Second pass: if first pass found nothing, expand terms using portfolio knowledge.
+    if not resolved and allow_portfolio_expansion:
+        expanded_terms = main._expand_terms_with_portfolio_knowledge(terms)
+        original_normalized = {main.normalize_text_value(t) for t in terms if t}
+        new_terms = [t for t in expanded_terms if t not in original_normalized]
+        _collect_inventory_rows(main, _lookup_terms_concurrently(main, new_terms), seen_codes, resolved)
+
+    resolved = resolved[:4]
+    # Acompañantes de todos los productos en una sola consulta (antes: N+1).
+    companions_by_code = main.fetch_product_companions_bulk([item["codigo"] for item in resolved])
+    for item in resolved:
+        item["productos_complementarios"] = [
+            {
+                "referencia": c.get("companion_referencia"),
+                "descripcion": c.get("companion_descripcion") or c.get("descripcion_inventario"),
+                "tipo": c.get("tipo_relacion"),
+                "proporcion": c.get("proporcion"),
+            }
+            for c in companions_by_code.get(str(item["codigo"]), [])
+        ]
+    return resolved
 
 
 __all__ = [
@@ -0,0 +1,307 @@
+"""Cache entre turnos de la recuperación de `consultar_conocimiento_tecnico`.
+
+`agent_v3` sólo deduplicaba dentro de un turno: la misma pregunta técnica
+de 50 clientes en un día corría 50 veces embedding + pgvector + segunda
+pasada por portafolio + perfiles.
+
+Qué se cachea: la salida de las etapas de recuperación (chunks, guías,
+índice multimodal, fallbacks aplicados y perfiles técnicos). La síntesis
+aguas abajo (guía estructurada, políticas, candidatos de inventario con
+stock) se sigue calculando en cada turno; las notas expertas también.
+
+Diseño:
+
+  * Clave = sha256 de la consulta normalizada + marca + segmentos +
+    prefiltros de metadata + generación de ingesta (chunks y perfiles,
+    las que sube `run_ingestion`). Una reingesta cambia la clave: nunca se
+    sirve un resultado de antes de la ingesta.
+  * La generación se lee de `agent_refresh_generation` como mucho cada
+    `generation_check_seconds`; el NOTIFY de la ingesta la adelanta y
+    vacía la memoria.
+  * Nivel 1: LRU en memoria con TTL y tope de entradas.
+  * Nivel 2 opcional (RAG_RESULT_CACHE_PERSIST=1): tabla
+    `rag_result_cache` compartida por los workers. Si la BD falla se
+    desactiva un rato y el cache sigue sólo en memoria.
+  * Los valores se guardan como JSON y se decodifican en cada acierto: el
+    llamador recibe copias que puede modificar.
+"""
+
+from __future__ import annotations
+
+import datetime
+import decimal
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+try:
+    from local_vector_index import CHUNK_INDEX_SCOPE
+except ImportError:
+    from backend.local_vector_index import CHUNK_INDEX_SCOPE
+
+try:
+    from technical_profile_store import PROFILE_SCOPE
+except ImportError:
+    from backend.technical_profile_store import PROFILE_SCOPE
+
+logger = logging.getLogger("ferreinox_agent.rag_result_cache")
+
+RAG_RESULT_CACHE_SCOPES = (CHUNK_INDEX_SCOPE, PROFILE_SCOPE)
+
+RAG_RESULT_CACHE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS public.rag_result_cache (
+    cache_key text PRIMARY KEY,
+    generation text NOT NULL,
+    payload text NOT NULL,
+    hit_count integer NOT NULL DEFAULT 0,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    expires_at timestamptz NOT NULL
+)
+"""
+
+_PERSISTENCE_COOLDOWN_SECONDS = 60.0
+_PURGE_EVERY_PUTS = 200
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _normalize(value: Optional[str]) -> str:
+    return " ".join(str(value or "").split()).lower()
+
+
+class RagResultCache:
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 21600.0,
+                 engine_factory: Optional[Callable[[], Any]] = None, persist: bool = False,
+                 generation_check_seconds: float = 30.0, enabled: bool = True):
+        self._max_entries = max(1, int(max_entries))
+        self._ttl_seconds = float(ttl_seconds)
+        self._engine_factory = engine_factory
+        self._persist = persist
+        self._generation_check_seconds = float(generation_check_seconds)
+        self._enabled = enabled
+        self._entries: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation: Optional[str] = None
+        self._generation_checked_at = 0.0
+        self._table_ready = False
+        self._persistence_disabled_until = 0.0
+        self._puts = 0
+        self._counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "expired": 0,
+                          "generation_changes": 0, "db_errors": 0}
+
+    def bind_engine(self, engine_factory: Callable[[], Any]) -> None:
+        self._engine_factory = engine_factory
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    # ── Generación de ingesta ───────────────────────────────────────────
+    def current_generation(self) -> str:
+        """Token de generación (chunks:perfiles); se relee como mucho cada `generation_check_seconds`."""
+        with self._lock:
+            if self._generation is not None and time.time() - self._generation_checked_at < self._generation_check_seconds:
+                return self._generation
+        token = self._read_generation()
+        with self._lock:
+            if self._generation is not None and token != self._generation:
+                self._counters["generation_changes"] += 1
+                self._entries.clear()
+            self._generation = token
+            self._generation_checked_at = time.time()
+        return token
+
+    def _read_generation(self) -> str:
+        if self._engine_factory is None:
+            return "-"
+        try:
+            from cache_invalidation import fetch_refresh_generation
+        except ImportError:
+            from backend.cache_invalidation import fetch_refresh_generation
+        try:
+            with self._engine_factory().connect() as connection:
+                values = [fetch_refresh_generation(connection, scope) for scope in RAG_RESULT_CACHE_SCOPES]
+        except Exception as exc:
+            logger.debug("rag_result_cache: no se pudo leer la generación: %s", exc)
+            values = [None] * len(RAG_RESULT_CACHE_SCOPES)
+        return ":".join("-" if value is None else str(value) for value in values)
+
+    def on_generation(self, payload: Optional[dict]) -> None:
+        """Handler de REFRESH_GENERATION_CHANNEL: la próxima consulta relee la generación."""
+        scope = (payload or {}).get("scope")
+        if scope not in (None, *RAG_RESULT_CACHE_SCOPES):
+            return
+        with self._lock:
+            self._generation_checked_at = 0.0
+
+    # ── API principal ───────────────────────────────────────────────────
+    def key_for(self, query: str, *, marca: Optional[str] = None, segments: Optional[list[str]] = None,
+                metadata_prefilters: Optional[dict] = None) -> str:
+        parts = {
+            "q": _normalize(query),
+            "marca": _normalize(marca),
+            "segments": sorted(segments or []),
+            "prefilters": {key: sorted(value or []) for key, value in sorted((metadata_prefilters or {}).items())},
+            "generation": self.current_generation(),
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        if not self._enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return json.loads(entry[1])
+                del self._entries[key]
+                self._counters["expired"] += 1
+        payload = self._db_get(key)
+        if payload is not None:
+            self._count("db_hits")
+            self._memory_put(key, payload, now + self._ttl_seconds)
+            return json.loads(payload)
+        self._count("misses")
+        return None
+
+    def put(self, key: str, value: dict) -> None:
+        if not self._enabled:
+            return
+        try:
+            payload = json.dumps(value, ensure_ascii=False, default=_json_default)
+        except (TypeError, ValueError) as exc:
+            logger.debug("rag_result_cache: resultado no serializable: %s", exc)
+            return
+        self._memory_put(key, payload, time.time() + self._ttl_seconds)
+        self._count("stores")
+        self._db_put(key, payload)
+
+    def _memory_put(self, key: str, payload: str, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    # ── Nivel 2: Postgres (opcional) ────────────────────────────────────
+    def _engine(self):
+        if not self._persist or self._engine_factory is None or time.time() < self._persistence_disabled_until:
+            return None
+        try:
+            engine = self._engine_factory()
+            if not self._table_ready:
+                from sqlalchemy import text
+
+                with engine.begin() as connection:
+                    connection.execute(text(RAG_RESULT_CACHE_TABLE_SQL))
+                self._table_ready = True
+            return engine
+        except Exception as exc:
+            self._disable_persistence(exc)
+            return None
+
+    def _disable_persistence(self, exc: Exception) -> None:
+        self._count("db_errors")
+        self._persistence_disabled_until = time.time() + _PERSISTENCE_COOLDOWN_SECONDS
+        logger.warning("rag_result_cache sin BD por %.0fs: %s", _PERSISTENCE_COOLDOWN_SECONDS, exc)
+
+    def _db_get(self, key: str) -> Optional[str]:
+        engine = self._engine()
+        if engine is None:
+            return None
+        from sqlalchemy import text
+
+        try:
+            with engine.begin() as connection:
+                return connection.execute(
+                    text(
+                        """
+                        UPDATE public.rag_result_cache
+                        SET hit_count = hit_count + 1
+                        WHERE cache_key = :key AND expires_at > now()
+                        RETURNING payload
+                        """
+                    ),
+                    {"key": key},
+                ).scalar()
+        except Exception as exc:
+            self._disable_persistence(exc)
+            return None
+
+    def _db_put(self, key: str, payload: str) -> None:
+        engine = self._engine()
+        if engine is None:
+            return
+        from sqlalchemy import text
+
+        with self._lock:
+            self._puts += 1
+            purge = self._puts % _PURGE_EVERY_PUTS == 0
+        try:
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        """
+                        INSERT INTO public.rag_result_cache (cache_key, generation, payload, expires_at)
+                        VALUES (:key, :generation, :payload, now() + make_interval(secs => :ttl))
+                        ON CONFLICT (cache_key) DO UPDATE
+                        SET payload = EXCLUDED.payload, expires_at = EXCLUDED.expires_at
+                        """
+                    ),
+                    {"key": key, "generation": self._generation or "-", "payload": payload, "ttl": self._ttl_seconds},
+                )
+                if purge:
+                    connection.execute(text("DELETE FROM public.rag_result_cache WHERE expires_at < now()"))
+        except Exception as exc:
+            self._disable_persistence(exc)
+
+    # ── Métricas / estado ───────────────────────────────────────────────
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            nbytes = sum(len(payload) for _, payload in self._entries.values())
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        hits = counters["memory_hits"] + counters["db_hits"]
+        return {
+            **counters,
+            "enabled": self._enabled,
+            "lookups": lookups,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": entries,
+            "memory_kb": round(nbytes / 1024, 1),
+            "generation": self._generation,
+            "persistence_enabled": self._persist and self._engine_factory is not None
+            and time.time() >= self._persistence_disabled_until,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Singleton compartido por el proceso; main.py enlaza el engine y el NOTIFY.
+rag_result_cache = RagResultCache(
+    max_entries=int(os.getenv("RAG_RESULT_CACHE_MAX_ENTRIES", "512") or "512"),
+    ttl_seconds=float(os.getenv("RAG_RESULT_CACHE_TTL_SECONDS", "21600") or "21600"),
+    persist=(os.getenv("RAG_RESULT_CACHE_PERSIST", "0") or "0").strip().lower() in ("1", "true", "on"),
+    enabled=(os.getenv("RAG_RESULT_CACHE", "on") or "on").strip().lower() not in ("0", "false", "off"),
+)
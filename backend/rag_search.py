@@ -20,22 +20,49 @@ Reglas:
 
 from __future__ import annotations
 
-import json
+import logging
 import os
 import re
+import time
 import unicodedata
 from typing import Optional
 
 try:
+    from gemini_embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL
     from gemini_embeddings import generate_query_embedding as generate_gemini_query_embedding
+    from gemini_embeddings import generate_query_embeddings as generate_gemini_query_embeddings
 except ImportError:
+    from backend.gemini_embeddings import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL
     from backend.gemini_embeddings import generate_query_embedding as generate_gemini_query_embedding
+    from backend.gemini_embeddings import generate_query_embeddings as generate_gemini_query_embeddings
+
+try:
+    from embedding_cache import query_embedding_cache
+except ImportError:
+    from backend.embedding_cache import query_embedding_cache
 
 try:
     from policies import RAG_METADATA_CANONICAL_HINTS, RAG_METADATA_CHEMICAL_HINTS
 except ImportError:
     from backend.policies import RAG_METADATA_CANONICAL_HINTS, RAG_METADATA_CHEMICAL_HINTS
 
+try:
+    from local_vector_index import CHUNK_INDEX_SCOPE, local_index_mode, local_vector_index
+except ImportError:
+    from backend.local_vector_index import CHUNK_INDEX_SCOPE, local_index_mode, local_vector_index
+
+try:
+    from technical_profile_store import technical_profile_store
+except ImportError:
+    from backend.technical_profile_store import technical_profile_store
+
+try:
+    from rag_context import RagContextPack, pack_rag_context
+except ImportError:
+    from backend.rag_context import RagContextPack, pack_rag_context
+
+logger = logging.getLogger("ferreinox_agent.rag_search")
+
 
 # ── Helper local: réplica de normalize_text_value para evitar import desde main ──
 def _normalize_text_value(text_value: Optional[str]) -> str:
@@ -55,6 +82,10 @@ def _get_db_engine():
     return get_db_engine()
 
 
+# Perfiles técnicos: mismo engine (lambda para respetar parches de _get_db_engine).
+technical_profile_store.bind_engine(lambda: _get_db_engine())
+
+
 def _get_problem_class_helpers():
     """Lazy lookup de helpers que pueden no existir aún en main (defensa).
 
@@ -76,11 +107,34 @@ def _get_problem_class_helpers():
 # ─────────────────────────────────────────────────────────────────────────────
 
 def _generate_query_embedding(query_text: str) -> list[float] | None:
-    """Generate embedding vector for a search query using Gemini Embedding 2."""
-    try:
-        return generate_gemini_query_embedding(query_text.strip())
-    except Exception:
-        return None
+    """Generate embedding vector for a search query using Gemini Embedding 2.
+
+    Pasa por ``query_embedding_cache``: las tres búsquedas del mismo turno y
+    las preguntas repetidas entre turnos/workers reutilizan el vector.
+    """
+    return query_embedding_cache.get_or_compute(
+        query_text,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS,
+        compute=generate_gemini_query_embedding,
+    )
+
+
+def prefetch_query_embeddings(queries: list[str]) -> int:
+    """Embebe varias consultas en un solo request batch y las deja en el cache.
+
+    Para turnos con varias búsquedas (segunda pasada por portafolio): las
+    búsquedas posteriores encuentran su vector en memoria. Sólo se envían
+    las consultas que no estaban ya en cache. Devuelve cuántas quedaron
+    con embedding.
+    """
+    embeddings = query_embedding_cache.get_or_compute_many(
+        queries,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS,
+        compute_many=generate_gemini_query_embeddings,
+    )
+    return sum(1 for embedding in embeddings if embedding)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -215,40 +269,217 @@ def _infer_technical_metadata_prefilters(question: str, product: str = "", diagn
 # ─────────────────────────────────────────────────────────────────────────────
 # Búsqueda vectorial pgvector
 # ─────────────────────────────────────────────────────────────────────────────
+#
+# Las tres búsquedas (fichas, guías, índice multimodal) comparten una sola
+# sentencia: el vector se enlaza UNA vez en un CTE materializado y cada
+# índice es una rama ``UNION ALL`` con su propio ORDER BY/LIMIT (el índice
+# HNSW/IVFFlat sigue aplicando porque el operando es un parámetro escalar).
+# Antes eran tres checkouts del pool y el literal de 1536 floats viajaba y
+# se parseaba 6-7 veces por pregunta.
+
+# Columnas comunes de las ramas; cada fuente se re-proyecta a su forma original.
+_RAG_INDEX_COLUMNS = (
+    "source", "doc_filename", "doc_path_lower", "chunk_index", "chunk_text", "metadata",
+    "marca", "familia_producto", "tipo_documento", "canonical_family", "summary_text", "similarity",
+)
+_RAG_QUERY_VECTOR = "(SELECT embedding FROM q)"
+
+# Nivel de búsqueda sobre agent_technical_doc_chunk (RAG_VECTOR_TIER):
+#   exact   → HNSW sobre vector(1536) (histórico).
+#   halfvec → primera pasada en índice de expresión halfvec (mitad de memoria).
+#   bit     → primera pasada en índice binario (hamming, ~32x más pequeño).
+# Los niveles cuantizados traen top_k × RAG_QUANTIZED_RERANK_FACTOR
+# candidatos y los reordenan con la distancia coseno exacta del vector
+# completo, así la similitud devuelta es la misma que en "exact".
+# Los índices se crean con ``ingest_technical_sheets.py --vector-tier-index``.
+RAG_VECTOR_TIERS = ("exact", "halfvec", "bit")
+RAG_QUANTIZED_MIN_CANDIDATES = 40
+
+
+def _rag_vector_tier() -> str:
+    tier = (os.getenv("RAG_VECTOR_TIER", "exact") or "exact").strip().lower()
+    return tier if tier in RAG_VECTOR_TIERS else "exact"
+
+
+def quantized_candidate_limit(top_k: int) -> int:
+    try:
+        factor = int(os.getenv("RAG_QUANTIZED_RERANK_FACTOR", "5") or "5")
+    except (TypeError, ValueError):
+        factor = 5
+    return max(RAG_QUANTIZED_MIN_CANDIDATES, top_k * max(1, factor))
 
-def search_technical_chunks(query: str, top_k: int = 5, marca_filter: str | None = None,
-                            segment_filters: list[str] | None = None,
-                            metadata_prefilters: dict | None = None) -> list[dict]:
-    """Semantic search over vectorized technical sheet chunks using pgvector cosine distance.
 
-    Threshold dinámico (Fase C3 HITO 4):
-      Si la variable de entorno ``RAG_PGVECTOR_DISTANCE_THRESHOLD`` está
-      definida con un float > 0, se aplica un filtro adicional en SQL
-      ``(1 - (embedding <=> :q)) >= threshold`` para descartar chunks
-      cuya similitud coseno esté por debajo del umbral.
+def vector_distance_sql(tier: str, query_vector: str = _RAG_QUERY_VECTOR, column: str = "embedding") -> str:
+    """Expresión ORDER BY de la primera pasada; debe coincidir con la del índice del nivel."""
+    if tier == "halfvec":
+        return f"({column}::halfvec({EMBEDDING_DIMENSIONS})) <=> ({query_vector})::halfvec({EMBEDDING_DIMENSIONS})"
+    if tier == "bit":
+        return f"(binary_quantize({column})::bit({EMBEDDING_DIMENSIONS})) <~> binary_quantize({query_vector})"
+    return f"{column} <=> {query_vector}"
 
-      Default = 0 = sin filtrado adicional (comportamiento histórico
-      preservado). Se recomienda subir gradualmente (ej. 0.30) tras
-      tuning empírico contra ``test_global_policy_matrix*.py``.
+
+def _chunk_table_source(where_clauses: list[str], params: list, top_k: int) -> tuple[str, str, list]:
+    """FROM/WHERE de una rama sobre agent_technical_doc_chunk según el nivel activo.
+
+    En niveles cuantizados los filtros se aplican en la subconsulta de
+    candidatos y la rama externa sólo reordena por distancia exacta.
     """
-    embedding = _generate_query_embedding(query)
-    if not embedding:
-        return []
+    tier = _rag_vector_tier()
+    if tier == "exact":
+        return "public.agent_technical_doc_chunk", " AND ".join(where_clauses), [*params, top_k]
+    candidates_sql = f"""(
+            SELECT doc_filename, doc_path_lower, chunk_index, chunk_text, metadata,
+                   marca, familia_producto, tipo_documento, embedding
+            FROM public.agent_technical_doc_chunk
+            WHERE {' AND '.join(where_clauses)}
+            ORDER BY {vector_distance_sql(tier)}
+            LIMIT %s
+        ) AS candidates"""
+    return candidates_sql, "TRUE", [*params, quantized_candidate_limit(top_k), top_k]
+
+
+# ── Parámetros HNSW por consulta y selección de índices parciales ────────
+# Con filtros estrictos (marca, segmento, familia) el escaneo ANN devuelve
+# ef_search candidatos y el filtro se aplica después: pueden quedar menos
+# de top_k filas. Por eso cada consulta fija ``hnsw.ef_search`` con SET LOCAL
+# (más alto si hay filtros) y, en pgvector >= 0.8, ``hnsw.iterative_scan``
+# para que el índice siga escaneando hasta llenar el LIMIT.
+# Índices parciales (ingest_technical_sheets.py --partial-indexes): fichas
+# técnicas por segmento de portafolio y guías. El planner los elige solo
+# cuando el WHERE implica su predicado; por eso un filtro de un único
+# segmento se emite como igualdad (``= 'segmento'``) y no como ``= ANY``.
+PARTIAL_INDEX_SEGMENTS = tuple(PORTFOLIO_SEGMENT_QUERY_HINTS)
+TECHNICAL_SHEET_TYPES_SQL = "tipo_documento IN ('ficha_tecnica', 'ficha_tecnica_experto')"
+GUIDE_TYPE_SQL = "tipo_documento = 'guia_solucion'"
+PORTFOLIO_SEGMENT_SQL = "COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general')"
+HNSW_ITERATIVE_SCAN_MODES = ("off", "strict_order", "relaxed_order")
+
+_PGVECTOR_VERSION: tuple[int, ...] | None = None
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+def _segment_clause(segment_filters: list[str]) -> tuple[str, list]:
+    if len(segment_filters) == 1:
+        return f"{PORTFOLIO_SEGMENT_SQL} = %s", [segment_filters[0]]
+    return f"{PORTFOLIO_SEGMENT_SQL} = ANY(%s)", [list(segment_filters)]
+
+
+def _pgvector_version(cur) -> tuple[int, ...]:
+    """Versión de la extensión vector (una consulta por proceso)."""
+    global _PGVECTOR_VERSION
+    if _PGVECTOR_VERSION is None:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+        _PGVECTOR_VERSION = tuple(int(part) for part in re.findall(r"\d+", (row[0] if row else "") or "0")[:3])
+    return _PGVECTOR_VERSION
+
+
+# ── Búsqueda híbrida (texto completo + vector) ───────────────────────────
+# Nombres exactos, códigos y términos químicos ("P-11", "epóxico 2K") se
+# pierden en el espacio vectorial. ``chunk_tsv`` es un tsvector generado
+# (configuración española + unaccent, familia con peso A y texto con peso
+# B) con índice GIN (migración 2026_10_19_chunk_fulltext.sql o
+# ``ingest_technical_sheets.py --fulltext-index``). Fichas y guías fusionan
+# su ranking ANN con ``ts_rank_cd`` por reciprocal rank fusion dentro de la
+# misma sentencia. RAG_HYBRID_SEARCH=off vuelve a sólo-vector; sin la
+# columna (migración pendiente) se queda en sólo-vector automáticamente.
+CHUNK_TSVECTOR_COLUMN = "chunk_tsv"
+CHUNK_TSVECTOR_CONFIG = "public.rag_es_unaccent"
+_RAG_QUERY_TSQUERY = "(SELECT tsq FROM q)"
+RAG_HYBRID_MIN_CANDIDATES = 20
+
+_CHUNK_FULLTEXT_AVAILABLE: bool | None = None
+
+
+def hybrid_candidate_limit(top_k: int) -> int:
+    """Candidatos por lista (ANN y texto) antes de fusionar."""
+    if _rag_vector_tier() != "exact":
+        return quantized_candidate_limit(top_k)
+    return max(top_k, _env_int("RAG_HYBRID_CANDIDATES", RAG_HYBRID_MIN_CANDIDATES))
+
+
+def _chunk_fulltext_available(cur) -> bool:
+    """¿Existe ``chunk_tsv``? (una consulta por proceso; reiniciar tras la migración)."""
+    global _CHUNK_FULLTEXT_AVAILABLE
+    if _CHUNK_FULLTEXT_AVAILABLE is None:
+        cur.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_attribute "
+            "WHERE attrelid = to_regclass('public.agent_technical_doc_chunk') "
+            "AND attname = %s AND NOT attisdropped)",
+            [CHUNK_TSVECTOR_COLUMN],
+        )
+        row = cur.fetchone()
+        _CHUNK_FULLTEXT_AVAILABLE = bool(row and row[0])
+    return _CHUNK_FULLTEXT_AVAILABLE
+
 
-    embedding_literal = "[" + ",".join(str(v) for v in embedding) + "]"
+def _hybrid_search_enabled(cur, query: str) -> bool:
+    mode = (os.getenv("RAG_HYBRID_SEARCH", "auto") or "auto").strip().lower()
+    if mode in ("off", "0", "false") or not (query or "").strip():
+        return False
+    return _chunk_fulltext_available(cur)
 
+
+def fulltext_query_sql(config: str = CHUNK_TSVECTOR_CONFIG) -> str:
+    """tsquery OR de los términos de la pregunta (plainto_tsquery exige todos)."""
+    return f"replace(plainto_tsquery('{config}', %s)::text, ' & ', ' | ')::tsquery"
+
+
+def hnsw_session_sql(max_limit: int, filtered: bool, pgvector_version: tuple[int, ...]) -> str:
+    """SET LOCAL de ef_search / iterative_scan para la transacción de la consulta.
+
+    ef_search nunca queda por debajo del LIMIT más grande de la sentencia
+    (si no, HNSW devuelve menos filas que el LIMIT).
+    """
+    base = _env_int("RAG_HNSW_EF_SEARCH", 40)
+    if filtered:
+        base = _env_int("RAG_HNSW_EF_SEARCH_FILTERED", 100)
+    ef_search = max(1, min(1000, max(base, max_limit)))
+    statements = [f"SET LOCAL hnsw.ef_search = {ef_search}"]
+    iterative = (os.getenv("RAG_HNSW_ITERATIVE_SCAN", "strict_order") or "off").strip().lower()
+    if filtered and iterative in HNSW_ITERATIVE_SCAN_MODES and iterative != "off" and pgvector_version >= (0, 8, 0):
+        statements.append(f"SET LOCAL hnsw.iterative_scan = {iterative}")
+    return ";\n".join(statements) + ";\n"
+
+
+def _vector_param(embedding: list[float]) -> str:
+    """Literal de texto del vector de consulta; la sentencia lo castea con ``%s::vector``.
+
+    No se registra un adaptador global de ``np.ndarray`` en psycopg2: cambiaría
+    cómo se adapta cualquier ndarray del proceso, no sólo esta consulta.
+    """
+    return "[" + ",".join(str(float(v)) for v in embedding) + "]"
+
+
+def _distance_threshold() -> float:
+    """Threshold dinámico opt-in vía env var. Default 0.0 = no filtra."""
+    try:
+        return float(os.getenv("RAG_PGVECTOR_DISTANCE_THRESHOLD", "0") or "0")
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _technical_chunk_filters(marca_filter: str | None, segment_filters: list[str] | None,
+                             metadata_prefilters: dict | None) -> tuple[list[str], list]:
     where_clauses = [
-        "tipo_documento IN ('ficha_tecnica', 'ficha_tecnica_experto')",
+        TECHNICAL_SHEET_TYPES_SQL,
         "COALESCE(metadata ->> 'document_scope', 'primary') = 'primary'",
         "COALESCE(metadata ->> 'quality_tier', 'primary') <> 'rejected'",
     ]
-    params: list = [embedding_literal]
+    params: list = []
     if marca_filter:
         where_clauses.append("LOWER(marca) = LOWER(%s)")
         params.append(marca_filter)
     if segment_filters:
-        where_clauses.append("COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general') = ANY(%s)")
-        params.append(segment_filters)
+        segment_sql, segment_params = _segment_clause(segment_filters)
+        where_clauses.append(segment_sql)
+        params.extend(segment_params)
     canonical_family_patterns = list((metadata_prefilters or {}).get("canonical_family_patterns") or [])
     chemical_family_terms = [term.lower() for term in ((metadata_prefilters or {}).get("chemical_family_terms") or []) if term]
     if canonical_family_patterns and chemical_family_terms:
@@ -265,238 +496,478 @@ def search_technical_chunks(query: str, top_k: int = 5, marca_filter: str | None
         where_clauses.append("LOWER(COALESCE(metadata ->> 'chemical_family', '')) = ANY(%s)")
         params.append(chemical_family_terms)
 
-    # Threshold dinámico opt-in vía env var. Default 0.0 = no filtra.
-    try:
-        distance_threshold = float(os.getenv("RAG_PGVECTOR_DISTANCE_THRESHOLD", "0") or "0")
-    except (TypeError, ValueError):
-        distance_threshold = 0.0
+    distance_threshold = _distance_threshold()
     if distance_threshold > 0:
-        where_clauses.append("(1 - (embedding <=> %s::vector)) >= %s")
-        params.append(embedding_literal)
+        where_clauses.append(f"(1 - (embedding <=> {_RAG_QUERY_VECTOR})) >= %s")
         params.append(distance_threshold)
+    return where_clauses, params
 
-    params.extend([embedding_literal, top_k])
 
-    try:
-        engine = _get_db_engine()
-        raw_conn = engine.raw_connection()
-        try:
-            cur = raw_conn.cursor()
-            cur.execute(
-                f"""
-                  SELECT doc_filename, doc_path_lower, chunk_index, chunk_text,
-                      metadata,
-                       marca, familia_producto, tipo_documento,
-                       1 - (embedding <=> %s::vector) AS similarity
-                                FROM public.agent_technical_doc_chunk
-                                    WHERE {' AND '.join(where_clauses)}
-                ORDER BY embedding <=> %s::vector
-                LIMIT %s
-                """,
-                params,
-            )
-            columns = [desc[0] for desc in cur.description]
-            rows = [dict(zip(columns, row)) for row in cur.fetchall()]
-            return rows
-        finally:
-            raw_conn.close()
-    except Exception:
-        return []
-
-
-def search_supporting_technical_guides(query: str, top_k: int = 3, marca_filter: str | None = None,
-                                      segment_filters: list[str] | None = None) -> list[dict]:
-    embedding = _generate_query_embedding(query)
-    if not embedding:
-        return []
-
-    embedding_literal = "[" + ",".join(str(v) for v in embedding) + "]"
+def _guide_filters(marca_filter: str | None, segment_filters: list[str] | None) -> tuple[list[str], list]:
     where_clauses = [
-        "tipo_documento = 'guia_solucion'",
+        GUIDE_TYPE_SQL,
         "COALESCE(metadata ->> 'document_scope', 'guide') = 'guide'",
     ]
-    params: list = [embedding_literal]
+    params: list = []
     if marca_filter:
         where_clauses.append("LOWER(marca) = LOWER(%s)")
         params.append(marca_filter)
     if segment_filters:
-        where_clauses.append("COALESCE(metadata ->> 'portfolio_segment', 'portafolio_general') = ANY(%s)")
-        params.append(segment_filters)
-    params.extend([embedding_literal, top_k])
+        segment_sql, segment_params = _segment_clause(segment_filters)
+        where_clauses.append(segment_sql)
+        params.extend(segment_params)
+    return where_clauses, params
 
-    try:
-        engine = _get_db_engine()
-        raw_conn = engine.raw_connection()
-        try:
-            cur = raw_conn.cursor()
-            cur.execute(
-                f"""
-                  SELECT doc_filename, doc_path_lower, chunk_index, chunk_text,
-                      metadata,
-                       marca, familia_producto, tipo_documento,
-                       1 - (embedding <=> %s::vector) AS similarity
-                                FROM public.agent_technical_doc_chunk
-                                    WHERE {' AND '.join(where_clauses)}
-                ORDER BY embedding <=> %s::vector
+
+def _vector_chunk_branch(source: str, where_clauses: list[str], params: list, top_k: int) -> tuple[str, list]:
+    source_sql, where_sql, params = _chunk_table_source(where_clauses, params, top_k)
+    return (
+        f"""
+        SELECT '{source}'::text AS source, doc_filename, doc_path_lower, chunk_index, chunk_text, metadata,
+               marca, familia_producto, tipo_documento, NULL::text AS canonical_family, NULL::text AS summary_text,
+               1 - (embedding <=> {_RAG_QUERY_VECTOR}) AS similarity
+        FROM {source_sql}
+        WHERE {where_sql}
+        ORDER BY embedding <=> {_RAG_QUERY_VECTOR}
+        LIMIT %s
+        """,
+        params,
+    )
+
+
+def _hybrid_chunk_branch(source: str, where_clauses: list[str], params: list, top_k: int) -> tuple[str, list]:
+    """ANN + texto completo fusionados por RRF en una sola rama.
+
+    ``ann``: candidatos del índice vectorial del nivel activo, rankeados por
+    distancia exacta. ``fts``: coincidencias de ``chunk_tsv`` rankeadas por
+    ``ts_rank_cd``. Cada fila suma 1 / (k + rank) por cada lista en la que
+    aparece. La similitud devuelta sigue siendo la coseno exacta (los
+    umbrales de los llamadores no cambian); el orden es el de la fusión.
+    """
+    where_sql = " AND ".join(where_clauses)
+    candidates = hybrid_candidate_limit(top_k)
+    ts_rank_sql = f"ts_rank_cd({CHUNK_TSVECTOR_COLUMN}, {_RAG_QUERY_TSQUERY}, 1)"
+    return (
+        f"""
+        WITH ann AS (
+            SELECT id, row_number() OVER (ORDER BY embedding <=> {_RAG_QUERY_VECTOR}) AS rank
+            FROM (
+                SELECT id, embedding
+                FROM public.agent_technical_doc_chunk
+                WHERE {where_sql}
+                ORDER BY {vector_distance_sql(_rag_vector_tier())}
                 LIMIT %s
-                """,
-                params,
-            )
-            columns = [desc[0] for desc in cur.description]
-            return [dict(zip(columns, row)) for row in cur.fetchall()]
-        finally:
-            raw_conn.close()
-    except Exception:
-        return []
+            ) AS ann_candidates
+        ), fts AS (
+            SELECT id, row_number() OVER (ORDER BY {ts_rank_sql} DESC, id) AS rank
+            FROM public.agent_technical_doc_chunk
+            WHERE {where_sql} AND {CHUNK_TSVECTOR_COLUMN} @@ {_RAG_QUERY_TSQUERY}
+            ORDER BY {ts_rank_sql} DESC, id
+            LIMIT %s
+        ), fused AS (
+            SELECT id, SUM(1.0 / (%s + rank)) AS rrf_score
+            FROM (SELECT id, rank FROM ann UNION ALL SELECT id, rank FROM fts) AS ranked
+            GROUP BY id
+            ORDER BY rrf_score DESC, id
+            LIMIT %s
+        )
+        SELECT '{source}'::text AS source, c.doc_filename, c.doc_path_lower, c.chunk_index, c.chunk_text, c.metadata,
+               c.marca, c.familia_producto, c.tipo_documento, NULL::text AS canonical_family, NULL::text AS summary_text,
+               1 - (c.embedding <=> {_RAG_QUERY_VECTOR}) AS similarity
+        FROM fused
+        JOIN public.agent_technical_doc_chunk c ON c.id = fused.id
+        ORDER BY fused.rrf_score DESC, similarity DESC
+        """,
+        [*params, candidates, *params, candidates, _env_int("RAG_HYBRID_RRF_K", 60), top_k],
+    )
 
 
-def search_multimodal_product_index(query: str, top_k: int = 3, marca_filter: str | None = None) -> list[dict]:
-    embedding = _generate_query_embedding(query)
-    if not embedding:
-        return []
+def _technical_chunk_branch(top_k: int, marca_filter: str | None, segment_filters: list[str] | None,
+                            metadata_prefilters: dict | None, hybrid: bool = False) -> tuple[str, list]:
+    where_clauses, params = _technical_chunk_filters(marca_filter, segment_filters, metadata_prefilters)
+    if hybrid:
+        return _hybrid_chunk_branch("chunks", where_clauses, params, top_k)
+    return _vector_chunk_branch("chunks", where_clauses, params, top_k)
+
+
+def _guide_branch(top_k: int, marca_filter: str | None, segment_filters: list[str] | None,
+                  hybrid: bool = False) -> tuple[str, list]:
+    where_clauses, params = _guide_filters(marca_filter, segment_filters)
+    if hybrid:
+        return _hybrid_chunk_branch("guides", where_clauses, params, top_k)
+    return _vector_chunk_branch("guides", where_clauses, params, top_k)
+
 
-    embedding_literal = "[" + ",".join(str(v) for v in embedding) + "]"
-    params: list = [embedding_literal]
+# El índice multimodal es opcional (lo crea la ingesta con imágenes): si
+# falta, la sentencia combinada se arma sin esa rama en vez de fallar entera.
+MULTIMODAL_INDEX_TABLE = "public.agent_product_multimodal_index"
+MULTIMODAL_PROBE_RETRY_SECONDS = 300.0
+
+_MULTIMODAL_INDEX_AVAILABLE: bool | None = None
+_MULTIMODAL_PROBED_AT = 0.0
+
+
+def _multimodal_index_available(cur, raw_conn) -> bool:
+    """¿Existe la tabla multimodal? (una consulta por proceso; si falta, se reintenta cada 5 min)."""
+    global _MULTIMODAL_INDEX_AVAILABLE, _MULTIMODAL_PROBED_AT
+    if _MULTIMODAL_INDEX_AVAILABLE or (
+        _MULTIMODAL_INDEX_AVAILABLE is False
+        and time.monotonic() - _MULTIMODAL_PROBED_AT < MULTIMODAL_PROBE_RETRY_SECONDS
+    ):
+        return bool(_MULTIMODAL_INDEX_AVAILABLE)
+    try:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", [MULTIMODAL_INDEX_TABLE])
+        row = cur.fetchone()
+    except Exception:
+        raw_conn.rollback()
+        return False
+    _MULTIMODAL_INDEX_AVAILABLE = bool(row and row[0])
+    _MULTIMODAL_PROBED_AT = time.monotonic()
+    if not _MULTIMODAL_INDEX_AVAILABLE:
+        logger.info("Índice multimodal %s no existe; la búsqueda RAG omite esa rama", MULTIMODAL_INDEX_TABLE)
+    return _MULTIMODAL_INDEX_AVAILABLE
+
+
+def _multimodal_branch(top_k: int, marca_filter: str | None) -> tuple[str, list]:
     where_clauses = ["1=1"]
+    params: list = []
     if marca_filter:
         where_clauses.append("LOWER(marca) = LOWER(%s)")
         params.append(marca_filter)
-    params.extend([embedding_literal, top_k])
+    params.append(top_k)
+    return (
+        f"""
+        SELECT 'multimodal'::text AS source, source_doc_filename AS doc_filename,
+               source_doc_path_lower AS doc_path_lower, NULL::integer AS chunk_index, NULL::text AS chunk_text,
+               metadata, marca, NULL::text AS familia_producto, NULL::text AS tipo_documento,
+               canonical_family, summary_text,
+               1 - (embedding <=> {_RAG_QUERY_VECTOR}) AS similarity
+        FROM {MULTIMODAL_INDEX_TABLE}
+        WHERE {' AND '.join(where_clauses)}
+        ORDER BY embedding <=> {_RAG_QUERY_VECTOR}
+        LIMIT %s
+        """,
+        params,
+    )
+
+
+def _local_hydration_branch(local_hits: dict[str, list[tuple[int, float]]]) -> tuple[str, list]:
+    """Rama que sólo trae texto/metadata por id para los aciertos del índice local."""
+    ids: list[int] = []
+    sources: list[str] = []
+    similarities: list[float] = []
+    for source, hits in local_hits.items():
+        for chunk_id, similarity in hits:
+            ids.append(chunk_id)
+            sources.append(source)
+            similarities.append(similarity)
+    return (
+        """
+        SELECT h.source, c.doc_filename, c.doc_path_lower, c.chunk_index, c.chunk_text, c.metadata,
+               c.marca, c.familia_producto, c.tipo_documento, NULL::text AS canonical_family, NULL::text AS summary_text,
+               h.similarity
+        FROM unnest(%s::bigint[], %s::text[], %s::float8[]) AS h(id, source, similarity)
+        JOIN public.agent_technical_doc_chunk c ON c.id = h.id
+        """,
+        [ids, sources, similarities],
+    )
+
+
+def _search_local_index(embedding: list[float], chunks_top_k: int, guides_top_k: int, marca_filter: str | None,
+                        segment_filters: list[str] | None, metadata_prefilters: dict | None) -> dict[str, list[tuple[int, float]]]:
+    hits: dict[str, list[tuple[int, float]]] = {}
+    for source, top_k in (("chunks", chunks_top_k), ("guides", guides_top_k)):
+        if top_k > 0:
+            hits[source] = local_vector_index.search(
+                embedding,
+                source=source,
+                top_k=top_k,
+                marca_filter=marca_filter,
+                segment_filters=segment_filters,
+                metadata_prefilters=metadata_prefilters if source == "chunks" else None,
+                distance_threshold=_distance_threshold() if source == "chunks" else 0.0,
+            )
+    return hits
+
+
+def _refresh_local_index_generation(cur, raw_conn) -> None:
+    """Generación de los chunks en BD (a lo sumo una consulta por minuto; NOTIFY la adelanta)."""
+    if not local_vector_index.needs_db_generation():
+        return
+    try:
+        cur.execute("SELECT generation FROM public.agent_refresh_generation WHERE scope = %s", [CHUNK_INDEX_SCOPE])
+        row = cur.fetchone()
+        local_vector_index.note_db_generation(row[0] if row else None)
+    except Exception:
+        raw_conn.rollback()
+        local_vector_index.note_db_generation(None)
+
+
+def _statement_timeout_sql() -> str:
+    timeout_ms = _env_int("RAG_PGVECTOR_STATEMENT_TIMEOUT_MS", 1500)
+    return f"SET LOCAL statement_timeout = {max(1, timeout_ms)};\n"
+
+
+def _shape_rag_index_row(row: dict) -> dict:
+    """Re-proyecta una fila de la consulta combinada a la forma histórica de su fuente."""
+    if row["source"] == "multimodal":
+        return {
+            "canonical_family": row["canonical_family"],
+            "source_doc_filename": row["doc_filename"],
+            "source_doc_path_lower": row["doc_path_lower"],
+            "marca": row["marca"],
+            "summary_text": row["summary_text"],
+            "metadata": row["metadata"],
+            "similarity": row["similarity"],
+        }
+    return {
+        "doc_filename": row["doc_filename"],
+        "doc_path_lower": row["doc_path_lower"],
+        "chunk_index": row["chunk_index"],
+        "chunk_text": row["chunk_text"],
+        "metadata": row["metadata"],
+        "marca": row["marca"],
+        "familia_producto": row["familia_producto"],
+        "tipo_documento": row["tipo_documento"],
+        "similarity": row["similarity"],
+    }
+
+
+def search_rag_indexes(query: str, *, chunks_top_k: int = 5, guides_top_k: int = 3, multimodal_top_k: int = 3,
+                       marca_filter: str | None = None, segment_filters: list[str] | None = None,
+                       metadata_prefilters: dict | None = None) -> dict[str, list[dict]]:
+    """Busca en fichas técnicas, guías e índice multimodal en un solo viaje a la BD.
+
+    Devuelve ``{"chunks": [...], "guides": [...], "multimodal": [...]}`` con
+    las mismas filas que las funciones individuales. Una fuente con
+    ``top_k <= 0`` no se consulta. El índice multimodal sólo filtra por
+    marca (igual que ``search_multimodal_product_index``) y se omite si su
+    tabla no existe. Si la sentencia combinada falla, cada índice se
+    consulta por separado y sólo la fuente que falla queda vacía.
+    """
+    results: dict[str, list[dict]] = {"chunks": [], "guides": [], "multimodal": []}
+    if chunks_top_k <= 0 and guides_top_k <= 0 and multimodal_top_k <= 0:
+        return results
+
+    def _branches(hybrid: bool, multimodal: bool) -> list[tuple[str, tuple[str, list]]]:
+        branches: list[tuple[str, tuple[str, list]]] = []
+        if chunks_top_k > 0:
+            branches.append(("chunks", _technical_chunk_branch(
+                chunks_top_k, marca_filter, segment_filters, metadata_prefilters, hybrid)))
+        if guides_top_k > 0:
+            branches.append(("guides", _guide_branch(guides_top_k, marca_filter, segment_filters, hybrid)))
+        if multimodal:
+            branches.append(("multimodal", _multimodal_branch(multimodal_top_k, marca_filter)))
+        return branches
+
+    embedding = _generate_query_embedding(query)
+    if not embedding:
+        return results
+
+    def _max_limit(hybrid: bool) -> int:
+        # El LIMIT más grande (candidatos cuantizados/híbridos incluidos) acota ef_search por abajo.
+        max_limit = max(chunks_top_k, guides_top_k, multimodal_top_k)
+        if chunks_top_k > 0 or guides_top_k > 0:
+            if hybrid:
+                max_limit = max(max_limit, hybrid_candidate_limit(max(chunks_top_k, guides_top_k)))
+            elif _rag_vector_tier() != "exact":
+                max_limit = max(max_limit, quantized_candidate_limit(max(chunks_top_k, guides_top_k)))
+        return max_limit
+
+    filtered = bool(marca_filter or segment_filters or metadata_prefilters)
+    local_mode = local_index_mode()
+
+    def _statement(statement_branches: list[tuple[str, tuple[str, list]]], session_sql: str) -> tuple[str, list]:
+        params: list = []
+        union_sql = "\nUNION ALL\n".join(f"({branch_sql})" for _, (branch_sql, _) in statement_branches)
+        for _, (_, branch_params) in statement_branches:
+            params.extend(branch_params)
+        if _RAG_QUERY_VECTOR not in union_sql:
+            return session_sql + union_sql, params
+        if _RAG_QUERY_TSQUERY in union_sql:
+            return (
+                session_sql
+                + f"""
+                WITH q AS MATERIALIZED (SELECT %s::vector AS embedding, {fulltext_query_sql()} AS tsq)
+                {union_sql}
+                """,
+                [_vector_param(embedding), query, *params],
+            )
+        return (
+            session_sql
+            + f"""
+                WITH q AS MATERIALIZED (SELECT %s::vector AS embedding)
+                {union_sql}
+                """,
+            [_vector_param(embedding), *params],
+        )
 
     try:
         engine = _get_db_engine()
         raw_conn = engine.raw_connection()
         try:
             cur = raw_conn.cursor()
-            cur.execute(
-                f"""
-                    SELECT canonical_family, source_doc_filename, source_doc_path_lower,
-                           marca, summary_text, metadata,
-                           1 - (embedding <=> %s::vector) AS similarity
-                    FROM public.agent_product_multimodal_index
-                    WHERE {' AND '.join(where_clauses)}
-                    ORDER BY embedding <=> %s::vector
-                    LIMIT %s
-                """,
-                params,
-            )
-            columns = [desc[0] for desc in cur.description]
-            return [dict(zip(columns, row)) for row in cur.fetchall()]
+            hybrid = (chunks_top_k > 0 or guides_top_k > 0) and _hybrid_search_enabled(cur, query)
+            multimodal = multimodal_top_k > 0 and _multimodal_index_available(cur, raw_conn)
+            branches = _branches(hybrid, multimodal)
+            session_sql = hnsw_session_sql(_max_limit(hybrid), filtered, _pgvector_version(cur))
+            local_hits = None
+            if local_mode != "off":
+                _refresh_local_index_generation(cur, raw_conn)
+                if local_mode == "fallback":
+                    # Postgres lento = error rápido y respuesta desde el índice local.
+                    session_sql = _statement_timeout_sql() + session_sql
+                elif local_vector_index.is_current() and (chunks_top_k > 0 or guides_top_k > 0):
+                    local_hits = _search_local_index(
+                        embedding, chunks_top_k, guides_top_k, marca_filter, segment_filters, metadata_prefilters,
+                    )
+            if local_hits is not None:
+                statement_branches = [("local", _local_hydration_branch(local_hits))]
+                statement_branches.extend(branch for branch in branches if branch[0] == "multimodal")
+            else:
+                statement_branches = branches
+            # SET LOCAL + búsqueda en un solo execute: sigue siendo un viaje.
+            try:
+                cur.execute(*_statement(statement_branches, session_sql))
+                rows = cur.fetchall()
+            except Exception as exc:
+                raw_conn.rollback()
+                if local_mode == "fallback" and local_vector_index.is_current() and (chunks_top_k > 0 or guides_top_k > 0):
+                    local_hits = _search_local_index(
+                        embedding, chunks_top_k, guides_top_k, marca_filter, segment_filters, metadata_prefilters,
+                    )
+                    logger.warning("Búsqueda pgvector falló/lenta; se responde con el índice vectorial local")
+                    statement_branches = [("local", _local_hydration_branch(local_hits))]
+                    session_sql = ""
+                else:
+                    logger.warning("Búsqueda RAG combinada falló (%s); se consulta cada índice por separado", exc)
+                # Una rama rota (tabla ausente, timeout) no se lleva las filas de las demás.
+                rows = []
+                for source, branch in statement_branches:
+                    try:
+                        cur.execute(*_statement([(source, branch)], session_sql))
+                        rows.extend(cur.fetchall())
+                    except Exception as branch_exc:
+                        raw_conn.rollback()
+                        logger.warning("Búsqueda RAG en %s falló: %s", source, branch_exc)
+            for row in rows:
+                item = dict(zip(_RAG_INDEX_COLUMNS, row))
+                results[item["source"]].append(_shape_rag_index_row(item))
+            if local_hits is not None:
+                # El JOIN de hidratación no preserva el orden del índice local.
+                for source in local_hits:
+                    results[source].sort(key=lambda chunk: chunk.get("similarity") or 0, reverse=True)
+            return results
         finally:
             raw_conn.close()
     except Exception:
-        return []
+        return {"chunks": [], "guides": [], "multimodal": []}
+
+
+def search_technical_chunks(query: str, top_k: int = 5, marca_filter: str | None = None,
+                            segment_filters: list[str] | None = None,
+                            metadata_prefilters: dict | None = None) -> list[dict]:
+    """Semantic search over vectorized technical sheet chunks using pgvector cosine distance.
+
+    Threshold dinámico (Fase C3 HITO 4):
+      Si la variable de entorno ``RAG_PGVECTOR_DISTANCE_THRESHOLD`` está
+      definida con un float > 0, se aplica un filtro adicional en SQL
+      ``(1 - (embedding <=> :q)) >= threshold`` para descartar chunks
+      cuya similitud coseno esté por debajo del umbral.
+
+      Default = 0 = sin filtrado adicional (comportamiento histórico
+      preservado). Se recomienda subir gradualmente (ej. 0.30) tras
+      tuning empírico contra ``test_global_policy_matrix*.py``.
+    """
+    return search_rag_indexes(
+        query,
+        chunks_top_k=top_k,
+        guides_top_k=0,
+        multimodal_top_k=0,
+        marca_filter=marca_filter,
+        segment_filters=segment_filters,
+        metadata_prefilters=metadata_prefilters,
+    )["chunks"]
+
+
+def search_supporting_technical_guides(query: str, top_k: int = 3, marca_filter: str | None = None,
+                                      segment_filters: list[str] | None = None) -> list[dict]:
+    return search_rag_indexes(
+        query,
+        chunks_top_k=0,
+        guides_top_k=top_k,
+        multimodal_top_k=0,
+        marca_filter=marca_filter,
+        segment_filters=segment_filters,
+    )["guides"]
+
+
+def search_multimodal_product_index(query: str, top_k: int = 3, marca_filter: str | None = None) -> list[dict]:
+    return search_rag_indexes(
+        query,
+        chunks_top_k=0,
+        guides_top_k=0,
+        multimodal_top_k=top_k,
+        marca_filter=marca_filter,
+    )["multimodal"]
 
 
 def fetch_technical_profiles(canonical_families: list[str], source_files: list[str] | None = None,
                              limit: int = 3, segment_filters: list[str] | None = None) -> list[dict]:
+    """Perfiles `ready` por familia canónica o archivo fuente, desde `technical_profile_store`.
+
+    Mismo orden (completeness_score DESC, canonical_family) y filtro de
+    segmento que la consulta SQL histórica; sin viaje a la BD salvo al
+    recargar el snapshot tras una ingesta.
+    """
     families = [family for family in canonical_families if family]
     files = [name for name in (source_files or []) if name]
     if not families and not files:
         return []
-
-    try:
-        engine = _get_db_engine()
-        raw_conn = engine.raw_connection()
-        try:
-            cur = raw_conn.cursor()
-            clauses = []
-            params: list = []
-            if families:
-                clauses.append("canonical_family = ANY(%s)")
-                params.append(families)
-            if files:
-                clauses.append("source_doc_filename = ANY(%s)")
-                params.append(files)
-            segment_clause = ""
-            if segment_filters:
-                segment_clause = "AND COALESCE(profile_json -> 'product_identity' ->> 'portfolio_segment', 'portafolio_general') = ANY(%s)"
-                params.append(segment_filters)
-            cur.execute(
-                f"""
-                SELECT canonical_family, source_doc_filename, source_doc_path_lower,
-                       marca, tipo_documento, completeness_score, extraction_status, profile_json
-                FROM public.agent_technical_profile
-                WHERE extraction_status = 'ready'
-                  AND ({' OR '.join(clauses)})
-                  {segment_clause}
-                ORDER BY completeness_score DESC, canonical_family
-                LIMIT %s
-                """,
-                [*params, limit],
-            )
-            columns = [desc[0] for desc in cur.description]
-            rows = []
-            for row in cur.fetchall():
-                item = dict(zip(columns, row))
-                profile_json = item.get("profile_json")
-                if isinstance(profile_json, str):
-                    try:
-                        item["profile_json"] = json.loads(profile_json)
-                    except Exception:
-                        item["profile_json"] = None
-                rows.append(item)
-            return rows
-        finally:
-            raw_conn.close()
-    except Exception:
-        return []
+    return technical_profile_store.find(families, files, limit=limit, segment_filters=segment_filters) or []
 
 
-def build_rag_context(chunks: list[dict], max_chunks: int = 4) -> str:
+def build_rag_context(chunks: list[dict], max_chunks: int = 4, token_budget: Optional[int] = None) -> str:
     """Build a textual context from RAG chunks for injection into the agent prompt.
 
     Skips FDS/HDS (safety data sheet) chunks entirely — they contain chemical
     hazard classifications and transport regulations that add noise and zero
     value for product recommendation.  Only FT (ficha técnica) content is
     useful for advising customers.
+
+    Near-duplicate passages are dropped and adjacent chunks of the same
+    document are merged. Only when `token_budget` is given is the result
+    packed into that many tokens (see `rag_context.pack_rag_context`).
     """
-    if not chunks:
-        return ""
-    parts = []
-    seen_files = set()
-    seen_signatures = set()
-    for chunk in chunks[:max_chunks + 4]:  # read more to compensate for FDS skips
-        if len(parts) >= max_chunks:
-            break
-        similarity = chunk.get("similarity", 0)
-        if similarity < 0.25:
-            continue
-        filename = chunk.get("doc_filename", "desconocido")
-        # Skip FDS/HDS safety data sheets — no recommendation value
-        fn_upper = (filename or "").upper()
-        if fn_upper.startswith("FDS") or fn_upper.startswith("HDS"):
-            continue
-        text_content = (chunk.get("chunk_text") or "").strip()
-        if not text_content:
-            continue
-        metadata = chunk.get("metadata") or {}
-        canonical_family = metadata.get("canonical_family") or chunk.get("familia_producto") or filename
-        section_match = re.search(r"\[SECCIÓN:\s*([^\]]+)\]", text_content)
-        section_name = (section_match.group(1).strip().lower() if section_match else "general")
-        signature = f"{canonical_family}|{section_name}"
-        if signature in seen_signatures:
-            continue
-        header = f"[Fuente: {filename}]"
-        parts.append(f"{header}\n{text_content}")
-        seen_files.add(filename)
-        seen_signatures.add(signature)
-    if not parts:
-        return ""
-    return "\n\n---\n\n".join(parts)
+    return pack_rag_context(chunks, max_chunks=max_chunks, token_budget=token_budget).text
 
 
 __all__ = [
     "PORTFOLIO_SEGMENT_ALIASES",
     "PORTFOLIO_SEGMENT_QUERY_HINTS",
     "_generate_query_embedding",
+    "prefetch_query_embeddings",
     "_normalize_portfolio_segment",
     "_infer_portfolio_segments_for_query",
     "_dedupe_preserve_order",
     "_infer_technical_metadata_prefilters",
+    "RAG_VECTOR_TIERS",
+    "PARTIAL_INDEX_SEGMENTS",
+    "TECHNICAL_SHEET_TYPES_SQL",
+    "GUIDE_TYPE_SQL",
+    "PORTFOLIO_SEGMENT_SQL",
+    "hnsw_session_sql",
+    "vector_distance_sql",
+    "CHUNK_TSVECTOR_COLUMN",
+    "CHUNK_TSVECTOR_CONFIG",
+    "hybrid_candidate_limit",
+    "fulltext_query_sql",
+    "search_rag_indexes",
     "search_technical_chunks",
     "search_supporting_technical_guides",
     "search_multimodal_product_index",
     "fetch_technical_profiles",
     "build_rag_context",
+    "pack_rag_context",
+    "RagContextPack",
 ]
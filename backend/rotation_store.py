@@ -0,0 +1,166 @@
+"""Almacén compacto de `rotation_score` (mv_product_rotation) en memoria.
+
+Antes: `fetch_rotation_cache` recargaba toda la MV a un `dict[str, float]`
+cada 5 minutos dentro del request que encontraba el TTL vencido.
+
+Ahora:
+
+  * Snapshot inmutable con un arreglo NumPy ordenado de códigos y un
+    arreglo `float32` paralelo; la búsqueda es binaria (`np.searchsorted`).
+  * El snapshot implementa `Mapping`, así que `rank_product_match_rows`,
+    `smart_score_product` y las búsquedas smart lo usan igual que el dict
+    anterior, sin copias por request.
+  * Cada snapshot recuerda la *refresh generation* de la MV; sólo se
+    recarga cuando la generación en BD cambia (la sube
+    `fn_bump_refresh_generation` al refrescar la vista). La recarga la hace
+    un hilo en segundo plano (al arrancar, por NOTIFY o por el chequeo
+    periódico) y se publica con un swap atómico; mientras corre, los
+    requests siguen leyendo el snapshot anterior.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from typing import Any, Iterable, Iterator, Optional
+
+import numpy as np
+
+logger = logging.getLogger("ferreinox_agent.rotation_store")
+
+ROTATION_SCOPE = "mv_product_rotation"
+
+
+class RotationSnapshot(Mapping):
+    """Vista de sólo lectura `producto_codigo -> rotation_score`."""
+
+    __slots__ = ("_codes", "_scores", "generation", "loaded_at")
+
+    def __init__(self, codes: np.ndarray, scores: np.ndarray, generation: Optional[int] = None, loaded_at: float = 0.0):
+        self._codes = codes
+        self._scores = scores
+        self.generation = generation
+        self.loaded_at = loaded_at
+
+    @classmethod
+    def empty(cls) -> "RotationSnapshot":
+        return cls(np.array([], dtype=str), np.array([], dtype=np.float32))
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Any], generation: Optional[int] = None) -> "RotationSnapshot":
+        best: dict[str, float] = {}
+        for code, score in rows:
+            if code is None:
+                continue
+            key = str(code)
+            best[key] = float(score or 0.0)
+        codes = np.array(sorted(best), dtype=str)
+        scores = np.fromiter((best[code] for code in codes), dtype=np.float32, count=len(codes))
+        return cls(codes, scores, generation=generation, loaded_at=time.time())
+
+    def _position(self, key: Any) -> int:
+        if key is None or not len(self._codes):
+            return -1
+        key = str(key)
+        position = int(np.searchsorted(self._codes, key))
+        if position < len(self._codes) and self._codes[position] == key:
+            return position
+        return -1
+
+    def __getitem__(self, key: Any) -> float:
+        position = self._position(key)
+        if position < 0:
+            raise KeyError(key)
+        return float(self._scores[position])
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        position = self._position(key)
+        return float(self._scores[position]) if position >= 0 else default
+
+    def __contains__(self, key: object) -> bool:
+        return self._position(key) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(code) for code in self._codes)
+
+    def __len__(self) -> int:
+        return int(len(self._codes))
+
+    def scores_for(self, keys: Iterable[Any], default: float = 0.0) -> np.ndarray:
+        """Búsqueda vectorizada: un `float32` por clave, `default` si no existe."""
+        query = np.array([str(key) for key in keys], dtype=str)
+        result = np.full(len(query), default, dtype=np.float32)
+        if not len(query) or not len(self._codes):
+            return result
+        positions = np.searchsorted(self._codes, query)
+        in_range = positions < len(self._codes)
+        found = np.zeros(len(query), dtype=bool)
+        found[in_range] = self._codes[positions[in_range]] == query[in_range]
+        result[found] = self._scores[positions[found]]
+        return result
+
+    def nbytes(self) -> int:
+        return int(self._codes.nbytes + self._scores.nbytes)
+
+
+class RotationStore:
+    """Contenedor thread-safe del snapshot vigente."""
+
+    def __init__(self):
+        self._snapshot = RotationSnapshot.empty()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._rerun = False
+        self._last_check = 0.0
+
+    def snapshot(self) -> RotationSnapshot:
+        # Lectura de una referencia: atómica en CPython, sin lock.
+        return self._snapshot
+
+    def publish(self, snapshot: RotationSnapshot) -> None:
+        with self._lock:
+            self._snapshot = snapshot
+            self._last_check = time.time()
+        logger.info(
+            "RotationStore: %d códigos (%.1f KB), generación %s",
+            len(snapshot), snapshot.nbytes() / 1024, snapshot.generation,
+        )
+
+    def is_loaded(self) -> bool:
+        return self._snapshot.loaded_at > 0
+
+    @property
+    def generation(self) -> Optional[int]:
+        return self._snapshot.generation
+
+    def mark_checked(self) -> None:
+        with self._lock:
+            self._last_check = time.time()
+
+    def check_due(self, interval_seconds: float) -> bool:
+        with self._lock:
+            return time.time() - self._last_check >= interval_seconds
+
+    def try_begin_refresh(self) -> bool:
+        """Toma el turno de recarga; si ya hay una en curso, le pide repetir al terminar."""
+        with self._lock:
+            if self._refreshing:
+                self._rerun = True
+                return False
+            self._refreshing = True
+            return True
+
+    def end_refresh(self) -> bool:
+        """Suelta el turno; True si durante la recarga llegó otro pedido (el turno sigue tomado)."""
+        with self._lock:
+            if self._rerun:
+                self._rerun = False
+                return True
+            self._refreshing = False
+            return False
+
+
+# Singleton compartido por el proceso.
+rotation_store = RotationStore()
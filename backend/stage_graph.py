@@ -0,0 +1,127 @@
+"""Ejecución concurrente de etapas con dependencias (DAG) y timeout por etapa.
+
+Pensado para handlers que encadenan búsquedas independientes (embedding +
+pgvector, perfiles técnicos, conocimiento experto...). Cada etapa declara de
+qué etapas depende; arranca en cuanto sus entradas están listas, así la
+latencia total se acerca a la ruta crítica y no a la suma.
+
+Reglas:
+
+  * Las dependencias deben estar declaradas antes (`add` en orden
+    topológico): no puede haber ciclos.
+  * La función de una etapa recibe los resultados de sus dependencias como
+    argumentos posicionales, en el orden declarado.
+  * Si una etapa lanza excepción o excede su timeout, su resultado es el
+    `default` declarado y las dependientes siguen con ese valor. El hilo
+    que excedió el timeout no se puede matar; su resultado se descarta.
+  * Los resultados se leen por nombre, nunca por orden de llegada: el
+    merge aguas abajo es determinístico.
+"""
+
+from __future__ import annotations
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("ferreinox_agent.stage_graph")
+
+
+@dataclass
+class _Stage:
+    name: str
+    fn: Callable[..., Any]
+    deps: tuple[str, ...]
+    timeout: Optional[float]
+    default: Any
+
+
+@dataclass
+class StageResults:
+    values: dict[str, Any] = field(default_factory=dict)
+    timings_ms: dict[str, int] = field(default_factory=dict)
+    failures: dict[str, str] = field(default_factory=dict)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values[name]
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.values.get(name, default)
+
+
+class StageGraph:
+    def __init__(self, default_timeout: Optional[float] = None, max_workers: Optional[int] = None):
+        self._stages: dict[str, _Stage] = {}
+        self._default_timeout = default_timeout
+        self._max_workers = max_workers
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        *,
+        deps: tuple[str, ...] | list[str] = (),
+        timeout: Optional[float] = None,
+        default: Any = None,
+    ) -> None:
+        if name in self._stages:
+            raise ValueError(f"Etapa duplicada: {name}")
+        missing = [dep for dep in deps if dep not in self._stages]
+        if missing:
+            raise ValueError(f"La etapa {name} depende de etapas no declaradas: {missing}")
+        self._stages[name] = _Stage(
+            name=name,
+            fn=fn,
+            deps=tuple(deps),
+            timeout=self._default_timeout if timeout is None else timeout,
+            default=default,
+        )
+
+    def run(self) -> StageResults:
+        results = StageResults()
+        if not self._stages:
+            return results
+        workers = self._max_workers or len(self._stages)
+        executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="stage")
+        pending = dict(self._stages)
+        running: dict[Future, tuple[_Stage, float]] = {}
+        try:
+            while pending or running:
+                # Orden de declaración: el envío también es determinístico.
+                for name in [n for n, stage in pending.items() if all(dep in results.values for dep in stage.deps)]:
+                    stage = pending.pop(name)
+                    args = [results.values[dep] for dep in stage.deps]
+                    running[executor.submit(stage.fn, *args)] = (stage, time.monotonic())
+
+                deadlines = [started + stage.timeout for stage, started in running.values() if stage.timeout is not None]
+                wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                done, _ = wait(list(running), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, started = running.pop(future)
+                    self._record(results, stage, started, future)
+
+                now = time.monotonic()
+                for future, (stage, started) in list(running.items()):
+                    if stage.timeout is not None and now - started >= stage.timeout and not future.done():
+                        running.pop(future)
+                        future.cancel()
+                        results.values[stage.name] = stage.default
+                        results.timings_ms[stage.name] = int((now - started) * 1000)
+                        results.failures[stage.name] = "timeout"
+                        logger.warning("Etapa %s excedió %.1fs; se usa el valor por defecto", stage.name, stage.timeout)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    @staticmethod
+    def _record(results: StageResults, stage: _Stage, started: float, future: Future) -> None:
+        results.timings_ms[stage.name] = int((time.monotonic() - started) * 1000)
+        try:
+            results.values[stage.name] = future.result()
+        except Exception as exc:
+            results.values[stage.name] = stage.default
+            results.failures[stage.name] = f"{type(exc).__name__}: {exc}"
+            logger.warning("Etapa %s falló: %s", stage.name, exc)
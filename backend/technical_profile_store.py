@@ -0,0 +1,231 @@
+"""Perfiles técnicos (`agent_technical_profile`) en memoria.
+
+`fetch_technical_profiles` iba a Postgres en cada llamada (dos veces por
+invocación de la herramienta técnica, más la ruta de asesoría y el admin)
+y re-decodificaba `profile_json`; `validador_pedido` cargaba la tabla
+entera con su propio engine. Los perfiles sólo cambian al reingerir.
+
+Diseño:
+
+  * Un snapshot por worker con los perfiles `ready` ya parseados, en el
+    orden de la consulta histórica (completeness_score DESC,
+    canonical_family).
+  * Índices por familia canónica, archivo fuente y alias (display_name y
+    `product_identity.aliases`, en minúsculas).
+  * Se recarga cuando sube la generación `agent_technical_profile`
+    (la ingesta la sube al terminar; NOTIFY la adelanta) o, sin
+    generación, por TTL.
+  * Los `profile_json` devueltos se comparten entre llamadas: son de sólo
+    lectura.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("ferreinox_agent.technical_profile_store")
+
+PROFILE_SCOPE = "agent_technical_profile"
+_LOAD_RETRY_SECONDS = 30.0
+
+EngineFactory = Callable[[], Any]
+
+
+def _parse_profile_json(value: Any) -> Optional[dict]:
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except Exception:
+            return None
+    return value
+
+
+def _profile_segment(profile_json: Optional[dict]) -> str:
+    identity = (profile_json or {}).get("product_identity") or {}
+    return identity.get("portfolio_segment") or "portafolio_general"
+
+
+class ProfileSnapshot:
+    def __init__(self, rows: list[dict], generation: Optional[int]):
+        self.generation = generation
+        self.loaded_at = time.time()
+        self.rows = rows
+        self.segments = [_profile_segment(row.get("profile_json")) for row in rows]
+        self.by_family: dict[str, list[int]] = {}
+        self.by_file: dict[str, list[int]] = {}
+        self.by_alias: dict[str, list[int]] = {}
+        for index, row in enumerate(rows):
+            if row.get("canonical_family"):
+                self.by_family.setdefault(row["canonical_family"], []).append(index)
+            if row.get("source_doc_filename"):
+                self.by_file.setdefault(row["source_doc_filename"], []).append(index)
+            identity = (row.get("profile_json") or {}).get("product_identity") or {}
+            names = [row.get("canonical_family"), identity.get("display_name"), *(identity.get("aliases") or [])]
+            for name in names:
+                alias = str(name or "").strip().lower()
+                if alias and index not in self.by_alias.get(alias, ()):
+                    self.by_alias.setdefault(alias, []).append(index)
+        # Alias más largos primero: "koraza elastomérica" gana a "koraza".
+        self.alias_scan = sorted(self.by_alias, key=len, reverse=True)
+
+
+class TechnicalProfileStore:
+    def __init__(self, engine_factory: Optional[EngineFactory] = None, ttl_seconds: float = 600.0):
+        self._engine_factory = engine_factory
+        self._ttl_seconds = float(ttl_seconds)
+        self._snapshot: Optional[ProfileSnapshot] = None
+        self._checked_at = 0.0
+        self._stale = True
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._counters = {"lookups": 0, "loads": 0, "load_errors": 0}
+
+    def bind_engine(self, engine_factory: EngineFactory) -> None:
+        self._engine_factory = engine_factory
+
+    def is_bound(self) -> bool:
+        return self._engine_factory is not None
+
+    # ── Carga ───────────────────────────────────────────────────────────
+    def snapshot(self) -> Optional[ProfileSnapshot]:
+        current = self._snapshot
+        if current is not None and not self._stale and time.time() - self._checked_at < self._ttl_seconds:
+            return current
+        self._refresh()
+        return self._snapshot
+
+    def _refresh(self) -> None:
+        if not self._refresh_lock.acquire(blocking=self._snapshot is None):
+            return  # otro hilo ya recarga; se responde con el snapshot vigente
+        try:
+            current = self._snapshot
+            if current is not None and not self._stale and time.time() - self._checked_at < self._ttl_seconds:
+                return
+            if self._engine_factory is None:
+                return
+            invalidations = self._invalidations
+            try:
+                engine = self._engine_factory()
+                generation = self._read_generation(engine)
+                if current is not None and not self._stale and generation is not None and generation == current.generation:
+                    self._checked_at = time.time()
+                    return
+                rows = self._load_rows(engine)
+            except Exception as exc:
+                self._counters["load_errors"] += 1
+                self._checked_at = time.time() - self._ttl_seconds + _LOAD_RETRY_SECONDS
+                logger.debug("technical_profile_store: carga falló: %s", exc)
+                return
+            snapshot = ProfileSnapshot(rows, generation)
+            with self._lock:
+                self._snapshot = snapshot
+                # Una invalidación que llegó durante la carga obliga a recargar otra vez.
+                self._stale = invalidations != self._invalidations
+                self._checked_at = time.time()
+                self._counters["loads"] += 1
+            logger.info("technical_profile_store: %s perfiles, generación %s", len(rows), generation)
+        finally:
+            self._refresh_lock.release()
+
+    @staticmethod
+    def _read_generation(engine) -> Optional[int]:
+        try:
+            from cache_invalidation import fetch_refresh_generation
+        except ImportError:
+            from backend.cache_invalidation import fetch_refresh_generation
+
+        with engine.connect() as connection:
+            return fetch_refresh_generation(connection, PROFILE_SCOPE)
+
+    @staticmethod
+    def _load_rows(engine) -> list[dict]:
+        from sqlalchemy import text
+
+        with engine.connect() as connection:
+            result = connection.execute(
+                text(
+                    """
+                    SELECT canonical_family, source_doc_filename, source_doc_path_lower,
+                           marca, tipo_documento, completeness_score, extraction_status, profile_json
+                    FROM public.agent_technical_profile
+                    WHERE extraction_status = 'ready'
+                    ORDER BY completeness_score DESC, canonical_family
+                    """
+                )
+            ).mappings().all()
+        rows = []
+        for record in result:
+            row = dict(record)
+            row["profile_json"] = _parse_profile_json(row.get("profile_json"))
+            rows.append(row)
+        return rows
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._stale = True
+
+    def on_generation(self, payload: Optional[dict]) -> None:
+        """Handler de REFRESH_GENERATION_CHANNEL."""
+        scope = (payload or {}).get("scope")
+        if scope not in (None, PROFILE_SCOPE):
+            return
+        current = self._snapshot
+        if current is None or (payload or {}).get("generation") != current.generation:
+            self.invalidate()
+
+    # ── Consultas ───────────────────────────────────────────────────────
+    def find(self, canonical_families: list[str], source_files: list[str] | None = None,
+             limit: int = 3, segment_filters: list[str] | None = None) -> Optional[list[dict]]:
+        """Perfiles por familia o archivo (mismo orden y filtros que la consulta SQL).
+
+        None si no hay snapshot (BD no disponible): el llamador decide.
+        """
+        snapshot = self.snapshot()
+        if snapshot is None:
+            return None
+        self._counters["lookups"] += 1
+        indexes: set[int] = set()
+        for family in canonical_families:
+            indexes.update(snapshot.by_family.get(family, ()))
+        for filename in source_files or []:
+            indexes.update(snapshot.by_file.get(filename, ()))
+        if segment_filters:
+            allowed = set(segment_filters)
+            indexes = {index for index in indexes if snapshot.segments[index] in allowed}
+        return [dict(snapshot.rows[index]) for index in sorted(indexes)[:max(0, limit)]]
+
+    def match_product_text(self, product_text: str) -> Optional[dict]:
+        """Primer perfil cuyo alias (familia, display_name o alias) aparece en `product_text`."""
+        normalized = (product_text or "").lower()
+        snapshot = self.snapshot()
+        if not normalized or snapshot is None:
+            return None
+        self._counters["lookups"] += 1
+        for alias in snapshot.alias_scan:
+            if alias in normalized:
+                return dict(snapshot.rows[min(snapshot.by_alias[alias])])
+        return None
+
+    def all_profiles(self) -> list[dict]:
+        snapshot = self.snapshot()
+        return [dict(row) for row in snapshot.rows] if snapshot else []
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            **self._counters,
+            "profiles": len(snapshot.rows) if snapshot else 0,
+            "aliases": len(snapshot.by_alias) if snapshot else 0,
+            "generation": snapshot.generation if snapshot else None,
+            "stale": self._stale,
+        }
+
+
+# Singleton compartido por el proceso; main.py / rag_search enlazan el engine.
+technical_profile_store = TechnicalProfileStore()
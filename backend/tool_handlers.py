@@ -23,6 +23,8 @@ Reglas:
 from __future__ import annotations
 
 import json
+import logging
+import os
 
 # Imports directos desde módulos ya extraídos (sin riesgo de ciclo)
 try:
@@ -31,8 +33,9 @@ try:
         _infer_technical_metadata_prefilters,
         build_rag_context,
         fetch_technical_profiles,
-        search_multimodal_product_index,
-        search_supporting_technical_guides,
+        pack_rag_context,
+        prefetch_query_embeddings,
+        search_rag_indexes,
         search_technical_chunks,
     )
 except ImportError:
@@ -41,11 +44,22 @@ except ImportError:
         _infer_technical_metadata_prefilters,
         build_rag_context,
         fetch_technical_profiles,
-        search_multimodal_product_index,
-        search_supporting_technical_guides,
+        pack_rag_context,
+        prefetch_query_embeddings,
+        search_rag_indexes,
         search_technical_chunks,
     )
 
+try:
+    from rag_result_cache import rag_result_cache
+except ImportError:
+    from backend.rag_result_cache import rag_result_cache
+
+try:
+    from rag_context import default_token_budget, guide_token_budget
+except ImportError:
+    from backend.rag_context import default_token_budget, guide_token_budget
+
 try:
     from policies import _build_hard_policies_for_context
 except ImportError:
@@ -89,6 +103,17 @@ except ImportError:
     )
 
 
+try:
+    from stage_graph import StageGraph
+except ImportError:
+    from backend.stage_graph import StageGraph
+
+logger = logging.getLogger("ferreinox_agent.tool_handlers")
+
+# Timeout por etapa del fan-out RAG (embedding + consulta pgvector).
+RAG_STAGE_TIMEOUT_SECONDS = float(os.getenv("RAG_STAGE_TIMEOUT_SECONDS", "12"))
+
+
 def _main_primitives():
     """Acceso a primitivas aún residentes en ``backend.main``.
 
@@ -151,35 +176,14 @@ def _handle_tool_consultar_conocimiento_tecnico(args, context, conversation_cont
     prefilter_diagnosis = _build_structured_diagnosis(pregunta, producto, 0.0)
     metadata_prefilters = _infer_technical_metadata_prefilters(pregunta, producto, prefilter_diagnosis)
     metadata_prefilter_active = bool(metadata_prefilters.get("canonical_family_patterns") or metadata_prefilters.get("chemical_family_terms"))
-    metadata_prefilter_fallback = False
-
-    chunks = search_technical_chunks(
-        search_query,
-        top_k=6,
-        marca_filter=marca_filter,
-        segment_filters=segment_filters or None,
-        metadata_prefilters=metadata_prefilters if metadata_prefilter_active else None,
-    )
-    guide_chunks = search_supporting_technical_guides(search_query, top_k=3, marca_filter=marca_filter, segment_filters=segment_filters or None)
-    if not chunks and metadata_prefilter_active:
-        metadata_prefilter_fallback = True
-        chunks = search_technical_chunks(search_query, top_k=6, marca_filter=marca_filter, segment_filters=segment_filters or None)
-    segment_fallback_used = False
-    if not chunks and not guide_chunks and segment_filters:
-        chunks = search_technical_chunks(search_query, top_k=6, marca_filter=marca_filter)
-        guide_chunks = search_supporting_technical_guides(search_query, top_k=3, marca_filter=marca_filter)
-        segment_fallback_used = True
-
-    # ── Portfolio-aware second search pass ──────────────────────────
+
+    # ── Portfolio-aware second search pass: términos (CPU puro) ──────
     # If the initial RAG search returned weak/wrong results AND no specific
     # product was provided, try again with portfolio-expanded terms.
-    # Threshold 0.70: most correct product-level queries score >0.70,
-    # so anything below that likely means the RAG didn't find the right product.
-    best_sim_initial = max((c.get("similarity", 0) for c in chunks), default=0)
-    if best_sim_initial < 0.70 and not producto:
+    portfolio_products: list[str] = []
+    if not producto:
         # Extract key terms from the question and expand via portfolio map
         pregunta_norm = primitives.normalize_text_value(pregunta)
-        portfolio_products: list[str] = []
         # Check full question and individual words against PORTFOLIO_CATEGORY_MAP
         for category_key, brand_terms in primitives.PORTFOLIO_CATEGORY_MAP.items():
             if category_key in pregunta_norm or pregunta_norm in category_key:
@@ -193,18 +197,111 @@ def _handle_tool_consultar_conocimiento_tecnico(args, context, conversation_cont
                 for bt in primitives.PORTFOLIO_CATEGORY_MAP[word]:
                     if bt != "__SIN_PRODUCTO_FERREINOX__" and bt not in portfolio_products:
                         portfolio_products.append(bt)
-        # Do targeted RAG searches for top portfolio products
-        if portfolio_products:
-            extra_chunks: list[dict] = []
-            for pp in portfolio_products[:3]:  # Top 3 most relevant
-                pp_chunks = search_technical_chunks(
-                    f"{pp}: {pregunta}",
+    portfolio_products = portfolio_products[:3]  # Top 3 most relevant
+
+    # ── Cache entre turnos: misma consulta + filtros + generación de ingesta ──
+    # Un acierto se salta embedding y recuperación; notas expertas, guía
+    # estructurada e inventario se recalculan siempre.
+    rag_cache_key = None
+    cached_retrieval = None
+    if rag_result_cache.enabled:
+        rag_cache_key = rag_result_cache.key_for(
+            search_query,
+            marca=marca_filter,
+            segments=segment_filters,
+            metadata_prefilters=metadata_prefilters if metadata_prefilter_active else None,
+        )
+        cached_retrieval = rag_result_cache.get(rag_cache_key)
+
+    # ── Fan-out concurrente: cada etapa arranca cuando sus entradas están listas ──
+    # Raíces: búsqueda vectorial combinada (fichas + guías + índice multimodal
+    # en una sola sentencia) y notas expertas. Luego fallbacks → segunda
+    # pasada por portafolio (3 búsquedas en paralelo) → perfiles técnicos.
+    graph = StageGraph(default_timeout=RAG_STAGE_TIMEOUT_SECONDS)
+    graph.add("expert", lambda: fetch_expert_knowledge(f"{producto} {pregunta}", limit=8), default=[])
+    if cached_retrieval is None:
+        graph.add(
+            "primary",
+            lambda: search_rag_indexes(
+                search_query,
+                chunks_top_k=6,
+                guides_top_k=3,
+                multimodal_top_k=3,
+                marca_filter=marca_filter,
+                segment_filters=segment_filters or None,
+                metadata_prefilters=metadata_prefilters if metadata_prefilter_active else None,
+            ),
+            default={"chunks": [], "guides": [], "multimodal": []},
+        )
+
+        def _apply_search_fallbacks(primary: dict) -> dict:
+            chunks = primary["chunks"]
+            guide_chunks = primary["guides"]
+            metadata_fallback = False
+            if not chunks and metadata_prefilter_active:
+                metadata_fallback = True
+                chunks = search_technical_chunks(search_query, top_k=6, marca_filter=marca_filter, segment_filters=segment_filters or None)
+            segment_fallback = False
+            if not chunks and not guide_chunks and segment_filters:
+                unfiltered = search_rag_indexes(
+                    search_query, chunks_top_k=6, guides_top_k=3, multimodal_top_k=0, marca_filter=marca_filter,
+                )
+                chunks = unfiltered["chunks"]
+                guide_chunks = unfiltered["guides"]
+                segment_fallback = True
+            return {
+                "chunks": chunks,
+                "guide_chunks": guide_chunks,
+                "metadata_prefilter_fallback": metadata_fallback,
+                "segment_fallback_used": segment_fallback,
+            }
+
+        graph.add(
+            "fallback",
+            _apply_search_fallbacks,
+            deps=("primary",),
+            timeout=RAG_STAGE_TIMEOUT_SECONDS * 2,
+            default={"chunks": [], "guide_chunks": [], "metadata_prefilter_fallback": False, "segment_fallback_used": False},
+        )
+
+        def _needs_portfolio_pass(fallback_result: dict) -> bool:
+            # Threshold 0.70: most correct product-level queries score >0.70,
+            # so anything below that likely means the RAG didn't find the right product.
+            best_sim_initial = max((c.get("similarity", 0) for c in fallback_result["chunks"]), default=0)
+            return best_sim_initial < 0.70
+
+        def _prefetch_portfolio_embeddings(fallback_result: dict) -> int:
+            # Un solo request batch para las N consultas de portafolio; cada
+            # búsqueda paralela encuentra después su vector en el cache.
+            if not portfolio_products or not _needs_portfolio_pass(fallback_result):
+                return 0
+            return prefetch_query_embeddings([f"{term}: {pregunta}" for term in portfolio_products])
+
+        graph.add("portfolio_embeddings", _prefetch_portfolio_embeddings, deps=("fallback",), default=0)
+
+        def _portfolio_search(portfolio_term: str):
+            def _run(fallback_result: dict, _prefetched: int) -> list[dict]:
+                if not _needs_portfolio_pass(fallback_result):
+                    return []
+                return search_technical_chunks(
+                    f"{portfolio_term}: {pregunta}",
                     top_k=3,
                     marca_filter=marca_filter,
                     segment_filters=segment_filters or None,
                     metadata_prefilters=metadata_prefilters if metadata_prefilter_active else None,
                 )
-                extra_chunks.extend(pp_chunks)
+            return _run
+
+        portfolio_stages = [f"portfolio_{index}" for index in range(len(portfolio_products))]
+        for stage_name, portfolio_term in zip(portfolio_stages, portfolio_products):
+            graph.add(stage_name, _portfolio_search(portfolio_term), deps=("fallback", "portfolio_embeddings"), default=[])
+
+        def _merge_portfolio_chunks(fallback_result: dict, *portfolio_results: list[dict]) -> list[dict]:
+            chunks = fallback_result["chunks"]
+            if not _needs_portfolio_pass(fallback_result) or not portfolio_products:
+                return chunks
+            # Orden fijo por término de portafolio, no por orden de llegada.
+            extra_chunks: list[dict] = [chunk for result in portfolio_results for chunk in result]
             # Merge: keep best chunks from both searches, deduplicate by text
             seen_texts: set[str] = set()
             seen_families: set[str] = set()
@@ -222,7 +319,64 @@ def _handle_tool_consultar_conocimiento_tecnico(args, context, conversation_cont
                 if family_key:
                     seen_families.add(family_key)
                 merged.append(ch)
-            chunks = merged[:8]
+            return merged[:8]
+
+        graph.add("chunks_final", _merge_portfolio_chunks, deps=("fallback", *portfolio_stages), default=[])
+
+        def _chunk_profiles(chunks: list[dict]) -> list[dict]:
+            if not chunks:
+                return []
+            source_files = list(dict.fromkeys(c.get("doc_filename", "") for c in chunks if c.get("similarity", 0) >= 0.25))
+            canonical_families = list(dict.fromkeys(
+                (c.get("metadata") or {}).get("canonical_family") or c.get("familia_producto")
+                for c in chunks
+                if c.get("similarity", 0) >= 0.25
+            ))
+            return fetch_technical_profiles(canonical_families, source_files, limit=3, segment_filters=segment_filters or None)
+
+        def _guide_profiles(fallback_result: dict) -> list[dict]:
+            guide_chunks = fallback_result["guide_chunks"]
+            if not guide_chunks:
+                return []
+            guide_canonical_families = list(dict.fromkeys(
+                (c.get("metadata") or {}).get("canonical_family") or c.get("familia_producto")
+                for c in guide_chunks
+                if c.get("similarity", 0) >= 0.2
+            ))
+            guide_source_files = list(dict.fromkeys(c.get("doc_filename", "") for c in guide_chunks if c.get("similarity", 0) >= 0.2))
+            return fetch_technical_profiles(guide_canonical_families, guide_source_files, limit=3, segment_filters=segment_filters or None)
+
+        graph.add("technical_profiles", _chunk_profiles, deps=("chunks_final",), default=[])
+        graph.add("guide_profiles", _guide_profiles, deps=("fallback",), default=[])
+
+    stages = graph.run()
+    if stages.failures:
+        logger.warning("consultar_conocimiento_tecnico: etapas degradadas %s | tiempos %s", stages.failures, stages.timings_ms)
+    else:
+        logger.debug("consultar_conocimiento_tecnico: tiempos por etapa %s", stages.timings_ms)
+
+    if cached_retrieval is None:
+        retrieval = {
+            "fallback": stages["fallback"],
+            "chunks_final": stages["chunks_final"],
+            "multimodal": stages["primary"]["multimodal"],
+            "technical_profiles": stages["technical_profiles"],
+            "guide_profiles": stages["guide_profiles"],
+        }
+        # Sólo resultados completos: ni etapas degradadas ni vacíos (la búsqueda
+        # devuelve [] también cuando la BD falla).
+        retrieval_failed = any(name != "expert" for name in stages.failures)
+        if rag_cache_key and not retrieval_failed and (retrieval["chunks_final"] or retrieval["fallback"]["guide_chunks"]):
+            rag_result_cache.put(rag_cache_key, retrieval)
+    else:
+        retrieval = cached_retrieval
+        logger.info("consultar_conocimiento_tecnico: recuperación desde rag_result_cache")
+
+    fallback_result = retrieval["fallback"]
+    chunks = retrieval["chunks_final"]
+    guide_chunks = fallback_result["guide_chunks"]
+    metadata_prefilter_fallback = fallback_result["metadata_prefilter_fallback"]
+    segment_fallback_used = fallback_result["segment_fallback_used"]
 
     if not chunks and not guide_chunks:
         return json.dumps(
@@ -232,26 +386,24 @@ def _handle_tool_consultar_conocimiento_tecnico(args, context, conversation_cont
             ensure_ascii=False,
         )
 
-    rag_context = build_rag_context(chunks, max_chunks=4)
-    guide_context = build_rag_context(guide_chunks, max_chunks=2)
+    # Las guías se empacan después de las fichas y descartan lo que ya repiten.
+    rag_pack = pack_rag_context(chunks, max_chunks=4, token_budget=default_token_budget())
+    guide_pack = pack_rag_context(guide_chunks, max_chunks=2, token_budget=guide_token_budget(), exclude=rag_pack.shingle_sets)
+    rag_context = rag_pack.text
+    guide_context = guide_pack.text
+    logger.info(
+        "consultar_conocimiento_tecnico: contexto RAG %s tokens (dedup -%s, presupuesto -%s) | "
+        "guías %s tokens (dedup -%s, presupuesto -%s)",
+        rag_pack.tokens, rag_pack.tokens_saved, rag_pack.tokens_truncated,
+        guide_pack.tokens, guide_pack.tokens_saved, guide_pack.tokens_truncated,
+    )
     source_files = list(dict.fromkeys(c.get("doc_filename", "") for c in chunks if c.get("similarity", 0) >= 0.25))
     best_similarity = max((c.get("similarity", 0) for c in chunks), default=max((c.get("similarity", 0) for c in guide_chunks), default=0))
-    canonical_families = list(dict.fromkeys(
-        (c.get("metadata") or {}).get("canonical_family") or c.get("familia_producto")
-        for c in chunks
-        if c.get("similarity", 0) >= 0.25
-    ))
-    technical_profiles = fetch_technical_profiles(canonical_families, source_files, limit=3, segment_filters=segment_filters or None)
-    guide_canonical_families = list(dict.fromkeys(
-        (c.get("metadata") or {}).get("canonical_family") or c.get("familia_producto")
-        for c in guide_chunks
-        if c.get("similarity", 0) >= 0.2
-    ))
-    guide_source_files = list(dict.fromkeys(c.get("doc_filename", "") for c in guide_chunks if c.get("similarity", 0) >= 0.2))
-    guide_profiles = fetch_technical_profiles(guide_canonical_families, guide_source_files, limit=3, segment_filters=segment_filters or None)
-    multimodal_products = search_multimodal_product_index(search_query, top_k=3, marca_filter=marca_filter)
-
-    expert_notes = fetch_expert_knowledge(f"{producto} {pregunta}", limit=8)
+    technical_profiles = retrieval["technical_profiles"]
+    guide_profiles = retrieval["guide_profiles"]
+    multimodal_products = retrieval["multimodal"]
+
+    expert_notes = stages["expert"]
     structured_diagnosis = _build_structured_diagnosis(pregunta, producto, best_similarity)
     # ── Phase D1: two-pass guide build ───────────────────────────────────
     # Pass 1: preliminary guide from RAG chunks only. Used to derive
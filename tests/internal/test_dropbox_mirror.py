@@ -0,0 +1,196 @@
+import datetime
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+import dropbox
+from dropbox.exceptions import ApiError
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from dropbox_mirror import DropboxMirror
+
+
+ROOT = "/data/FICHAS TÉCNICAS Y HOJAS DE SEGURIDAD"
+MODIFIED = datetime.datetime(2026, 10, 1, 8, 0)
+
+
+def _file(name, rev_number=1, folder=ROOT):
+    path = f"{folder}/{name}"
+    return dropbox.files.FileMetadata(
+        name=name, id=f"id:{abs(hash(path)) % 10 ** 9}", client_modified=MODIFIED, server_modified=MODIFIED,
+        rev=f"{rev_number:012x}", size=1024 * rev_number, path_lower=path.lower(), path_display=path,
+        content_hash=f"{rev_number:064x}",
+    )
+
+
+class FakeDropbox:
+    """Carpeta de Dropbox en memoria con cursores: `v<n>` = cambios desde la posición n del log."""
+
+    page_size = 2
+
+    def __init__(self, files):
+        self.files = {entry.path_lower: entry for entry in files}
+        self.log = []
+        self.expired = set()
+        self.calls = []
+
+    def change(self, entry):
+        self.files[entry.path_lower] = entry
+        self.log.append(entry)
+
+    def delete(self, path_lower):
+        for path in [path for path in self.files if path == path_lower or path.startswith(path_lower + "/")]:
+            del self.files[path]
+        self.log.append(dropbox.files.DeletedMetadata(name=path_lower.rsplit("/", 1)[-1], path_lower=path_lower))
+
+    def _listing(self):
+        folder = dropbox.files.FolderMetadata(name="sub", id="id:folder", path_lower=f"{ROOT.lower()}/sub")
+        return [folder, *self.files.values()]
+
+    def _page(self, entries, offset, prefix):
+        chunk = entries[offset:offset + self.page_size]
+        has_more = offset + self.page_size < len(entries)
+        cursor = f"{prefix}:{offset + self.page_size}" if has_more else f"v{len(self.log)}"
+        return SimpleNamespace(entries=chunk, has_more=has_more, cursor=cursor)
+
+    def files_list_folder(self, path, recursive=False):
+        self.calls.append(("list", path))
+        return self._page(self._listing(), 0, "full")
+
+    def files_list_folder_continue(self, cursor):
+        self.calls.append(("continue", cursor))
+        if cursor in self.expired:
+            raise ApiError("req", dropbox.files.ListFolderContinueError.reset, None, None)
+        prefix, _, offset = cursor.rpartition(":")
+        if prefix == "full":
+            return self._page(self._listing(), int(offset), "full")
+        if prefix:
+            return self._page(self.log[int(prefix[1:]):], int(offset), prefix)
+        return self._page(self.log[int(cursor[1:]):], 0, cursor)
+
+
+class FakeMirrorDatabase:
+    """engine.begin()/connect() mínimos sobre las dos tablas del espejo."""
+
+    def __init__(self):
+        self.rows = {}
+        self.cursors = {}
+        self.fail = False
+
+    def begin(self):
+        if self.fail:
+            raise ConnectionError("postgres caído")
+        return self
+
+    connect = begin
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        if sql.startswith("SELECT cursor"):
+            return SimpleNamespace(scalar=lambda: (self.cursors.get(params["root"]) or {}).get("cursor"))
+        if sql.startswith("SELECT EXTRACT"):
+            state = self.cursors.get(params["root"])
+            return SimpleNamespace(scalar=lambda: None if state is None else state["age"])
+        if sql.startswith("SELECT path_lower, rev"):
+            found = [(path, row["rev"]) for (root, path), row in self.rows.items() if root == params["root"]]
+            return SimpleNamespace(fetchall=lambda: found)
+        if sql.startswith("SELECT name"):
+            found = [{column: row[column] for column in ("name", "path_lower", "size", "content_hash", "rev")}
+                     for (root, path), row in sorted(self.rows.items()) if root == params["root"]]
+            return SimpleNamespace(mappings=lambda: SimpleNamespace(fetchall=lambda: found))
+        if sql.startswith("DELETE FROM public.dropbox_file_mirror"):
+            for path in params["paths"]:
+                self.rows.pop((params["root"], path), None)
+        elif sql.startswith("INSERT INTO public.dropbox_file_mirror"):
+            for row in params:
+                self.rows[(row["root"], row["path_lower"])] = dict(row)
+        elif sql.startswith("INSERT INTO public.dropbox_mirror_cursor"):
+            self.cursors[params["root"]] = {"cursor": params["cursor"], "age": 0.0}
+        return SimpleNamespace()
+
+
+class DropboxMirrorTests(unittest.TestCase):
+    def setUp(self):
+        self.dbx = FakeDropbox([_file("Koraza.pdf"), _file("Pintulux.pdf"), _file("Notas.txt"),
+                                _file("Viniltex.pdf", folder=f"{ROOT}/sub")])
+        self.database = FakeMirrorDatabase()
+        self.mirror = DropboxMirror(ROOT, engine_factory=lambda: self.database)
+
+    def _names(self):
+        return [entry["name"] for entry in self.mirror.entries()]
+
+    def test_first_sync_lists_everything_then_follows_the_cursor(self):
+        first = self.mirror.sync(self.dbx)
+        self.assertEqual(first["mode"], "full")
+        self.assertEqual(first["pages"], 3)
+        self.assertEqual(sorted(entry["name"] for entry in first["changed"]), ["Koraza.pdf", "Pintulux.pdf", "Viniltex.pdf"])
+        self.assertEqual(self._names(), ["Koraza.pdf", "Pintulux.pdf", "Viniltex.pdf"])
+
+        self.dbx.calls.clear()
+        self.assertEqual(self.mirror.sync(self.dbx)["changed"], [])
+        self.assertEqual([call[0] for call in self.dbx.calls], ["continue"])
+
+        self.dbx.change(_file("Koraza.pdf", rev_number=2))
+        self.dbx.change(_file("Pintuco Fill.pdf"))
+        self.dbx.change(_file("Koraza.pdf", rev_number=2))
+        self.dbx.delete(f"{ROOT}/sub".lower())
+        second = self.mirror.sync(self.dbx)
+
+        self.assertEqual(second["mode"], "incremental")
+        self.assertNotIn("list", [call[0] for call in self.dbx.calls])
+        self.assertEqual(sorted(entry["name"] for entry in second["changed"]), ["Koraza.pdf", "Pintuco Fill.pdf"])
+        self.assertEqual(second["deleted"], [f"{ROOT}/sub/viniltex.pdf".lower()])
+        koraza = next(entry for entry in self.mirror.entries() if entry["name"] == "Koraza.pdf")
+        self.assertEqual((koraza["rev"], koraza["size"]), (f"{2:012x}", 2048))
+        self.assertEqual(self._names(), ["Koraza.pdf", "Pintuco Fill.pdf", "Pintulux.pdf"])
+
+    def test_reset_cursor_falls_back_to_full_listing_and_reconciles(self):
+        self.mirror.sync(self.dbx)
+        cursor = self.database.cursors[ROOT.lower()]["cursor"]
+        self.dbx.expired.add(cursor)
+        del self.dbx.files[f"{ROOT}/Pintulux.pdf".lower()]
+
+        result = self.mirror.sync(self.dbx)
+        self.assertEqual(result["mode"], "full")
+        self.assertEqual(result["changed"], [])
+        self.assertEqual(result["deleted"], [f"{ROOT}/Pintulux.pdf".lower()])
+        self.assertEqual(self._names(), ["Koraza.pdf", "Viniltex.pdf"])
+
+    def test_refresh_throttles_syncs_and_degrades_when_dropbox_or_db_fail(self):
+        clients = []
+
+        def factory():
+            clients.append(self.dbx)
+            return self.dbx
+
+        self.assertEqual(len(self.mirror.refresh(factory, max_age_seconds=600)), 3)
+        self.assertEqual(len(self.mirror.refresh(factory, max_age_seconds=600)), 3)
+        self.assertEqual(len(clients), 1)
+
+        self.database.cursors[ROOT.lower()]["age"] = 900.0
+        self.dbx.expired.add(self.database.cursors[ROOT.lower()]["cursor"])
+        self.dbx.files_list_folder = lambda *args, **kwargs: (_ for _ in ()).throw(ConnectionError("dropbox 503"))
+        self.assertEqual(len(self.mirror.refresh(factory, max_age_seconds=600)), 3)
+        self.assertEqual(self.mirror.stats()["sync_errors"], 1)
+
+        del self.dbx.files_list_folder
+        self.database.fail = True
+        walked = self.mirror.refresh(factory, max_age_seconds=600)
+        self.assertEqual(sorted(entry["name"] for entry in walked), ["Koraza.pdf", "Pintulux.pdf", "Viniltex.pdf"])
+        self.assertEqual(self.mirror.stats()["db_errors"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
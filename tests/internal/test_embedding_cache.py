@@ -0,0 +1,307 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+import gemini_embeddings
+from embedding_cache import IngestEmbeddingCache, QueryEmbeddingCache, embedding_cache_key, normalize_query_text
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, text_value):
+        self.calls.append(text_value)
+        return [float(len(text_value)), 0.5, 0.25]
+
+
+class QueryEmbeddingCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache = QueryEmbeddingCache(max_entries=2)
+        self.embedder = CountingEmbedder()
+
+    def _get(self, text_value, model="gemini-embedding-2", dimensions=3):
+        return self.cache.get_or_compute(text_value, model=model, dimensions=dimensions, compute=self.embedder)
+
+    def test_normalized_text_shares_one_embedding(self):
+        first = self._get("Impermeabilizante para techo")
+        second = self._get("  impermeabilizante   PARA techo ")
+        self.assertEqual(first, second)
+        # Se embebe el mismo texto normalizado que forma la clave.
+        self.assertEqual(self.embedder.calls, ["impermeabilizante para techo"])
+        stats = self.cache.stats()
+        self.assertEqual((stats["memory_hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_model_and_dimensions_are_part_of_the_key(self):
+        self._get("koraza")
+        self._get("koraza", model="text-embedding-3-small")
+        self._get("koraza", dimensions=768)
+        self.assertEqual(len(self.embedder.calls), 3)
+        self.assertNotEqual(
+            embedding_cache_key("koraza", "a", 3),
+            embedding_cache_key("koraza", "a", 4),
+        )
+
+    def test_lru_evicts_least_recently_used(self):
+        self._get("uno")
+        self._get("dos")
+        self._get("uno")
+        self._get("tres")
+        self._get("uno")
+        self._get("dos")
+        self.assertEqual(self.embedder.calls, ["uno", "dos", "tres", "dos"])
+
+    def test_failures_and_empty_text_are_not_cached(self):
+        def failing(text_value):
+            raise RuntimeError("quota")
+
+        self.assertIsNone(self.cache.get_or_compute("viniltex", model="m", dimensions=3, compute=failing))
+        self.assertIsNone(self._get("   "))
+        self.assertEqual(self._get("viniltex"), [8.0, 0.5, 0.25])
+        self.assertEqual(self.cache.stats()["compute_errors"], 1)
+
+    def test_unavailable_database_falls_back_to_memory(self):
+        def broken_engine():
+            raise RuntimeError("No se encontró DATABASE_URL")
+
+        cache = QueryEmbeddingCache(engine_factory=broken_engine)
+        with self.assertLogs("ferreinox_agent.embedding_cache", level="WARNING"):
+            cache.get_or_compute("pintura", model="m", dimensions=3, compute=self.embedder)
+        cache.get_or_compute("pintura", model="m", dimensions=3, compute=self.embedder)
+        stats = cache.stats()
+        self.assertEqual(len(self.embedder.calls), 1)
+        self.assertFalse(stats["persistence_enabled"])
+        self.assertEqual(stats["db_errors"], 1)
+
+    def test_batch_sends_only_deduplicated_misses_in_one_call(self):
+        batches = []
+
+        def compute_many(texts):
+            batches.append(list(texts))
+            return [[float(len(text_value)), 0.5, 0.25] for text_value in texts]
+
+        cache = QueryEmbeddingCache(max_entries=10)
+        cache.get_or_compute("koraza", model="m", dimensions=3, compute=self.embedder)
+        vectors = cache.get_or_compute_many(
+            ["koraza", "Viniltex", "viniltex ", "", "pintulux"],
+            model="m",
+            dimensions=3,
+            compute_many=compute_many,
+        )
+        self.assertEqual(batches, [["viniltex", "pintulux"]])
+        self.assertEqual(vectors[0], [6.0, 0.5, 0.25])
+        self.assertEqual(vectors[1], vectors[2])
+        self.assertIsNone(vectors[3])
+        self.assertEqual(vectors[4], [8.0, 0.5, 0.25])
+        self.assertEqual(cache.stats()["memory_hits"], 1)
+
+    def test_batch_failure_returns_none_only_for_misses(self):
+        def failing_many(texts):
+            raise RuntimeError("quota")
+
+        self._get("koraza")
+        vectors = self.cache.get_or_compute_many(
+            ["koraza", "estuco"], model="gemini-embedding-2", dimensions=3, compute_many=failing_many,
+        )
+        self.assertEqual(vectors, [[6.0, 0.5, 0.25], None])
+        self.assertEqual(self.cache.stats()["compute_errors"], 1)
+
+    def test_gemini_batch_embeds_queries_in_one_request(self):
+        calls = []
+
+        def fake_embed(*, model, contents, config):
+            calls.append(contents)
+            return SimpleNamespace(embeddings=[SimpleNamespace(values=[float(i)]) for i, _ in enumerate(contents)])
+
+        fake_types = SimpleNamespace(EmbedContentConfig=lambda **kwargs: kwargs)
+        with mock.patch.object(gemini_embeddings, "get_gemini_client", return_value=(None, fake_types)), \
+                mock.patch.object(gemini_embeddings, "_embed_query_content_with_retry", side_effect=fake_embed):
+            vectors = gemini_embeddings.generate_query_embeddings(["koraza: fachada", "viniltex: fachada"])
+        self.assertEqual(vectors, [[0.0], [1.0]])
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(content.startswith("task: search result | query: ") for content in calls[0]))
+
+    def test_normalize_query_text(self):
+        self.assertEqual(normalize_query_text("  Hola\n  Mundo "), "hola mundo")
+
+
+class FakeQueryCacheTable:
+    """engine.begin() mínimo sobre `query_embedding_cache`."""
+
+    def __init__(self, rows=None):
+        self.rows = dict(rows or {})
+        self.statements = []
+
+    def begin(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.statements.append((sql, params))
+        if sql.startswith("SELECT cache_key, embedding"):
+            found = [(key, self.rows[key]) for key in params["keys"] if key in self.rows]
+            return SimpleNamespace(fetchall=lambda: found)
+        if sql.startswith("INSERT INTO public.query_embedding_cache"):
+            self.rows[params["key"]] = params["embedding"]
+        return SimpleNamespace()
+
+    def hit_updates(self):
+        return [params for sql, params in self.statements if sql.startswith("UPDATE public.query_embedding_cache")]
+
+
+class QueryEmbeddingCachePersistenceTests(unittest.TestCase):
+    def setUp(self):
+        key = embedding_cache_key("koraza fachada", "m", 3)
+        self.table = FakeQueryCacheTable({key: [1.0, 2.0, 3.0]})
+        self.cache = QueryEmbeddingCache(engine_factory=lambda: self.table)
+        self.embedder = CountingEmbedder()
+
+    def _get(self, text_value):
+        return self.cache.get_or_compute(text_value, model="m", dimensions=3, compute=self.embedder)
+
+    def test_db_hits_are_plain_reads_and_misses_store_the_normalized_text(self):
+        self.assertEqual(self._get("Koraza  FACHADA"), [1.0, 2.0, 3.0])
+        self._get("Viniltex Blanco")
+
+        self.assertEqual(self.embedder.calls, ["viniltex blanco"])
+        self.assertEqual(self.table.hit_updates(), [])
+        insert = next(params for sql, params in self.table.statements if sql.startswith("INSERT"))
+        self.assertEqual(insert["normalized_text"], "viniltex blanco")
+        self.assertEqual(insert["key"], embedding_cache_key("viniltex blanco", "m", 3))
+
+    def test_hit_counts_are_flushed_in_one_background_batch(self):
+        self._get("koraza fachada")
+        self._get("KORAZA fachada")
+        self._get("viniltex")
+        self._get("viniltex")
+        self.assertEqual(self.table.hit_updates(), [])
+
+        flushed = []
+        self.cache._hits_flushed_at = 0.0
+        with mock.patch("embedding_cache.threading.Thread") as thread:
+            thread.side_effect = lambda target, args, **kwargs: SimpleNamespace(
+                start=lambda: flushed.append(target(*args)))
+            self._get("koraza fachada")
+        self.assertEqual(len(flushed), 1)
+        updates = self.table.hit_updates()
+        self.assertEqual(len(updates), 1)
+        counts = dict(zip(updates[0]["keys"], updates[0]["hits"]))
+        self.assertEqual(counts, {
+            embedding_cache_key("koraza fachada", "m", 3): 3,
+            embedding_cache_key("viniltex", "m", 3): 1,
+        })
+        self.assertEqual(self.cache.stats()["hit_flushes"], 1)
+
+        self._get("koraza fachada")
+        self.assertEqual(len(self.table.hit_updates()), 1)
+
+
+class FakeEmbeddingTable:
+    """engine.begin() mínimo sobre un dict {(sha, model, dims): vector}."""
+
+    def __init__(self):
+        self.rows = {}
+        self.statements = []
+
+    def begin(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.statements.append(sql)
+        if sql.startswith("UPDATE public.embedding_cache"):
+            found = [(key, self.rows[(key, params["model"], params["dims"])]) for key in params["keys"]
+                     if (key, params["model"], params["dims"]) in self.rows]
+            return SimpleNamespace(fetchall=lambda: found)
+        if sql.startswith("INSERT INTO public.embedding_cache"):
+            for row in params:
+                self.rows.setdefault((row["key"], row["model"], row["dims"]), row["vector"])
+        return SimpleNamespace(fetchall=lambda: [])
+
+
+class IngestEmbeddingCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.table = FakeEmbeddingTable()
+        self.cache = IngestEmbeddingCache(engine_factory=lambda: self.table)
+        self.batches = []
+
+    def _embed(self, texts, model="gemini-embedding-2", dimensions=3):
+        def compute_many(missing):
+            self.batches.append(list(missing))
+            return [[float(len(text_value)), 1.0, 0.0] for text_value in missing]
+
+        return self.cache.get_or_embed(texts, model=model, dimensions=dimensions, content=lambda item: item,
+                                       compute_many=compute_many)
+
+    def test_only_new_content_is_embedded_across_runs(self):
+        first = self._embed(["chunk a", "chunk b", "chunk a"])
+        self.assertEqual(self.batches, [["chunk a", "chunk b"]])
+        self.assertEqual(first[0], first[2])
+
+        self.cache.reset_stats()
+        second = self._embed(["chunk a", "chunk c", "chunk b"])
+        self.assertEqual(self.batches[1:], [["chunk c"]])
+        self.assertEqual(second[0], first[0])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["stored"]), (2, 1, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 0.6667, places=4)
+
+    def test_model_and_dimensions_partition_the_table(self):
+        self._embed(["koraza"])
+        self._embed(["koraza"], model="otro-modelo")
+        self._embed(["koraza"], dimensions=768)
+        self.assertEqual(len(self.batches), 3)
+        self.assertEqual(len(self.table.rows), 3)
+
+    def test_database_outage_still_embeds_everything(self):
+        def broken_engine():
+            raise RuntimeError("sin BD")
+
+        cache = IngestEmbeddingCache(engine_factory=broken_engine)
+        with self.assertLogs("ferreinox_agent.embedding_cache", level="WARNING"):
+            vectors = cache.get_or_embed(["a", "b"], model="m", dimensions=3, content=lambda item: item,
+                                         compute_many=lambda missing: [[1.0, 2.0, 3.0] for _ in missing])
+        self.assertEqual(len(vectors), 2)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_ingestion_embeds_through_the_cache(self):
+        import ingest_technical_sheets
+
+        sent = []
+
+        def fake_embed(documents, sleep_seconds=0.1):
+            sent.append([document["text"] for document in documents])
+            return [[0.1, 0.2, 0.3] for _ in documents]
+
+        with mock.patch.object(ingest_technical_sheets, "ingest_embedding_cache", self.cache), \
+                mock.patch.object(ingest_technical_sheets, "generate_document_embeddings", side_effect=fake_embed), \
+                mock.patch.object(ingest_technical_sheets, "EMBEDDING_DIMENSIONS", 3):
+            ingest_technical_sheets.generate_embeddings(None, ["uno", "dos"])
+            ingest_technical_sheets.generate_embeddings(None, ["dos", "tres"])
+        self.assertEqual(sent, [["uno", "dos"], ["tres"]])
+        self.assertTrue(all(key[1] == gemini_embeddings.EMBEDDING_MODEL for key in self.table.rows))
+
+
+if __name__ == "__main__":
+    unittest.main()
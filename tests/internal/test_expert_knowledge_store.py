@@ -0,0 +1,163 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from expert_knowledge_store import ExpertKnowledgeStore
+
+
+def normalize(value):
+    return " ".join(str(value or "").lower().split())
+
+
+ROWS = [
+    {
+        "id": 1, "tipo": "correccion", "_ts": 30,
+        "contexto_tags": "piso, pintucoat, resistencia, tráfico medio",
+        "nota_comercial": "Pintucoat NO resiste montacargas; usar Intergard 2002.",
+        "producto_recomendado": "Pintucoat", "producto_desestimado": None,
+        "embedding": "[1,0,0]",
+    },
+    {
+        "id": 2, "tipo": "evitar", "_ts": 20,
+        "contexto_tags": "eternit, fibrocemento, techo",
+        "nota_comercial": "Para eternit usar Sellomax.",
+        "producto_recomendado": "Sellomax", "producto_desestimado": "Koraza",
+        "embedding": [0.6, 0.8, 0.0],
+    },
+    {
+        "id": 3, "tipo": "alerta_superficie", "_ts": 10,
+        "contexto_tags": "piso madera, poliuretano, interior",
+        "nota_comercial": "Poliuretano 1550 solo interior; en exterior usar Barnex.",
+        "producto_recomendado": "Poliuretano 1550", "producto_desestimado": "Barnex",
+        "embedding": None,
+    },
+    # Duplicado de la fila 1 (mismo tipo y textos): se descarta al cargar.
+    {
+        "id": 4, "tipo": "correccion", "_ts": 5,
+        "contexto_tags": "piso, pintucoat, resistencia, tráfico medio",
+        "nota_comercial": "Pintucoat NO resiste montacargas; usar Intergard 2002.",
+        "producto_recomendado": "Pintucoat", "producto_desestimado": None,
+        "embedding": "[0,0,1]",
+    },
+]
+
+
+def legacy_keyword_scores(rows, terms, anchor_terms, limit):
+    """Algoritmo histórico de fetch_expert_knowledge (substring sobre textos normalizados)."""
+    scored, seen_keys = [], set()
+    for row in rows:
+        context_text = normalize(row.get("contexto_tags"))
+        note_text = normalize(row.get("nota_comercial"))
+        recommended_text = normalize(row.get("producto_recomendado"))
+        rejected_text = normalize(row.get("producto_desestimado"))
+        searchable = " ".join((context_text, note_text, recommended_text, rejected_text))
+        matched_terms = [t for t in terms if t in searchable]
+        if not matched_terms:
+            continue
+        score, context_hits = 0.0, 0
+        for term in matched_terms:
+            score += 1.0
+            if term in context_text:
+                score += 2.0
+                context_hits += 1
+            elif term in note_text:
+                score += 1.0
+            elif term in recommended_text or term in rejected_text:
+                score += 0.4
+            if len(term) >= 7:
+                score += 0.35
+        anchor_context_hits = sum(1 for term in anchor_terms if term in context_text)
+        if anchor_context_hits:
+            score += 2.5 * anchor_context_hits
+        elif anchor_terms:
+            score -= 1.5
+        if row.get("tipo") == "alerta_superficie" and context_hits:
+            score += 1.5
+        if row.get("tipo") == "evitar" and any(term in rejected_text for term in matched_terms):
+            score += 0.75
+        key = (row.get("tipo") or "", context_text, note_text, recommended_text, rejected_text)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        if score >= 2.0:
+            scored.append((score, len(matched_terms), row))
+    scored.sort(key=lambda item: (-item[0], -item[1], -(item[2].get("_ts") or 0)))
+    return [(row["id"], round(score, 2)) for score, _, row in scored[:limit]]
+
+
+class ExpertKnowledgeStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.loads = 0
+        self.generation = 1
+
+        def loader():
+            self.loads += 1
+            return [dict(row) for row in ROWS]
+
+        self.store = ExpertKnowledgeStore(loader, lambda: self.generation, ttl_seconds=0, normalize=normalize)
+
+    def test_keyword_ranking_matches_legacy_substring_scoring(self):
+        queries = [
+            (["piso", "pintuc", "montacargas"], ["montacargas"]),
+            (["eternit", "koraza"], ["eternit", "koraza"]),
+            (["interior", "usar"], []),
+            (["barnex", "poliuretano"], ["poliuretano"]),
+        ]
+        for terms, anchors in queries:
+            with self.subTest(terms=terms):
+                results = self.store.keyword_search(terms, anchors, limit=5)
+                self.assertEqual(
+                    [(row["id"], row["_expert_score"]) for row in results],
+                    legacy_keyword_scores(ROWS, terms, anchors, 5),
+                )
+        self.assertNotIn("embedding", self.store.rows()[0])
+        self.assertEqual([row["id"] for row in self.store.rows()], [1, 2, 3])
+
+    def test_semantic_search_is_one_matrix_product_with_threshold(self):
+        results = self.store.semantic_search([1.0, 0.1, 0.0], limit=3)
+        self.assertEqual([row["id"] for row in results], [1, 2])
+        self.assertGreater(results[0]["similarity"], results[1]["similarity"])
+        self.assertEqual(self.store.semantic_search([0.0, 0.0, 1.0], limit=3), [])
+        self.assertEqual(self.store.semantic_search([1.0, 0.0], limit=3), [])
+
+    def test_reloads_only_when_generation_changes(self):
+        self.store.rows()
+        self.store.rows()
+        self.assertEqual(self.loads, 1)
+        self.generation = 2
+        self.store.rows()
+        self.assertEqual(self.loads, 2)
+        self.store.on_generation({"scope": "mv_productos", "generation": 9})
+        self.store.rows()
+        self.assertEqual(self.loads, 2)
+        self.store.on_generation({"scope": "agent_expert_knowledge", "generation": 3})
+        self.store.rows()
+        self.assertEqual(self.loads, 3)
+
+    def test_load_failure_keeps_previous_snapshot(self):
+        self.store.rows()
+        self.generation = 2
+
+        def broken():
+            raise RuntimeError("sin BD")
+
+        self.store.bind(broken, lambda: self.generation, normalize=normalize)
+        self.assertEqual(len(self.store.rows()), 3)
+        self.assertEqual(self.store.stats()["load_errors"], 1)
+
+    def test_matrix_rows_are_normalized(self):
+        snapshot = self.store.snapshot()
+        norms = np.linalg.norm(snapshot.matrix[snapshot.has_embedding], axis=1)
+        self.assertTrue(np.allclose(norms, 1.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
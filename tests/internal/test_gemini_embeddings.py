@@ -0,0 +1,159 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from gemini_embeddings import QueryEmbeddingBatcher, TokenBucket
+
+
+class SlowEmbedder:
+    def __init__(self, delay=0.05, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.batches.append(list(texts))
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("quota")
+        return [[float(len(text_value))] for text_value in texts]
+
+
+def run_concurrently(batcher, requests):
+    results = [None] * len(requests)
+    errors = [None] * len(requests)
+    start = threading.Barrier(len(requests))
+
+    def _call(index, texts):
+        start.wait()
+        try:
+            results[index] = batcher.embed(texts)
+        except Exception as exc:
+            errors[index] = exc
+
+    threads = [threading.Thread(target=_call, args=(index, texts)) for index, texts in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+class QueryEmbeddingBatcherTests(unittest.TestCase):
+    def test_concurrent_identical_texts_share_one_call(self):
+        embedder = SlowEmbedder()
+        batcher = QueryEmbeddingBatcher(embedder, window_seconds=0.02)
+        results, errors = run_concurrently(batcher, [["koraza fachada"]] * 6)
+        self.assertEqual(errors, [None] * 6)
+        self.assertEqual(results, [[[14.0]]] * 6)
+        self.assertEqual(embedder.batches, [["koraza fachada"]])
+        self.assertEqual(batcher.stats()["singleflight_hits"], 5)
+
+    def test_concurrent_turns_are_merged_into_one_batch(self):
+        embedder = SlowEmbedder()
+        batcher = QueryEmbeddingBatcher(embedder, window_seconds=0.05)
+        results, _ = run_concurrently(batcher, [["viniltex"], ["pintulux", "koraza"], ["estuco"]])
+        self.assertEqual(len(embedder.batches), 1)
+        self.assertEqual(sorted(embedder.batches[0]), ["estuco", "koraza", "pintulux", "viniltex"])
+        self.assertEqual(results[1], [[8.0], [6.0]])
+        stats = batcher.stats()
+        self.assertEqual((stats["batches"], stats["batch_size_max"]), (1, 4))
+        self.assertGreater(stats["queue_wait_ms_p50"], 0)
+
+    def test_batches_respect_max_items(self):
+        embedder = SlowEmbedder(delay=0)
+        batcher = QueryEmbeddingBatcher(embedder, window_seconds=0, max_items=2)
+        self.assertEqual(batcher.embed(["a", "bb", "ccc"]), [[1.0], [2.0], [3.0]])
+        self.assertEqual(embedder.batches, [["a", "bb"], ["ccc"]])
+
+    def test_failure_reaches_every_waiter_and_is_not_cached(self):
+        embedder = SlowEmbedder(fail=True)
+        batcher = QueryEmbeddingBatcher(embedder, window_seconds=0.02)
+        _, errors = run_concurrently(batcher, [["koraza"], ["koraza"]])
+        self.assertTrue(all(isinstance(error, RuntimeError) for error in errors))
+        embedder.fail = False
+        self.assertEqual(batcher.embed(["koraza"]), [[6.0]])
+        self.assertEqual(batcher.stats()["batch_errors"], 1)
+
+    def test_leader_returns_once_its_own_texts_are_done_and_hands_off(self):
+        release = threading.Event()
+        computed_by = {}
+
+        def embedder(texts):
+            if texts == ["a"]:
+                release.wait(2)
+            computed_by[tuple(texts)] = threading.current_thread().name
+            return [[float(len(text_value))] for text_value in texts]
+
+        batcher = QueryEmbeddingBatcher(embedder, window_seconds=0)
+        results = {}
+        leader = threading.Thread(target=lambda: results.setdefault("a", batcher.embed(["a"])), name="turno-a")
+        follower = threading.Thread(target=lambda: results.setdefault("bb", batcher.embed(["bb"])), name="turno-b")
+        leader.start()
+        time.sleep(0.05)
+        follower.start()
+        time.sleep(0.05)
+        release.set()
+        leader.join(2)
+        follower.join(2)
+
+        self.assertEqual(results, {"a": [[1.0]], "bb": [[2.0]]})
+        self.assertEqual(computed_by, {("a",): "turno-a", ("bb",): "turno-b"})
+        self.assertEqual(batcher.stats()["batches"], 2)
+
+    def test_failed_batch_is_retried_per_text_so_each_caller_gets_its_own_outcome(self):
+        embedder = SlowEmbedder(delay=0)
+        original = embedder.__call__
+
+        def flaky(texts):
+            if "veneno" in texts:
+                raise RuntimeError("texto rechazado")
+            return original(texts)
+
+        batcher = QueryEmbeddingBatcher(flaky, window_seconds=0.05)
+        results, errors = run_concurrently(batcher, [["koraza"], ["veneno"]])
+        self.assertEqual(results[0], [[6.0]])
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], RuntimeError)
+        stats = batcher.stats()
+        self.assertEqual((stats["batch_errors"], stats["single_retries"]), (1, 2))
+
+
+class TokenBucketTests(unittest.TestCase):
+    def test_burst_is_free_then_paced(self):
+        bucket = TokenBucket(rate=20.0, burst=3)
+        started = time.monotonic()
+        waits = [bucket.acquire() for _ in range(5)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertTrue(all(wait_time > 0.03 for wait_time in waits[3:]))
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+        self.assertEqual(bucket.waits, 2)
+
+    def test_sleep_happens_outside_the_lock(self):
+        bucket = TokenBucket(rate=5.0, burst=1)
+        bucket.acquire()
+        waiter = threading.Thread(target=bucket.acquire)
+        waiter.start()
+        time.sleep(0.02)
+        # Otro hilo puede reservar mientras el primero duerme su deuda.
+        self.assertTrue(bucket._lock.acquire(timeout=0.05))
+        bucket._lock.release()
+        waiter.join(2)
+
+    def test_zero_rate_disables_limit(self):
+        bucket = TokenBucket(rate=0)
+        self.assertEqual([bucket.acquire() for _ in range(10)], [0.0] * 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
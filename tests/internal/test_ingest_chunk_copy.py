@@ -0,0 +1,159 @@
+import json
+import os
+import struct
+import sys
+import unittest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+import ingest_technical_sheets
+from ingest_technical_sheets import CHUNK_COPY_COLUMNS, encode_chunk_copy_rows, insert_chunks
+
+
+def _chunk(index, path="/fichas/koraza.pdf", **extra):
+    values = {
+        "doc_filename": "Koraza FT.pdf",
+        "doc_path_lower": path,
+        "chunk_index": index,
+        "chunk_text": f"[PRODUCTO: KORAZA]\nSección {index} — fachadas",
+        "marca": "pintuco",
+        "familia_producto": "KORAZA",
+        "tipo_documento": "ficha_tecnica",
+        "metadata": {"canonical_family": "KORAZA", "ocr_pages": 0},
+        "embedding": [0.5, -1.25, float(index)],
+        "token_count": 12,
+    }
+    values.update(extra)
+    return values
+
+
+def _decode_copy(payload):
+    """Lector mínimo del formato binario de COPY para verificar el stream."""
+    assert payload.startswith(b"PGCOPY\n\xff\r\n\x00")
+    offset = 11 + 8
+    rows = []
+    while True:
+        (fields,) = struct.unpack_from(">h", payload, offset)
+        offset += 2
+        if fields == -1:
+            break
+        row = []
+        for _ in range(fields):
+            (length,) = struct.unpack_from(">i", payload, offset)
+            offset += 4
+            if length == -1:
+                row.append(None)
+                continue
+            row.append(payload[offset:offset + length])
+            offset += length
+        rows.append(row)
+    assert offset == len(payload)
+    return rows
+
+
+class FakeCursor:
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+
+    def execute(self, sql, params=None):
+        statement = " ".join(sql.split())
+        if self.fail_on and self.fail_on in statement:
+            raise RuntimeError("fallo simulado")
+        self.calls.append(("execute", statement))
+
+    def copy_expert(self, sql, stream):
+        self.calls.append(("copy", sql, stream.read()))
+
+
+class FakeRawConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.events = []
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.events.append("commit")
+
+    def rollback(self):
+        self.events.append("rollback")
+
+    def close(self):
+        self.events.append("close")
+
+
+class FakeEngine:
+    def __init__(self, fail_on=None):
+        self.connection = FakeRawConnection(FakeCursor(fail_on))
+
+    def raw_connection(self):
+        return self.connection
+
+
+class ChunkCopyTests(unittest.TestCase):
+    def test_binary_stream_round_trips_text_jsonb_and_vector(self):
+        rows = _decode_copy(encode_chunk_copy_rows([_chunk(0), _chunk(1, marca=None, token_count=None)]))
+        self.assertEqual(len(rows), 2)
+        first = dict(zip(CHUNK_COPY_COLUMNS, rows[0]))
+        self.assertEqual(first["chunk_text"].decode("utf-8"), "[PRODUCTO: KORAZA]\nSección 0 — fachadas")
+        self.assertEqual(struct.unpack(">i", first["chunk_index"])[0], 0)
+        self.assertEqual(first["metadata"][:1], b"\x01")
+        self.assertEqual(json.loads(first["metadata"][1:]), {"canonical_family": "KORAZA", "ocr_pages": 0})
+        dim, unused = struct.unpack_from(">HH", first["embedding"])
+        self.assertEqual((dim, unused), (3, 0))
+        self.assertEqual(list(struct.unpack_from(">3f", first["embedding"], 4)), [0.5, -1.25, 0.0])
+        second = dict(zip(CHUNK_COPY_COLUMNS, rows[1]))
+        self.assertIsNone(second["marca"])
+        self.assertIsNone(second["token_count"])
+
+    def test_vector_encoding_matches_pgvector_adapter_and_fallback(self):
+        packed = struct.pack(">HH3f", 3, 0, 0.5, -1.25, 2.0)
+        self.assertEqual(ingest_technical_sheets._copy_vector([0.5, -1.25, 2.0]), packed)
+        original = ingest_technical_sheets.PgVector
+        ingest_technical_sheets.PgVector = None
+        try:
+            self.assertEqual(ingest_technical_sheets._copy_vector([0.5, -1.25, 2.0]), packed)
+        finally:
+            ingest_technical_sheets.PgVector = original
+
+    def test_replace_copies_then_swaps_in_one_transaction(self):
+        engine = FakeEngine()
+        insert_chunks(engine, [_chunk(0), _chunk(1), _chunk(1, chunk_text="última versión")], replace=True)
+
+        calls = engine.connection.cursor().calls
+        self.assertEqual([call[0] for call in calls], ["execute", "copy", "execute", "execute"])
+        self.assertIn("CREATE TEMP TABLE IF NOT EXISTS agent_chunk_copy_stage", calls[0][1])
+        self.assertIn("ON COMMIT DELETE ROWS", calls[0][1])
+        self.assertIn("FROM STDIN WITH (FORMAT binary)", calls[1][1])
+        copied = _decode_copy(calls[1][2])
+        self.assertEqual(len(copied), 2)
+        self.assertEqual(copied[1][3].decode("utf-8"), "última versión")
+        self.assertTrue(calls[2][1].startswith("DELETE FROM public.agent_technical_doc_chunk"))
+        self.assertIn("INSERT INTO public.agent_technical_doc_chunk", calls[3][1])
+        self.assertIn("SELECT doc_filename, doc_path_lower", calls[3][1])
+        self.assertEqual(engine.connection.events, ["commit", "close"])
+
+    def test_upsert_mode_keeps_other_chunks_and_rolls_back_on_error(self):
+        engine = FakeEngine()
+        insert_chunks(engine, [_chunk(0)])
+        statements = [call[1] for call in engine.connection.cursor().calls if call[0] == "execute"]
+        self.assertFalse(any(statement.startswith("DELETE") for statement in statements))
+
+        failing = FakeEngine(fail_on="INSERT INTO public.agent_technical_doc_chunk")
+        with self.assertRaises(RuntimeError):
+            insert_chunks(failing, [_chunk(0)], replace=True)
+        self.assertEqual(failing.connection.events, ["rollback", "close"])
+
+        untouched = FakeEngine()
+        insert_chunks(untouched, [])
+        self.assertEqual(untouched.connection.events, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from ingest_pipeline import PipelineConfig, StagedIngestPipeline, benchmark_ingest_pipeline
+
+
+def _entries(count):
+    return [{"name": f"ficha_{index}.pdf", "path_lower": f"/fichas/ficha_{index}.pdf"} for index in range(count)]
+
+
+class FakeStages:
+    def __init__(self, write_delay=0.0):
+        self.write_delay = write_delay
+        self.lock = threading.Lock()
+        self.written = []
+        self.batches = []
+        self.writers_active = 0
+        self.max_writers_active = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def download(self, entry):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return entry["name"].encode("utf-8")
+
+    @staticmethod
+    def extract(pdf_bytes):
+        return [{"page_number": 1, "text": pdf_bytes.decode("utf-8")}]
+
+    @staticmethod
+    def prepare(entry, pdf_bytes, pages):
+        return {"entry": entry, "chunks": [f"{pages[0]['text']}#{n}" for n in range(5)]}
+
+    def embed(self, texts):
+        with self.lock:
+            self.batches.append(len(texts))
+        return [[float(len(text_value))] for text_value in texts]
+
+    def write(self, prepared, embeddings):
+        with self.lock:
+            self.writers_active += 1
+            self.max_writers_active = max(self.max_writers_active, self.writers_active)
+        time.sleep(self.write_delay)
+        with self.lock:
+            self.writers_active -= 1
+            self.in_flight -= 1
+            self.written.append((prepared["entry"]["name"], len(embeddings)))
+        return len(embeddings)
+
+    def pipeline(self, **overrides):
+        config = PipelineConfig(download_workers=2, extract_processes=0, prepare_workers=2, embed_workers=2,
+                                embed_batch_size=2, queue_size=2, progress_seconds=0)
+        for key, value in overrides.items():
+            setattr(config, key, value)
+        return StagedIngestPipeline(download=self.download, extract=self.extract, prepare=self.prepare,
+                                    embed=self.embed, write=self.write, config=config,
+                                    progress=lambda snapshot: None)
+
+
+class StagedIngestPipelineTests(unittest.TestCase):
+    def test_every_document_is_written_once_by_a_single_writer(self):
+        stages = FakeStages(write_delay=0.002)
+        snapshots = []
+        pipeline = stages.pipeline()
+        pipeline._progress = snapshots.append
+        report = pipeline.run(_entries(12))
+
+        self.assertEqual(sorted(name for name, _ in stages.written), sorted(e["name"] for e in _entries(12)))
+        self.assertEqual(report.written, 12)
+        self.assertEqual(report.chunks, 60)
+        self.assertEqual(stages.max_writers_active, 1)
+        # 5 chunks por documento en lotes de 2 → 2 + 2 + 1.
+        self.assertEqual(sorted(set(stages.batches)), [1, 2])
+        self.assertEqual(len(stages.batches), 36)
+        self.assertTrue(snapshots[-1]["final"])
+        self.assertEqual(snapshots[-1]["stages"]["embed"]["done"], 12)
+
+    def test_failures_and_skips_only_affect_their_document(self):
+        stages = FakeStages()
+        original_download = stages.download
+
+        def flaky_download(entry):
+            if entry["name"] == "ficha_3.pdf":
+                raise ConnectionError("dropbox 503")
+            return original_download(entry)
+
+        def prepare(entry, pdf_bytes, pages):
+            return None if entry["name"] == "ficha_5.pdf" else FakeStages.prepare(entry, pdf_bytes, pages)
+
+        stages.download = flaky_download
+        stages.prepare = prepare
+        report = stages.pipeline().run(_entries(8))
+
+        self.assertEqual(report.written, 6)
+        self.assertEqual(report.skipped, 1)
+        self.assertEqual(report.failed, [
+            {"name": "ficha_3.pdf", "path_lower": "/fichas/ficha_3.pdf", "stage": "download", "error": "dropbox 503"},
+        ])
+        self.assertNotIn("ficha_5.pdf", [name for name, _ in stages.written])
+
+    def test_bounded_queues_hold_back_downloads_behind_a_slow_writer(self):
+        stages = FakeStages(write_delay=0.005)
+        report = stages.pipeline(queue_size=1).run(_entries(40))
+        self.assertEqual(report.written, 40)
+        # 4 colas de 1 + 9 hilos de trabajo (+1 tomado por la descarga en curso).
+        self.assertLessEqual(stages.max_in_flight, 14)
+
+    def test_serial_baseline_runs_the_same_stages(self):
+        stages = FakeStages()
+        report = stages.pipeline().run_serial(_entries(4))
+        self.assertEqual([name for name, _ in stages.written], [e["name"] for e in _entries(4)])
+        self.assertEqual(report.chunks, 20)
+
+    def test_config_from_env_and_overrides(self):
+        with mock.patch.dict(os.environ, {"INGEST_EMBED_WORKERS": "7", "INGEST_QUEUE_SIZE": "3"}):
+            config = PipelineConfig.from_env(download_workers=9, embed_batch_size=None)
+        self.assertEqual((config.embed_workers, config.queue_size, config.download_workers), (7, 3, 9))
+        self.assertEqual(config.embed_batch_size, 16)
+
+
+class IngestBenchmarkTests(unittest.TestCase):
+    def test_benchmark_extracts_and_chunks_local_pdfs_with_stub_embedder(self):
+        import fitz
+
+        with tempfile.TemporaryDirectory() as pdf_dir:
+            for index in range(3):
+                doc = fitz.open()
+                page = doc.new_page()
+                page.insert_text((50, 72), f"FICHA TECNICA {index}\nDESCRIPCION\n" + "Pintura acrilica para fachadas.\n" * 12,
+                                 fontsize=9)
+                doc.save(os.path.join(pdf_dir, f"ficha_{index}.pdf"))
+                doc.close()
+            result = benchmark_ingest_pipeline(
+                pdf_dir, config=PipelineConfig(extract_processes=0, progress_seconds=0), embed_latency_seconds=0,
+            )
+
+        self.assertEqual(result["documents"], 3)
+        for mode in ("serial", "staged"):
+            self.assertEqual(result[mode]["written"], 3)
+            self.assertEqual(result[mode]["failed"], [])
+        self.assertGreater(result["staged"]["chunks"], 0)
+        self.assertEqual(result["staged"]["chunks"], result["serial"]["chunks"])
+        self.assertIsNotNone(result["speedup"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+import datetime
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+import ingest_technical_sheets
+from ingest_pipeline import PipelineConfig, PipelineReport, StagedIngestPipeline
+from ingestion_journal import IngestionJournal
+
+
+RUN_STARTED = datetime.datetime(2026, 10, 1, 8, 0, tzinfo=datetime.timezone.utc)
+
+
+def _entry(name, content_hash="h1", rev="r1"):
+    return {"name": name, "path_lower": f"/fichas/{name.lower()}", "content_hash": content_hash, "rev": rev}
+
+
+def _row(name, stage, attempts=0, quarantined=False, artifact=None, completed_at=None, content_hash="h1", rev="r1"):
+    return {
+        "doc_path_lower": f"/fichas/{name.lower()}", "doc_filename": name, "content_hash": content_hash,
+        "dropbox_rev": rev, "stage": stage, "attempts": attempts, "quarantined": quarantined,
+        "last_error": None, "artifact": artifact, "completed_at": completed_at,
+    }
+
+
+class FakeJournalEngine:
+    """engine.begin()/connect() mínimos: SELECT devuelve `rows`, el resto se registra."""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.statements = []
+
+    def begin(self):
+        return self
+
+    connect = begin
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.statements.append((sql, params))
+        rows = self.rows if sql.startswith("SELECT doc_path_lower") else []
+        return SimpleNamespace(mappings=lambda: SimpleNamespace(fetchall=lambda: rows), rowcount=len(rows))
+
+    def updates(self):
+        return [(sql, params) for sql, params in self.statements if sql.startswith("UPDATE public.ingestion_journal SET")]
+
+
+class IngestionJournalTests(unittest.TestCase):
+    def test_plan_skips_quarantined_crash_loops_and_docs_done_in_resumed_run(self):
+        engine = FakeJournalEngine([
+            _row("Nueva.pdf", "profiled", content_hash="viejo"),
+            _row("Veneno.pdf", "extracted", attempts=1, quarantined=True),
+            _row("Oom.pdf", "started", attempts=3),
+            _row("Lista.pdf", "profiled", completed_at=RUN_STARTED + datetime.timedelta(hours=1)),
+            _row("Antigua.pdf", "profiled", completed_at=RUN_STARTED - datetime.timedelta(days=2)),
+        ])
+        journal = IngestionJournal(engine, max_attempts=3)
+        entries = [_entry(name) for name in ("Nueva.pdf", "Veneno.pdf", "Oom.pdf", "Lista.pdf", "Antigua.pdf", "Sin.pdf")]
+        todo, held = journal.plan(entries, {"resumed": True, "started_at": RUN_STARTED})
+
+        self.assertEqual([entry["name"] for entry in todo], ["Nueva.pdf", "Antigua.pdf", "Sin.pdf"])
+        self.assertEqual([entry["name"] for entry in held["quarantined"]], ["Veneno.pdf", "Oom.pdf"])
+        self.assertEqual([entry["name"] for entry in held["done_this_run"]], ["Lista.pdf"])
+        updates = engine.updates()
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0][1]["path"], "/fichas/oom.pdf")
+        self.assertTrue(updates[0][1]["quarantined"])
+
+        dry_engine = FakeJournalEngine([_row("Oom.pdf", "started", attempts=3)])
+        IngestionJournal(dry_engine, max_attempts=3).plan([_entry("Oom.pdf")], {"resumed": False}, persist=False)
+        self.assertEqual(dry_engine.updates(), [])
+
+    def test_resume_artifact_only_for_same_revision_past_extraction(self):
+        prepared = {"entry": {"name": "Koraza.pdf"}, "chunks": ["a", "b"]}
+        journal = IngestionJournal(FakeJournalEngine([
+            _row("Koraza.pdf", "embedded", attempts=1, artifact='{"entry": {"name": "Koraza.pdf"}, "chunks": ["a", "b"]}'),
+            _row("Pintulux.pdf", "downloaded", attempts=1, artifact={"chunks": []}),
+        ]))
+        journal.load()
+        self.assertEqual(journal.resume_artifact(_entry("Koraza.pdf")), prepared)
+        self.assertIsNone(journal.resume_artifact(_entry("Koraza.pdf", rev="r2")))
+        self.assertIsNone(journal.resume_artifact(_entry("Pintulux.pdf")))
+        self.assertIsNone(journal.resume_artifact(_entry("Otra.pdf")))
+
+    def test_attempts_are_bounded_and_reset_by_completion_or_new_revision(self):
+        engine = FakeJournalEngine()
+        journal = IngestionJournal(engine, max_attempts=2)
+        entry = _entry("Veneno.pdf")
+        journal.load()
+
+        journal.begin(entry)
+        self.assertFalse(journal.fail(entry, "extract", "PDF corrupto"))
+        journal.begin(entry)
+        self.assertEqual(journal.attempts(entry), 2)
+        self.assertTrue(journal.fail(entry, "extract", "PDF corrupto"))
+        self.assertTrue(engine.updates()[-1][1]["quarantined"])
+        self.assertEqual(engine.updates()[-1][1]["last_error"], "extract: PDF corrupto")
+
+        journal.begin(_entry("Veneno.pdf", rev="r2"))
+        self.assertEqual(journal.attempts(entry), 1)
+        self.assertIn("ON CONFLICT (doc_path_lower) DO UPDATE", engine.statements[-1][0])
+        journal.mark(entry, "profiled")
+        self.assertEqual(journal.attempts(entry), 0)
+        self.assertIn("completed_at = now()", engine.statements[-1][0])
+
+    def test_pipeline_events_record_stages_and_resume_skips_download(self):
+        journal = IngestionJournal(FakeJournalEngine([
+            _row("Reanudada.pdf", "extracted", attempts=1, artifact={"entry": _entry("Reanudada.pdf"), "chunks": ["x", "y"]}),
+        ]))
+        journal.load()
+        stages = []
+        original_mark = journal.mark
+        journal.mark = lambda entry, stage, artifact=None: (stages.append((entry["name"], stage)),
+                                                            original_mark(entry, stage, artifact))
+        downloads = []
+
+        def download(entry):
+            downloads.append(entry["name"])
+            if entry["name"] == "Rota.pdf":
+                raise ConnectionError("dropbox 503")
+            return b"%PDF"
+
+        pipeline = StagedIngestPipeline(
+            download=download,
+            extract=lambda pdf_bytes: [{"page_number": 1, "text": "texto"}],
+            prepare=lambda entry, pdf_bytes, pages: {"entry": entry, "chunks": ["c1"]},
+            embed=lambda texts: [[1.0] for _ in texts],
+            write=lambda prepared, embeddings: len(embeddings),
+            config=PipelineConfig(download_workers=1, extract_processes=0, prepare_workers=1, embed_workers=1,
+                                  queue_size=2, progress_seconds=0),
+            progress=lambda snapshot: None,
+            resume=journal.resume_artifact,
+            on_event=journal.on_pipeline_event,
+        )
+        report = pipeline.run([_entry("Reanudada.pdf"), _entry("Nueva.pdf"), _entry("Rota.pdf")])
+
+        self.assertEqual(sorted(downloads), ["Nueva.pdf", "Rota.pdf"])
+        self.assertEqual((report.written, report.resumed, report.chunks), (2, 1, 3))
+        self.assertEqual([stage for name, stage in stages if name == "Reanudada.pdf"], ["embedded", "profiled"])
+        self.assertEqual([stage for name, stage in stages if name == "Nueva.pdf"],
+                         ["downloaded", "extracted", "embedded", "profiled"])
+        self.assertEqual(journal.attempts(_entry("Reanudada.pdf")), 0)
+        self.assertEqual(journal.attempts(_entry("Rota.pdf")), 1)
+        self.assertEqual(report.failed[0]["name"], "Rota.pdf")
+
+
+class ResumedJournal:
+    """Diario con una corrida --full abierta: Koraza ya quedó completa en ella."""
+
+    instances = []
+
+    def __init__(self, engine):
+        self.finished = []
+        ResumedJournal.instances.append(self)
+
+    def ensure_tables(self):
+        pass
+
+    def start_run(self, mode, persist=True):
+        return {"run_id": 7, "started_at": RUN_STARTED, "mode": mode, "resumed": mode == "full"}
+
+    def plan(self, entries, run, persist=True):
+        done = [entry for entry in entries if entry["name"] == "Koraza.pdf"]
+        return [entry for entry in entries if entry not in done], {"quarantined": [], "done_this_run": done}
+
+    def finish_run(self, run):
+        self.finished.append(run["run_id"])
+
+    def quarantined(self):
+        return []
+
+
+class ResumedFullRunTests(unittest.TestCase):
+    def test_resumed_full_run_loads_the_index_instead_of_wiping_it(self):
+        engine = FakeJournalEngine()
+        entries = [_entry("Koraza.pdf"), _entry("Pintulux.pdf")]
+        for entry in entries:
+            entry["path_lower"] = f"{ingest_technical_sheets.TECHNICAL_DOC_FOLDER.lower()}/{entry['name'].lower()}"
+        staged_calls = []
+
+        def run_staged(dbx, openai_client, engine_arg, pending, **kwargs):
+            staged_calls.append([entry["name"] for entry in pending])
+            return PipelineReport(documents=len(pending), written=len(pending), skipped=0, chunks=4,
+                                  elapsed_seconds=0.1, failed=[], stages={})
+
+        module = ingest_technical_sheets
+        patches = [
+            mock.patch.object(module, "IngestionJournal", ResumedJournal),
+            mock.patch.object(module, "get_db_engine", return_value=engine),
+            mock.patch.object(module, "get_openai_client", return_value=object()),
+            mock.patch.object(module, "get_dropbox_client", return_value=object()),
+            mock.patch.object(module, "ingest_embedding_cache"),
+            mock.patch.object(module, "list_dropbox_pdfs", return_value=entries),
+            mock.patch.object(module, "curate_pdf_entries", return_value=(entries, [], [])),
+            mock.patch.object(module, "write_corpus_report"),
+            mock.patch.object(module, "get_ingested_paths", return_value={entries[0]["path_lower"]}),
+            mock.patch.object(module, "get_ingested_doc_index", return_value={entries[0]["path_lower"]: "h1"}),
+            mock.patch.object(module, "get_ingested_profile_index", return_value={entries[0]["path_lower"]: "h1"}),
+            mock.patch.object(module, "run_staged_ingestion", side_effect=run_staged),
+            mock.patch.object(module, "pipeline_mode", return_value="staged"),
+            mock.patch.object(module, "_partial_chunk_indexes_present", return_value=False),
+        ]
+        for name in ("ensure_chunk_table", "ensure_profile_table", "ensure_product_multimodal_table",
+                     "publish_chunk_generation", "publish_profile_generation"):
+            patches.append(mock.patch.object(module, name))
+        ResumedJournal.instances.clear()
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with mock.patch.dict(os.environ, {"RAG_VECTOR_TIER": "exact"}):
+            module.run_ingestion(full_mode=True)
+
+        self.assertEqual(staged_calls, [["Pintulux.pdf"]])
+        self.assertFalse(any(sql.startswith("DELETE") for sql, _ in engine.statements))
+        self.assertEqual(ResumedJournal.instances[0].finished, [7])
+
+
+if __name__ == "__main__":
+    unittest.main()
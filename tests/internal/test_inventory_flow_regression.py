@@ -2,6 +2,7 @@ import json
 import os
 import sys
 import unittest
+from types import SimpleNamespace
 from unittest import mock
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
@@ -167,5 +168,72 @@ class InventoryFlowRegressionTests(unittest.TestCase):
         self.assertNotIn("commercial_draft", conversation_context)
 
 
+
+class FakeSalesConnection:
+    """Conexión mínima: SAVEPOINT vía begin_nested() y consultas registradas."""
+
+    def __init__(self, table_exists=True):
+        self.table_exists = table_exists
+        self.queries = []
+        self.savepoints = []
+
+    def begin_nested(self):
+        connection = self
+
+        class _Savepoint:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, exc_type, exc, tb):
+                connection.savepoints.append("rollback" if exc_type else "release")
+                return False
+
+        return _Savepoint()
+
+    def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.queries.append((sql, params))
+        if "historical_product_names" in sql:
+            if not self.table_exists:
+                raise RuntimeError('relation "public.historical_product_names" does not exist')
+            rows = [{"codigo_articulo": "5890919", "nombre_articulo": "BARNIZ SD-1", "match_score": 2}]
+        else:
+            rows = [{"codigo_articulo": "5890919", "nombre_articulo": "BARNIZ SD-1", "match_score": 1}]
+        return SimpleNamespace(mappings=lambda: SimpleNamespace(all=lambda: rows))
+
+
+class HistoricalSalesLookupTests(unittest.TestCase):
+    def test_reads_the_prebuilt_table_inside_a_savepoint(self):
+        connection = FakeSalesConnection()
+        rows = main.fetch_historical_sales_rows(connection, ["barniz", "sd 1"], limit=5)
+
+        self.assertEqual(len(connection.queries), 1)
+        sql, params = connection.queries[0]
+        self.assertIn("FROM public.historical_product_names", sql)
+        self.assertIn("search_blob ILIKE :pattern_0 OR search_blob ILIKE :pattern_1", sql)
+        self.assertIn("LIMIT 5", sql)
+        self.assertEqual(params, {"pattern_0": "%barniz%", "pattern_1": "%sd 1%"})
+        self.assertEqual(connection.savepoints, ["release"])
+        self.assertEqual(rows[0]["match_score"], 2)
+
+    def test_missing_table_rolls_back_the_savepoint_and_scans_vw_ventas_netas(self):
+        connection = FakeSalesConnection(table_exists=False)
+        rows = main.fetch_historical_sales_rows(connection, ["barniz"])
+
+        self.assertEqual(connection.savepoints, ["rollback"])
+        self.assertEqual(len(connection.queries), 2)
+        sql, params = connection.queries[1]
+        self.assertIn("FROM public.vw_ventas_netas", sql)
+        self.assertIn("GROUP BY 1, 2, 3, 4", sql)
+        self.assertIn("LIMIT 10", sql)
+        self.assertEqual(params, {"pattern_0": "%barniz%"})
+        self.assertEqual(rows[0]["codigo_articulo"], "5890919")
+
+    def test_no_terms_skips_both_queries(self):
+        connection = FakeSalesConnection()
+        self.assertEqual(main.fetch_historical_sales_rows(connection, []), [])
+        self.assertEqual(connection.queries, [])
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,170 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("DATABASE_URL", "postgresql://postgres:x@localhost:5432/test")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+import main
+import rag_helpers
+
+
+class FakeCompanionEngine:
+    """engine.connect() mínimo: devuelve las aristas de las referencias pedidas."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        self.queries.append((" ".join(str(statement).split()), params))
+        found = [dict(row) for row in self.rows if row["producto_referencia"] in params["refs"]]
+        return SimpleNamespace(mappings=lambda: SimpleNamespace(all=lambda: found))
+
+
+def _edge(ref, companion, tipo="complementario"):
+    return {
+        "producto_referencia": ref, "companion_referencia": companion, "companion_descripcion": companion.lower(),
+        "tipo_relacion": tipo, "proporcion": None, "notas": None, "confidence": 0.9,
+        "stock_total": 3, "descripcion_inventario": companion,
+    }
+
+
+class CompanionBulkTests(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeCompanionEngine([
+            _edge("5890919", "THINNER"), _edge("5890919", "BROCHA", "herramienta"), _edge("P11", "CATALIZADOR"),
+        ])
+        patchers = [
+            mock.patch.object(main, "get_db_engine", return_value=self.engine),
+            mock.patch.object(main, "_companion_graph", {}),
+            mock.patch.object(main, "_companion_graph_ts", time.time()),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_one_query_groups_by_reference_and_caches_empty_ones(self):
+        result = main.fetch_product_companions_bulk(["5890919", "P11", "SIN", "5890919", ""])
+
+        self.assertEqual(len(self.engine.queries), 1)
+        self.assertIn("= ANY(:refs)", self.engine.queries[0][0])
+        self.assertEqual(self.engine.queries[0][1], {"refs": ["5890919", "P11", "SIN"]})
+        self.assertEqual(list(result), ["5890919", "P11", "SIN"])
+        self.assertEqual([edge["companion_referencia"] for edge in result["5890919"]], ["THINNER", "BROCHA"])
+        self.assertNotIn("producto_referencia", result["P11"][0])
+        self.assertEqual(result["SIN"], [])
+
+        result["5890919"][0]["companion_referencia"] = "mutado"
+        self.assertEqual(main.fetch_product_companions("5890919")[0]["companion_referencia"], "THINNER")
+        self.assertEqual(main.fetch_product_companions_bulk(["SIN", "P11"])["P11"][0]["companion_referencia"],
+                         "CATALIZADOR")
+        self.assertEqual(len(self.engine.queries), 1)
+
+    def test_invalidation_refetches_and_db_errors_degrade_to_empty(self):
+        main.fetch_product_companions_bulk(["P11"])
+        main.invalidate_product_companion_cache()
+        main.fetch_product_companions_bulk(["P11"])
+        self.assertEqual(len(self.engine.queries), 2)
+
+        with mock.patch.object(main, "get_db_engine", side_effect=RuntimeError("sin BD")):
+            self.assertEqual(main.fetch_product_companions_bulk(["NUEVA", "P11"]), {"NUEVA": [], "P11": []})
+
+
+def _fake_main(lookup):
+    return SimpleNamespace(
+        lookup_product_context=lookup,
+        prepare_product_request_for_search=lambda term: {"term": term},
+        get_exact_product_description=lambda row: row["descripcion"],
+        build_product_audit_label=lambda row: row["descripcion"],
+        infer_product_presentation_from_row=lambda row: None,
+        parse_numeric_value=lambda value: value,
+    )
+
+
+def _rows(term):
+    return [{"referencia": f"{term}-1", "descripcion": term}, {"referencia": f"{term}-2", "descripcion": term}]
+
+
+class ConcurrentTermLookupTests(unittest.TestCase):
+    def test_rows_merge_in_term_order_and_failed_terms_are_logged(self):
+        def lookup(term, request):
+            if term == "falla":
+                raise RuntimeError("timeout inventario")
+            if term == "lenta":
+                time.sleep(0.05)
+            return _rows(term)[:1]
+
+        main_stub = _fake_main(lookup)
+        resolved = []
+        with mock.patch.object(rag_helpers, "RAG_INVENTORY_LOOKUP_WORKERS", 4), \
+                self.assertLogs("ferreinox_agent", level="WARNING") as logs:
+            rag_helpers._collect_inventory_rows(
+                main_stub, rag_helpers._lookup_terms_concurrently(main_stub, ["lenta", "falla", "", "rapida"]),
+                set(), resolved,
+            )
+
+        self.assertEqual([item["codigo"] for item in resolved], ["lenta-1", "rapida-1"])
+        self.assertTrue(any("'falla'" in line for line in logs.output))
+
+    def test_pending_terms_are_cancelled_once_four_products_are_in(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        called = []
+
+        def lookup(term, request):
+            called.append(term)
+            if term not in ("t1", "t2"):
+                release.wait(2)
+            return _rows(term)
+
+        main_stub = _fake_main(lookup)
+        resolved = []
+        with mock.patch.object(rag_helpers, "RAG_INVENTORY_LOOKUP_WORKERS", 2):
+            rag_helpers._collect_inventory_rows(
+                main_stub, rag_helpers._lookup_terms_concurrently(main_stub, ["t1", "t2", "t3", "t4", "t5"]),
+                set(), resolved,
+            )
+        release.set()
+        time.sleep(0.05)
+
+        self.assertEqual([item["codigo"] for item in resolved], ["t1-1", "t1-2", "t2-1", "t2-2"])
+        self.assertNotIn("t5", called)
+
+    def test_single_worker_keeps_the_sequential_early_exit(self):
+        called = []
+
+        def lookup(term, request):
+            called.append(term)
+            return _rows(term)
+
+        main_stub = _fake_main(lookup)
+        resolved = []
+        with mock.patch.object(rag_helpers, "RAG_INVENTORY_LOOKUP_WORKERS", 1):
+            rag_helpers._collect_inventory_rows(
+                main_stub, rag_helpers._lookup_terms_concurrently(main_stub, ["t1", "t2", "t3"]), set(), resolved,
+            )
+        self.assertEqual(called, ["t1", "t2"])
+        self.assertEqual(len(resolved), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+import rag_search
+from local_vector_index import MANIFEST_NAME, LocalVectorIndex
+
+
+ROWS = [
+    # id, vector, tipo_documento, marca, segmento, scope, tier, familia canónica, familia química
+    (11, [1.0, 0.0, 0.0], "ficha_tecnica", "pintuco", "arquitectonico", "", "", "koraza", "acrilica"),
+    (12, [0.9, 0.1, 0.0], "ficha_tecnica", "pintuco", "arquitectonico", "", "rejected", "koraza", "acrilica"),
+    (13, [0.7, 0.7, 0.0], "ficha_tecnica_experto", "mpa", "industrial", "primary", "", "pintulux 3en1", "alquidica"),
+    (14, [0.8, 0.0, 0.6], "guia_solucion", "pintuco", "arquitectonico", "guide", "", "", ""),
+    (15, [0.6, 0.8, 0.0], "ficha_tecnica", "pintuco", "arquitectonico", "secondary", "", "koraza", "acrilica"),
+]
+
+
+def write_index(directory: Path, generation: int) -> None:
+    matrix = np.asarray([row[1] for row in ROWS], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.save(directory / "chunks-test.npy", matrix)
+    columns = ("tipo_documento", "marca", "portfolio_segment", "document_scope", "quality_tier",
+               "canonical_family", "chemical_family")
+    rows = {"id": [row[0] for row in ROWS]}
+    for offset, name in enumerate(columns, start=2):
+        rows[name] = [row[offset] for row in ROWS]
+    (directory / "chunks-test.rows.json").write_text(json.dumps(rows), encoding="utf-8")
+    manifest = {"generation": generation, "matrix_file": "chunks-test.npy", "rows_file": "chunks-test.rows.json"}
+    (directory / MANIFEST_NAME).write_text(json.dumps(manifest), encoding="utf-8")
+
+
+class LocalVectorIndexTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = Path(tmp.name)
+        write_index(self.directory, generation=7)
+        self.index = LocalVectorIndex(self.directory, check_interval=0)
+
+    def test_top_k_applies_the_sql_branch_filters(self):
+        hits = self.index.search([1.0, 0.2, 0.0], source="chunks", top_k=5)
+        # 12 rechazado, 14 es guía, 15 fuera del scope primario.
+        self.assertEqual([chunk_id for chunk_id, _ in hits], [11, 13])
+        self.assertGreater(hits[0][1], hits[1][1])
+        self.assertEqual([hit[0] for hit in self.index.search([1.0, 0.0, 0.0], source="guides", top_k=3)], [14])
+
+    def test_marca_segment_and_family_prefilters(self):
+        self.assertEqual(
+            [hit[0] for hit in self.index.search([1.0, 0.0, 0.0], source="chunks", top_k=5, marca_filter="MPA")],
+            [13],
+        )
+        self.assertEqual(
+            [hit[0] for hit in self.index.search(
+                [1.0, 0.0, 0.0], source="chunks", top_k=5, segment_filters=["arquitectonico"],
+            )],
+            [11],
+        )
+        prefilters = {"canonical_family_patterns": ["%pintulux%"], "chemical_family_terms": []}
+        self.assertEqual(
+            [hit[0] for hit in self.index.search(
+                [1.0, 0.0, 0.0], source="chunks", top_k=5, metadata_prefilters=prefilters,
+            )],
+            [13],
+        )
+
+    def test_only_current_when_generation_matches_database(self):
+        self.assertFalse(self.index.is_current())
+        self.index.note_db_generation(8)
+        self.assertFalse(self.index.is_current())
+        self.index.note_db_generation(7)
+        self.assertTrue(self.index.is_current())
+        self.assertEqual(self.index.stats()["stale_skips"], 1)
+
+
+class FakeCursor:
+    def __init__(self, rows, fail_vector_query=False):
+        self.rows = rows
+        self.fail_vector_query = fail_vector_query
+        self.executed = []
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, list(params)))
+        if self.fail_vector_query and "<=>" in sql:
+            raise RuntimeError("canceling statement due to statement timeout")
+
+    def fetchone(self):
+        return (7,)
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeRawConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+class FakeEngine:
+    def __init__(self, cursor):
+        self.connection = FakeRawConnection(cursor)
+
+    def raw_connection(self):
+        return self.connection
+
+
+def _hydrated(source, filename, similarity):
+    values = {column: None for column in rag_search._RAG_INDEX_COLUMNS}
+    values.update(source=source, doc_filename=filename, similarity=similarity)
+    return tuple(values[column] for column in rag_search._RAG_INDEX_COLUMNS)
+
+
+class RagSearchLocalIndexTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        write_index(Path(tmp.name), generation=7)
+        self.index = LocalVectorIndex(Path(tmp.name), check_interval=0)
+        # El JOIN devuelve en cualquier orden; el resultado debe quedar por similitud.
+        self.rows = [_hydrated("chunks", "pintulux.pdf", 0.70), _hydrated("chunks", "koraza.pdf", 0.98)]
+        for patcher in (
+            mock.patch.object(rag_search, "local_vector_index", self.index),
+            mock.patch.object(rag_search, "_generate_query_embedding", return_value=[1.0, 0.2, 0.0]),
+            mock.patch.object(rag_search, "_PGVECTOR_VERSION", (0, 8, 0)),
+            mock.patch.object(rag_search, "_CHUNK_FULLTEXT_AVAILABLE", False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _search(self, mode, cursor):
+        with mock.patch.dict(os.environ, {"RAG_LOCAL_INDEX": mode}), \
+                mock.patch.object(rag_search, "_get_db_engine", return_value=FakeEngine(cursor)):
+            return rag_search.search_technical_chunks("koraza fachada", top_k=2)
+
+    def test_primary_mode_hydrates_local_hits_without_vector_scan(self):
+        cursor = FakeCursor(self.rows)
+        results = self._search("primary", cursor)
+        self.assertEqual([chunk["doc_filename"] for chunk in results], ["koraza.pdf", "pintulux.pdf"])
+        sql, params = cursor.executed[-1]
+        self.assertNotIn("<=>", sql)
+        self.assertEqual(params[0], [11, 13])
+
+    def test_fallback_mode_answers_locally_when_pgvector_fails(self):
+        cursor = FakeCursor(self.rows, fail_vector_query=True)
+        with self.assertLogs("ferreinox_agent.rag_search", level="WARNING"):
+            results = self._search("fallback", cursor)
+        self.assertEqual(len(results), 2)
+        vector_sql = next(sql for sql, _ in cursor.executed if "<=>" in sql)
+        self.assertIn("statement_timeout", vector_sql)
+        self.assertEqual(cursor.executed[-1][1][0], [11, 13])
+
+    def test_stale_index_is_never_used(self):
+        write_index(Path(self.index.directory), generation=6)
+        os.utime(self.index.directory / MANIFEST_NAME, (0, 0))
+        cursor = FakeCursor(self.rows, fail_vector_query=True)
+        self.assertEqual(self._search("fallback", cursor), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import sys
+import unittest
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from price_book import PriceBook
+from pipeline_deterministico.matcher_productos import match_sistema_completo
+from pipeline_pedido.matcher_inventario import match_pedido_completo
+
+
+class FakeLoader:
+    def __init__(self, prices):
+        self.prices = prices
+        self.calls = []
+
+    def __call__(self, references, price_list):
+        self.calls.append((list(references), price_list))
+        return {ref: self.prices[ref] for ref in references if ref in self.prices}
+
+
+class PriceBookTests(unittest.TestCase):
+    def setUp(self):
+        self.loader = FakeLoader({"5891111": {"precio_mejor": 100.0}, "5892222": {"precio_mejor": 250.0}})
+        self.book = PriceBook(loader=self.loader, ttl_seconds=60)
+
+    def test_get_many_loads_all_missing_references_in_one_call(self):
+        prices = self.book.get_many(["5891111", " 5892222 ", "0000", "5891111", None])
+        self.assertEqual(list(prices), ["5891111", "5892222", "0000"])
+        self.assertEqual(prices["5892222"]["precio_mejor"], 250.0)
+        self.assertIsNone(prices["0000"])
+        self.assertEqual(len(self.loader.calls), 1)
+
+    def test_cached_references_and_misses_do_not_hit_the_loader_again(self):
+        self.book.get_many(["5891111", "0000"])
+        self.assertEqual(self.book.get("5891111")["precio_mejor"], 100.0)
+        self.assertIsNone(self.book.get("0000"))
+        self.book.get_many(["5891111", "5892222"])
+        self.assertEqual(self.loader.calls[-1][0], ["5892222"])
+        self.assertEqual(len(self.loader.calls), 2)
+
+    def test_price_lists_are_cached_separately(self):
+        self.book.get("5891111")
+        self.book.get("5891111", price_list="mayorista")
+        self.assertEqual([call[1] for call in self.loader.calls], ["general", "mayorista"])
+
+    def test_expired_and_invalidated_entries_reload(self):
+        book = PriceBook(loader=self.loader, ttl_seconds=0)
+        book.get("5891111")
+        book.get("5891111")
+        self.assertEqual(len(self.loader.calls), 2)
+        self.book.get("5891111")
+        self.book.invalidate(["5891111"])
+        self.book.get("5891111")
+        self.assertEqual(len(self.loader.calls), 4)
+
+    def test_loader_errors_are_not_cached(self):
+        def failing_loader(references, price_list):
+            raise RuntimeError("db down")
+
+        book = PriceBook(loader=failing_loader)
+        self.assertIsNone(book.get("5891111"))
+        self.assertEqual(book.size(), 0)
+
+    def test_size_is_bounded(self):
+        book = PriceBook(loader=self.loader, max_entries=2)
+        book.get_many(["a", "b", "c"])
+        self.assertEqual(book.size(), 2)
+
+
+class MatchPedidoBulkPricingTests(unittest.TestCase):
+    def test_resolved_lines_are_priced_with_a_single_bulk_call(self):
+        catalog = {
+            "viniltex blanco": [{"referencia": "5891111", "descripcion": "VINILTEX BLANCO", "stock_total": 5}],
+            "koraza blanco": [{"referencia": "5892222", "descripcion": "KORAZA BLANCO", "stock_total": 5, "precio_venta": 9}],
+            "estuco": [{"referencia": "5893333", "descripcion": "ESTUCO", "stock_total": 5, "precio_venta": 7}],
+        }
+        bulk_calls = []
+
+        def lookup_fn(text, product_request=None):
+            return catalog.get(text, [])
+
+        def price_fn(codigo):
+            raise AssertionError("price_fn no debe llamarse cuando hay prices_fn")
+
+        def prices_fn(codigos):
+            bulk_calls.append(sorted(codigos))
+            return {"5891111": {"precio_mejor": 100.0}, "5892222": {"precio_mejor": 250.0}}
+
+        lineas = [
+            {"texto": name, "producto": name, "cantidad": 1, "unidad": "", "codigos": []}
+            for name in ("viniltex blanco", "koraza blanco", "estuco")
+        ]
+        resultado = match_pedido_completo(lineas, lookup_fn, price_fn, prices_fn=prices_fn)
+
+        self.assertEqual(bulk_calls, [["5891111", "5892222", "5893333"]])
+        precios = {r.codigo_encontrado: r.precio_unitario for r in resultado.productos_resueltos}
+        self.assertEqual(precios, {"5891111": 100.0, "5892222": 250.0, "5893333": 7.0})
+
+
+class MatchSistemaBulkPricingTests(unittest.TestCase):
+    def test_system_and_tools_are_priced_with_a_single_bulk_call(self):
+        catalog = {
+            "koraza": {"codigo_articulo": "5891111", "descripcion": "KORAZA BLANCO GALON 3.79L", "marca": "PINTUCO",
+                       "stock_total": 5, "precio_venta": 90},
+            "brocha": {"codigo_articulo": "7001", "descripcion": "BROCHA GOYA 3 PULGADAS", "marca": "GOYA",
+                       "stock_total": 5, "precio_venta": 9},
+        }
+        bulk_calls = []
+
+        def lookup_fn(text):
+            return [row for key, row in catalog.items() if key in text.lower()]
+
+        def price_fn(codigo):
+            raise AssertionError("price_fn no debe llamarse cuando hay prices_fn")
+
+        def prices_fn(codigos):
+            bulk_calls.append(list(codigos))
+            return {"5891111": {"precio_mejor": 120.0}}
+
+        recomendacion = {
+            "sistema": [{"producto": "Koraza blanco", "presentacion": "galon", "cantidad": 2, "funcion": "acabado"}],
+            "herramientas": [{"producto": "brocha goya 3 pulgadas", "cantidad": 1}],
+        }
+        resultado = match_sistema_completo(recomendacion, lookup_fn, price_fn=price_fn, prices_fn=prices_fn)
+
+        self.assertEqual(bulk_calls, [["5891111", "7001"]])
+        precios = {item["codigo"]: item["precio_unitario"]
+                   for item in resultado["productos_resueltos"] + resultado["herramientas_resueltas"]}
+        # Sin precio en el libro se conserva el precio_venta del inventario.
+        self.assertEqual(precios, {"5891111": 120.0, "7001": 9.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
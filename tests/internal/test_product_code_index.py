@@ -0,0 +1,88 @@
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from product_code_index import ProductCodeIndex, damerau_levenshtein, normalize_code
+
+
+class ProductCodeIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = ProductCodeIndex(max_distance=2)
+        self.index.build(["117474", "5891234", "P-11", "T-95-ABC", "117475", None, ""])
+
+    def test_normalize_matches_fn_keep_alnum(self):
+        self.assertEqual(normalize_code(" t-95/abc "), "T95ABC")
+        self.assertEqual(normalize_code("Ñandú-1"), "NANDU1")
+
+    def test_exact_code_has_distance_zero(self):
+        self.assertEqual(self.index.lookup("117474")[0], ("117474", 0))
+
+    def test_missing_digit_is_found(self):
+        codes = dict(self.index.lookup("17474"))
+        self.assertEqual(codes.get("117474"), 1)
+
+    def test_transposition_counts_as_one_edit(self):
+        codes = dict(self.index.lookup("5819234"))
+        self.assertEqual(codes.get("5891234"), 1)
+        self.assertEqual(damerau_levenshtein("5819234", "5891234", 2), 1)
+
+    def test_distance_two_is_found_and_sorted_after_distance_one(self):
+        results = self.index.lookup("17174")
+        self.assertIn(("117474", 2), results)
+        distances = [distance for _, distance in results]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_far_codes_are_excluded(self):
+        self.assertEqual(self.index.lookup("999999"), [])
+
+    def test_lookup_many_keeps_best_distance(self):
+        results = dict(self.index.lookup_many(["17474", "117474"]))
+        self.assertEqual(results["117474"], 0)
+
+    def test_short_codes_are_ignored(self):
+        self.assertEqual(self.index.lookup("P1"), [])
+
+    def test_empty_index_returns_nothing(self):
+        self.assertEqual(ProductCodeIndex().lookup("117474"), [])
+
+
+class FakeCatalogConnection:
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, statement, params=None):
+        self.calls.append((" ".join(str(statement).split()), params))
+        return SimpleNamespace(mappings=lambda: SimpleNamespace(all=lambda: []))
+
+
+class NearCodeHydrationTests(unittest.TestCase):
+    def test_referencia_only_dashed_code_hydrates_with_the_index_normalization(self):
+        os.environ.setdefault("DATABASE_URL", "postgresql://postgres:x@localhost:5432/test")
+        os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+        import main
+
+        index = ProductCodeIndex(max_distance=2)
+        # Sólo existe como referencia con guion; producto_codigo es otro valor.
+        index.build(["pq-117474", "5891234"])
+        near_codes = index.lookup("pq11747")
+        self.assertEqual(near_codes[0], ("PQ117474", 1))
+
+        connection = FakeCatalogConnection()
+        main.fetch_near_code_product_rows(connection, near_codes, [])
+        sql, params = connection.calls[0]
+        self.assertIn("public.fn_keep_alnum(p.referencia) = ANY(:near_codes)", sql)
+        self.assertIn("public.fn_keep_alnum(p.producto_codigo) = ANY(:near_codes)", sql)
+        self.assertNotIn(" producto_codigo = ANY(:near_codes)", sql)
+        self.assertEqual(params["near_codes"], ["PQ117474"])
+        self.assertEqual(params["near_codes_d1"], ["PQ117474"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import json
+import sys
+import unittest
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from cache_invalidation import ChangeNotifier
+from product_learning_index import ProductLearningIndex
+
+
+def _row(phrase, reference, confidence=0.82, usage_count=1, conversation_id=None, description=None):
+    return {
+        "normalized_phrase": phrase,
+        "canonical_reference": reference,
+        "canonical_description": description or f"PRODUCTO {reference}",
+        "canonical_brand": "PINTUCO",
+        "canonical_presentation": None,
+        "source_conversation_id": conversation_id,
+        "confidence": confidence,
+        "usage_count": usage_count,
+    }
+
+
+class ProductLearningIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = ProductLearningIndex()
+        self.index.build(
+            [
+                _row("p53", "5892240", confidence=0.95, usage_count=4, conversation_id=7),
+                _row("p53", "5892241", confidence=0.82, usage_count=9),
+                _row("koraza blanca", "1001", conversation_id=7),
+                _row("", "9999"),
+            ]
+        )
+
+    def test_exact_lookup_orders_like_sql(self):
+        results = self.index.lookup("p53")
+        self.assertEqual([row["canonical_reference"] for row in results], ["5892240", "5892241"])
+        self.assertEqual(results[0]["total_hits"], 4)
+
+    def test_partial_lookup_uses_token_prefixes(self):
+        results = self.index.lookup_partial("koraza blancas galon")
+        self.assertEqual([row["canonical_reference"] for row in results], ["1001"])
+
+    def test_partial_lookup_requires_every_learned_token(self):
+        self.assertEqual(self.index.lookup_partial("koraza galon"), [])
+
+    def test_upsert_is_idempotent(self):
+        stored = _row("p53", "5892240", confidence=0.95, usage_count=5, conversation_id=7)
+        self.index.upsert(stored)
+        self.index.upsert(stored)
+        self.assertEqual(self.index.lookup("p53")[0]["total_hits"], 5)
+
+    def test_merge_follows_on_conflict_semantics(self):
+        self.index.merge(_row("p53", "5892241", confidence=0.5, description="OTRA"))
+        merged = [row for row in self.index.lookup("p53") if row["canonical_reference"] == "5892241"][0]
+        self.assertEqual(merged["total_hits"], 10)
+        self.assertEqual(merged["confidence"], 0.82)
+        self.assertEqual(merged["canonical_description"], "PRODUCTO 5892241")
+
+        self.index.merge(_row("p53", "5892241", description="CONFIRMADA"), overwrite_description=True)
+        merged = [row for row in self.index.lookup("p53") if row["canonical_reference"] == "5892241"][0]
+        self.assertEqual(merged["canonical_description"], "CONFIRMADA")
+
+    def test_count_for_conversation(self):
+        self.assertEqual(self.index.count_for_conversation(7), 2)
+        self.assertEqual(self.index.count_for_conversation(None), 0)
+
+    def test_invalidate_marks_unloaded(self):
+        self.assertTrue(self.index.is_loaded())
+        self.index.invalidate()
+        self.assertFalse(self.index.is_loaded())
+
+
+class ChangeNotifierDispatchTests(unittest.TestCase):
+    def test_dispatch_decodes_payload_and_isolates_handler_errors(self):
+        notifier = ChangeNotifier()
+        received = []
+
+        def broken(payload):
+            raise RuntimeError("boom")
+
+        notifier.subscribe("agent_product_learning_changed", broken)
+        notifier.subscribe("agent_product_learning_changed", received.append)
+        notifier.dispatch("agent_product_learning_changed", '{"normalized_phrase": "p53"}')
+        notifier.dispatch("agent_product_learning_changed", "")
+
+        self.assertEqual(received, [{"normalized_phrase": "p53"}, None])
+
+    def test_invalid_channel_is_rejected(self):
+        with self.assertRaises(ValueError):
+            ChangeNotifier().subscribe("canal; DROP TABLE x", lambda payload: None)
+
+
+class GuardarAprendizajeToolTests(unittest.TestCase):
+    def setUp(self):
+        os.environ.setdefault("DATABASE_URL", "postgresql://postgres:x@localhost:5432/test")
+        os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+        import main
+
+        self.main = main
+        self.index = ProductLearningIndex()
+        self.index.build([])
+        resolved = {"referencia": "5891234", "descripcion": "PINTULUX BLANCO 3.79L", "marca": "PINTUCO"}
+        for patcher in (
+            mock.patch.object(main, "product_learning_index", self.index),
+            mock.patch.object(main, "resolve_confirmed_learning_product_row", return_value=resolved),
+            mock.patch.object(main, "get_db_engine", side_effect=ConnectionError("sin catálogo")),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _call(self):
+        result = self.main._handle_tool_guardar_aprendizaje_producto(
+            {"codigo_cliente": "DERC20", "descripcion_asociada": "pintulux blanco galón"},
+            {"conversation_id": 41},
+        )
+        return json.loads(result)
+
+    def test_failed_write_is_not_reported_as_saved_nor_kept_in_memory(self):
+        with mock.patch.object(self.main, "persist_product_learning_rows", side_effect=ConnectionError("postgres caído")):
+            result = self._call()
+        self.assertFalse(result["guardado"])
+        self.assertEqual(self.index.count_for_conversation(41), 0)
+
+    def test_success_is_reported_after_the_row_is_stored(self):
+        def persist(rows, upsert_sql):
+            for row in rows:
+                self.index.upsert({**row, "usage_count": 1})
+
+        with mock.patch.object(self.main, "persist_product_learning_rows", side_effect=persist) as persisted:
+            result = self._call()
+        self.assertTrue(result["guardado"])
+        persisted.assert_called_once()
+        self.assertEqual(self.index.count_for_conversation(41), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
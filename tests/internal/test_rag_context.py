@@ -0,0 +1,141 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+import rag_context
+from rag_context import count_tokens, pack_rag_context, rag_context_stats
+from rag_search import build_rag_context
+
+
+BODY_A = (
+    "Koraza es una pintura acrilica para fachadas con alta resistencia a la intemperie. "
+    "Se aplica sobre superficies limpias y secas con brocha rodillo o equipo airless. "
+    "Rinde entre 20 y 30 metros cuadrados por galon a dos manos segun la porosidad."
+)
+BODY_B = (
+    "Rinde entre 20 y 30 metros cuadrados por galon a dos manos segun la porosidad. "
+    "Para dilucion usar maximo 10 por ciento de agua limpia y mezclar bien antes de aplicar. "
+    "Tiempo de secado al tacto de 30 minutos y repinte a las 2 horas."
+)
+
+
+def _chunk(filename, index, section, body, similarity, family="KORAZA"):
+    return {
+        "doc_filename": filename,
+        "chunk_index": index,
+        "chunk_text": f"[PRODUCTO: {family}] [MARCA: PINTUCO]\n[SECCIÓN: {section}]\n\n{body}",
+        "similarity": similarity,
+        "metadata": {"canonical_family": family},
+    }
+
+
+class RagContextTests(unittest.TestCase):
+    def test_legacy_filters_still_apply(self):
+        chunks = [
+            _chunk("FDS Koraza.pdf", 0, "Peligros", BODY_A, 0.9),
+            _chunk("Koraza FT.pdf", 1, "Descripcion", BODY_A, 0.8),
+            _chunk("Koraza FT (2).pdf", 7, "Descripcion", "Otro texto distinto del anterior.", 0.7),
+            _chunk("Pintulux FT.pdf", 2, "Uso", "Esmalte para metal y madera.", 0.2, family="PINTULUX"),
+        ]
+        text = build_rag_context(chunks, max_chunks=4, token_budget=10_000)
+        self.assertEqual(text.count("[Fuente:"), 1)
+        self.assertIn("[Fuente: Koraza FT.pdf]", text)
+        self.assertNotIn("FDS", text)
+        self.assertNotIn("Pintulux", text)
+
+    def test_near_duplicates_from_other_documents_are_dropped(self):
+        chunks = [
+            _chunk("Koraza FT.pdf", 1, "Descripcion", BODY_A, 0.8),
+            _chunk("KORAZA copia.pdf", 4, "Descripcion general", BODY_A + " Color blanco.", 0.79, family="KORAZA COPIA"),
+        ]
+        pack = pack_rag_context(chunks, max_chunks=4, token_budget=10_000)
+        self.assertEqual(pack.passages, 1)
+        self.assertEqual(pack.duplicates_dropped, 1)
+        self.assertGreater(pack.tokens_saved, 0)
+
+    def test_adjacent_chunks_merge_without_repeated_headers_or_overlap(self):
+        chunks = [
+            _chunk("Koraza FT.pdf", 3, "Aplicacion", BODY_B, 0.7),
+            _chunk("Koraza FT.pdf", 2, "Descripcion", BODY_A, 0.8),
+        ]
+        pack = pack_rag_context(chunks, max_chunks=4, token_budget=10_000)
+        self.assertEqual(pack.chunks_merged, 1)
+        self.assertEqual(pack.text.count("[Fuente:"), 1)
+        self.assertEqual(pack.text.count("[PRODUCTO:"), 1)
+        self.assertEqual(pack.text.count("Rinde entre 20 y 30"), 1)
+        self.assertLess(pack.text.index("[SECCIÓN: Descripcion]"), pack.text.index("[SECCIÓN: Aplicacion]"))
+
+    def test_packs_by_relevance_within_budget(self):
+        chunks = [
+            _chunk("Koraza FT.pdf", 1, "Descripcion", BODY_A, 0.9),
+            _chunk("Viniltex FT.pdf", 5, "Uso", "Viniltex es un vinilo para interiores. " * 20, 0.6, family="VINILTEX"),
+            _chunk("Pintulux FT.pdf", 9, "Uso", "Esmalte para metal y madera.", 0.5, family="PINTULUX"),
+        ]
+        budget = count_tokens(f"[Fuente: Koraza FT.pdf]\n{chunks[0]['chunk_text']}") + 60
+        pack = pack_rag_context(chunks, max_chunks=4, token_budget=budget)
+        self.assertLessEqual(pack.tokens, budget)
+        self.assertIn("Koraza FT.pdf", pack.text)
+        self.assertNotIn("Viniltex", pack.text)
+        self.assertIn("Pintulux FT.pdf", pack.text)
+        self.assertEqual(pack.over_budget_dropped, 1)
+        # El recorte por presupuesto no cuenta como ahorro de deduplicación.
+        self.assertEqual(pack.tokens_saved, 0)
+        self.assertGreater(pack.tokens_truncated, 0)
+        self.assertEqual(pack.deduplicated_tokens, pack.tokens + pack.tokens_truncated)
+
+        tiny = pack_rag_context(chunks[:1], max_chunks=1, token_budget=25)
+        self.assertTrue(tiny.text)
+        self.assertLessEqual(tiny.tokens, 25)
+
+    def test_exclude_drops_guide_passages_already_sent(self):
+        rag_pack = pack_rag_context([_chunk("Koraza FT.pdf", 1, "Descripcion", BODY_A, 0.8)], token_budget=10_000)
+        guide_pack = pack_rag_context(
+            [_chunk("Guia fachadas.pdf", 0, "Sistema", BODY_A, 0.7, family="GUIA FACHADAS"),
+             _chunk("Guia fachadas.pdf", 8, "Preparacion", "Lavar la fachada con hidrolavadora antes de pintar.", 0.6,
+                    family="GUIA FACHADAS")],
+            max_chunks=2, token_budget=10_000, exclude=rag_pack.shingle_sets,
+        )
+        self.assertEqual(guide_pack.duplicates_dropped, 1)
+        self.assertIn("hidrolavadora", guide_pack.text)
+
+    def test_budget_is_opt_in(self):
+        chunks = [
+            _chunk("Koraza FT.pdf", 1, "Descripcion", BODY_A, 0.9),
+            _chunk("Viniltex FT.pdf", 5, "Uso", "Viniltex es un vinilo para interiores. " * 200, 0.6, family="VINILTEX"),
+        ]
+        with mock.patch.dict(os.environ, {"RAG_CONTEXT_TOKEN_BUDGET": "40"}):
+            unbounded = pack_rag_context(chunks, max_chunks=4)
+            legacy_text = build_rag_context(chunks, max_chunks=4)
+        self.assertEqual(unbounded.passages, 2)
+        self.assertEqual(unbounded.over_budget_dropped, 0)
+        self.assertEqual(unbounded.tokens_truncated, 0)
+        self.assertEqual(legacy_text, unbounded.text)
+
+    def test_stats_accumulate_savings_and_truncation_separately(self):
+        before = rag_context_stats()
+        with mock.patch.dict(os.environ, {"RAG_CONTEXT_TOKEN_BUDGET": "40"}):
+            pack = pack_rag_context([_chunk("Koraza FT.pdf", 1, "Descripcion", BODY_A, 0.8)],
+                                    token_budget=rag_context.default_token_budget())
+        self.assertLessEqual(pack.tokens, 40)
+        after = rag_context_stats()
+        self.assertEqual(after["packs"], before["packs"] + 1)
+        self.assertEqual(after["tokens_saved"] - before["tokens_saved"], pack.tokens_saved)
+        self.assertEqual(after["tokens_truncated"] - before["tokens_truncated"], pack.tokens_truncated)
+        self.assertGreater(pack.tokens_truncated, 0)
+        self.assertEqual(pack.report()["tokens_truncated"], pack.tokens_truncated)
+
+    def test_heuristic_token_count_without_tiktoken(self):
+        with mock.patch.object(rag_context, "_ENCODING", None):
+            self.assertEqual(count_tokens(""), 0)
+            self.assertEqual(count_tokens("pintura, acrilica."), 2 + 1 + 2 + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import decimal
+import json
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from rag_result_cache import RagResultCache
+
+
+class CacheUnderTest(RagResultCache):
+    def __init__(self, **kwargs):
+        super().__init__(generation_check_seconds=3600, **kwargs)
+        self.generation_value = "1:1"
+        self.generation_reads = 0
+
+    def _read_generation(self):
+        self.generation_reads += 1
+        return self.generation_value
+
+
+class RagResultCacheTests(unittest.TestCase):
+    def test_key_normalizes_query_and_filters_and_includes_generation(self):
+        cache = CacheUnderTest()
+        key = cache.key_for("Koraza:  Fachada ", marca="Pintuco", segments=["b", "a"])
+        self.assertEqual(key, cache.key_for("koraza: fachada", marca="pintuco", segments=["a", "b"]))
+        self.assertNotEqual(key, cache.key_for("koraza: fachada", marca="international", segments=["a", "b"]))
+        self.assertNotEqual(key, cache.key_for("koraza: fachada", marca="pintuco", segments=["a", "b"],
+                                               metadata_prefilters={"chemical_family_terms": ["epoxica"]}))
+        self.assertEqual(cache.generation_reads, 1)
+
+        cache.put(key, {"chunks_final": [{"similarity": decimal.Decimal("0.8")}]})
+        cache.generation_value = "2:1"
+        cache.on_generation({"scope": "mv_productos", "generation": 4})
+        self.assertEqual(cache.key_for("koraza: fachada", marca="pintuco", segments=["a", "b"]), key)
+        cache.on_generation({"scope": "agent_technical_chunks", "generation": 2})
+        new_key = cache.key_for("koraza: fachada", marca="pintuco", segments=["a", "b"])
+        self.assertNotEqual(new_key, key)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(cache.stats()["generation_changes"], 1)
+
+    def test_hits_return_independent_copies(self):
+        cache = CacheUnderTest()
+        cache.put("k", {"chunks_final": [{"chunk_text": "Koraza", "similarity": decimal.Decimal("0.75")}]})
+        first = cache.get("k")
+        first["chunks_final"].append({"chunk_text": "otro"})
+        second = cache.get("k")
+        self.assertEqual(second, {"chunks_final": [{"chunk_text": "Koraza", "similarity": 0.75}]})
+        self.assertEqual(cache.stats()["memory_hits"], 2)
+
+    def test_ttl_and_size_limits(self):
+        cache = CacheUnderTest(max_entries=2, ttl_seconds=60)
+        for name in ("a", "b", "c"):
+            cache.put(name, {"v": name})
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("c"), {"v": "c"})
+        with mock.patch("rag_result_cache.time.time", return_value=time.time() + 120):
+            self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["expired"], 1)
+
+    def test_disabled_cache_never_stores(self):
+        cache = CacheUnderTest(enabled=False)
+        cache.put("k", {"v": 1})
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["memory_entries"], 0)
+
+
+class TechnicalToolCacheTests(unittest.TestCase):
+    def test_second_identical_question_skips_embedding_and_retrieval(self):
+        import tool_handlers
+
+        primitives = mock.Mock()
+        primitives.normalize_text_value = lambda value: (value or "").lower()
+        primitives.PORTFOLIO_CATEGORY_MAP = {}
+        primitives.parse_numeric_value = lambda value: value
+        search = mock.Mock(return_value={
+            "chunks": [{"chunk_text": "Koraza fachadas", "similarity": 0.82, "doc_filename": "koraza.pdf",
+                        "familia_producto": "KORAZA", "chunk_index": 0}],
+            "guides": [],
+            "multimodal": [],
+        })
+        expert = mock.Mock(return_value=[])
+        cache = CacheUnderTest()
+        patches = [
+            mock.patch.object(tool_handlers, "_main_primitives", return_value=primitives),
+            mock.patch.object(tool_handlers, "search_rag_indexes", search),
+            mock.patch.object(tool_handlers, "search_technical_chunks", return_value=[]),
+            mock.patch.object(tool_handlers, "fetch_expert_knowledge", expert),
+            mock.patch.object(tool_handlers, "fetch_technical_profiles", return_value=[]),
+            mock.patch.object(tool_handlers, "lookup_inventory_candidates_from_terms", return_value=[]),
+            mock.patch.object(tool_handlers, "_infer_portfolio_segments_for_query", return_value=[]),
+            mock.patch.object(tool_handlers, "_infer_technical_metadata_prefilters", return_value={}),
+            mock.patch.object(tool_handlers, "rag_result_cache", cache),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        first = json.loads(tool_handlers._handle_tool_consultar_conocimiento_tecnico({"pregunta": "pintura fachada"}, {}, {}))
+        second = json.loads(tool_handlers._handle_tool_consultar_conocimiento_tecnico({"pregunta": "Pintura  fachada"}, {}, {}))
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(expert.call_count, 2)
+        self.assertEqual(first["archivos_fuente"], second["archivos_fuente"])
+        self.assertEqual(first["respuesta_rag"], second["respuesta_rag"])
+
+        search.return_value = {"chunks": [], "guides": [], "multimodal": []}
+        tool_handlers._handle_tool_consultar_conocimiento_tecnico({"pregunta": "estuco"}, {}, {})
+        tool_handlers._handle_tool_consultar_conocimiento_tecnico({"pregunta": "estuco"}, {}, {})
+        # Resultados vacíos (p. ej. BD caída) no se cachean.
+        self.assertEqual(search.call_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,281 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+import rag_search
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, list(params)))
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeRawConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.closed = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        self.closed = True
+
+
+class FakeEngine:
+    def __init__(self, rows):
+        self.cursor = FakeCursor(rows)
+        self.checkouts = []
+
+    def raw_connection(self):
+        connection = FakeRawConnection(self.cursor)
+        self.checkouts.append(connection)
+        return connection
+
+
+def _row(source, filename, similarity, **extra):
+    values = {column: None for column in rag_search._RAG_INDEX_COLUMNS}
+    values.update(source=source, doc_filename=filename, similarity=similarity, **extra)
+    return tuple(values[column] for column in rag_search._RAG_INDEX_COLUMNS)
+
+
+class SearchRagIndexesTests(unittest.TestCase):
+    def setUp(self):
+        rows = [
+            _row("chunks", "koraza.pdf", 0.81, chunk_text="Koraza", familia_producto="koraza", chunk_index=2),
+            _row("guides", "guia_humedad.pdf", 0.66, chunk_text="Humedad"),
+            _row("multimodal", "koraza.pdf", 0.74, canonical_family="koraza", summary_text="Fachadas"),
+        ]
+        self.engine = FakeEngine(rows)
+        patchers = [
+            mock.patch.object(rag_search, "_get_db_engine", return_value=self.engine),
+            mock.patch.object(rag_search, "_generate_query_embedding", return_value=[0.1, 0.2, 0.3]),
+            mock.patch.object(rag_search, "_PGVECTOR_VERSION", (0, 8, 0)),
+            mock.patch.object(rag_search, "_CHUNK_FULLTEXT_AVAILABLE", False),
+            mock.patch.object(rag_search, "_MULTIMODAL_INDEX_AVAILABLE", True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_three_indexes_in_one_statement_with_vector_bound_once(self):
+        results = rag_search.search_rag_indexes(
+            "pintura fachada", chunks_top_k=6, guides_top_k=3, multimodal_top_k=3,
+            marca_filter="pintuco", segment_filters=["arquitectonico"],
+        )
+        self.assertEqual(len(self.engine.checkouts), 1)
+        self.assertTrue(self.engine.checkouts[0].closed)
+        self.assertEqual(len(self.engine.cursor.executed), 1)
+        sql, params = self.engine.cursor.executed[0]
+        self.assertEqual(sql.count("%s::vector"), 1)
+        self.assertEqual(sql.count("UNION ALL"), 2)
+        # Literal de texto con cast explícito: sin adaptador global de ndarray.
+        self.assertEqual(params[0], "[0.1,0.2,0.3]")
+        # Un solo segmento → igualdad (habilita el índice parcial del segmento).
+        self.assertEqual(params[1:], ["pintuco", "arquitectonico", 6, "pintuco", "arquitectonico", 3, "pintuco", 3])
+        self.assertIn("= %s", sql)
+
+        self.assertEqual(results["chunks"][0]["doc_filename"], "koraza.pdf")
+        self.assertEqual(results["chunks"][0]["chunk_index"], 2)
+        self.assertNotIn("source", results["chunks"][0])
+        self.assertEqual(results["guides"][0]["chunk_text"], "Humedad")
+        self.assertEqual(
+            results["multimodal"][0],
+            {
+                "canonical_family": "koraza",
+                "source_doc_filename": "koraza.pdf",
+                "source_doc_path_lower": None,
+                "marca": None,
+                "summary_text": "Fachadas",
+                "metadata": None,
+                "similarity": 0.74,
+            },
+        )
+
+    def test_single_index_wrappers_only_query_their_branch(self):
+        chunks = rag_search.search_technical_chunks("koraza", top_k=4)
+        sql, params = self.engine.cursor.executed[0]
+        self.assertNotIn("UNION ALL", sql)
+        self.assertNotIn("agent_product_multimodal_index", sql)
+        self.assertEqual(params[1:], [4])
+        self.assertEqual([chunk["doc_filename"] for chunk in chunks], ["koraza.pdf"])
+
+    def test_quantized_tier_reranks_candidates_with_exact_distance(self):
+        with mock.patch.dict(os.environ, {"RAG_VECTOR_TIER": "halfvec", "RAG_QUANTIZED_RERANK_FACTOR": "10"}):
+            rag_search.search_rag_indexes("koraza", chunks_top_k=6, guides_top_k=3, multimodal_top_k=3)
+        sql, params = self.engine.cursor.executed[0]
+        self.assertEqual(sql.count("(embedding::halfvec(1536)) <=> ((SELECT embedding FROM q))::halfvec(1536)"), 2)
+        self.assertEqual(sql.count("ORDER BY embedding <=> (SELECT embedding FROM q)"), 3)
+        # chunks: 60 candidatos → 6; guías: mínimo 40 candidatos → 3; multimodal siempre exacto.
+        self.assertEqual(params[1:], [60, 6, 40, 3, 3])
+
+    def test_unknown_tier_falls_back_to_exact(self):
+        with mock.patch.dict(os.environ, {"RAG_VECTOR_TIER": "pq"}):
+            rag_search.search_technical_chunks("koraza", top_k=4)
+        sql, params = self.engine.cursor.executed[0]
+        self.assertNotIn("candidates", sql)
+        self.assertEqual(params[1:], [4])
+        self.assertIn("binary_quantize(embedding)::bit(1536)", rag_search.vector_distance_sql("bit"))
+
+    def test_hnsw_settings_are_set_locally_in_the_same_statement(self):
+        rag_search.search_rag_indexes("koraza", marca_filter="pintuco", segment_filters=["a", "b"])
+        sql, params = self.engine.cursor.executed[0]
+        self.assertTrue(sql.startswith("SET LOCAL hnsw.ef_search = 100;\nSET LOCAL hnsw.iterative_scan = strict_order;"))
+        self.assertIn("= ANY(%s)", sql)
+        self.assertEqual(params[1:3], ["pintuco", ["a", "b"]])
+
+        self.engine.cursor.executed.clear()
+        with mock.patch.object(rag_search, "_PGVECTOR_VERSION", (0, 7, 4)):
+            rag_search.search_rag_indexes("koraza", chunks_top_k=50)
+        sql, _ = self.engine.cursor.executed[0]
+        self.assertTrue(sql.startswith("SET LOCAL hnsw.ef_search = 50;\n"))
+        self.assertNotIn("iterative_scan", sql)
+
+    def test_single_segment_branch_implies_partial_index_predicate(self):
+        sql, params = rag_search._technical_chunk_branch(6, None, ["herrajes_seguridad"], None)
+        self.assertIn(rag_search.TECHNICAL_SHEET_TYPES_SQL, sql)
+        self.assertIn(f"{rag_search.PORTFOLIO_SEGMENT_SQL} = %s", sql)
+        self.assertEqual(params, ["herrajes_seguridad", 6])
+        guide_sql, _ = rag_search._guide_branch(3, None, None)
+        self.assertIn(rag_search.GUIDE_TYPE_SQL, guide_sql)
+
+    def test_pgvector_version_is_queried_once(self):
+        class VersionCursor(FakeCursor):
+            def fetchone(self):
+                return ("0.8.1",)
+
+        cursor = VersionCursor([])
+        with mock.patch.object(rag_search, "_PGVECTOR_VERSION", None):
+            self.assertEqual(rag_search._pgvector_version(cursor), (0, 8, 1))
+            self.assertEqual(rag_search._pgvector_version(cursor), (0, 8, 1))
+        self.assertEqual(len(cursor.executed), 1)
+
+    def test_missing_multimodal_table_is_probed_once_and_left_out(self):
+        class ProbeCursor(FakeCursor):
+            def fetchone(self):
+                return (False,)
+
+        self.engine.cursor = ProbeCursor(self.engine.cursor.rows[:2])
+        with mock.patch.object(rag_search, "_MULTIMODAL_INDEX_AVAILABLE", None):
+            results = rag_search.search_rag_indexes("koraza", chunks_top_k=6, guides_top_k=3, multimodal_top_k=3)
+            rag_search.search_rag_indexes("koraza", chunks_top_k=6, guides_top_k=3, multimodal_top_k=3)
+        probes = [sql for sql, _ in self.engine.cursor.executed if "to_regclass" in sql]
+        self.assertEqual(len(probes), 1)
+        sql, _ = self.engine.cursor.executed[-1]
+        self.assertNotIn("agent_product_multimodal_index", sql)
+        self.assertEqual(sql.count("UNION ALL"), 1)
+        self.assertEqual([len(results[source]) for source in ("chunks", "guides", "multimodal")], [1, 1, 0])
+
+    def test_failed_combined_statement_falls_back_to_one_query_per_index(self):
+        class BrokenMultimodalCursor(FakeCursor):
+            def execute(self, sql, params=()):
+                super().execute(sql, params)
+                self.source = next(source for source in ("chunks", "guides", "multimodal")
+                                   if f"'{source}'::text AS source" in sql)
+                if "agent_product_multimodal_index" in sql:
+                    raise RuntimeError('relation "agent_product_multimodal_index" does not exist')
+
+            def fetchall(self):
+                return [row for row in self.rows if row[0] == self.source]
+
+        self.engine.cursor = BrokenMultimodalCursor(self.engine.cursor.rows)
+        results = rag_search.search_rag_indexes("koraza", chunks_top_k=6, guides_top_k=3, multimodal_top_k=3)
+
+        self.assertEqual(len(self.engine.cursor.executed), 4)
+        self.assertEqual(self.engine.cursor.executed[0][0].count("UNION ALL"), 2)
+        for sql, _ in self.engine.cursor.executed[1:]:
+            self.assertNotIn("UNION ALL", sql)
+            self.assertEqual(sql.count("%s::vector"), 1)
+        self.assertEqual(self.engine.checkouts[0].rollbacks, 2)
+        self.assertEqual(results["chunks"][0]["doc_filename"], "koraza.pdf")
+        self.assertEqual(results["guides"][0]["chunk_text"], "Humedad")
+        self.assertEqual(results["multimodal"], [])
+
+    def test_database_errors_return_empty_sources(self):
+        with mock.patch.object(rag_search, "_get_db_engine", side_effect=RuntimeError("sin BD")):
+            self.assertEqual(
+                rag_search.search_rag_indexes("koraza"),
+                {"chunks": [], "guides": [], "multimodal": []},
+            )
+
+
+class HybridSearchTests(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeEngine([_row("chunks", "p11.pdf", 0.42, chunk_text="Imprimante P-11", chunk_index=0)])
+        patchers = [
+            mock.patch.object(rag_search, "_get_db_engine", return_value=self.engine),
+            mock.patch.object(rag_search, "_generate_query_embedding", return_value=[0.1, 0.2, 0.3]),
+            mock.patch.object(rag_search, "_PGVECTOR_VERSION", (0, 8, 0)),
+            mock.patch.object(rag_search, "_CHUNK_FULLTEXT_AVAILABLE", True),
+            mock.patch.object(rag_search, "_MULTIMODAL_INDEX_AVAILABLE", True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_chunks_and_guides_fuse_ann_and_fulltext_in_one_statement(self):
+        results = rag_search.search_rag_indexes(
+            "epóxico 2K P-11", chunks_top_k=6, guides_top_k=3, multimodal_top_k=3, marca_filter="pintuco",
+        )
+        self.assertEqual(len(self.engine.cursor.executed), 1)
+        sql, params = self.engine.cursor.executed[0]
+        self.assertEqual(sql.count("%s::vector"), 1)
+        self.assertIn("plainto_tsquery('public.rag_es_unaccent', %s)", sql)
+        self.assertEqual(sql.count("chunk_tsv @@ (SELECT tsq FROM q)"), 2)
+        self.assertEqual(sql.count("SUM(1.0 / (%s + rank))"), 2)
+        self.assertEqual(sql.count("UNION ALL"), 2 + 2)
+        # ef_search cubre los 20 candidatos ANN de la rama híbrida.
+        self.assertTrue(sql.startswith("SET LOCAL hnsw.ef_search = 100;"))
+        self.assertEqual(params[1], "epóxico 2K P-11")
+        # fichas: filtros ANN, 20 candidatos, filtros texto, 20 candidatos, k RRF, top_k.
+        self.assertEqual(params[2:8], ["pintuco", 20, "pintuco", 20, 60, 6])
+        self.assertEqual(params[8:14], ["pintuco", 20, "pintuco", 20, 60, 3])
+        self.assertEqual(params[14:], ["pintuco", 3])
+        self.assertEqual(results["chunks"][0]["chunk_text"], "Imprimante P-11")
+
+    def test_quantized_tier_keeps_its_index_for_the_ann_list(self):
+        with mock.patch.dict(os.environ, {"RAG_VECTOR_TIER": "bit", "RAG_QUANTIZED_RERANK_FACTOR": "10"}):
+            rag_search.search_technical_chunks("koraza", top_k=6)
+        sql, params = self.engine.cursor.executed[0]
+        self.assertIn("binary_quantize(embedding)::bit(1536)", sql)
+        self.assertEqual(params[2:], [60, 60, 60, 6])
+
+    def test_off_switch_and_missing_column_stay_vector_only(self):
+        with mock.patch.dict(os.environ, {"RAG_HYBRID_SEARCH": "off"}):
+            rag_search.search_technical_chunks("koraza", top_k=4)
+        sql, params = self.engine.cursor.executed[0]
+        self.assertNotIn("tsq", sql)
+        self.assertEqual(params[1:], [4])
+
+        class ProbeCursor(FakeCursor):
+            def fetchone(self):
+                return (False,)
+
+        cursor = ProbeCursor([])
+        with mock.patch.object(rag_search, "_CHUNK_FULLTEXT_AVAILABLE", None):
+            self.assertFalse(rag_search._hybrid_search_enabled(cursor, "koraza"))
+            self.assertFalse(rag_search._hybrid_search_enabled(cursor, "koraza"))
+        self.assertEqual(len(cursor.executed), 1)
+        self.assertEqual(cursor.executed[0][1], ["chunk_tsv"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("DATABASE_URL", "postgresql://postgres:x@localhost:5432/test")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+
+from sqlalchemy import create_engine, text
+
+import main
+from rotation_store import RotationSnapshot, RotationStore
+
+
+class RotationSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = RotationSnapshot.from_rows(
+            [("5892240", 0.75), ("1001", 0.1), ("P11", 1.0), (None, 0.5), ("1001", 0.2)],
+            generation=3,
+        )
+
+    def test_behaves_like_the_previous_dict(self):
+        self.assertEqual(len(self.snapshot), 3)
+        self.assertIn("5892240", self.snapshot)
+        self.assertNotIn("0000", self.snapshot)
+        self.assertAlmostEqual(self.snapshot["5892240"], 0.75, places=5)
+        self.assertAlmostEqual(self.snapshot.get("1001"), 0.2, places=5)
+        self.assertEqual(self.snapshot.get("0000", 0), 0)
+        self.assertEqual(sorted(self.snapshot), ["1001", "5892240", "P11"])
+        with self.assertRaises(KeyError):
+            self.snapshot["0000"]
+
+    def test_scores_for_is_vectorized_with_default(self):
+        scores = self.snapshot.scores_for(["P11", "missing", "1001"])
+        self.assertEqual([round(float(value), 2) for value in scores], [1.0, 0.0, 0.2])
+
+    def test_empty_snapshot_is_falsy_and_safe(self):
+        empty = RotationSnapshot.empty()
+        self.assertFalse(empty)
+        self.assertIsNone(empty.get("1001"))
+        self.assertEqual(list(empty.scores_for(["1001"])), [0.0])
+
+    def test_store_publishes_snapshot_with_generation(self):
+        store = RotationStore()
+        self.assertFalse(store.is_loaded())
+        store.publish(self.snapshot)
+        self.assertTrue(store.is_loaded())
+        self.assertEqual(store.generation, 3)
+        self.assertIs(store.snapshot(), self.snapshot)
+        self.assertFalse(store.check_due(60))
+
+    def test_only_one_refresh_at_a_time(self):
+        store = RotationStore()
+        self.assertTrue(store.try_begin_refresh())
+        self.assertFalse(store.try_begin_refresh())
+        self.assertTrue(store.end_refresh())
+        self.assertFalse(store.end_refresh())
+        self.assertTrue(store.try_begin_refresh())
+
+
+class RotationRefreshTests(unittest.TestCase):
+    def setUp(self):
+        self.store = RotationStore()
+        self.loads = []
+        self.generation = 4
+        patchers = [
+            mock.patch.object(main, "rotation_store", self.store),
+            mock.patch.object(main, "get_db_engine", return_value=mock.MagicMock()),
+            mock.patch.object(main, "fetch_refresh_generation", side_effect=lambda connection, scope: self.generation),
+            mock.patch.object(main, "_load_rotation_snapshot", side_effect=self._load),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _load(self, connection, generation):
+        self.loads.append(generation)
+        return RotationSnapshot.from_rows([("P11", 0.5)], generation=generation)
+
+    def test_request_path_never_loads_and_serves_the_current_snapshot(self):
+        scheduled = []
+        connection = mock.MagicMock()
+        with mock.patch.object(main, "run_background_io", side_effect=lambda name, target: scheduled.append(name)):
+            cold = main.fetch_rotation_cache(connection)
+            self.assertFalse(cold)
+            self.assertEqual(scheduled, ["rotation-store"])
+            main.fetch_rotation_cache(connection)
+            self.assertEqual(scheduled, ["rotation-store"])
+
+            previous = RotationSnapshot.from_rows([("P11", 0.1)], generation=3)
+            self.store.publish(previous)
+            self.store._last_check = 0.0
+            self.assertIs(main.fetch_rotation_cache(connection), previous)
+            self.assertEqual(len(scheduled), 2)
+        self.assertEqual(self.loads, [])
+        connection.execute.assert_not_called()
+
+    def test_notify_during_a_rebuild_reruns_it_and_keeps_the_old_snapshot_meanwhile(self):
+        previous = RotationSnapshot.from_rows([("P11", 0.1)], generation=3)
+        self.store.publish(previous)
+        started, release = threading.Event(), threading.Event()
+        seen_during_rebuild = []
+
+        def slow_load(connection, generation):
+            if not started.is_set():
+                started.set()
+                release.wait(2)
+            return self._load(connection, generation)
+
+        with mock.patch.object(main, "_load_rotation_snapshot", side_effect=slow_load):
+            worker = threading.Thread(target=main.refresh_rotation_store)
+            worker.start()
+            self.assertTrue(started.wait(2))
+            seen_during_rebuild.append(main.fetch_rotation_cache(mock.MagicMock()))
+            self.generation = 5
+            main.refresh_rotation_store()
+            release.set()
+            worker.join(2)
+
+        self.assertIs(seen_during_rebuild[0], previous)
+        self.assertEqual(self.loads, [4, 5])
+        self.assertEqual(self.store.generation, 5)
+
+
+
+class RotationRerankTests(unittest.TestCase):
+    """La frontera de match_score se trae completa antes de desempatar por rotación."""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        rows = [{"code": f"V{i:03d}", "stock": 100 - i, "score": 2} for i in range(40)]
+        rows.append({"code": "ROTA", "stock": 1, "score": 2})
+        rows.extend({"code": f"B{i}", "stock": 500, "score": 1} for i in range(5))
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE productos (producto_codigo TEXT, stock_total REAL, score INTEGER)"))
+            connection.execute(text("INSERT INTO productos VALUES (:code, :stock, :score)"), rows)
+        snapshot = RotationSnapshot.from_rows([("ROTA", 0.95), ("V005", 0.4), ("B0", 1.0)], generation=1)
+        patcher = mock.patch.object(main, "fetch_rotation_cache", return_value=snapshot)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_high_rotation_low_stock_row_in_a_large_tie_is_kept(self):
+        with self.engine.connect() as connection:
+            ranked = main._fetch_rotation_ranked_rows(
+                connection, "SELECT producto_codigo, stock_total, score AS match_score FROM productos WHERE score > 0",
+                {}, "producto_codigo", 5,
+            )
+
+        self.assertEqual([row["producto_codigo"] for row in ranked], ["ROTA", "V005", "V000", "V001", "V002"])
+        self.assertEqual(ranked[0]["rotation_score"], 0.95)
+        # 41 filas empatadas en match_score 2 (> 3×limit); las de match_score 1 no se traen.
+        with self.engine.connect() as connection:
+            fetched = connection.execute(text(main._rotation_rerank_sql(
+                "SELECT producto_codigo, stock_total, score AS match_score FROM productos", 5))).fetchall()
+        self.assertEqual(len(fetched), 41)
+
+    def test_fewer_rows_than_limit_returns_them_all(self):
+        with self.engine.connect() as connection:
+            ranked = main._fetch_rotation_ranked_rows(
+                connection, "SELECT producto_codigo, stock_total, score AS match_score FROM productos WHERE score = 1",
+                {}, "producto_codigo", 30,
+            )
+        self.assertEqual(len(ranked), 5)
+        self.assertEqual(ranked[0]["producto_codigo"], "B0")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+from stage_graph import StageGraph
+
+
+class StageGraphTests(unittest.TestCase):
+    def test_independent_stages_run_concurrently_and_dependents_get_inputs(self):
+        barrier = threading.Barrier(2, timeout=2)
+
+        def root(value):
+            def _run():
+                barrier.wait()  # sólo pasa si ambas raíces corren a la vez
+                return value
+            return _run
+
+        graph = StageGraph(default_timeout=5)
+        graph.add("a", root(2))
+        graph.add("b", root(3))
+        graph.add("sum", lambda a, b: a + b, deps=("a", "b"))
+        results = graph.run()
+        self.assertEqual(results["sum"], 5)
+        self.assertEqual(results.failures, {})
+        self.assertEqual(set(results.timings_ms), {"a", "b", "sum"})
+
+    def test_failures_and_timeouts_fall_back_to_defaults(self):
+        release = threading.Event()
+
+        def boom():
+            raise RuntimeError("pgvector caído")
+
+        def slow():
+            release.wait(2)
+            return ["tarde"]
+
+        graph = StageGraph()
+        graph.add("boom", boom, default=[])
+        graph.add("slow", slow, timeout=0.05, default=["default"])
+        graph.add("merge", lambda boom_value, slow_value: boom_value + slow_value, deps=("boom", "slow"))
+        started = time.monotonic()
+        with self.assertLogs("ferreinox_agent.stage_graph", level="WARNING"):
+            results = graph.run()
+        release.set()
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(results["merge"], ["default"])
+        self.assertEqual(results.failures["slow"], "timeout")
+        self.assertIn("pgvector caído", results.failures["boom"])
+
+    def test_dependencies_must_be_declared_first(self):
+        graph = StageGraph()
+        with self.assertRaises(ValueError):
+            graph.add("b", lambda a: a, deps=("a",))
+        graph.add("a", lambda: 1)
+        with self.assertRaises(ValueError):
+            graph.add("a", lambda: 2)
+
+
+class ConocimientoTecnicoFanOutTests(unittest.TestCase):
+    def test_portfolio_results_merge_in_declared_order(self):
+        import tool_handlers
+        from rag_result_cache import RagResultCache
+
+        def fake_chunks(query, top_k=6, **kwargs):
+            if ":" in query and not query.startswith("impermeabilizante"):
+                term = query.split(":", 1)[0]
+                # El primer término responde último: el merge no debe depender del orden de llegada.
+                time.sleep(0.05 if term == "koraza" else 0)
+                return [{"chunk_text": f"{term} ficha", "similarity": 0.6, "doc_filename": f"{term}.pdf", "familia_producto": term}]
+            return [{"chunk_text": "base", "similarity": 0.5, "doc_filename": "base.pdf", "familia_producto": "base"}]
+
+        primitives = mock.Mock()
+        primitives.normalize_text_value = lambda value: (value or "").lower()
+        primitives.PORTFOLIO_CATEGORY_MAP = {"impermeabilizante": ["koraza", "aquablock", "sellomax"]}
+        primitives.parse_numeric_value = lambda value: value
+
+        patches = [
+            mock.patch.object(tool_handlers, "_main_primitives", return_value=primitives),
+            mock.patch.object(tool_handlers, "search_technical_chunks", side_effect=fake_chunks),
+            mock.patch.object(
+                tool_handlers,
+                "search_rag_indexes",
+                side_effect=lambda query, **kwargs: {"chunks": fake_chunks(query), "guides": [], "multimodal": []},
+            ),
+            mock.patch.object(tool_handlers, "prefetch_query_embeddings", return_value=3),
+            mock.patch.object(tool_handlers, "fetch_expert_knowledge", return_value=[]),
+            mock.patch.object(tool_handlers, "fetch_technical_profiles", return_value=[]),
+            mock.patch.object(tool_handlers, "lookup_inventory_candidates_from_terms", return_value=[]),
+            mock.patch.object(tool_handlers, "_infer_portfolio_segments_for_query", return_value=[]),
+            mock.patch.object(tool_handlers, "_infer_technical_metadata_prefilters", return_value={}),
+            mock.patch.object(tool_handlers, "rag_result_cache", RagResultCache(enabled=False)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        payload = json.loads(
+            tool_handlers._handle_tool_consultar_conocimiento_tecnico(
+                {"pregunta": "impermeabilizante"}, {}, {},
+            )
+        )
+        tool_handlers.prefetch_query_embeddings.assert_called_once_with(
+            ["koraza: impermeabilizante", "aquablock: impermeabilizante", "sellomax: impermeabilizante"]
+        )
+        self.assertTrue(payload["encontrado"])
+        self.assertEqual(payload["archivos_fuente"], ["koraza.pdf", "aquablock.pdf", "sellomax.pdf", "base.pdf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+BACKEND_DIR = os.path.join(ROOT_DIR, "backend")
+
+sys.path.insert(0, BACKEND_DIR)
+
+import rag_search
+from technical_profile_store import TechnicalProfileStore
+
+
+def _profile(family, filename, score, segment=None, aliases=(), display_name=None, **extra):
+    identity = {"aliases": list(aliases), "display_name": display_name}
+    if segment:
+        identity["portfolio_segment"] = segment
+    return {
+        "canonical_family": family,
+        "source_doc_filename": filename,
+        "source_doc_path_lower": f"/fichas/{filename.lower()}",
+        "marca": "pintuco",
+        "tipo_documento": "ficha_tecnica",
+        "completeness_score": score,
+        "extraction_status": "ready",
+        # Como llega de psycopg2 sin adaptador jsonb: texto.
+        "profile_json": json.dumps({"product_identity": identity, **extra}),
+    }
+
+
+PROFILES = [
+    _profile("KORAZA", "Koraza FT.pdf", 0.9, segment="arquitectonico", aliases=["koraza sol y lluvia"]),
+    _profile("INTERTHANE 990", "Interthane 990 FT.pdf", 0.8, segment="industrial",
+             display_name="Interthane 990", chemical_family="poliuretano", requires_component_b=True),
+    _profile("CORROTEC", "Corrotec FT.pdf", 0.7, segment="industrial", aliases=["corrotec anticorrosivo"],
+             chemical_family="alquidica"),
+    _profile("KORAZA ELASTOMERICA", "Koraza Elastomerica FT.pdf", 0.6, aliases=["koraza elastomerica"]),
+]
+
+
+class StoreUnderTest(TechnicalProfileStore):
+    def __init__(self):
+        super().__init__(engine_factory=lambda: object(), ttl_seconds=0)
+        self.generation = 1
+        self.loads = 0
+
+    def _read_generation(self, engine):
+        return self.generation
+
+    def _load_rows(self, engine):
+        self.loads += 1
+        rows = [dict(row) for row in PROFILES]
+        for row in rows:
+            row["profile_json"] = json.loads(row["profile_json"])
+        return rows
+
+
+class TechnicalProfileStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = StoreUnderTest()
+
+    def test_find_by_family_or_file_keeps_sql_order_and_segment_filter(self):
+        found = self.store.find(["CORROTEC"], ["Koraza FT.pdf"], limit=3)
+        self.assertEqual([row["canonical_family"] for row in found], ["KORAZA", "CORROTEC"])
+        self.assertIsInstance(found[0]["profile_json"], dict)
+        found = self.store.find(["KORAZA", "KORAZA ELASTOMERICA", "CORROTEC"], limit=5, segment_filters=["portafolio_general"])
+        self.assertEqual([row["canonical_family"] for row in found], ["KORAZA ELASTOMERICA"])
+        self.assertEqual(self.store.find(["KORAZA", "CORROTEC"], limit=1)[0]["canonical_family"], "KORAZA")
+
+    def test_alias_match_prefers_the_longest_alias(self):
+        self.assertEqual(self.store.match_product_text("2 gal Koraza Elastomerica blanco")["canonical_family"], "KORAZA ELASTOMERICA")
+        self.assertEqual(self.store.match_product_text("interthane 990 blanco")["profile_json"]["chemical_family"], "poliuretano")
+        self.assertIsNone(self.store.match_product_text("estuco plastico"))
+
+    def test_reloads_only_when_generation_changes(self):
+        for _ in range(3):
+            self.store.find(["KORAZA"])
+        self.assertEqual(self.store.loads, 1)
+        self.store.on_generation({"scope": "agent_technical_chunks", "generation": 5})
+        self.store.find(["KORAZA"])
+        self.assertEqual(self.store.loads, 1)
+        self.store.generation = 2
+        self.store.find(["KORAZA"])
+        self.assertEqual(self.store.loads, 2)
+
+    def test_fetch_technical_profiles_and_validator_go_through_the_store(self):
+        from pipeline_pedido import validador_pedido
+
+        with mock.patch.object(rag_search, "technical_profile_store", self.store), \
+                mock.patch.object(validador_pedido, "technical_profile_store", self.store):
+            profiles = rag_search.fetch_technical_profiles(["INTERTHANE 990"], None, limit=3)
+            metadata = validador_pedido._resolve_structured_product_metadata("INTERTHANE 990 BLANCO GALON")
+            self.assertEqual(len(validador_pedido._load_structured_product_profiles()), 4)
+        self.assertEqual([row["canonical_family"] for row in profiles], ["INTERTHANE 990"])
+        self.assertEqual(metadata["chemical_family"], "poliuretano")
+        self.assertTrue(metadata["requires_component_b"])
+        self.assertEqual(self.store.loads, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
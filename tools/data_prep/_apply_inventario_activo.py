@@ -1,4 +1,4 @@
-"""Aplica la nueva vista de inventario activo a la BD."""
+"""Aplica el inventario activo materializado (inventario_agente_activo) a la BD."""
 import os
 from sqlalchemy import create_engine, text
 
@@ -25,15 +25,32 @@ WHERE NULLIF(TRIM(nombre_articulo), '') IS NOT NULL
 GROUP BY public.fn_normalize_text(nombre_articulo)
 HAVING MAX(fecha_venta::date) >= CURRENT_DATE - INTERVAL '1 year';
 
--- Vista filtrada
-CREATE OR REPLACE VIEW public.vw_inventario_agente_activo AS
-SELECT inv.*
+-- Inventario activo materializado (mismo bloque que postgrest_views.sql)
+DROP TABLE IF EXISTS public.inventario_agente_activo CASCADE;
+CREATE TABLE public.inventario_agente_activo AS
+WITH recent_sales AS (
+    SELECT
+        am.referencia_normalizada,
+        MAX(public.fn_parse_date(rv.fecha_venta)) AS last_sale_date
+    FROM public.raw_ventas_detalle rv
+    JOIN public.articulos_maestro am ON am.codigo_articulo = rv.codigo_articulo
+    WHERE LOWER(COALESCE(rv.tipo_documento, '')) LIKE '%factura%'
+    GROUP BY am.referencia_normalizada
+)
+SELECT inv.*, rs.last_sale_date AS ultima_venta
 FROM public.vw_inventario_agente inv
-WHERE EXISTS (
-    SELECT 1
-    FROM public.inventario_refs_activas act
-    WHERE act.descripcion_normalizada = inv.descripcion_normalizada
-);
+JOIN public.inventario_refs_activas act
+  ON act.descripcion_normalizada = inv.descripcion_normalizada
+LEFT JOIN recent_sales rs
+  ON rs.referencia_normalizada = inv.referencia_normalizada;
+
+CREATE INDEX IF NOT EXISTS idx_inv_activo_almacen ON public.inventario_agente_activo (cod_almacen);
+CREATE INDEX IF NOT EXISTS idx_inv_activo_referencia ON public.inventario_agente_activo (referencia_normalizada);
+CREATE INDEX IF NOT EXISTS idx_inv_activo_search_blob_trgm ON public.inventario_agente_activo USING GIN (search_blob gin_trgm_ops);
+ANALYZE public.inventario_agente_activo;
+
+CREATE OR REPLACE VIEW public.vw_inventario_agente_activo AS
+SELECT * FROM public.inventario_agente_activo;
 """
 
 with engine.begin() as conn: